@@ -0,0 +1,17 @@
+"""
+Performance benchmarks for Lasagne.
+
+The suite times the forward pass, the backward pass and a full training
+step of each layer family, as well as the update step of each optimizer in
+:mod:`lasagne.updates`, over a grid of shapes and batch sizes, and the time
+it takes to import Lasagne. Run it from the root of the repository with::
+
+    python -m benchmarks.run --output results.json
+
+and compare two runs, e.g., before and after a change, with::
+
+    python -m benchmarks.compare before.json after.json
+
+See ``python -m benchmarks.run --help`` for selecting benchmarks and
+shortening runs.
+"""
@@ -0,0 +1,104 @@
+"""
+Compares two runs of the benchmark suite and flags regressions.
+"""
+
+import argparse
+import json
+import sys
+
+
+def result_key(result):
+    return (result['benchmark'], result['mode'],
+            json.dumps(result['params'], sort_keys=True))
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares the results of two runs of the benchmark suite.
+
+    Parameters
+    ----------
+    baseline, current : list of dict
+        The ``'results'`` of the two runs.
+    threshold : float (default: 0.1)
+        The relative change of the time per call beyond which a benchmark
+        counts as regressed or improved.
+
+    Returns
+    -------
+    list of dict
+        One dictionary per benchmark, mode and shape present in both runs,
+        sorted by decreasing ratio, with the keys ``'benchmark'``,
+        ``'mode'``, ``'params'``, ``'baseline'`` and ``'current'`` (the
+        times per call), ``'ratio'`` (the current time divided by the
+        baseline time) and ``'status'`` (``'regression'``,
+        ``'improvement'`` or ``'unchanged'``).
+    """
+    baseline = dict((result_key(r), r) for r in baseline)
+    rows = []
+    for result in current:
+        old = baseline.get(result_key(result))
+        if old is None:
+            continue
+        ratio = result['time'] / old['time']
+        if ratio > 1 + threshold:
+            status = 'regression'
+        elif ratio < 1 / (1 + threshold):
+            status = 'improvement'
+        else:
+            status = 'unchanged'
+        rows.append({'benchmark': result['benchmark'],
+                     'mode': result['mode'],
+                     'params': result['params'],
+                     'baseline': old['time'],
+                     'current': result['time'],
+                     'ratio': ratio,
+                     'status': status})
+    return sorted(rows, key=lambda row: -row['ratio'])
+
+
+def load(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.compare', description=__doc__.strip())
+    parser.add_argument('baseline', help="JSON file of the baseline run")
+    parser.add_argument('current', help="JSON file of the run to check")
+    parser.add_argument('-t', '--threshold', type=float, default=0.1,
+                        help="relative slowdown counting as a regression "
+                             "(default: %(default)s)")
+    parser.add_argument('-a', '--all', action='store_true',
+                        help="also list unchanged benchmarks")
+    args = parser.parse_args(argv)
+
+    baseline, current = load(args.baseline), load(args.current)
+    for name in 'machine', 'theano', 'floatX', 'device', 'blas':
+        old = baseline['metadata'].get(name)
+        new = current['metadata'].get(name)
+        if old != new:
+            print("warning: the runs differ in %s (%s vs. %s)" %
+                  (name, old, new))
+    rows = compare(baseline['results'], current['results'], args.threshold)
+    for row in rows:
+        if args.all or row['status'] != 'unchanged':
+            params = ', '.join('%s=%s' % item for item in sorted(
+                row['params'].items()))
+            print('%-11s %6.2fx %-32s %-8s %10.3f ms -> %10.3f ms  %s' % (
+                row['status'], row['ratio'], row['benchmark'], row['mode'],
+                row['baseline'] * 1e3, row['current'] * 1e3, params))
+    regressions = sum(row['status'] == 'regression' for row in rows)
+    print("%d of %d benchmarks regressed by more than %d%%, %d improved" % (
+        regressions, len(rows), round(args.threshold * 100),
+        sum(row['status'] == 'improvement' for row in rows)))
+    missing = len(set(map(result_key, baseline['results'])) ^
+                  set(map(result_key, current['results'])))
+    if missing:
+        print("%d benchmarks ran in only one of the runs" % missing)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,28 @@
+"""
+Benchmarks of the time it takes to import Lasagne.
+"""
+
+import os
+import subprocess
+import sys
+
+from .suite import param_grid, register
+
+
+@register('import', 'imports', param_grid(
+    module=['lasagne', 'lasagne.layers']), self_timed=True)
+def import_module(module):
+    # time the import in a fresh interpreter, after importing Theano, whose
+    # import time is not ours to improve
+    code = ("import timeit, theano; start = timeit.default_timer(); "
+            "import %s; print(timeit.default_timer() - start)" % module)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    def run():
+        output = subprocess.check_output([sys.executable, '-c', code],
+                                         env=env)
+        return float(output.decode().split()[-1])
+    return {'import': (run, 1)}
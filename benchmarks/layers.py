@@ -0,0 +1,273 @@
+"""
+Benchmarks of the layer families.
+"""
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+
+from lasagne import init, nonlinearities
+from lasagne.layers import (InputLayer, DenseLayer, Conv1DLayer,
+                            CausalConv1DLayer, Conv2DLayer,
+                            TransposedConv2DLayer, DilatedConv2DLayer,
+                            DepthwiseSeparableConv2DLayer,
+                            LocallyConnected2DLayer, MaxPool1DLayer,
+                            MaxPool2DLayer, Pool2DLayer, MaxPool3DLayer,
+                            Upscale2DLayer, GlobalPoolLayer, FeaturePoolLayer,
+                            SpatialPyramidPoolingLayer, AdaptivePool2DLayer,
+                            BatchNormLayer, LSTMLayer, GRULayer,
+                            TransformerLayer, TPSTransformerLayer,
+                            EmbeddingLayer)
+from lasagne.decoding import CausalConvGenerator
+
+from .suite import param_grid, random_input, register, register_layer
+
+
+def image_input(batch_size, channels, size, ndim=2):
+    shape = (batch_size, channels) + (size,) * ndim
+    l_in = InputLayer((None, channels) + (size,) * ndim)
+    return l_in, {l_in: random_input(shape)}
+
+
+@register_layer('DenseLayer', 'dense', param_grid(
+    batch_size=[64, 512], **{'num_inputs,num_units': [(256, 256),
+                                                      (1024, 1024)]}))
+def dense(batch_size, num_inputs, num_units):
+    l_in = InputLayer((None, num_inputs))
+    l_out = DenseLayer(l_in, num_units)
+    return l_out, {l_in: random_input((batch_size, num_inputs))}
+
+
+# Convolutions
+
+CONV_GRID = param_grid(batch_size=[16, 64],
+                       **{'channels,size': [(16, 32), (64, 16)]})
+
+
+@register_layer('Conv1DLayer', 'conv', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(16, 256), (64, 64)]}))
+def conv1d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size, ndim=1)
+    return Conv1DLayer(l_in, channels, 3, pad='same'), inputs
+
+
+@register_layer('CausalConv1DLayer', 'conv', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(16, 256), (64, 64)]}))
+def causal_conv1d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size, ndim=1)
+    return CausalConv1DLayer(l_in, channels, 3, dilation=2), inputs
+
+
+@register_layer('Conv2DLayer', 'conv', CONV_GRID)
+def conv2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return Conv2DLayer(l_in, channels, 3, pad='same'), inputs
+
+
+@register_layer('Conv2DLayer(num_groups=4)', 'conv', CONV_GRID)
+def grouped_conv2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return Conv2DLayer(l_in, channels, 3, pad='same', num_groups=4), inputs
+
+
+@register_layer('DepthwiseSeparableConv2DLayer', 'conv', CONV_GRID)
+def separable_conv2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return DepthwiseSeparableConv2DLayer(l_in, channels, 3,
+                                         pad='same'), inputs
+
+
+@register_layer('DilatedConv2DLayer', 'conv', CONV_GRID)
+def dilated_conv2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return DilatedConv2DLayer(l_in, channels, 3, dilation=2), inputs
+
+
+@register_layer('TransposedConv2DLayer', 'conv', CONV_GRID)
+def transposed_conv2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return TransposedConv2DLayer(l_in, channels, 4, stride=2,
+                                 crop=1), inputs
+
+
+@register_layer('LocallyConnected2DLayer', 'conv', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(8, 16), (16, 16)]}))
+def locally_connected2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return LocallyConnected2DLayer(l_in, channels, 3, pad='same'), inputs
+
+
+@register('CausalConvGenerator', 'conv', param_grid(
+    batch_size=[1, 32], channels=[32, 128]))
+def causal_generation(batch_size, channels):
+    l_in = InputLayer((None, channels, None))
+    layer = l_in
+    for dilation in (1, 2, 4, 8):
+        layer = CausalConv1DLayer(layer, channels, 2, dilation=dilation)
+    generator = CausalConvGenerator(layer, batch_size)
+    input_n = random_input((batch_size, channels))
+
+    def step():
+        # generate sequences of 64 steps
+        if generator.position.get_value() >= 64:
+            generator.reset()
+        generator.step(input_n)
+    return {'step': (step, batch_size)}
+
+
+# Pooling and upscaling
+
+POOL_GRID = param_grid(batch_size=[16, 64],
+                       **{'channels,size': [(32, 32), (64, 16)]})
+
+
+@register_layer('MaxPool1DLayer', 'pool', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(32, 256), (64, 64)]}))
+def max_pool1d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size, ndim=1)
+    return MaxPool1DLayer(l_in, 2), inputs
+
+
+@register_layer('MaxPool2DLayer', 'pool', POOL_GRID)
+def max_pool2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return MaxPool2DLayer(l_in, 2), inputs
+
+
+@register_layer('MaxPool2DLayer(overlapping)', 'pool', POOL_GRID)
+def overlapping_max_pool2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return MaxPool2DLayer(l_in, 3, stride=2), inputs
+
+
+@register_layer('Pool2DLayer(average)', 'pool', POOL_GRID)
+def average_pool2d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return Pool2DLayer(l_in, 2, mode='average_exc_pad'), inputs
+
+
+@register_layer('MaxPool3DLayer', 'pool', param_grid(
+    batch_size=[4, 16], **{'channels,size': [(16, 16)]}))
+def max_pool3d(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size, ndim=3)
+    return MaxPool3DLayer(l_in, 2), inputs
+
+
+@register_layer('GlobalPoolLayer', 'pool', POOL_GRID)
+def global_pool(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return GlobalPoolLayer(l_in), inputs
+
+
+@register_layer('FeaturePoolLayer', 'pool', POOL_GRID)
+def feature_pool(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return FeaturePoolLayer(l_in, 2), inputs
+
+
+@register_layer('SpatialPyramidPoolingLayer', 'pool', POOL_GRID)
+def spatial_pyramid_pool(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return SpatialPyramidPoolingLayer(l_in, [4, 2, 1]), inputs
+
+
+@register_layer('AdaptivePool2DLayer', 'pool', POOL_GRID)
+def adaptive_pool2d(batch_size, channels, size):
+    # not dividing the input size, to time the general case
+    l_in, inputs = image_input(batch_size, channels, size)
+    return AdaptivePool2DLayer(l_in, 7), inputs
+
+
+@register_layer('Upscale2DLayer', 'pool', param_grid(
+    batch_size=[16, 64], mode=['repeat', 'bilinear'],
+    **{'channels,size': [(32, 16)]}))
+def upscale2d(batch_size, channels, size, mode):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return Upscale2DLayer(l_in, 2, mode=mode), inputs
+
+
+# Normalization
+
+@register_layer('BatchNormLayer', 'normalization', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(32, 32), (256, 1)]}))
+def batch_norm(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    return BatchNormLayer(l_in), inputs
+
+
+# Recurrent layers
+
+def sequence_input(batch_size, seq_len, num_inputs, mask):
+    l_in = InputLayer((None, None, num_inputs))
+    inputs = {l_in: random_input((batch_size, seq_len, num_inputs))}
+    l_mask = None
+    if mask:
+        # skewed lengths: most sequences are much shorter than the longest
+        rng = np.random.RandomState(0)
+        lengths = np.minimum(seq_len, 1 + rng.geometric(4. / seq_len,
+                                                        batch_size))
+        lengths[0] = seq_len
+        l_mask = InputLayer((None, None))
+        inputs[l_mask] = (np.arange(seq_len) < lengths[:, None]).astype(
+            theano.config.floatX)
+    return l_in, l_mask, inputs
+
+
+RECURRENT_GRID = param_grid(batch_size=[16, 64], mask=['none', 'mask',
+                                                       'packed'],
+                            **{'seq_len,num_units': [(50, 128)]})
+
+
+@register_layer('LSTMLayer', 'recurrent', RECURRENT_GRID)
+def lstm(batch_size, seq_len, num_units, mask):
+    l_in, l_mask, inputs = sequence_input(batch_size, seq_len, 64,
+                                          mask != 'none')
+    return LSTMLayer(l_in, num_units, mask_input=l_mask,
+                     pack_sequences=mask == 'packed'), inputs
+
+
+@register_layer('GRULayer', 'recurrent', RECURRENT_GRID)
+def gru(batch_size, seq_len, num_units, mask):
+    l_in, l_mask, inputs = sequence_input(batch_size, seq_len, 64,
+                                          mask != 'none')
+    return GRULayer(l_in, num_units, mask_input=l_mask,
+                    pack_sequences=mask == 'packed'), inputs
+
+
+# Spatial transformers
+
+def localization_network(l_in, num_outputs, b):
+    return DenseLayer(l_in, num_outputs, W=init.Constant(0.), b=b,
+                      nonlinearity=nonlinearities.identity)
+
+
+@register_layer('TransformerLayer', 'special', param_grid(
+    batch_size=[16, 64], **{'channels,size': [(3, 64)]}))
+def transformer(batch_size, channels, size):
+    l_in, inputs = image_input(batch_size, channels, size)
+    identity = np.array([1, 0, 0, 0, 1, 0], dtype=theano.config.floatX)
+    l_loc = localization_network(l_in, 6, identity)
+    return TransformerLayer(l_in, l_loc), inputs
+
+
+@register_layer('TPSTransformerLayer', 'special', param_grid(
+    batch_size=[16, 64], control_points=[16, 64],
+    **{'channels,size': [(3, 64)]}))
+def tps_transformer(batch_size, channels, size, control_points):
+    l_in, inputs = image_input(batch_size, channels, size)
+    l_loc = localization_network(l_in, 2 * control_points, init.Constant(0.))
+    return TPSTransformerLayer(l_in, l_loc,
+                               control_points=control_points), inputs
+
+
+# Embeddings
+
+@register_layer('EmbeddingLayer', 'embedding', param_grid(
+    batch_size=[16, 64], **{'vocab_size,seq_len': [(10000, 50)]}))
+def embedding(batch_size, vocab_size, seq_len):
+    l_in = InputLayer((None, seq_len), input_var=T.imatrix())
+    rng = np.random.RandomState(0)
+    tokens = rng.randint(0, vocab_size, (batch_size, seq_len))
+    return (EmbeddingLayer(l_in, vocab_size, 128),
+            {l_in: tokens.astype('int32')})
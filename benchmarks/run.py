@@ -0,0 +1,107 @@
+"""
+Runs the benchmark suite and writes the results as JSON.
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import platform
+import sys
+
+import theano
+
+import lasagne
+
+from . import imports, layers, updates  # noqa: F401 (registration)
+from .suite import BENCHMARKS, run
+
+
+def metadata():
+    """
+    Returns a description of the environment the benchmarks run in.
+    """
+    try:
+        blas = theano.config.blas.ldflags
+    except Exception:
+        blas = None
+    return {'date': datetime.datetime.now().isoformat(),
+            'machine': platform.node(),
+            'processor': platform.processor() or platform.machine(),
+            'python': platform.python_version(),
+            'theano': theano.__version__,
+            'lasagne': lasagne.__version__,
+            'device': theano.config.device,
+            'floatX': theano.config.floatX,
+            'blas': blas}
+
+
+def select(patterns=None, families=None):
+    """
+    Returns the registered benchmarks whose names match one of the given
+    shell-style patterns and whose families are among the given ones.
+    """
+    return [benchmark for benchmark in BENCHMARKS
+            if (not patterns or any(fnmatch.fnmatchcase(benchmark.name, p)
+                                    for p in patterns)) and
+            (not families or benchmark.family in families)]
+
+
+def format_result(result):
+    params = ', '.join('%s=%s' % item for item in sorted(
+        result['params'].items()))
+    return '%-32s %-8s %10.3f ms %12.1f samples/s  %s' % (
+        result['benchmark'], result['mode'], result['time'] * 1e3,
+        result['samples_per_second'], params)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run', description=__doc__.strip())
+    parser.add_argument('patterns', nargs='*', metavar='PATTERN',
+                        help="run the benchmarks matching these patterns, "
+                             "e.g., 'Conv*' (default: all)")
+    parser.add_argument('-f', '--family', action='append',
+                        help="run the benchmarks of this family only, e.g., "
+                             "'recurrent' (can be repeated)")
+    parser.add_argument('-m', '--mode', action='append',
+                        choices=['forward', 'backward', 'update', 'step',
+                                 'import'],
+                        help="time this mode only (can be repeated)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="write the results to this JSON file")
+    parser.add_argument('-q', '--quick', action='store_true',
+                        help="run the first shape of each benchmark only")
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help="minimum time of a timing loop in seconds "
+                             "(default: %(default)s)")
+    parser.add_argument('--repeat', type=int, default=3,
+                        help="number of timing loops, the fastest of which "
+                             "counts (default: %(default)s)")
+    parser.add_argument('-l', '--list', action='store_true',
+                        help="list the selected benchmarks and exit")
+    args = parser.parse_args(argv)
+
+    benchmarks = select(args.patterns, args.family)
+    if args.list:
+        for benchmark in benchmarks:
+            print('%-32s %-14s %d shapes' % (benchmark.name, benchmark.family,
+                                             len(benchmark.grid)))
+        return 0
+    if not benchmarks:
+        parser.error("no benchmark matches the given patterns and families")
+
+    def report(result):
+        print(format_result(result))
+        sys.stdout.flush()
+    results = run(benchmarks, args.quick, args.mode, args.min_time,
+                  args.repeat, callback=report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': metadata(), 'results': results}, f,
+                      indent=1, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
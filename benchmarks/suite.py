@@ -0,0 +1,223 @@
+"""
+Registry of benchmarks and the code timing them.
+"""
+
+import itertools
+from timeit import default_timer
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+
+import lasagne
+from lasagne.layers import InputLayer, get_all_layers, get_all_params
+from lasagne.layers import get_output
+
+
+#: All registered benchmarks, in order of registration
+BENCHMARKS = []
+
+
+class Benchmark(object):
+    """
+    A benchmark timing one or more modes of a computation over a grid of
+    parameters.
+
+    Parameters
+    ----------
+    name : str
+        The name identifying the benchmark in results.
+    family : str
+        The family the benchmark belongs to, e.g., ``'conv'``.
+    grid : list of dict
+        The keyword arguments to call `setup` with, one dictionary per grid
+        point. The first one should be the cheapest.
+    setup : callable
+        Builds the computation for a grid point, returning a dictionary
+        mapping the name of each mode to a pair of a function without
+        arguments to time and the number of samples it processes.
+    self_timed : bool (default: False)
+        If True, the functions return the time to report themselves, e.g.,
+        because they run a subprocess whose startup should not count. The
+        fastest of `repeat` calls counts.
+    """
+    def __init__(self, name, family, grid, setup, self_timed=False):
+        self.name = name
+        self.family = family
+        self.grid = grid
+        self.setup = setup
+        self.self_timed = self_timed
+
+
+def param_grid(**axes):
+    """
+    Returns the cartesian product of the given parameter values as a list
+    of dictionaries. Comma-separated names can be used as keys to vary
+    several parameters together, e.g.,
+    ``param_grid(batch_size=[32, 128], **{'channels,size': [(3, 32)]})``.
+    """
+    names = sorted(axes)
+    points = []
+    for values in itertools.product(*(axes[name] for name in names)):
+        point = {}
+        for name, value in zip(names, values):
+            if ',' in name:
+                point.update(zip(name.split(','), value))
+            else:
+                point[name] = value
+        points.append(point)
+    return points
+
+
+def register(name, family, grid, self_timed=False):
+    """
+    Decorator registering a function as the `setup` of a
+    :class:`Benchmark`.
+    """
+    def decorator(setup):
+        BENCHMARKS.append(Benchmark(name, family, grid, setup, self_timed))
+        return setup
+    return decorator
+
+
+def register_layer(name, family, grid):
+    """
+    Decorator registering a function building a network as a benchmark of
+    its forward pass, its backward pass and a training step.
+
+    The decorated function must return the output layer of the network and
+    a dictionary mapping its input layers to input values. The first input
+    determines the number of samples. The backward pass computes the
+    gradient of the sum of the output with respect to the trainable
+    parameters and floating-point inputs, and the training step adds an SGD
+    update of the parameters (skipped if there are none).
+    """
+    def decorator(build):
+        def setup(**params):
+            l_out, inputs = build(**params)
+            return layer_modes(l_out, inputs)
+        BENCHMARKS.append(Benchmark(name, family, grid, setup))
+        return build
+    return decorator
+
+
+def layer_modes(l_out, inputs):
+    """
+    Compiles the forward pass, backward pass and training step of a
+    network, see :func:`register_layer`.
+    """
+    input_layers = [layer for layer in get_all_layers(l_out)
+                    if isinstance(layer, InputLayer)]
+    input_vars = [layer.input_var for layer in input_layers]
+    values = [inputs[layer] for layer in input_layers]
+    num_samples = len(values[0])
+    output = get_output(l_out)
+    cost = output.sum()
+    params = get_all_params(l_out, trainable=True)
+    wrt = params + [var for var in input_vars
+                    if var.dtype in T.float_dtypes]
+
+    modes = {'forward': (_compiled(input_vars, output, values), num_samples),
+             'backward': (_compiled(input_vars, theano.grad(cost, wrt),
+                                    values), num_samples)}
+    if params:
+        updates = lasagne.updates.sgd(cost, params, learning_rate=1e-6)
+        modes['update'] = (_compiled(input_vars, cost, values,
+                                     updates=updates), num_samples)
+    return modes
+
+
+def _compiled(inputs, outputs, values, **kwargs):
+    # a function calling the compiled graph on the given values, compiling
+    # it on the first call only, so modes that are not run cost nothing
+    fn = []
+
+    def call():
+        if not fn:
+            fn.append(theano.function(inputs, outputs, **kwargs))
+        return fn[0](*values)
+    return call
+
+
+def random_input(shape, dtype=None, low=-1., high=1., seed=0):
+    """
+    Returns an array of uniformly distributed values for an input layer.
+    """
+    rng = np.random.RandomState(seed)
+    return rng.uniform(low, high, shape).astype(dtype or theano.config.floatX)
+
+
+def time_function(fn, min_time=0.2, repeat=3):
+    """
+    Returns the time of a call of a function in seconds.
+
+    After a first call to warm up, the function is called in a loop long
+    enough to take at least `min_time` seconds, and the fastest of `repeat`
+    such loops counts.
+    """
+    fn()
+    # increase the number of calls per loop in steps of 1, 2, 5, 10, ...
+    for number in (m * 10 ** e for e in itertools.count() for m in (1, 2, 5)):
+        start = default_timer()
+        for _ in range(number):
+            fn()
+        elapsed = default_timer() - start
+        if elapsed >= min_time:
+            break
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = default_timer()
+        for _ in range(number):
+            fn()
+        timings.append((default_timer() - start) / number)
+    return min(timings)
+
+
+def run(benchmarks, quick=False, modes=None, min_time=0.2, repeat=3,
+        callback=None):
+    """
+    Runs benchmarks and returns their results.
+
+    Parameters
+    ----------
+    benchmarks : list of :class:`Benchmark`
+        The benchmarks to run.
+    quick : bool (default: False)
+        Whether to only run the first point of the grid of each benchmark.
+    modes : list of str or None (default: None)
+        The modes to time, e.g., ``['forward']``. Defaults to all modes.
+    min_time, repeat
+        See :func:`time_function`.
+    callback : callable or None (default: None)
+        Called with each result once it is available, e.g., to print it.
+
+    Returns
+    -------
+    list of dict
+        One dictionary per benchmark, grid point and mode, with the keys
+        ``'benchmark'``, ``'family'``, ``'params'``, ``'mode'``, ``'time'``
+        (the time per call in seconds) and ``'samples_per_second'``.
+    """
+    results = []
+    for benchmark in benchmarks:
+        for params in benchmark.grid[:1] if quick else benchmark.grid:
+            setup = benchmark.setup(**params)
+            for mode in sorted(setup):
+                if modes is not None and mode not in modes:
+                    continue
+                fn, num_samples = setup[mode]
+                if benchmark.self_timed:
+                    time = min(fn() for _ in range(repeat))
+                else:
+                    time = time_function(fn, min_time, repeat)
+                result = {'benchmark': benchmark.name,
+                          'family': benchmark.family,
+                          'params': params,
+                          'mode': mode,
+                          'time': time,
+                          'samples_per_second': num_samples / time}
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+    return results
@@ -0,0 +1,45 @@
+"""
+Benchmarks of the optimizers in :mod:`lasagne.updates`.
+"""
+
+import theano
+
+import lasagne.updates
+
+from .suite import param_grid, random_input, register
+
+
+#: The parameter shapes of the networks the optimizers update
+NETWORKS = {
+    # a multi-layer perceptron with few large parameters
+    'mlp': [(784, 1024), (1024,), (1024, 1024), (1024,), (1024, 10), (10,)],
+    # a deep network with many small parameters
+    'deep': [(64, 64, 3, 3), (64,), (64,), (64,)] * 20,
+}
+
+OPTIMIZERS = ['sgd', 'momentum', 'nesterov_momentum', 'adagrad', 'rmsprop',
+              'adadelta', 'adam', 'adamax']
+
+
+def optimizer_benchmark(name):
+    @register(name, 'updates', param_grid(network=sorted(NETWORKS)))
+    def setup(network):
+        shapes = NETWORKS[network]
+        params = [theano.shared(random_input(shape, seed=i))
+                  for i, shape in enumerate(shapes)]
+        grads = [theano.shared(random_input(shape, low=-1e-3, high=1e-3,
+                                            seed=len(shapes) + i))
+                 for i, shape in enumerate(shapes)]
+        update_fn = getattr(lasagne.updates, name)
+        if name in ('sgd', 'momentum', 'nesterov_momentum'):
+            updates = update_fn(grads, params, learning_rate=1e-3)
+        else:
+            updates = update_fn(grads, params)
+        fn = theano.function([], updates=updates)
+        # samples per second are updates per second
+        return {'update': (fn, 1)}
+    return setup
+
+
+for name in OPTIMIZERS:
+    optimizer_benchmark(name)
@@ -211,7 +211,8 @@ def build_cnn(input_var=None):
 # several changes in the main program, though, and is not demonstrated here.
 # Notice that this function returns only mini-batches of size `batchsize`.
 # If the size of the data is not a multiple of `batchsize`, it will not
-# return the last (remaining) mini-batch.
+# return the last (remaining) mini-batch. To compute the network output for
+# every example of a dataset, use lasagne.prediction.predict() instead.
 
 def iterate_minibatches(inputs, targets, batchsize, shuffle=False):
     assert len(inputs) == len(targets)
@@ -21,6 +21,10 @@ else:
     del theano
 
 
+import importlib
+import sys
+import types
+
 from . import nonlinearities
 from . import init
 from . import layers
@@ -32,3 +36,36 @@ from . import utils
 
 
 __version__ = "0.2.dev1"
+
+
+#: Submodules imported on first access only, as they are not needed for
+#: building and training networks (and some of them import the threading
+#: and serving machinery of the standard library)
+_lazy_submodules = ('decoding', 'prediction', 'profiling', 'pruning',
+                    'quantization', 'runtime', 'serving')
+
+
+class _LazyModule(types.ModuleType):
+    """
+    The ``lasagne`` package namespace, importing the submodules of
+    ``_lazy_submodules`` when one of them is accessed as an attribute.
+
+    This replaces the package in ``sys.modules``, which works in all
+    supported Python versions (module-level ``__getattr__`` needs Python
+    3.7). The original module is kept alive in ``_module``, since Python 2
+    clears the globals of a deleted module.
+    """
+    def __getattr__(self, name):
+        if name in _lazy_submodules:
+            # importing sets the attribute, so this is only called once
+            return importlib.import_module('.' + name, self.__name__)
+        raise AttributeError("module %r has no attribute %r" %
+                             (self.__name__, name))
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(_lazy_submodules))
+
+
+_module = sys.modules[__name__]
+sys.modules[__name__] = _LazyModule(__name__, __doc__)
+sys.modules[__name__].__dict__.update(_module.__dict__)
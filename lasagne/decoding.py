@@ -0,0 +1,469 @@
+"""
+Functions to generate output sequences from trained recurrent and causal
+convolutional networks.
+
+.. autosummary::
+    :nosignatures:
+
+    beam_search
+    causal_conv_step
+    CausalConvGenerator
+
+Decoding reuses the step computation of a recurrent layer (see
+:meth:`lasagne.layers.LSTMLayer.get_step_output_for` and
+:meth:`lasagne.layers.GRULayer.get_step_output_for`), feeding back the
+tokens chosen in one step as the input of the next step. All hypotheses of
+all sequences in a batch are advanced together in a single compiled scan.
+
+Examples
+--------
+Assuming you have a recurrent language model that predicts the next token
+from the previous ones:
+
+>>> from lasagne.layers import InputLayer, EmbeddingLayer, LSTMLayer
+>>> from lasagne.layers import ReshapeLayer, DenseLayer
+>>> from lasagne.nonlinearities import softmax
+>>> vocab_size, num_units = 20, 16
+>>> l_in = InputLayer((None, None), input_var=theano.tensor.imatrix())
+>>> l_emb = EmbeddingLayer(l_in, vocab_size, 8)
+>>> l_rec = LSTMLayer(l_emb, num_units)
+>>> l_shp = ReshapeLayer(l_rec, (-1, num_units))
+>>> l_out = DenseLayer(l_shp, vocab_size, nonlinearity=softmax)
+
+You can decode the three best sequences for each of two start states with:
+
+>>> from lasagne.decoding import beam_search
+>>> hid_init = theano.tensor.matrix('hid_init')
+>>> cell_init = theano.tensor.zeros_like(hid_init)
+>>> sequences, scores, lengths = beam_search(
+...     l_rec, l_out, [cell_init, hid_init], start_token=0, end_token=1,
+...     beam_size=3, max_length=10)
+>>> decode = theano.function([hid_init], [sequences, scores, lengths])
+>>> sequences, scores, lengths = decode(
+...     np.zeros((2, num_units), dtype=theano.config.floatX))
+>>> sequences.shape[:2]
+(2, 3)
+
+Causal convolutional networks (see :class:`lasagne.layers.CausalConv1DLayer`)
+generate one position at a time from buffers of the past activations of each
+layer, which makes the cost of each step independent of the receptive field:
+
+>>> from lasagne.layers import CausalConv1DLayer
+>>> l_in = InputLayer((None, 1, None))
+>>> l_conv = l_in
+>>> for dilation in 1, 2, 4, 8:
+...     l_conv = CausalConv1DLayer(l_conv, 8, 2, dilation=dilation)
+>>> l_out = CausalConv1DLayer(l_conv, 1, 1, nonlinearity=None)
+>>> from lasagne.decoding import CausalConvGenerator
+>>> generator = CausalConvGenerator(l_out, batch_size=2)
+>>> sample = np.zeros((2, 1), dtype=theano.config.floatX)
+>>> for _ in range(10):
+...     sample = generator.step(sample)
+>>> sample.shape
+(2, 1)
+"""
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+
+from .layers import get_output, get_all_layers, EmbeddingLayer, LSTMLayer
+from .layers import GRULayer, InputLayer, MergeLayer, CausalConv1DLayer
+from .layers import (NonlinearityLayer, BiasLayer, ScaleLayer, DropoutLayer,
+                     GaussianNoiseLayer, ElemwiseMergeLayer, ElemwiseSumLayer,
+                     ConcatLayer, DimshuffleLayer, DenseLayer, NINLayer,
+                     Conv1DLayer)
+
+
+__all__ = [
+    "beam_search",
+    "causal_conv_step",
+    "CausalConvGenerator",
+]
+
+
+def beam_search(l_rec, l_out, init_states, start_token, end_token,
+                beam_size=4, max_length=50, length_normalization=0.,
+                hid_layer=None):
+    """
+    Beam search decoding with a recurrent layer.
+
+    Starting from the `start_token`, repeatedly advances all hypotheses by one
+    step, computes the probabilities of the next token with `l_out` and keeps
+    the `beam_size` best extensions of each sequence's hypotheses. A
+    hypothesis is finished when it emits the `end_token`; decoding stops
+    early once all hypotheses of all sequences are finished.
+
+    The hypotheses of a batch are kept in matrices of ``batch_size *
+    beam_size`` rows, which are reordered by gathering from the surviving
+    parent hypotheses in each step.
+
+    Parameters
+    ----------
+    l_rec : :class:`LSTMLayer` or :class:`GRULayer` instance
+        The recurrent layer to decode with. Its incoming layer must be an
+        :class:`EmbeddingLayer` over the tokens, or it must have been created
+        with ``fold_embedding=True``. With ``cache_folded_table=True``, the
+        tokens are gathered from its cached table, which must be up to date
+        (see :meth:`LSTMLayer.refresh_folded_table`).
+    l_out : :class:`Layer` instance
+        The layer computing the probabilities of the next token, as a matrix
+        of shape ``(num_hypotheses, vocabulary_size)``, from the output of
+        `hid_layer` (e.g., a :class:`DenseLayer` with softmax nonlinearity).
+        Its output is computed with ``deterministic=True``.
+    init_states : list of Theano expressions
+        The initial states of the recurrent layer, each of shape
+        ``(batch_size, num_units)``: the cell and hidden state for an
+        :class:`LSTMLayer`, the hidden state for a :class:`GRULayer`.
+    start_token : int
+        The token fed into the first step.
+    end_token : int
+        The token ending a hypothesis.
+    beam_size : int
+        The number of hypotheses kept per sequence.
+    max_length : int
+        The maximum number of decoding steps.
+    length_normalization : float
+        Hypotheses are ranked by their total log probability divided by
+        their length to the power of this value. The default of zero ranks
+        by total log probability, which favors short hypotheses.
+    hid_layer : :class:`Layer` instance or None
+        The layer whose output is replaced by the recurrent layer's hidden
+        state of shape ``(num_hypotheses, num_units)`` when computing the
+        output of `l_out`. Defaults to `l_rec`, which is correct for
+        networks connecting the recurrent layer to the output layer through
+        a :class:`ReshapeLayer` of shape ``(-1, num_units)``.
+
+    Returns
+    -------
+    sequences : Theano expression
+        The decoded tokens, an integer tensor of shape ``(batch_size,
+        beam_size, num_steps)``, with hypotheses sorted by their rank.
+        Finished hypotheses are padded with the `end_token`.
+    scores : Theano expression
+        The total log probability of each hypothesis, of shape
+        ``(batch_size, beam_size)``.
+    lengths : Theano expression
+        The length of each hypothesis including its `end_token`, of shape
+        ``(batch_size, beam_size)``.
+    """
+    if isinstance(l_rec, LSTMLayer):
+        num_states = 2
+    elif isinstance(l_rec, GRULayer):
+        num_states = 1
+    else:
+        raise TypeError("beam_search() requires an LSTMLayer or GRULayer, "
+                        "got %r" % l_rec)
+    if len(init_states) != num_states:
+        raise ValueError("%s requires %d initial states, got %d" %
+                         (l_rec.__class__.__name__, num_states,
+                          len(init_states)))
+    if l_rec.fold_embedding:
+        def embed(tokens):
+            return tokens
+    elif isinstance(l_rec.input_layers[0], EmbeddingLayer):
+        embed = l_rec.input_layers[0].get_output_for
+    else:
+        raise ValueError("beam_search() requires the recurrent layer to be "
+                         "fed by an EmbeddingLayer or to fold its embedding")
+    if hid_layer is None:
+        hid_layer = l_rec
+
+    batch_size = init_states[0].shape[0]
+    batch_index = T.arange(batch_size).dimshuffle(0, 'x')
+    floatX = theano.config.floatX
+
+    def step(*args):
+        states = args[:num_states]
+        tokens, scores, lengths, finished = args[num_states:]
+
+        # Advance all (batch_size * beam_size) hypotheses by one step
+        states = l_rec.get_step_output_for(embed(tokens.flatten()), *states,
+                                           deterministic=True)
+        if num_states == 1:
+            states = [states]
+        log_probs = T.log(get_output(l_out, {hid_layer: states[-1]},
+                                     deterministic=True))
+        vocab_size = log_probs.shape[1]
+        log_probs = log_probs.reshape((batch_size, beam_size, vocab_size))
+
+        # Finished hypotheses can only be extended by the end token, at no
+        # cost, so they compete with unfinished ones with a constant score
+        is_end = T.eq(T.arange(vocab_size), end_token)
+        log_probs = T.switch(finished.dimshuffle(0, 1, 'x'),
+                             T.switch(is_end, 0, -np.inf).astype(floatX),
+                             log_probs)
+        candidates = scores.dimshuffle(0, 1, 'x') + log_probs
+        candidates = candidates.reshape((batch_size, beam_size * vocab_size))
+        lengths = lengths + (1 - finished)
+        if length_normalization:
+            ranking = candidates / T.repeat(
+                lengths ** length_normalization, vocab_size, axis=1)
+        else:
+            ranking = candidates
+
+        # Keep the best extensions and gather the states of their parents
+        best = T.argsort(-ranking, axis=1)[:, :beam_size]
+        parents = best // vocab_size
+        tokens = best % vocab_size
+        parent_rows = (parents + batch_index * beam_size).flatten()
+        states = [state[parent_rows] for state in states]
+        scores = candidates[batch_index, best]
+        lengths = lengths[batch_index, parents]
+        finished = T.or_(finished[batch_index, parents],
+                         T.cast(T.eq(tokens, end_token), 'int8'))
+        return (states + [tokens, scores, lengths, finished, parents],
+                theano.scan_module.until(T.all(finished)))
+
+    init_tokens = T.zeros((batch_size, beam_size), 'int64') + start_token
+    # All hypotheses start out identical, so only the first one may be
+    # extended in the first step
+    init_scores = T.concatenate(
+        [T.zeros((batch_size, 1), floatX),
+         T.alloc(np.asarray(-np.inf, floatX), batch_size, beam_size - 1)],
+        axis=1)
+    init_lengths = T.zeros((batch_size, beam_size), floatX)
+    init_finished = T.zeros((batch_size, beam_size), 'int8')
+    # For a beam size of 1, the initial values would be broadcastable across
+    # hypotheses, unlike the results of the step function
+    outputs_info = ([T.repeat(state, beam_size, axis=0)
+                     for state in init_states] +
+                    [T.unbroadcast(value, 1) for value in (
+                        init_tokens, init_scores, init_lengths,
+                        init_finished)] +
+                    [None])
+    outputs = theano.scan(step, outputs_info=outputs_info,
+                          n_steps=max_length)[0]
+    tokens, scores, lengths, _, parents = outputs[num_states:]
+
+    # Backtrack from the final hypotheses through their parents
+    def backtrack(tokens_n, parents_n, hypotheses):
+        return (tokens_n[batch_index, hypotheses],
+                parents_n[batch_index, hypotheses])
+
+    init_hypotheses = T.unbroadcast(
+        T.zeros((batch_size, 1), 'int64') + T.arange(beam_size), 1)
+    sequences = theano.scan(backtrack, sequences=[tokens, parents],
+                            outputs_info=[None, init_hypotheses],
+                            go_backwards=True)[0][0]
+    sequences = sequences[::-1].dimshuffle(1, 2, 0)
+    return sequences, scores[-1], T.cast(lengths[-1], 'int32')
+
+
+def causal_conv_step(l_out, input_n, buffers, position, **kwargs):
+    """
+    Computes the output of a causal convolutional network for one position.
+
+    The network may consist of :class:`CausalConv1DLayer` instances and
+    layers that process each position independently. Each
+    :class:`CausalConv1DLayer` computes the output for the position from its
+    input at this position and a ring buffer of its inputs at the past
+    positions (see
+    :meth:`lasagne.layers.CausalConv1DLayer.get_step_output_for`), all other
+    layers are applied to sequences of length one. To not silently compute
+    wrong outputs, only the following layers (not their subclasses) are
+    accepted besides the causal convolutions:
+
+    * :class:`NonlinearityLayer`, :class:`DropoutLayer` and
+      :class:`GaussianNoiseLayer`
+    * :class:`BiasLayer` and :class:`ScaleLayer` sharing their parameters
+      over the time axis
+    * :class:`ElemwiseMergeLayer`, :class:`ElemwiseSumLayer`, and
+      :class:`ConcatLayer` joining a different axis than the time axis
+    * :class:`Conv1DLayer` with a filter size and stride of 1, no padding
+      and tied biases, and :class:`NINLayer` with tied biases
+    * :class:`DenseLayer` whose leading axes include the time axis
+    * :class:`DimshuffleLayer`, which may move the time axis
+
+    Any other layer raises a ValueError.
+
+    Parameters
+    ----------
+    l_out : :class:`Layer` instance
+        The output layer of the network, with an output of shape
+        ``(batch_size, num_channels, length)``.
+    input_n : Theano expression
+        The input of the network's single :class:`InputLayer` at the position,
+        of shape ``(batch_size, num_input_channels)``.
+    buffers : list of Theano expressions
+        The ring buffers of the :class:`CausalConv1DLayer` instances of the
+        network, in the order of :func:`lasagne.layers.get_all_layers`.
+    position : Theano expression
+        The position, an integer scalar counting from zero.
+    **kwargs
+        Any additional keyword arguments are passed to the layers'
+        :meth:`get_output_for` methods. Defaults to ``deterministic=True``.
+
+    Returns
+    -------
+    output_n : Theano expression
+        The output of `l_out` at the position, of shape ``(batch_size,
+        num_channels)``.
+    buffers : list of Theano expressions
+        The buffers for the next position.
+    """
+    kwargs.setdefault('deterministic', True)
+    all_layers = get_all_layers(l_out)
+    input_layers = [layer for layer in all_layers
+                    if isinstance(layer, InputLayer)]
+    if len(input_layers) != 1:
+        raise ValueError("causal_conv_step() requires a network with a "
+                         "single input layer, got %d" % len(input_layers))
+    all_outputs = {input_layers[0]: input_n.dimshuffle(0, 1, 'x')}
+    # the axis of each layer's output that holds the positions
+    time_axes = {input_layers[0]: 2}
+    buffers = list(buffers)
+    new_buffers = []
+    for layer in all_layers:
+        if layer in all_outputs:
+            continue
+        if isinstance(layer, MergeLayer):
+            layer_inputs = [all_outputs[input_layer]
+                            for input_layer in layer.input_layers]
+            input_time_axes = [time_axes[input_layer]
+                               for input_layer in layer.input_layers]
+        else:
+            layer_inputs = all_outputs[layer.input_layer]
+            input_time_axes = [time_axes[layer.input_layer]]
+        if isinstance(layer, CausalConv1DLayer) and input_time_axes == [2]:
+            if not buffers:
+                raise ValueError("causal_conv_step() requires a buffer for "
+                                 "each CausalConv1DLayer")
+            output_n, buffer = layer.get_step_output_for(
+                layer_inputs[:, :, 0], buffers.pop(0), position)
+            all_outputs[layer] = output_n.dimshuffle(0, 1, 'x')
+            time_axes[layer] = 2
+            new_buffers.append(buffer)
+            continue
+        time_axis = _step_time_axis(layer, input_time_axes)
+        if time_axis is None:
+            raise ValueError("causal_conv_step() cannot compute %r for a "
+                             "single position, as it may combine multiple "
+                             "positions" % layer)
+        all_outputs[layer] = layer.get_output_for(layer_inputs, **kwargs)
+        time_axes[layer] = time_axis
+    if buffers:
+        raise ValueError("causal_conv_step() got %d buffers too many" %
+                         len(buffers))
+    if time_axes[l_out] != 2:
+        raise ValueError("causal_conv_step() requires an output of shape "
+                         "(batch_size, num_channels, length)")
+    return all_outputs[l_out][:, :, 0], new_buffers
+
+
+def _step_time_axis(layer, input_time_axes):
+    # Returns the time axis of the layer's output if the layer computes each
+    # position independently of the others, given the time axes of its
+    # inputs, and None otherwise
+    time_axis = input_time_axes[0]
+    if any(axis != time_axis for axis in input_time_axes):
+        return None
+    layer_type = type(layer)
+    if layer_type in (NonlinearityLayer, DropoutLayer, GaussianNoiseLayer,
+                      ElemwiseMergeLayer, ElemwiseSumLayer):
+        return time_axis
+    elif layer_type in (BiasLayer, ScaleLayer):
+        if time_axis in layer.shared_axes:
+            return time_axis
+    elif layer_type is ConcatLayer:
+        ndim = len(layer.input_shapes[0])
+        if (layer.axis % ndim != time_axis and
+                (layer.cropping is None or
+                 layer.cropping[time_axis] is None)):
+            return time_axis
+    elif layer_type is DimshuffleLayer:
+        if time_axis in layer.pattern:
+            return layer.pattern.index(time_axis)
+    elif layer_type is DenseLayer:
+        num_leading_axes = layer.num_leading_axes
+        if num_leading_axes < 0:
+            num_leading_axes += len(layer.input_shape)
+        if time_axis < num_leading_axes:
+            return time_axis
+    elif layer_type is NINLayer:
+        if time_axis != 1 and not layer.untie_biases:
+            return time_axis
+    elif layer_type is Conv1DLayer:
+        if (time_axis == 2 and layer.filter_size == (1,) and
+                layer.stride == (1,) and layer.pad in ((0,), 'same', 'full')
+                and not layer.untie_biases):
+            return time_axis
+    return None
+
+
+class CausalConvGenerator(object):
+    """
+    Compiled generation with a causal convolutional network, one position
+    at a time.
+
+    Keeps a ring buffer of the past inputs of each
+    :class:`lasagne.layers.CausalConv1DLayer` of the network in a shared
+    variable and compiles a function computing the output of the network
+    for the next position (see :func:`causal_conv_step`). Each step computes
+    only the filter taps of the new position in each layer, so it takes time
+    linear in the number of layers instead of the receptive field.
+
+    Parameters
+    ----------
+    l_out : :class:`Layer` instance
+        The output layer of the network.
+    batch_size : int
+        The number of sequences generated in parallel.
+    **kwargs
+        Any additional keyword arguments are passed to
+        :func:`causal_conv_step`.
+
+    Attributes
+    ----------
+    layers : list of :class:`lasagne.layers.CausalConv1DLayer`
+        The causal convolutional layers of the network.
+    buffers : list of Theano shared variables
+        The ring buffers of the layers.
+    position : Theano shared variable
+        The position of the next step.
+    """
+    def __init__(self, l_out, batch_size, **kwargs):
+        self.layers = [layer for layer in get_all_layers(l_out)
+                       if isinstance(layer, CausalConv1DLayer)]
+        floatX = theano.config.floatX
+        self.buffers = [theano.shared(np.zeros((batch_size,
+                                                layer.input_shape[1],
+                                                layer.history_length),
+                                               dtype=floatX))
+                        for layer in self.layers]
+        self.position = theano.shared(np.asarray(0, dtype='int64'))
+        input_n = T.matrix('input_n')
+        output_n, buffers = causal_conv_step(l_out, input_n, self.buffers,
+                                             self.position, **kwargs)
+        updates = [(buffer, new_buffer)
+                   for buffer, new_buffer in zip(self.buffers, buffers)
+                   if buffer is not new_buffer]
+        updates.append((self.position, self.position + 1))
+        self._step = theano.function([input_n], output_n, updates=updates)
+
+    def step(self, input_n):
+        """
+        Computes the output of the network for the next position.
+
+        Parameters
+        ----------
+        input_n : numpy array
+            The input at the position, of shape ``(batch_size,
+            num_input_channels)``.
+
+        Returns
+        -------
+        numpy array
+            The output at the position, of shape ``(batch_size,
+            num_channels)``.
+        """
+        return self._step(input_n)
+
+    def reset(self):
+        """
+        Clears the buffers to start generating new sequences.
+        """
+        for buffer in self.buffers:
+            buffer.set_value(np.zeros_like(buffer.get_value()))
+        self.position.set_value(np.asarray(0, dtype='int64'))
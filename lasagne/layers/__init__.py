@@ -12,3 +12,5 @@ from .normalization import *
 from .embedding import *
 from .recurrent import *
 from .special import *
+from .quantized import *
+from .sparse import *
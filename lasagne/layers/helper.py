@@ -16,6 +16,8 @@ __all__ = [
     "get_output_shape",
     "get_all_params",
     "count_params",
+    "model_summary",
+    "format_model_summary",
     "get_all_param_values",
     "set_all_param_values",
 ]
@@ -109,7 +111,7 @@ def get_all_layers(layer, treat_as_input=None):
     return result
 
 
-def get_output(layer_or_layers, inputs=None, **kwargs):
+def get_output(layer_or_layers, inputs=None, tag_layers=False, **kwargs):
     """
     Computes the output of the network at one or more given layers.
     Optionally, you can define the input(s) to propagate through the network
@@ -134,6 +136,12 @@ def get_output(layer_or_layers, inputs=None, **kwargs):
         input layers) can be mapped to a Theano expression or numpy
         array to use instead of its regular output.
 
+    tag_layers : bool
+        If True, the Theano nodes created by each layer are tagged with
+        the layer, so computational costs can be attributed to layers
+        (see :mod:`lasagne.profiling`). Nodes tagged by an earlier call
+        keep their tag.
+
     Returns
     -------
     output : Theano expression or list
@@ -189,6 +197,8 @@ def get_output(layer_or_layers, inputs=None, **kwargs):
                                  "mapping this layer to an input expression."
                                  % layer)
             all_outputs[layer] = layer.get_output_for(layer_inputs, **kwargs)
+            if tag_layers:
+                _tag_layer(layer, layer_inputs, all_outputs[layer])
             try:
                 names, _, _, defaults = getargspec(layer.get_output_for)
             except TypeError:
@@ -217,6 +227,26 @@ def get_output(layer_or_layers, inputs=None, **kwargs):
         return all_outputs[layer_or_layers]
 
 
+def _tag_layer(layer, layer_inputs, output):
+    """
+    Tags the nodes between the given inputs and output of a layer with the
+    layer, and the output with the layer and its inputs.
+    """
+    if not isinstance(layer_inputs, (list, tuple)):
+        layer_inputs = [layer_inputs]
+    layer_inputs = [expr for expr in layer_inputs
+                    if isinstance(expr, theano.Variable)]
+    if not isinstance(output, theano.Variable) or output in layer_inputs:
+        return
+    for node in theano.gof.graph.io_toposort(layer_inputs, [output]):
+        if getattr(node.tag, 'lasagne_layer', None) is None:
+            node.tag.lasagne_layer = layer
+            node.tag.lasagne_pass = 'forward'
+    if getattr(output.tag, 'lasagne_layer', None) is None:
+        output.tag.lasagne_layer = layer
+        output.tag.lasagne_inputs = layer_inputs
+
+
 def get_output_shape(layer_or_layers, input_shapes=None):
     """
     Computes the output shape of the network at one or more given layers.
@@ -415,8 +445,7 @@ def count_params(layer, **tags):
     True
     """
     params = get_all_params(layer, **tags)
-    shapes = [p.get_value().shape for p in params]
-    counts = [np.prod(shape) for shape in shapes]
+    counts = [np.prod(_param_shape(p)) for p in params]
     return sum(counts)
 
 
@@ -518,3 +547,385 @@ def set_all_param_values(layer, values, **tags):
                              (p.get_value().shape, v.shape))
         else:
             p.set_value(v)
+
+
+def _param_shape(param):
+    # reads the shape of a shared variable without copying its value; the
+    # shape of a parameter expression is only known when it is evaluated
+    if not isinstance(param, theano.compile.SharedVariable):
+        return None
+    return param.get_value(borrow=True, return_internal_type=True).shape
+
+
+def model_summary(layer, batch_size=1, input_shapes=None, dtype=None):
+    """
+    Estimates the computational cost and memory requirements of all layers
+    below one or more given :class:`Layer` instances, without compiling
+    anything.
+
+    For each layer, the summary reports the number of parameters and their
+    size, the number of floating-point operations (FLOPs) of a forward pass
+    and the size of the activations produced in the forward and backward
+    pass, for the given batch size. FLOPs are estimated by formulas for the
+    layer classes in Lasagne, counting a multiply-add as two FLOPs and
+    nonlinearities as one FLOP per element. Layers of other classes (e.g.,
+    :class:`ExpressionLayer`) are reported with unknown FLOPs.
+
+    Parameters
+    ----------
+    layer : Layer or list
+        The :class:`Layer` instance for which to summarize the network, or a
+        list of :class:`Layer` instances.
+    batch_size : int or None (default: 1)
+        The batch size to use for input layers of unspecified batch size.
+    input_shapes : None or dict (default: None)
+        A dictionary mapping input layers to shape tuples to use instead of
+        their regular shape, e.g., to fill in unspecified sequence lengths
+        or image sizes.
+    dtype : str or None (default: None)
+        The data type of activations. Defaults to ``theano.config.floatX``.
+
+    Returns
+    -------
+    list of dict
+        One dictionary per layer in topological order, with the keys
+        ``'layer'`` (the :class:`Layer` instance), ``'name'``,
+        ``'output_shape'``, ``'params'`` (the number of parameter values),
+        ``'param_bytes'``, ``'flops'``, ``'forward_bytes'`` (the size of the
+        output and the intermediate results kept for the backward pass) and
+        ``'backward_bytes'`` (the size of the gradients with respect to the
+        layer's inputs and parameters). Quantities that depend on an
+        unspecified shape are ``None``.
+
+    Examples
+    --------
+    >>> from lasagne.layers import InputLayer, DenseLayer
+    >>> l_in = InputLayer((None, 20))
+    >>> l1 = DenseLayer(l_in, num_units=50)
+    >>> summary = model_summary(l1, batch_size=100)
+    >>> summary[1]['params']
+    1050
+    >>> summary[1]['flops'] == 100 * (2 * 20 * 50 + 2 * 50)
+    True
+    """
+    from .input import InputLayer
+    from .base import MergeLayer
+    from .embedding import EmbeddingLayer
+    itemsize = np.dtype(dtype or theano.config.floatX).itemsize
+
+    all_layers = get_all_layers(layer)
+    shapes = dict((layer, layer.shape) for layer in all_layers
+                  if isinstance(layer, InputLayer))
+    shapes.update(input_shapes or {})
+    for layer, shape in list(shapes.items()):
+        if batch_size is not None and shape and shape[0] is None:
+            shapes[layer] = (batch_size,) + tuple(shape[1:])
+    shapes = dict(zip(all_layers, get_output_shape(all_layers, shapes)))
+
+    summary = []
+    for layer in all_layers:
+        if isinstance(layer, MergeLayer):
+            in_shapes = [shapes[incoming] if incoming is not None else shape
+                         for incoming, shape in zip(layer.input_layers,
+                                                    layer.input_shapes)]
+        elif isinstance(layer, InputLayer):
+            in_shapes = []
+        elif layer.input_layer is not None:
+            in_shapes = [shapes[layer.input_layer]]
+        else:
+            in_shapes = [layer.input_shape]
+        params = layer.get_params()
+        param_counts = [int(np.prod(_param_shape(p))) for p in params]
+        param_bytes = sum(count * np.dtype(p.dtype).itemsize
+                          for count, p in zip(param_counts, params))
+        flops = _estimate_flops(layer, in_shapes, shapes[layer])
+        out_size = _size(shapes[layer])
+        extra_size = _intermediate_size(layer, in_shapes)
+        forward_bytes = _mul(itemsize, _add(out_size, extra_size))
+        if isinstance(layer, InputLayer):
+            in_size = 0
+        elif (isinstance(layer, EmbeddingLayer) or
+              getattr(layer, 'fold_embedding', False)):
+            # integer inputs have no gradient
+            in_size = _add(*[_size(shape) for shape in in_shapes[1:]])
+        else:
+            in_size = _add(*[_size(shape) for shape in in_shapes])
+        backward_bytes = _add(_mul(itemsize, in_size), param_bytes)
+        summary.append({
+            'layer': layer,
+            'name': layer.name or type(layer).__name__,
+            'output_shape': shapes[layer],
+            'params': sum(param_counts),
+            'param_bytes': param_bytes,
+            'flops': flops,
+            'forward_bytes': forward_bytes,
+            'backward_bytes': backward_bytes,
+        })
+    return summary
+
+
+def format_model_summary(summary):
+    """
+    Formats the result of :func:`model_summary` as a table, with a final
+    row of totals.
+
+    Parameters
+    ----------
+    summary : list of dict
+        The result of :func:`model_summary`.
+
+    Returns
+    -------
+    str
+        The table, one line per layer.
+    """
+    columns = ['name', 'output_shape', 'params', 'flops', 'param_bytes',
+               'forward_bytes', 'backward_bytes']
+    totals = dict((c, 0) for c in columns[2:])
+    for row in summary:
+        for c in totals:
+            totals[c] = _add(totals[c], row[c])
+    totals.update(name='total', output_shape='')
+    lines = [[c for c in columns]]
+    for row in summary + [totals]:
+        lines.append(['?' if row[c] is None else
+                      str(row[c]) if c in ('name', 'output_shape') else
+                      '{:,}'.format(row[c]) for c in columns])
+    widths = [max(len(line[i]) for line in lines)
+              for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) if i < 2 else cell.rjust(width)
+                  for i, (cell, width) in enumerate(zip(line, widths)))
+        for line in lines)
+
+
+def _size(shape):
+    # the number of elements of a shape, or None if partially unknown
+    if shape is None or any(s is None for s in shape):
+        return None
+    return int(np.prod(shape))
+
+
+def _add(*values):
+    return None if any(v is None for v in values) else sum(values)
+
+
+def _mul(*values):
+    return (None if any(v is None for v in values)
+            else int(np.prod(values)))
+
+
+def _intermediate_size(layer, input_shapes):
+    # the number of values kept by a layer for the backward pass in addition
+    # to its output: the gates and states at all steps of recurrent layers
+    from . import recurrent
+    if isinstance(layer, (recurrent.LSTMLayer,
+                          recurrent.BidirectionalLSTMLayer,
+                          recurrent.StackedLSTMLayer)):
+        gates, states = 4, 2
+    elif isinstance(layer, (recurrent.GRULayer,
+                            recurrent.BidirectionalGRULayer)):
+        gates, states = 3, 1
+    else:
+        return 0
+    if isinstance(layer, (recurrent.BidirectionalLSTMLayer,
+                          recurrent.BidirectionalGRULayer)):
+        gates, states = 2 * gates, 2 * states
+    num_layers = getattr(layer, 'num_layers', 1)
+    return _mul(_size(input_shapes[0][:2]), layer.num_units,
+                (gates + states) * num_layers)
+
+
+def _estimate_flops(layer, input_shapes, output_shape):
+    # dispatches to the first cost formula registered for the class of the
+    # layer or one of its base classes
+    formulas = _get_flop_formulas()
+    for cls in type(layer).__mro__:
+        if cls in formulas:
+            try:
+                return formulas[cls](layer, input_shapes, output_shape)
+            except TypeError:  # raised by arithmetic on unknown shapes
+                return None
+    if hasattr(layer, 'pool_size'):  # pooling layers of optional backends
+        return _mul(_size(output_shape), int(np.prod(layer.pool_size)))
+    return None
+
+
+def _elementwise_flops(layer, size):
+    # the FLOPs of adding a bias and applying a nonlinearity
+    from .. import nonlinearities
+    flops = 0
+    if getattr(layer, 'b', None) is not None:
+        flops += size
+    if getattr(layer, 'nonlinearity', None) not in (
+            None, nonlinearities.identity):
+        flops += size
+    return flops
+
+
+def _dense_flops(layer, input_shapes, output_shape):
+    size = _size(output_shape)
+    num_inputs = int(np.prod(layer.input_shape[layer.num_leading_axes:]))
+    return 2 * size * num_inputs + _elementwise_flops(layer, size)
+
+
+def _nin_flops(layer, input_shapes, output_shape):
+    size = _size(output_shape)
+    return 2 * size * layer.input_shape[1] + _elementwise_flops(layer, size)
+
+
+def _conv_flops(layer, input_shapes, output_shape):
+    size = _size(output_shape)
+    per_output = int(np.prod(layer.get_W_shape())) // layer.num_filters
+    return 2 * size * per_output + _elementwise_flops(layer, size)
+
+
+def _transposed_conv_flops(layer, input_shapes, output_shape):
+    # each input value is multiplied with one slice of the filters
+    per_input = int(np.prod(layer.get_W_shape()[1:]))
+    return (2 * _size(input_shapes[0]) * per_input +
+            _elementwise_flops(layer, _size(output_shape)))
+
+
+def _separable_conv_flops(layer, input_shapes, output_shape):
+    size = _size(output_shape)
+    channels = layer.get_W_shape()[0]
+    depthwise = (size // layer.num_filters * channels *
+                 int(np.prod(layer.filter_size)))
+    return (2 * depthwise + 2 * size * channels +
+            _elementwise_flops(layer, size))
+
+
+def _recurrent_flops(layer, input_shapes, output_shape):
+    # input projection, hidden-to-hidden products and elementwise
+    # operations of the gates at every step, for all layers and directions
+    name = type(layer).__name__
+    gates = 3 if 'GRU' in name else 4
+    directions = 2 if name.startswith('Bidirectional') else 1
+    num_layers = getattr(layer, 'num_layers', 1)
+    batch_size, num_steps = input_shapes[0][:2]
+    units = layer.num_units
+    steps = batch_size * num_steps * directions
+    if getattr(layer, 'fold_embedding', False):
+        vocab_size, embedding_size = _param_shape(layer.W_emb)
+        projection = 2 * vocab_size * embedding_size * gates * units
+    else:
+        num_inputs = int(np.prod(input_shapes[0][2:]))
+        projection = 2 * steps * num_inputs * gates * units
+    projection += 2 * steps * units * gates * units * (num_layers - 1)
+    recurrent = 2 * steps * units * gates * units * num_layers
+    elementwise = steps * units * (gates * 2 + 2) * num_layers
+    return projection + recurrent + elementwise
+
+
+def _custom_recurrent_flops(layer, input_shapes, output_shape):
+    # the costs of both sublayers at every step
+    batch_size, num_steps = input_shapes[0][:2]
+    flops = 0
+    for sublayer in (layer.input_to_hidden, layer.hidden_to_hidden):
+        shape = (batch_size,) + tuple(sublayer.input_shape[1:])
+        flops += _estimate_flops(sublayer, [shape],
+                                 sublayer.get_output_shape_for(shape))
+    return num_steps * (flops + _size(output_shape[:1] + output_shape[2:]))
+
+
+def _transformer_flops(layer, input_shapes, output_shape):
+    # grid transformation and bilinear interpolation of every output point
+    num_points = _size(output_shape[:1] + output_shape[2:])
+    if hasattr(layer, 'control_points'):
+        per_point = 10 * layer.control_points + 12
+    else:
+        per_point = 12
+    return num_points * (per_point + 10) + 8 * _size(output_shape)
+
+
+def _spp_flops(layer, input_shapes, output_shape):
+    batch_size, channels, rows, cols = input_shapes[0]
+    return sum(batch_size * channels * n * n *
+               -(-rows // n) * -(-cols // n) for n in layer.pool_dims)
+
+
+def _upscale_flops(layer, input_shapes, output_shape):
+    if getattr(layer, 'mode', None) == 'bilinear':
+        return 6 * _size(output_shape)
+    return 0
+
+
+def _pool_flops(layer, input_shapes, output_shape):
+    return _size(output_shape) * int(np.prod(layer.pool_size))
+
+
+def _lrn_flops(layer, input_shapes, output_shape):
+    return (layer.n + 5) * _size(output_shape)
+
+
+def _merge_flops(layer, input_shapes, output_shape):
+    return (len(input_shapes) - 1) * _size(output_shape)
+
+
+def _inverse_flops(layer, input_shapes, output_shape):
+    return _estimate_flops(layer.layer, [input_shapes[2]], input_shapes[1])
+
+
+def _per_output(factor):
+    def flops(layer, input_shapes, output_shape):
+        return factor * _size(output_shape)
+    return flops
+
+
+def _per_input(factor):
+    def flops(layer, input_shapes, output_shape):
+        return factor * _size(input_shapes[0])
+    return flops
+
+
+def _get_flop_formulas():
+    from . import (conv, dense, embedding, input, merge, noise,
+                   normalization, pool, recurrent, shape, special)
+    zero = _per_output(0)
+    return {
+        input.InputLayer: zero,
+        dense.DenseLayer: _dense_flops,
+        dense.NINLayer: _nin_flops,
+        conv.BaseConvLayer: _conv_flops,
+        conv.TransposedConv2DLayer: _transposed_conv_flops,
+        conv.DepthwiseSeparableConv2DLayer: _separable_conv_flops,
+        pool.Pool1DLayer: _pool_flops,
+        pool.Pool2DLayer: _pool_flops,
+        pool.Pool3DLayer: _pool_flops,
+        pool.Upscale1DLayer: _upscale_flops,
+        pool.Upscale2DLayer: _upscale_flops,
+        pool.Upscale3DLayer: _upscale_flops,
+        pool.FeaturePoolLayer: _per_input(1),
+        pool.FeatureWTALayer: _per_input(2),
+        pool.GlobalPoolLayer: _per_input(1),
+        pool.SpatialPyramidPoolingLayer: _spp_flops,
+        pool.AdaptivePool2DLayer: _per_input(1),
+        recurrent.CustomRecurrentLayer: _custom_recurrent_flops,
+        recurrent.LSTMLayer: _recurrent_flops,
+        recurrent.GRULayer: _recurrent_flops,
+        recurrent.BidirectionalLSTMLayer: _recurrent_flops,
+        recurrent.BidirectionalGRULayer: _recurrent_flops,
+        recurrent.StackedLSTMLayer: _recurrent_flops,
+        normalization.BatchNormLayer: _per_output(3),
+        normalization.BatchNormDoubleUnbiasedLayer: _per_output(3),
+        normalization.LocalResponseNormalization2DLayer: _lrn_flops,
+        embedding.EmbeddingLayer: zero,
+        noise.DropoutLayer: _per_output(1),
+        noise.GaussianNoiseLayer: _per_output(1),
+        shape.FlattenLayer: zero,
+        shape.ReshapeLayer: zero,
+        shape.DimshuffleLayer: zero,
+        shape.PadLayer: zero,
+        shape.SliceLayer: zero,
+        merge.ConcatLayer: zero,
+        merge.ElemwiseMergeLayer: _merge_flops,
+        special.NonlinearityLayer: _per_output(1),
+        special.BiasLayer: _per_output(1),
+        special.ScaleLayer: _per_output(1),
+        special.ParametricRectifierLayer: _per_output(2),
+        special.RandomizedRectifierLayer: _per_output(2),
+        special.InverseLayer: _inverse_flops,
+        special.TransformerLayer: _transformer_flops,
+        special.TPSTransformerLayer: _transformer_flops,
+    }
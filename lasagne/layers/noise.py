@@ -2,9 +2,7 @@ import theano
 import theano.tensor as T
 
 from .base import Layer
-from ..random import get_rng
-
-from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
+from ..random import get_rng, _RandomStreams
 
 
 __all__ = [
@@ -68,10 +66,12 @@ class DropoutLayer(Layer):
            Dropout: A Simple Way to Prevent Neural Networks from Overfitting.
            Journal of Machine Learning Research, 5(Jun)(2), 1929-1958.
     """
+    _srng = _RandomStreams()
+
     def __init__(self, incoming, p=0.5, rescale=True, shared_axes=(),
                  **kwargs):
         super(DropoutLayer, self).__init__(incoming, **kwargs)
-        self._srng = RandomStreams(get_rng().randint(1, 2147462579))
+        self._srng_seed = get_rng().randint(1, 2147462579)
         self.p = p
         self.rescale = rescale
         self.shared_axes = tuple(shared_axes)
@@ -191,9 +191,11 @@ class GaussianNoiseLayer(Layer):
            generalization.
            IEEE Transactions on Neural Networks, 7(6):1424-1438.
     """
+    _srng = _RandomStreams()
+
     def __init__(self, incoming, sigma=0.1, **kwargs):
         super(GaussianNoiseLayer, self).__init__(incoming, **kwargs)
-        self._srng = RandomStreams(get_rng().randint(1, 2147462579))
+        self._srng_seed = get_rng().randint(1, 2147462579)
         self.sigma = sigma
 
     def get_output_for(self, input, deterministic=False, **kwargs):
@@ -1,3 +1,4 @@
+import numpy as np
 import theano.tensor as T
 
 from .base import Layer
@@ -18,6 +19,8 @@ __all__ = [
     "FeaturePoolLayer",
     "FeatureWTALayer",
     "GlobalPoolLayer",
+    "SpatialPyramidPoolingLayer",
+    "AdaptivePool2DLayer",
 ]
 
 
@@ -541,6 +544,50 @@ class MaxPool3DLayer(Pool3DLayer):
 # TODO: add MaxPool3DLayer
 
 
+def _upscale_repeat(input, scale_factor):
+    # Repeats the elements along the trailing axes of the input by
+    # broadcasting against a new axis after each of them and merging the
+    # axes in a single reshape, so the gradient is a reshape and a sum
+    first = input.ndim - len(scale_factor)
+    pattern = list(range(first))
+    shape = [input.shape[i] for i in range(first)]
+    output_shape = list(shape)
+    for axis, factor in enumerate(scale_factor, first):
+        pattern.append(axis)
+        shape.append(input.shape[axis])
+        if factor > 1:
+            pattern.append('x')
+            shape.append(factor)
+        output_shape.append(input.shape[axis] * factor)
+    upscaled = T.alloc(input.dimshuffle(pattern), *shape)
+    return upscaled.reshape(output_shape, ndim=input.ndim)
+
+
+def _upscale_linear(input, axis, factor):
+    # Linearly interpolates the input along the given axis, treating
+    # elements as pixel centers and replicating the border elements. Each
+    # of the `factor` output phases between two neighbouring elements is a
+    # fixed two-tap elementwise op, and the phases are interleaved by a
+    # single stack and reshape.
+    def take(start, stop):
+        index = [slice(None)] * input.ndim
+        index[axis] = slice(start, stop)
+        return input[tuple(index)]
+
+    border = factor // 2
+    offsets = (np.arange(factor) + border + 0.5) / factor - 0.5
+    lower, upper = take(None, -1), take(1, None)
+    difference = upper - lower
+    phases = [lower + np.asarray(offset, dtype=input.dtype) * difference
+              for offset in offsets]
+    interior = T.stack(phases, axis=axis + 1)
+    shape = [input.shape[i] for i in range(input.ndim)]
+    shape[axis] = (shape[axis] - 1) * factor
+    interior = interior.reshape(shape, ndim=input.ndim)
+    return T.concatenate([take(0, 1)] * border + [interior] +
+                         [take(-1, None)] * (factor - border), axis=axis)
+
+
 class Upscale1DLayer(Layer):
     """
     1D upscaling layer
@@ -589,7 +636,7 @@ class Upscale1DLayer(Layer):
         upscaled = input
         if self.mode == 'repeat':
             if a > 1:
-                upscaled = T.extra_ops.repeat(upscaled, a, 2)
+                upscaled = _upscale_repeat(upscaled, self.scale_factor)
         elif self.mode == 'dilate':
             if a > 1:
                 output_shape = self.get_output_shape_for(input.shape)
@@ -614,9 +661,10 @@ class Upscale2DLayer(Layer):
         a square scale factor region. If an iterable, it should have two
         elements.
 
-    mode : {'repeat', 'dilate'}
-        Upscaling mode: repeat element values or upscale leaving zeroes between
-        upscaled elements. Default is 'repeat'.
+    mode : {'repeat', 'dilate', 'bilinear'}
+        Upscaling mode: repeat element values, upscale leaving zeroes between
+        upscaled elements, or interpolate bilinearly between element values.
+        Default is 'repeat'.
 
     **kwargs
         Any additional keyword arguments are passed to the :class:`Layer`
@@ -627,6 +675,12 @@ class Upscale2DLayer(Layer):
     Using ``mode='dilate'`` followed by a convolution can be
     realized more efficiently with a transposed convolution, see
     :class:`lasagne.layers.TransposedConv2DLayer`.
+
+    Using ``mode='bilinear'`` treats input and output elements as the
+    centers of equally-sized pixels and interpolates between the nearest
+    input pixels, replicating the border pixels of the input (this is the
+    ``align_corners=False`` behaviour of other frameworks). It is computed
+    separably with a fixed two-tap kernel per axis, without parameters.
     """
 
     def __init__(self, incoming, scale_factor, mode='repeat', **kwargs):
@@ -638,8 +692,9 @@ class Upscale2DLayer(Layer):
             raise ValueError('Scale factor must be >= 1, not {0}'.format(
                 self.scale_factor))
 
-        if mode not in {'repeat', 'dilate'}:
-            msg = "Mode must be either 'repeat' or 'dilate', not {0}"
+        if mode not in {'repeat', 'dilate', 'bilinear'}:
+            msg = ("Mode must be either 'repeat', 'dilate' or 'bilinear', "
+                   "not {0}")
             raise ValueError(msg.format(mode))
         self.mode = mode
 
@@ -655,10 +710,13 @@ class Upscale2DLayer(Layer):
         a, b = self.scale_factor
         upscaled = input
         if self.mode == 'repeat':
+            if b > 1 or a > 1:
+                upscaled = _upscale_repeat(upscaled, self.scale_factor)
+        elif self.mode == 'bilinear':
             if b > 1:
-                upscaled = T.extra_ops.repeat(upscaled, b, 3)
+                upscaled = _upscale_linear(upscaled, 3, b)
             if a > 1:
-                upscaled = T.extra_ops.repeat(upscaled, a, 2)
+                upscaled = _upscale_linear(upscaled, 2, a)
         elif self.mode == 'dilate':
             if b > 1 or a > 1:
                 output_shape = self.get_output_shape_for(input.shape)
@@ -721,12 +779,8 @@ class Upscale3DLayer(Layer):
         a, b, c = self.scale_factor
         upscaled = input
         if self.mode == 'repeat':
-            if c > 1:
-                upscaled = T.extra_ops.repeat(upscaled, c, 4)
-            if b > 1:
-                upscaled = T.extra_ops.repeat(upscaled, b, 3)
-            if a > 1:
-                upscaled = T.extra_ops.repeat(upscaled, a, 2)
+            if c > 1 or b > 1 or a > 1:
+                upscaled = _upscale_repeat(upscaled, self.scale_factor)
         elif self.mode == 'dilate':
             if c > 1 or b > 1 or a > 1:
                 output_shape = self.get_output_shape_for(input.shape)
@@ -906,3 +960,209 @@ class GlobalPoolLayer(Layer):
 
     def get_output_for(self, input, **kwargs):
         return self.pool_function(input.flatten(3), axis=2)
+
+
+class SpatialPyramidPoolingLayer(Layer):
+    """
+    Spatial Pyramid Pooling Layer
+
+    Performs spatial pyramid pooling (SPP) over the input.
+    It will turn a 2D input of arbitrary size into an output of fixed
+    dimension.
+    Hence, the convolutional part of a DNN can be connected to a dense part
+    with a fixed number of nodes even if the dimensions of the
+    input image are unknown.
+
+    The pooling is performed over :math:`l` pooling levels.
+    Each pooling level :math:`i` will create :math:`M_i` output features.
+    :math:`M_i` is given by :math:`n_i * n_i`,
+    with :math:`n_i` as the number of pooling operation per dimension in
+    level :math:`i`, and we use a list of the :math:`n_i`'s as a
+    parameter for SPP-Layer.
+    The length of this list is the level of the spatial pyramid.
+
+    Each level is computed with a single pooling operation, with a pooling
+    region of the input size divided by :math:`n_i` rounded up and a stride
+    of the input size divided by :math:`n_i` rounded down. This gives the same
+    results as :class:`lasagne.layers.dnn.SpatialPyramidPoolingDNNLayer`, but
+    works on any backend, so networks can be trained with one and deployed
+    with the other. Note that this choice of pooling regions produces more
+    than :math:`n_i` regions per dimension for some input sizes smaller than
+    :math:`n_i^2`, see :class:`AdaptivePool2DLayer` for exactly
+    :math:`n_i` regions.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or tuple
+        The layer feeding into this layer, or the expected input shape.
+
+    pool_dims : list of integers
+        The list of :math:`n_i`'s that define the output dimension of each
+        pooling level :math:`i`. The length of pool_dims is the level of
+        the spatial pyramid.
+
+    mode : string
+        Pooling mode, one of 'max', 'average_inc_pad' or 'average_exc_pad'.
+        Defaults to 'max'.
+
+    **kwargs
+        Any additional keyword arguments are passed to the :class:`Layer`
+        superclass.
+
+    Notes
+    -----
+    This layer should be inserted between the convolutional part of a
+    DNN and its dense part. Convolutions can be used for
+    arbitrary input dimensions, but the size of their output will
+    depend on their input dimensions. Connecting the output of the
+    convolutional to the dense part then usually demands us to fix
+    the dimensions of the network's InputLayer.
+    The spatial pyramid pooling layer, however, allows us to leave the
+    network input dimensions arbitrary. The advantage over a global
+    pooling layer is the added robustness against object deformations
+    due to the pooling on different scales.
+
+    References
+    ----------
+    .. [1] He, Kaiming et al (2015):
+           Spatial Pyramid Pooling in Deep Convolutional Networks
+           for Visual Recognition.
+           http://arxiv.org/pdf/1406.4729.pdf.
+    """
+    def __init__(self, incoming, pool_dims=[4, 2, 1], mode='max', **kwargs):
+        super(SpatialPyramidPoolingLayer, self).__init__(incoming, **kwargs)
+        if len(self.input_shape) != 4:
+            raise ValueError("Tried to create a SPP layer with "
+                             "input shape %r. Expected 4 input dimensions "
+                             "(batchsize, channels, 2 spatial dimensions)."
+                             % (self.input_shape,))
+        self.mode = mode
+        self.pool_dims = pool_dims
+
+    def get_output_for(self, input, **kwargs):
+        input_size = tuple(symb if fixed is None else fixed
+                           for fixed, symb
+                           in zip(self.input_shape[2:], input.shape[2:]))
+        pool_list = []
+        for pool_dim in self.pool_dims:
+            win_size = tuple((i + pool_dim - 1) // pool_dim
+                             for i in input_size)
+            str_size = tuple(i // pool_dim for i in input_size)
+            if not all(isinstance(i, int) for i in input_size):
+                # pass symbolic sizes as vectors rather than tuples
+                win_size = T.stack([T.cast(w, 'int64') for w in win_size])
+                str_size = T.stack([T.cast(s, 'int64') for s in str_size])
+
+            pool = pool_2d(input, ds=win_size, st=str_size,
+                           ignore_border=True, padding=(0, 0),
+                           mode=self.mode)
+            pool = pool.flatten(3)
+            pool_list.append(pool)
+
+        return T.concatenate(pool_list, axis=2)
+
+    def get_output_shape_for(self, input_shape):
+        num_features = sum(p*p for p in self.pool_dims)
+        return (input_shape[0], input_shape[1], num_features)
+
+
+class AdaptivePool2DLayer(Layer):
+    """
+    lasagne.layers.AdaptivePool2DLayer(incoming, output_size, mode='max',
+    **kwargs)
+
+    Adaptive 2D pooling layer
+
+    Performs 2D max or mean-pooling over the two trailing axes of a 4D input
+    tensor into a fixed output size, independent of the input size. Along
+    each axis, output element :math:`i` of :math:`n` pools the input elements
+    from :math:`\\lfloor i \\cdot l / n \\rfloor` up to excluding
+    :math:`\\lceil (i + 1) \\cdot l / n \\rceil` of an input of length
+    :math:`l`, so the pooling regions cover the input evenly and overlap by
+    at most one element.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or tuple
+        The layer feeding into this layer, or the expected input shape.
+
+    output_size : integer or iterable
+        The number of pooling regions in each dimension. If an integer, it is
+        used for both dimensions.
+
+    mode : {'max', 'average_inc_pad', 'average_exc_pad'}
+        Pooling mode: max-pooling or mean-pooling. As the pooling regions
+        never exceed the input, both mean-pooling modes are equivalent.
+        Default is 'max'.
+
+    **kwargs
+        Any additional keyword arguments are passed to the :class:`Layer`
+        superclass.
+
+    Notes
+    -----
+    If the input size is known and divisible by the output size, the layer
+    performs a single regular pooling operation. Otherwise, each axis is
+    pooled with a single vectorized operation: max-pooling gathers the
+    elements of all pooling regions into a padded array, repeating the last
+    element of shorter regions, and mean-pooling takes differences of the
+    cumulative sum of the input.
+    """
+    def __init__(self, incoming, output_size, mode='max', **kwargs):
+        super(AdaptivePool2DLayer, self).__init__(incoming, **kwargs)
+        if len(self.input_shape) != 4:
+            raise ValueError("Tried to create a 2D pooling layer with "
+                             "input shape %r. Expected 4 input dimensions "
+                             "(batchsize, channels, 2 spatial dimensions)."
+                             % (self.input_shape,))
+        if mode not in ('max', 'average_inc_pad', 'average_exc_pad'):
+            raise ValueError("Unsupported pooling mode %r" % (mode,))
+        self.output_size = as_tuple(output_size, 2, int)
+        self.mode = mode
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape[:2] + self.output_size
+
+    def get_output_for(self, input, **kwargs):
+        input_size = self.input_shape[2:]
+        if all(i is not None and i % o == 0
+               for i, o in zip(input_size, self.output_size)):
+            pool_size = tuple(i // o
+                              for i, o in zip(input_size, self.output_size))
+            return pool_2d(input, ds=pool_size, st=pool_size,
+                           ignore_border=True, padding=(0, 0),
+                           mode=self.mode)
+        for axis, (length, size) in enumerate(zip(input_size,
+                                                  self.output_size), 2):
+            input = _adaptive_pool_axis(input, axis, length, size, self.mode)
+        return input
+
+
+def _adaptive_pool_axis(input, axis, length, size, mode):
+    # Pools the given axis of the input into `size` regions
+    if length is None:
+        length = input.shape[axis]
+    index = T.arange(size)
+    start = (index * length) // size
+    stop = ((index + 1) * length + size - 1) // size
+    if mode == 'max':
+        # Gather the regions into a (size, max_region_size) array of
+        # indices, repeating the last index of shorter regions
+        if isinstance(length, int):
+            max_region_size = max(-(-(i + 1) * length // size) -
+                                  i * length // size for i in range(size))
+        else:
+            max_region_size = T.max(stop - start)
+        indices = T.minimum(start.dimshuffle(0, 'x') +
+                            T.arange(max_region_size).dimshuffle('x', 0),
+                            stop.dimshuffle(0, 'x') - 1)
+        return T.max(input.take(indices, axis=axis), axis=axis + 1)
+    else:
+        # Sum over the regions by differences of the cumulative sum
+        cumsum = T.cumsum(input, axis=axis)
+        padding = T.zeros_like(T.take(cumsum, [0], axis=axis))
+        cumsum = T.concatenate([padding, cumsum], axis=axis)
+        total = cumsum.take(stop, axis=axis) - cumsum.take(start, axis=axis)
+        pattern = ['x'] * input.ndim
+        pattern[axis] = 0
+        return total / T.cast(stop - start, input.dtype).dimshuffle(*pattern)
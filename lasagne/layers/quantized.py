@@ -0,0 +1,431 @@
+import numpy as np
+import theano
+import theano.tensor as T
+
+from .. import nonlinearities
+from ..theano_extensions import conv
+
+from .base import Layer
+from .conv import BaseConvLayer
+
+
+__all__ = [
+    "QuantizedDenseLayer",
+    "QuantizedNINLayer",
+    "QuantizedConv2DLayer",
+]
+
+
+#: The largest magnitude of the quantized weights and inputs (symmetric int8)
+QMAX = 127
+
+
+def _quantize(x, scale, dtype):
+    """
+    Symbolically quantizes `x` to the integers in ``[-QMAX, QMAX]`` after
+    dividing it by `scale`, returning them as type `dtype`.
+    """
+    return T.cast(T.clip(T.round(x / scale), -QMAX, QMAX), dtype)
+
+
+#: The largest number of products of quantized values whose sum is exact in
+#: float32, i.e., stays below ``2**24``
+CHUNK_SIZE = 2 ** 24 // QMAX ** 2
+
+
+def _chunks(size, block=1):
+    """
+    Splits the `size` elements of the fan-in, each contributing `block`
+    products to a sum, into slices of at most `CHUNK_SIZE` products. Returns
+    ``[slice(None)]`` if the whole fan-in fits into one chunk.
+    """
+    step = max(1, CHUNK_SIZE // block)
+    if size <= step:
+        return [slice(None)]
+    return [slice(start, start + step) for start in range(0, size, step)]
+
+
+def _take(x, chunk, axis):
+    # the chunk of `x` along `axis`, avoiding a no-op subtensor
+    if chunk == slice(None):
+        return x
+    return x[(slice(None),) * axis + (chunk,)]
+
+
+def _accumulate(partials):
+    """
+    Sums the float32 products of the chunks of the fan-in, which are exact
+    integers each. More than one chunk is summed in int32, so the total
+    stays exact beyond float32's 24 bits of mantissa.
+    """
+    if len(partials) == 1:
+        return partials[0]
+    accumulator = T.cast(partials[0], 'int32')
+    for partial in partials[1:]:
+        accumulator = accumulator + T.cast(partial, 'int32')
+    return accumulator
+
+
+def _float_weights(W, chunk, axis):
+    """
+    Returns a chunk of the int8 weights `W` cast to float32 for the
+    floating-point kernels. The cast is part of the graph, so the weights
+    stay int8 in memory between calls and follow changes of `W`.
+    """
+    return T.cast(_take(W, chunk, axis), 'float32')
+
+
+def _add_scales(layer, W_scale, input_scale, num_units):
+    layer.W_scale = layer.add_param(W_scale, (num_units,), name="W_scale",
+                                    trainable=False, regularizable=False)
+    layer.input_scale = layer.add_param(
+        np.asarray(input_scale, dtype=theano.config.floatX), (),
+        name="input_scale", trainable=False, regularizable=False)
+
+
+def _check_dtypes(layer):
+    for param, dtype in (layer.W, 'int8'), (layer.b, 'int32'):
+        if param is not None and param.dtype != dtype:
+            raise TypeError("%s must be of type %s, got %s" %
+                            (param.name or "parameter", dtype, param.dtype))
+
+
+def _add_biases(accumulator, b):
+    # the int32 biases are added in int32, where the sum is exact
+    return T.cast(accumulator, 'int32') + b
+
+
+def _dequantize(accumulator, scale):
+    # scale the accumulated integers back to real values; the next quantized
+    # layer requantizes them to its own input scale
+    return T.cast(accumulator, theano.config.floatX) * scale
+
+
+class QuantizedDenseLayer(Layer):
+    """
+    lasagne.layers.QuantizedDenseLayer(incoming, num_units, W, W_scale,
+    input_scale, b=None, nonlinearity=lasagne.nonlinearities.rectify,
+    num_leading_axes=1, **kwargs)
+
+    A fully connected layer with int8 weights, for inference.
+
+    The input is quantized to int8 with a fixed scale, multiplied with the
+    int8 weights accumulating in int32, the int32 biases are added, and the
+    result is scaled back to real values with the product of the input scale
+    and the per-unit weight scale. This is what :func:`quantize_network()
+    <lasagne.quantization.quantize_network>` replaces a trained
+    :class:`DenseLayer` with.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape
+
+    num_units : int
+        The number of units of the layer
+
+    W : Theano shared variable or numpy array of type int8
+        The quantized weights, a matrix of shape ``(num_inputs, num_units)``
+        with values in ``[-127, 127]``.
+
+    W_scale : Theano shared variable or numpy array
+        The scale of the weights of each unit, of shape ``(num_units,)``.
+
+    input_scale : float
+        The scale the input is divided by before rounding it to the integers
+        in ``[-127, 127]``.
+
+    b : Theano shared variable, numpy array of type int32 or ``None``
+        The quantized biases of shape ``(num_units,)``, in units of the
+        product of the input and weight scales, or ``None`` for no biases.
+
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations. If None
+        is provided, the layer will be linear.
+
+    num_leading_axes : int
+        Number of leading axes to distribute the dot product over, as for
+        :class:`DenseLayer`.
+
+    **kwargs
+        Any additional keyword arguments are passed to the `Layer` superclass.
+
+    Notes
+    -----
+    The int8 weights take a quarter of the memory of float32 weights.
+    Theano has no int8 kernels, so each call casts the weights to float32,
+    one chunk at a time (see below); the float32 chunks are temporary.
+
+    The products are accumulated in float32, which is exact as long as the
+    sums stay below ``2**24``. Larger fan-ins are split into chunks of at
+    most `CHUNK_SIZE` (1040) inputs whose sums are exact, and these are
+    added in int32, as are the biases. The layer thus gives the results of
+    int32 accumulation (for fan-ins up to about 130,000) with the float32
+    BLAS and convolution kernels.
+    """
+    def __init__(self, incoming, num_units, W, W_scale, input_scale, b=None,
+                 nonlinearity=nonlinearities.rectify, num_leading_axes=1,
+                 **kwargs):
+        super(QuantizedDenseLayer, self).__init__(incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+
+        self.num_units = num_units
+
+        if num_leading_axes >= len(self.input_shape):
+            raise ValueError(
+                    "Got num_leading_axes=%d for a %d-dimensional input, "
+                    "leaving no trailing axes for the dot product." %
+                    (num_leading_axes, len(self.input_shape)))
+        elif num_leading_axes < -len(self.input_shape):
+            raise ValueError(
+                    "Got num_leading_axes=%d for a %d-dimensional input, "
+                    "requesting more trailing axes than there are input "
+                    "dimensions." % (num_leading_axes, len(self.input_shape)))
+        self.num_leading_axes = num_leading_axes
+
+        if any(s is None for s in self.input_shape[num_leading_axes:]):
+            raise ValueError(
+                    "A QuantizedDenseLayer requires a fixed input shape "
+                    "(except for the leading axes). Got %r for "
+                    "num_leading_axes=%d." %
+                    (self.input_shape, self.num_leading_axes))
+        num_inputs = int(np.prod(self.input_shape[num_leading_axes:]))
+
+        self.W = self.add_param(W, (num_inputs, num_units), name="W",
+                                trainable=False, regularizable=False)
+        if b is None:
+            self.b = None
+        else:
+            self.b = self.add_param(b, (num_units,), name="b",
+                                    trainable=False, regularizable=False)
+        _check_dtypes(self)
+        _add_scales(self, W_scale, input_scale, num_units)
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape[:self.num_leading_axes] + (self.num_units,)
+
+    def get_output_for(self, input, **kwargs):
+        num_leading_axes = self.num_leading_axes
+        if num_leading_axes < 0:
+            num_leading_axes += input.ndim
+        if input.ndim > num_leading_axes + 1:
+            input = input.flatten(num_leading_axes + 1)
+
+        input = _quantize(input, self.input_scale, 'float32')
+        num_inputs = int(np.prod(self.input_shape[self.num_leading_axes:]))
+        activation = _accumulate([
+            T.dot(_take(input, chunk, num_leading_axes),
+                  _float_weights(self.W, chunk, 0))
+            for chunk in _chunks(num_inputs)])
+        if self.b is not None:
+            activation = _add_biases(activation, self.b)
+        activation = _dequantize(activation, self.input_scale * self.W_scale)
+        return self.nonlinearity(activation)
+
+
+class QuantizedNINLayer(Layer):
+    """
+    lasagne.layers.QuantizedNINLayer(incoming, num_units, W, W_scale,
+    input_scale, b=None, untie_biases=False,
+    nonlinearity=lasagne.nonlinearities.rectify, **kwargs)
+
+    A network-in-network layer with int8 weights, for inference.
+
+    Computes the same as :class:`NINLayer`, quantized as described for
+    :class:`QuantizedDenseLayer`.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape
+
+    num_units : int
+        The number of units of the layer
+
+    W : Theano shared variable or numpy array of type int8
+        The quantized weights, a matrix of shape ``(num_inputs, num_units)``,
+        where ``num_inputs`` is the size of the second dimension of the
+        input.
+
+    W_scale : Theano shared variable or numpy array
+        The scale of the weights of each unit, of shape ``(num_units,)``.
+
+    input_scale : float
+        The scale the input is divided by before rounding it to the integers
+        in ``[-127, 127]``.
+
+    b : Theano shared variable, numpy array of type int32 or ``None``
+        The quantized biases in units of the product of the input and weight
+        scales, or ``None`` for no biases. Of shape ``(num_units,)`` for
+        ``untie_biases=False``, and ``(num_units, input_shape[2], ...,
+        input_shape[-1])`` for ``untie_biases=True``.
+
+    untie_biases : bool
+        Whether there is a separate bias for each trailing dimension beyond
+        the 2nd.
+
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations. If None
+        is provided, the layer will be linear.
+
+    **kwargs
+        Any additional keyword arguments are passed to the `Layer` superclass.
+    """
+    def __init__(self, incoming, num_units, W, W_scale, input_scale, b=None,
+                 untie_biases=False, nonlinearity=nonlinearities.rectify,
+                 **kwargs):
+        super(QuantizedNINLayer, self).__init__(incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+
+        self.num_units = num_units
+        self.untie_biases = untie_biases
+
+        num_input_channels = self.input_shape[1]
+
+        self.W = self.add_param(W, (num_input_channels, num_units), name="W",
+                                trainable=False, regularizable=False)
+        if b is None:
+            self.b = None
+        else:
+            if self.untie_biases:
+                biases_shape = (num_units,) + self.output_shape[2:]
+            else:
+                biases_shape = (num_units,)
+            self.b = self.add_param(b, biases_shape, name="b",
+                                    trainable=False, regularizable=False)
+        _check_dtypes(self)
+        _add_scales(self, W_scale, input_scale, num_units)
+
+    def get_output_shape_for(self, input_shape):
+        return (input_shape[0], self.num_units) + input_shape[2:]
+
+    def get_output_for(self, input, **kwargs):
+        input = _quantize(input, self.input_scale, 'float32')
+        out_r = _accumulate([
+            T.tensordot(_float_weights(self.W, chunk, 0),
+                        _take(input, chunk, 1), axes=[[0], [1]])
+            for chunk in _chunks(self.input_shape[1])])
+        remaining_dims = range(2, input.ndim)
+        activation = out_r.dimshuffle(1, 0, *remaining_dims)
+
+        if self.b is not None:
+            if self.untie_biases:
+                remaining_dims_biases = range(1, input.ndim - 1)
+            else:
+                remaining_dims_biases = ['x'] * (input.ndim - 2)
+            activation = _add_biases(
+                activation, self.b.dimshuffle('x', 0, *remaining_dims_biases))
+        scale = (self.input_scale * self.W_scale).dimshuffle(
+            'x', 0, *(['x'] * (input.ndim - 2)))
+        return self.nonlinearity(_dequantize(activation, scale))
+
+
+class QuantizedConv2DLayer(BaseConvLayer):
+    """
+    lasagne.layers.QuantizedConv2DLayer(incoming, num_filters, filter_size,
+    W, W_scale, input_scale, b=None, stride=(1, 1), pad=0,
+    untie_biases=False, nonlinearity=lasagne.nonlinearities.rectify,
+    flip_filters=True, convolution=theano.tensor.nnet.conv2d, num_groups=1,
+    **kwargs)
+
+    A 2D convolutional layer with int8 filters, for inference.
+
+    Computes the same as :class:`Conv2DLayer`, quantized as described for
+    :class:`QuantizedDenseLayer`.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+
+    num_filters : int
+        The number of learnable convolutional filters this layer has.
+
+    filter_size : int or iterable of int
+        An integer or a 2-element tuple specifying the size of the filters.
+
+    W : Theano shared variable or numpy array of type int8
+        The quantized filters, of shape ``(num_filters, num_input_channels //
+        num_groups, filter_rows, filter_columns)``.
+
+    W_scale : Theano shared variable or numpy array
+        The scale of each filter, of shape ``(num_filters,)``.
+
+    input_scale : float
+        The scale the input is divided by before rounding it to the integers
+        in ``[-127, 127]``.
+
+    b : Theano shared variable, numpy array of type int32 or ``None``
+        The quantized biases in units of the product of the input and filter
+        scales, or ``None`` for no biases, of the shape expected by
+        :class:`Conv2DLayer`.
+
+    stride, pad, untie_biases, nonlinearity, flip_filters, convolution,
+    num_groups
+        As for :class:`Conv2DLayer`.
+
+    **kwargs
+        Any additional keyword arguments are passed to the `Layer` superclass.
+    """
+    def __init__(self, incoming, num_filters, filter_size, W, W_scale,
+                 input_scale, b=None, stride=(1, 1), pad=0,
+                 untie_biases=False, nonlinearity=nonlinearities.rectify,
+                 flip_filters=True, convolution=T.nnet.conv2d, num_groups=1,
+                 **kwargs):
+        super(QuantizedConv2DLayer, self).__init__(
+            incoming, num_filters, filter_size, stride, pad, untie_biases, W,
+            b, nonlinearity, flip_filters, num_groups, n=2, **kwargs)
+        # the quantized weights and biases are fixed
+        for param in self.W, self.b:
+            if param is not None:
+                self.params[param].difference_update(('trainable',
+                                                      'regularizable'))
+        _check_dtypes(self)
+        _add_scales(self, W_scale, input_scale, num_filters)
+        if num_groups > 1 and convolution is T.nnet.conv2d:
+            convolution = conv.conv2d_grouped
+        self.convolution = convolution
+
+    def convolve(self, input, **kwargs):
+        border_mode = 'half' if self.pad == 'same' else self.pad
+        extra_kwargs = {}
+        if self.num_groups > 1:  # only pass if needed
+            extra_kwargs['num_groups'] = self.num_groups
+        W_shape = self.get_W_shape()
+        channels = W_shape[1]
+        partials = []
+        for chunk in _chunks(channels, int(np.prod(W_shape[2:]))):
+            # the same chunk of channels of each group, so the chunks of the
+            # input and the filters still form num_groups groups
+            chunk_channels = len(range(channels)[chunk])
+            chunk_input = input
+            if chunk != slice(None):
+                chunk_input = input.reshape(
+                    (input.shape[0], self.num_groups, channels,
+                     input.shape[2], input.shape[3]))[:, :, chunk]
+                chunk_input = chunk_input.reshape(
+                    (input.shape[0], self.num_groups * chunk_channels,
+                     input.shape[2], input.shape[3]))
+            input_shape = (self.input_shape[:1] +
+                           (self.num_groups * chunk_channels,) +
+                           self.input_shape[2:])
+            partials.append(self.convolution(
+                chunk_input, _float_weights(self.W, chunk, 1), input_shape,
+                W_shape[:1] + (chunk_channels,) + W_shape[2:],
+                subsample=self.stride, border_mode=border_mode,
+                filter_flip=self.flip_filters, **extra_kwargs))
+        return _accumulate(partials)
+
+    def get_output_for(self, input, **kwargs):
+        activation = self.convolve(
+            _quantize(input, self.input_scale, 'float32'), **kwargs)
+        if self.b is not None:
+            if self.untie_biases:
+                b = T.shape_padleft(self.b, 1)
+            else:
+                b = self.b.dimshuffle('x', 0, 'x', 'x')
+            activation = _add_biases(activation, b)
+        scale = (self.input_scale * self.W_scale).dimshuffle('x', 0, 'x', 'x')
+        return self.nonlinearity(_dequantize(activation, scale))
@@ -18,6 +18,9 @@ The following recurrent layers are implemented:
     RecurrentLayer
     LSTMLayer
     GRULayer
+    BidirectionalLSTMLayer
+    BidirectionalGRULayer
+    StackedLSTMLayer
 
 For recurrent layers with gates we use a helper class to set up the parameters
 in each gate:
@@ -67,6 +70,7 @@ from ..utils import unroll_scan
 from .base import MergeLayer, Layer
 from .input import InputLayer
 from .dense import DenseLayer
+from .embedding import EmbeddingLayer
 from . import helper
 
 __all__ = [
@@ -74,10 +78,55 @@ __all__ = [
     "RecurrentLayer",
     "Gate",
     "LSTMLayer",
-    "GRULayer"
+    "GRULayer",
+    "BidirectionalLSTMLayer",
+    "BidirectionalGRULayer",
+    "StackedLSTMLayer",
 ]
 
 
+def _opaque_dot(dtype):
+    """
+    Returns an op computing the dot product of two matrices that is opaque
+    to Theano's scan optimizations. This is needed when the number of rows
+    changes from step to step: scan would otherwise move the accumulation of
+    the weight gradients out of the loop, which requires constant shapes.
+    """
+    x = T.matrix(dtype=dtype)
+    y = T.matrix(dtype=dtype)
+    op = theano.OpFromGraph([x, y], [T.dot(x, y)])
+
+    def dot(x, y):
+        return op(T.cast(x, dtype), T.cast(y, dtype))
+    return dot
+
+
+def _folded_table(layer):
+    """
+    Returns the expression of the input projection table of a recurrent
+    layer with `fold_embedding`: the embedding matrix multiplied with the
+    stacked input weights, plus the stacked biases.
+    """
+    W_in_stacked, _, b_stacked = layer._stack_weights()
+    return T.dot(layer.W_emb, W_in_stacked) + b_stacked
+
+
+def _input_table(layer, deterministic):
+    """
+    Returns the table a layer with `fold_embedding` gathers its input
+    projections from: the cached copy for the deterministic output with
+    `cache_folded_table`, the expression of the table otherwise.
+    """
+    if not (deterministic and layer.cache_folded_table):
+        return _folded_table(layer)
+    if layer.folded_table is None:
+        raise RuntimeError("The deterministic output of a layer with "
+                           "cache_folded_table=True requires the cached "
+                           "table: call refresh_folded_table() or add "
+                           "folded_table_update() to the training updates.")
+    return layer.folded_table
+
+
 class CustomRecurrentLayer(MergeLayer):
     """
     lasagne.layers.recurrent.CustomRecurrentLayer(incoming, input_to_hidden,
@@ -690,7 +739,9 @@ class LSTMLayer(MergeLayer):
     cell_init=lasagne.init.Constant(0.),
     hid_init=lasagne.init.Constant(0.), backwards=False, learn_init=False,
     peepholes=True, gradient_steps=-1, grad_clipping=0, unroll_scan=False,
-    precompute_input=True, mask_input=None, only_return_final=False, **kwargs)
+    precompute_input=True, mask_input=None, only_return_final=False,
+    fold_embedding=False, pack_sequences=False, cache_folded_table=False,
+    **kwargs)
 
     A long short-term memory (LSTM) layer.
 
@@ -769,6 +820,37 @@ class LSTMLayer(MergeLayer):
         If True, only return the final sequential output (e.g. for tasks where
         a single target value for the entire sequence is desired).  In this
         case, Theano makes an optimization which saves memory.
+    fold_embedding : bool
+        If True, `incoming` must be an :class:`EmbeddingLayer`. The layer
+        then takes that layer's integer input directly and folds the
+        embedding into the input projection: instead of gathering embeddings
+        and multiplying the whole sequence with the input weights, it
+        gathers the projected inputs from a table of the embedding matrix
+        multiplied with the input weights (plus biases). The table is
+        computed in the graph, i.e., in every call of a compiled function
+        (see `cache_folded_table`). The embedding matrix becomes a parameter
+        of this layer, available as the attribute ``W_emb``; as it is shared
+        with the embedding layer, it keeps that layer's name (e.g. ``W``).
+        Requires `precompute_input` to be True.
+    pack_sequences : bool
+        If True and a mask is given, the sequences are sorted by length and
+        each step only computes the sequences that have not ended yet,
+        instead of computing all of them and discarding the results for
+        those that have ended. This saves computation for batches of very
+        different sequence lengths. Requires the mask of each sequence to
+        consist of ones followed by zeros.
+    cache_folded_table : bool
+        If True (requires `fold_embedding`), the deterministic output
+        gathers from a copy of the table in the shared variable
+        ``folded_table`` instead of computing it in every call. **The copy
+        does not follow the parameters**: it is created and updated by
+        :meth:`refresh_folded_table`, or by the update returned by
+        :meth:`folded_table_update` added to the training function. After
+        any other change of the parameters, e.g., by a training loop without
+        that update or by :func:`set_all_param_values`, the deterministic
+        output uses stale weights until the table is refreshed. The
+        deterministic output raises a `RuntimeError` until the copy has been
+        created.
 
     References
     ----------
@@ -792,6 +874,9 @@ class LSTMLayer(MergeLayer):
                  precompute_input=True,
                  mask_input=None,
                  only_return_final=False,
+                 fold_embedding=False,
+                 pack_sequences=False,
+                 cache_folded_table=False,
                  **kwargs):
 
         # This layer inherits from a MergeLayer, because it can have four
@@ -799,6 +884,18 @@ class LSTMLayer(MergeLayer):
         # inital cell state. We will just provide the layer input as incomings,
         # unless a mask input, inital hidden state or initial cell state was
         # provided.
+        if fold_embedding:
+            if not isinstance(incoming, EmbeddingLayer):
+                raise ValueError("fold_embedding requires the incoming layer "
+                                 "to be an EmbeddingLayer")
+            if not precompute_input:
+                raise ValueError("fold_embedding requires precompute_input "
+                                 "to be True")
+            embedding = incoming
+            incoming = embedding.input_layer or embedding.input_shape
+        elif cache_folded_table:
+            raise ValueError("cache_folded_table requires fold_embedding")
+
         incomings = [incoming]
         self.mask_incoming_index = -1
         self.hid_init_incoming_index = -1
@@ -831,6 +928,11 @@ class LSTMLayer(MergeLayer):
         self.unroll_scan = unroll_scan
         self.precompute_input = precompute_input
         self.only_return_final = only_return_final
+        self.fold_embedding = fold_embedding
+        self.pack_sequences = pack_sequences
+        self.cache_folded_table = cache_folded_table
+        # created on demand, see refresh_folded_table()
+        self.folded_table = None
 
         if unroll_scan and gradient_steps != -1:
             raise ValueError(
@@ -843,6 +945,16 @@ class LSTMLayer(MergeLayer):
             raise ValueError("Input sequence length cannot be specified as "
                              "None when unroll_scan is True")
 
+        if fold_embedding:
+            # Take over the embedding matrix along with its tags
+            tags = dict((tag, True) for tag in embedding.params[embedding.W])
+            tags.setdefault('trainable', False)
+            tags.setdefault('regularizable', False)
+            self.W_emb = self.add_param(
+                embedding.W, (embedding.input_size, embedding.output_size),
+                name="W_emb", **tags)
+            input_shape = input_shape + (embedding.output_size,)
+
         num_inputs = np.prod(input_shape[2:])
 
         def add_gate_params(gate, gate_name):
@@ -899,6 +1011,36 @@ class LSTMLayer(MergeLayer):
                 hid_init, (1, self.num_units), name="hid_init",
                 trainable=learn_init, regularizable=False)
 
+    def folded_table_update(self):
+        """
+        Returns an update bringing the table cached with
+        `cache_folded_table` up to date, to be added to the updates of a
+        training function. Creates the cache if needed.
+
+        Returns
+        -------
+        tuple
+            The shared variable ``folded_table`` and the expression of the
+            table for the current parameters.
+        """
+        if not self.cache_folded_table:
+            raise ValueError("folded_table_update() requires "
+                             "cache_folded_table=True")
+        expression = _folded_table(self)
+        if self.folded_table is None:
+            self.folded_table = theano.shared(expression.eval(),
+                                              name="folded_table")
+        return self.folded_table, expression
+
+    def refresh_folded_table(self):
+        """
+        Recomputes the table cached with `cache_folded_table` from the
+        current parameter values. Call this after any change of the
+        parameters and before computing the deterministic output.
+        """
+        table, expression = self.folded_table_update()
+        table.set_value(expression.eval())
+
     def get_output_shape_for(self, input_shapes):
         # The shape of the input to this layer will be the first element
         # of input_shapes, whether or not a mask input is being used.
@@ -911,7 +1053,102 @@ class LSTMLayer(MergeLayer):
         else:
             return input_shape[0], input_shape[1], self.num_units
 
-    def get_output_for(self, inputs, **kwargs):
+    def _stack_weights(self):
+        # Stack input weight matrices into a (num_inputs, 4*num_units)
+        # matrix, which speeds up computation
+        W_in_stacked = T.concatenate(
+            [self.W_in_to_ingate, self.W_in_to_forgetgate,
+             self.W_in_to_cell, self.W_in_to_outgate], axis=1)
+
+        # Same for hidden weight matrices
+        W_hid_stacked = T.concatenate(
+            [self.W_hid_to_ingate, self.W_hid_to_forgetgate,
+             self.W_hid_to_cell, self.W_hid_to_outgate], axis=1)
+
+        # Stack biases into a (4*num_units) vector
+        b_stacked = T.concatenate(
+            [self.b_ingate, self.b_forgetgate,
+             self.b_cell, self.b_outgate], axis=0)
+
+        return W_in_stacked, W_hid_stacked, b_stacked
+
+    def _step(self, input_n, cell_previous, hid_previous, W_hid_stacked,
+              dot=T.dot):
+        # input_n is the (n_batch, 4*num_units) input projection of a step.
+        # We define a slicing function that extract the input to each LSTM gate
+        def slice_w(x, n):
+            return x[:, n*self.num_units:(n+1)*self.num_units]
+
+        # Calculate gates pre-activations and slice
+        gates = input_n + dot(hid_previous, W_hid_stacked)
+
+        # Clip gradients
+        if self.grad_clipping:
+            gates = theano.gradient.grad_clip(
+                gates, -self.grad_clipping, self.grad_clipping)
+
+        # Extract the pre-activation gate values
+        ingate = slice_w(gates, 0)
+        forgetgate = slice_w(gates, 1)
+        cell_input = slice_w(gates, 2)
+        outgate = slice_w(gates, 3)
+
+        if self.peepholes:
+            # Compute peephole connections
+            ingate += cell_previous*self.W_cell_to_ingate
+            forgetgate += cell_previous*self.W_cell_to_forgetgate
+
+        # Apply nonlinearities
+        ingate = self.nonlinearity_ingate(ingate)
+        forgetgate = self.nonlinearity_forgetgate(forgetgate)
+        cell_input = self.nonlinearity_cell(cell_input)
+
+        # Compute new cell value
+        cell = forgetgate*cell_previous + ingate*cell_input
+
+        if self.peepholes:
+            outgate += cell*self.W_cell_to_outgate
+        outgate = self.nonlinearity_outgate(outgate)
+
+        # Compute new hidden unit activation
+        hid = outgate*self.nonlinearity(cell)
+        return [cell, hid]
+
+    def get_step_output_for(self, input_n, cell_previous, hid_previous,
+                            deterministic=False):
+        """
+        Compute a single step of the recurrence, e.g., for decoding one
+        sequence element at a time (see :mod:`lasagne.decoding`).
+
+        Parameters
+        ----------
+        input_n : theano.TensorType
+            The input for the step, of shape ``(n_batch, num_inputs)``, or a
+            vector of ``n_batch`` indices when `fold_embedding` is set.
+        cell_previous : theano.TensorType
+            The previous cell state, of shape ``(n_batch, num_units)``.
+        hid_previous : theano.TensorType
+            The previous hidden state, of shape ``(n_batch, num_units)``.
+        deterministic : bool
+            With `cache_folded_table`, whether to gather from the cached
+            table instead of computing it.
+
+        Returns
+        -------
+        list of theano.TensorType
+            The new cell state and the new hidden state.
+        """
+        W_in_stacked, W_hid_stacked, b_stacked = self._stack_weights()
+        if self.fold_embedding:
+            table = _input_table(self, deterministic)
+            input_n = table[input_n]
+        else:
+            if input_n.ndim > 2:
+                input_n = T.flatten(input_n, 2)
+            input_n = T.dot(input_n, W_in_stacked) + b_stacked
+        return self._step(input_n, cell_previous, hid_previous, W_hid_stacked)
+
+    def get_output_for(self, inputs, deterministic=False, **kwargs):
         """
         Compute this layer's output function given a symbolic input variable
 
@@ -955,83 +1192,50 @@ class LSTMLayer(MergeLayer):
         if self.cell_init_incoming_index > 0:
             cell_init = inputs[self.cell_init_incoming_index]
 
-        # Treat all dimensions after the second as flattened feature dimensions
-        if input.ndim > 3:
-            input = T.flatten(input, 3)
-
-        # Because scan iterates over the first dimension we dimshuffle to
-        # (n_time_steps, n_batch, n_features)
-        input = input.dimshuffle(1, 0, 2)
-        seq_len, num_batch, _ = input.shape
-
-        # Stack input weight matrices into a (num_inputs, 4*num_units)
-        # matrix, which speeds up computation
-        W_in_stacked = T.concatenate(
-            [self.W_in_to_ingate, self.W_in_to_forgetgate,
-             self.W_in_to_cell, self.W_in_to_outgate], axis=1)
-
-        # Same for hidden weight matrices
-        W_hid_stacked = T.concatenate(
-            [self.W_hid_to_ingate, self.W_hid_to_forgetgate,
-             self.W_hid_to_cell, self.W_hid_to_outgate], axis=1)
+        if self.fold_embedding:
+            # The input is a (n_batch, n_time_steps) matrix of indices; we
+            # dimshuffle to (n_time_steps, n_batch) for scan
+            input = input.dimshuffle(1, 0)
+        else:
+            # Treat all dimensions after the second as flattened feature
+            # dimensions
+            if input.ndim > 3:
+                input = T.flatten(input, 3)
+
+            # Because scan iterates over the first dimension we dimshuffle to
+            # (n_time_steps, n_batch, n_features)
+            input = input.dimshuffle(1, 0, 2)
+        seq_len, num_batch = input.shape[0], input.shape[1]
 
-        # Stack biases into a (4*num_units) vector
-        b_stacked = T.concatenate(
-            [self.b_ingate, self.b_forgetgate,
-             self.b_cell, self.b_outgate], axis=0)
+        W_in_stacked, W_hid_stacked, b_stacked = self._stack_weights()
 
-        if self.precompute_input:
+        if self.fold_embedding:
+            # Fold the embedding into the input projection: gather from an
+            # (input_size, 4*num_units) table of the projection of every
+            # embedding. input is then (n_time_steps, n_batch, 4*num_units).
+            table = _input_table(self, deterministic)
+            input = table[input]
+        elif self.precompute_input:
             # Because the input is given for all time steps, we can
             # precompute_input the inputs dot weight matrices before scanning.
             # W_in_stacked is (n_features, 4*num_units). input is then
             # (n_time_steps, n_batch, 4*num_units).
             input = T.dot(input, W_in_stacked) + b_stacked
 
-        # When theano.scan calls step, input_n will be (n_batch, 4*num_units).
-        # We define a slicing function that extract the input to each LSTM gate
-        def slice_w(x, n):
-            return x[:, n*self.num_units:(n+1)*self.num_units]
+        # The products computed in each step of packed sequences have a
+        # varying number of rows, see _opaque_dot()
+        if mask is not None and self.pack_sequences:
+            dot = _opaque_dot(W_hid_stacked.dtype)
+        else:
+            dot = T.dot
 
         # Create single recurrent computation step function
         # input_n is the n'th vector of the input
         def step(input_n, cell_previous, hid_previous, *args):
             if not self.precompute_input:
-                input_n = T.dot(input_n, W_in_stacked) + b_stacked
-
-            # Calculate gates pre-activations and slice
-            gates = input_n + T.dot(hid_previous, W_hid_stacked)
-
-            # Clip gradients
-            if self.grad_clipping:
-                gates = theano.gradient.grad_clip(
-                    gates, -self.grad_clipping, self.grad_clipping)
-
-            # Extract the pre-activation gate values
-            ingate = slice_w(gates, 0)
-            forgetgate = slice_w(gates, 1)
-            cell_input = slice_w(gates, 2)
-            outgate = slice_w(gates, 3)
-
-            if self.peepholes:
-                # Compute peephole connections
-                ingate += cell_previous*self.W_cell_to_ingate
-                forgetgate += cell_previous*self.W_cell_to_forgetgate
-
-            # Apply nonlinearities
-            ingate = self.nonlinearity_ingate(ingate)
-            forgetgate = self.nonlinearity_forgetgate(forgetgate)
-            cell_input = self.nonlinearity_cell(cell_input)
-
-            # Compute new cell value
-            cell = forgetgate*cell_previous + ingate*cell_input
-
-            if self.peepholes:
-                outgate += cell*self.W_cell_to_outgate
-            outgate = self.nonlinearity_outgate(outgate)
-
-            # Compute new hidden unit activation
-            hid = outgate*self.nonlinearity(cell)
-            return [cell, hid]
+                input_n = dot(input_n, W_in_stacked) + b_stacked
+            return self._step(input_n, cell_previous, hid_previous,
+                              W_hid_stacked, dot)
 
         def step_masked(input_n, mask_n, cell_previous, hid_previous, *args):
             cell, hid = step(input_n, cell_previous, hid_previous, *args)
@@ -1043,7 +1247,34 @@ class LSTMLayer(MergeLayer):
 
             return [cell, hid]
 
-        if mask is not None:
+        def step_packed(input_n, num_active, cell_previous, hid_previous,
+                        *args):
+            # Only compute the first num_active rows, which hold the
+            # sequences that have not ended yet, and keep the others.
+            cell, hid = step(input_n[:num_active],
+                             cell_previous[:num_active],
+                             hid_previous[:num_active], *args)
+            cell = T.set_subtensor(cell_previous[:num_active], cell)
+            hid = T.set_subtensor(hid_previous[:num_active], hid)
+
+            return [cell, hid]
+
+        if mask is not None and self.pack_sequences:
+            # Sort the sequences by decreasing length, so the sequences not
+            # ended at time step t are the first num_active[t] ones
+            lengths = T.cast(mask.sum(axis=1), 'int64')
+            order = T.argsort(-lengths)
+            num_active = T.sum(T.gt(lengths.dimshuffle('x', 0),
+                                    T.arange(seq_len).dimshuffle(0, 'x')),
+                               axis=1)
+            input = input[:, order]
+            if hid_init is not None:
+                hid_init = hid_init[order]
+            if cell_init is not None:
+                cell_init = cell_init[order]
+            sequences = [input, num_active]
+            step_fun = step_packed
+        elif mask is not None:
             # mask is given as (batch_size, seq_len). Because scan iterates
             # over first dimension, we dimshuffle to (seq_len, batch_size) and
             # add a broadcastable dimension
@@ -1099,6 +1330,10 @@ class LSTMLayer(MergeLayer):
                 non_sequences=non_seqs,
                 strict=True)[0]
 
+        if mask is not None and self.pack_sequences:
+            # Undo the sorting of sequences by length
+            hid_out = hid_out[:, T.argsort(order)]
+
         # When it is requested that we only return the final sequence step,
         # we need to slice it out immediately after scan is applied
         if self.only_return_final:
@@ -1123,7 +1358,9 @@ class GRULayer(MergeLayer):
     W_cell=None, lasagne.nonlinearities.tanh),
     hid_init=lasagne.init.Constant(0.), backwards=False, learn_init=False,
     gradient_steps=-1, grad_clipping=0, unroll_scan=False,
-    precompute_input=True, mask_input=None, only_return_final=False, **kwargs)
+    precompute_input=True, mask_input=None, only_return_final=False,
+    fold_embedding=False, pack_sequences=False, cache_folded_table=False,
+    **kwargs)
 
     Gated Recurrent Unit (GRU) Layer
 
@@ -1184,6 +1421,37 @@ class GRULayer(MergeLayer):
         If True, only return the final sequential output (e.g. for tasks where
         a single target value for the entire sequence is desired).  In this
         case, Theano makes an optimization which saves memory.
+    fold_embedding : bool
+        If True, `incoming` must be an :class:`EmbeddingLayer`. The layer
+        then takes that layer's integer input directly and folds the
+        embedding into the input projection: instead of gathering embeddings
+        and multiplying the whole sequence with the input weights, it
+        gathers the projected inputs from a table of the embedding matrix
+        multiplied with the input weights (plus biases). The table is
+        computed in the graph, i.e., in every call of a compiled function
+        (see `cache_folded_table`). The embedding matrix becomes a parameter
+        of this layer, available as the attribute ``W_emb``; as it is shared
+        with the embedding layer, it keeps that layer's name (e.g. ``W``).
+        Requires `precompute_input` to be True.
+    pack_sequences : bool
+        If True and a mask is given, the sequences are sorted by length and
+        each step only computes the sequences that have not ended yet,
+        instead of computing all of them and discarding the results for
+        those that have ended. This saves computation for batches of very
+        different sequence lengths. Requires the mask of each sequence to
+        consist of ones followed by zeros.
+    cache_folded_table : bool
+        If True (requires `fold_embedding`), the deterministic output
+        gathers from a copy of the table in the shared variable
+        ``folded_table`` instead of computing it in every call. **The copy
+        does not follow the parameters**: it is created and updated by
+        :meth:`refresh_folded_table`, or by the update returned by
+        :meth:`folded_table_update` added to the training function. After
+        any other change of the parameters, e.g., by a training loop without
+        that update or by :func:`set_all_param_values`, the deterministic
+        output uses stale weights until the table is refreshed. The
+        deterministic output raises a `RuntimeError` until the copy has been
+        created.
 
     References
     ----------
@@ -1220,12 +1488,27 @@ class GRULayer(MergeLayer):
                  precompute_input=True,
                  mask_input=None,
                  only_return_final=False,
+                 fold_embedding=False,
+                 pack_sequences=False,
+                 cache_folded_table=False,
                  **kwargs):
 
         # This layer inherits from a MergeLayer, because it can have three
         # inputs - the layer input, the mask and the initial hidden state.  We
         # will just provide the layer input as incomings, unless a mask input
         # or initial hidden state was provided.
+        if fold_embedding:
+            if not isinstance(incoming, EmbeddingLayer):
+                raise ValueError("fold_embedding requires the incoming layer "
+                                 "to be an EmbeddingLayer")
+            if not precompute_input:
+                raise ValueError("fold_embedding requires precompute_input "
+                                 "to be True")
+            embedding = incoming
+            incoming = embedding.input_layer or embedding.input_shape
+        elif cache_folded_table:
+            raise ValueError("cache_folded_table requires fold_embedding")
+
         incomings = [incoming]
         self.mask_incoming_index = -1
         self.hid_init_incoming_index = -1
@@ -1247,6 +1530,11 @@ class GRULayer(MergeLayer):
         self.unroll_scan = unroll_scan
         self.precompute_input = precompute_input
         self.only_return_final = only_return_final
+        self.fold_embedding = fold_embedding
+        self.pack_sequences = pack_sequences
+        self.cache_folded_table = cache_folded_table
+        # created on demand, see refresh_folded_table()
+        self.folded_table = None
 
         if unroll_scan and gradient_steps != -1:
             raise ValueError(
@@ -1259,6 +1547,16 @@ class GRULayer(MergeLayer):
             raise ValueError("Input sequence length cannot be specified as "
                              "None when unroll_scan is True")
 
+        if fold_embedding:
+            # Take over the embedding matrix along with its tags
+            tags = dict((tag, True) for tag in embedding.params[embedding.W])
+            tags.setdefault('trainable', False)
+            tags.setdefault('regularizable', False)
+            self.W_emb = self.add_param(
+                embedding.W, (embedding.input_size, embedding.output_size),
+                name="W_emb", **tags)
+            input_shape = input_shape + (embedding.output_size,)
+
         # Input dimensionality is the output dimensionality of the input layer
         num_inputs = np.prod(input_shape[2:])
 
@@ -1293,6 +1591,36 @@ class GRULayer(MergeLayer):
                 hid_init, (1, self.num_units), name="hid_init",
                 trainable=learn_init, regularizable=False)
 
+    def folded_table_update(self):
+        """
+        Returns an update bringing the table cached with
+        `cache_folded_table` up to date, to be added to the updates of a
+        training function. Creates the cache if needed.
+
+        Returns
+        -------
+        tuple
+            The shared variable ``folded_table`` and the expression of the
+            table for the current parameters.
+        """
+        if not self.cache_folded_table:
+            raise ValueError("folded_table_update() requires "
+                             "cache_folded_table=True")
+        expression = _folded_table(self)
+        if self.folded_table is None:
+            self.folded_table = theano.shared(expression.eval(),
+                                              name="folded_table")
+        return self.folded_table, expression
+
+    def refresh_folded_table(self):
+        """
+        Recomputes the table cached with `cache_folded_table` from the
+        current parameter values. Call this after any change of the
+        parameters and before computing the deterministic output.
+        """
+        table, expression = self.folded_table_update()
+        table.set_value(expression.eval())
+
     def get_output_shape_for(self, input_shapes):
         # The shape of the input to this layer will be the first element
         # of input_shapes, whether or not a mask input is being used.
@@ -1305,7 +1633,98 @@ class GRULayer(MergeLayer):
         else:
             return input_shape[0], input_shape[1], self.num_units
 
-    def get_output_for(self, inputs, **kwargs):
+    def _stack_weights(self):
+        # Stack input weight matrices into a (num_inputs, 3*num_units)
+        # matrix, which speeds up computation
+        W_in_stacked = T.concatenate(
+            [self.W_in_to_resetgate, self.W_in_to_updategate,
+             self.W_in_to_hidden_update], axis=1)
+
+        # Same for hidden weight matrices
+        W_hid_stacked = T.concatenate(
+            [self.W_hid_to_resetgate, self.W_hid_to_updategate,
+             self.W_hid_to_hidden_update], axis=1)
+
+        # Stack gate biases into a (3*num_units) vector
+        b_stacked = T.concatenate(
+            [self.b_resetgate, self.b_updategate,
+             self.b_hidden_update], axis=0)
+
+        return W_in_stacked, W_hid_stacked, b_stacked
+
+    def _step(self, input_n, hid_previous, W_hid_stacked, W_in_stacked=None,
+              b_stacked=None, dot=T.dot):
+        # input_n is the (n_batch, 3*num_units) input projection of a step,
+        # or the (n_batch, num_inputs) input if W_in_stacked is given.
+        # We define a slicing function that extract the input to each GRU gate
+        def slice_w(x, n):
+            return x[:, n*self.num_units:(n+1)*self.num_units]
+
+        # Compute W_{hr} h_{t - 1}, W_{hu} h_{t - 1}, and W_{hc} h_{t - 1}
+        hid_input = dot(hid_previous, W_hid_stacked)
+
+        if self.grad_clipping:
+            input_n = theano.gradient.grad_clip(
+                input_n, -self.grad_clipping, self.grad_clipping)
+            hid_input = theano.gradient.grad_clip(
+                hid_input, -self.grad_clipping, self.grad_clipping)
+
+        if W_in_stacked is not None:
+            # Compute W_{xr}x_t + b_r, W_{xu}x_t + b_u, and W_{xc}x_t + b_c
+            input_n = dot(input_n, W_in_stacked) + b_stacked
+
+        # Reset and update gates
+        resetgate = slice_w(hid_input, 0) + slice_w(input_n, 0)
+        updategate = slice_w(hid_input, 1) + slice_w(input_n, 1)
+        resetgate = self.nonlinearity_resetgate(resetgate)
+        updategate = self.nonlinearity_updategate(updategate)
+
+        # Compute W_{xc}x_t + r_t \odot (W_{hc} h_{t - 1})
+        hidden_update_in = slice_w(input_n, 2)
+        hidden_update_hid = slice_w(hid_input, 2)
+        hidden_update = hidden_update_in + resetgate*hidden_update_hid
+        if self.grad_clipping:
+            hidden_update = theano.gradient.grad_clip(
+                hidden_update, -self.grad_clipping, self.grad_clipping)
+        hidden_update = self.nonlinearity_hid(hidden_update)
+
+        # Compute (1 - u_t)h_{t - 1} + u_t c_t
+        hid = (1 - updategate)*hid_previous + updategate*hidden_update
+        return hid
+
+    def get_step_output_for(self, input_n, hid_previous,
+                            deterministic=False):
+        """
+        Compute a single step of the recurrence, e.g., for decoding one
+        sequence element at a time (see :mod:`lasagne.decoding`).
+
+        Parameters
+        ----------
+        input_n : theano.TensorType
+            The input for the step, of shape ``(n_batch, num_inputs)``, or a
+            vector of ``n_batch`` indices when `fold_embedding` is set.
+        hid_previous : theano.TensorType
+            The previous hidden state, of shape ``(n_batch, num_units)``.
+        deterministic : bool
+            With `cache_folded_table`, whether to gather from the cached
+            table instead of computing it.
+
+        Returns
+        -------
+        theano.TensorType
+            The new hidden state.
+        """
+        W_in_stacked, W_hid_stacked, b_stacked = self._stack_weights()
+        if self.fold_embedding:
+            table = _input_table(self, deterministic)
+            input_n = table[input_n]
+            return self._step(input_n, hid_previous, W_hid_stacked)
+        if input_n.ndim > 2:
+            input_n = T.flatten(input_n, 2)
+        return self._step(input_n, hid_previous, W_hid_stacked,
+                          W_in_stacked, b_stacked)
+
+    def get_output_for(self, inputs, deterministic=False, **kwargs):
         """
         Compute this layer's output function given a symbolic input variable
 
@@ -1341,75 +1760,49 @@ class GRULayer(MergeLayer):
         if self.hid_init_incoming_index > 0:
             hid_init = inputs[self.hid_init_incoming_index]
 
-        # Treat all dimensions after the second as flattened feature dimensions
-        if input.ndim > 3:
-            input = T.flatten(input, 3)
-
-        # Because scan iterates over the first dimension we dimshuffle to
-        # (n_time_steps, n_batch, n_features)
-        input = input.dimshuffle(1, 0, 2)
-        seq_len, num_batch, _ = input.shape
-
-        # Stack input weight matrices into a (num_inputs, 3*num_units)
-        # matrix, which speeds up computation
-        W_in_stacked = T.concatenate(
-            [self.W_in_to_resetgate, self.W_in_to_updategate,
-             self.W_in_to_hidden_update], axis=1)
-
-        # Same for hidden weight matrices
-        W_hid_stacked = T.concatenate(
-            [self.W_hid_to_resetgate, self.W_hid_to_updategate,
-             self.W_hid_to_hidden_update], axis=1)
+        if self.fold_embedding:
+            # The input is a (n_batch, n_time_steps) matrix of indices; we
+            # dimshuffle to (n_time_steps, n_batch) for scan
+            input = input.dimshuffle(1, 0)
+        else:
+            # Treat all dimensions after the second as flattened feature
+            # dimensions
+            if input.ndim > 3:
+                input = T.flatten(input, 3)
+
+            # Because scan iterates over the first dimension we dimshuffle to
+            # (n_time_steps, n_batch, n_features)
+            input = input.dimshuffle(1, 0, 2)
+        seq_len, num_batch = input.shape[0], input.shape[1]
 
-        # Stack gate biases into a (3*num_units) vector
-        b_stacked = T.concatenate(
-            [self.b_resetgate, self.b_updategate,
-             self.b_hidden_update], axis=0)
+        W_in_stacked, W_hid_stacked, b_stacked = self._stack_weights()
 
-        if self.precompute_input:
+        if self.fold_embedding:
+            # Gather the input projections from an (input_size, 3*num_units)
+            # table, see LSTMLayer.get_output_for()
+            table = _input_table(self, deterministic)
+            input = table[input]
+        elif self.precompute_input:
             # precompute_input inputs*W. W_in is (n_features, 3*num_units).
             # input is then (n_batch, n_time_steps, 3*num_units).
             input = T.dot(input, W_in_stacked) + b_stacked
 
-        # When theano.scan calls step, input_n will be (n_batch, 3*num_units).
-        # We define a slicing function that extract the input to each GRU gate
-        def slice_w(x, n):
-            return x[:, n*self.num_units:(n+1)*self.num_units]
+        # The products computed in each step of packed sequences have a
+        # varying number of rows, see _opaque_dot()
+        if mask is not None and self.pack_sequences:
+            dot = _opaque_dot(W_hid_stacked.dtype)
+        else:
+            dot = T.dot
 
         # Create single recurrent computation step function
         # input__n is the n'th vector of the input
         def step(input_n, hid_previous, *args):
-            # Compute W_{hr} h_{t - 1}, W_{hu} h_{t - 1}, and W_{hc} h_{t - 1}
-            hid_input = T.dot(hid_previous, W_hid_stacked)
-
-            if self.grad_clipping:
-                input_n = theano.gradient.grad_clip(
-                    input_n, -self.grad_clipping, self.grad_clipping)
-                hid_input = theano.gradient.grad_clip(
-                    hid_input, -self.grad_clipping, self.grad_clipping)
-
-            if not self.precompute_input:
-                # Compute W_{xr}x_t + b_r, W_{xu}x_t + b_u, and W_{xc}x_t + b_c
-                input_n = T.dot(input_n, W_in_stacked) + b_stacked
-
-            # Reset and update gates
-            resetgate = slice_w(hid_input, 0) + slice_w(input_n, 0)
-            updategate = slice_w(hid_input, 1) + slice_w(input_n, 1)
-            resetgate = self.nonlinearity_resetgate(resetgate)
-            updategate = self.nonlinearity_updategate(updategate)
-
-            # Compute W_{xc}x_t + r_t \odot (W_{hc} h_{t - 1})
-            hidden_update_in = slice_w(input_n, 2)
-            hidden_update_hid = slice_w(hid_input, 2)
-            hidden_update = hidden_update_in + resetgate*hidden_update_hid
-            if self.grad_clipping:
-                hidden_update = theano.gradient.grad_clip(
-                    hidden_update, -self.grad_clipping, self.grad_clipping)
-            hidden_update = self.nonlinearity_hid(hidden_update)
-
-            # Compute (1 - u_t)h_{t - 1} + u_t c_t
-            hid = (1 - updategate)*hid_previous + updategate*hidden_update
-            return hid
+            if self.precompute_input:
+                return self._step(input_n, hid_previous, W_hid_stacked,
+                                  dot=dot)
+            else:
+                return self._step(input_n, hid_previous, W_hid_stacked,
+                                  W_in_stacked, b_stacked, dot)
 
         def step_masked(input_n, mask_n, hid_previous, *args):
             hid = step(input_n, hid_previous, *args)
@@ -1420,7 +1813,26 @@ class GRULayer(MergeLayer):
 
             return hid
 
-        if mask is not None:
+        def step_packed(input_n, num_active, hid_previous, *args):
+            # Only compute the first num_active rows, which hold the
+            # sequences that have not ended yet, and keep the others.
+            hid = step(input_n[:num_active], hid_previous[:num_active],
+                       *args)
+            return T.set_subtensor(hid_previous[:num_active], hid)
+
+        if mask is not None and self.pack_sequences:
+            # Sort the sequences by decreasing length, see LSTMLayer
+            lengths = T.cast(mask.sum(axis=1), 'int64')
+            order = T.argsort(-lengths)
+            num_active = T.sum(T.gt(lengths.dimshuffle('x', 0),
+                                    T.arange(seq_len).dimshuffle(0, 'x')),
+                               axis=1)
+            input = input[:, order]
+            if hid_init is not None:
+                hid_init = hid_init[order]
+            sequences = [input, num_active]
+            step_fun = step_packed
+        elif mask is not None:
             # mask is given as (batch_size, seq_len). Because scan iterates
             # over first dimension, we dimshuffle to (seq_len, batch_size) and
             # add a broadcastable dimension
@@ -1465,6 +1877,10 @@ class GRULayer(MergeLayer):
                 truncate_gradient=self.gradient_steps,
                 strict=True)[0]
 
+        if mask is not None and self.pack_sequences:
+            # Undo the sorting of sequences by length
+            hid_out = hid_out[:, T.argsort(order)]
+
         # When it is requested that we only return the final sequence step,
         # we need to slice it out immediately after scan is applied
         if self.only_return_final:
@@ -1478,3 +1894,1029 @@ class GRULayer(MergeLayer):
                 hid_out = hid_out[:, ::-1]
 
         return hid_out
+
+
+def _interleave_directions(x_fwd, x_bwd, num_gates, num_units):
+    """
+    Interleaves two tensors whose last dimension holds ``num_gates`` stacked
+    gate blocks of ``num_units`` each, such that the result holds the
+    forward and backward block of each gate next to each other: ``[g1_fwd,
+    g1_bwd, g2_fwd, g2_bwd, ...]``.
+    """
+    ndim = x_fwd.ndim
+    shape = T.concatenate([x_fwd.shape[:-1], [num_gates, 1, num_units]])
+    x = T.concatenate([x_fwd.reshape(shape, ndim=ndim + 2),
+                       x_bwd.reshape(shape, ndim=ndim + 2)], axis=ndim)
+    out_shape = T.concatenate([x_fwd.shape[:-1], [2 * num_gates * num_units]])
+    return x.reshape(out_shape, ndim=ndim)
+
+
+def _block_interleave_directions(W_fwd, W_bwd, num_gates, num_units):
+    """
+    Combines two ``(n, num_gates*num_units)`` weight matrices into a single
+    block-diagonal ``(2*n, 2*num_gates*num_units)`` matrix with gate-major
+    column layout (see :func:`_interleave_directions`), so a concatenated
+    ``[x_fwd, x_bwd]`` row can be multiplied with both in a single dot.
+    """
+    zeros = T.zeros_like(W_fwd)
+    return T.concatenate([_interleave_directions(W_fwd, zeros,
+                                                 num_gates, num_units),
+                          _interleave_directions(zeros, W_bwd,
+                                                 num_gates, num_units)],
+                         axis=0)
+
+
+class BidirectionalLSTMLayer(MergeLayer):
+    r"""
+    lasagne.layers.recurrent.BidirectionalLSTMLayer(incoming, num_units,
+    ingate=lasagne.layers.Gate(), forgetgate=lasagne.layers.Gate(),
+    cell=lasagne.layers.Gate(
+    W_cell=None, nonlinearity=lasagne.nonlinearities.tanh),
+    outgate=lasagne.layers.Gate(),
+    nonlinearity=lasagne.nonlinearities.tanh,
+    cell_init=lasagne.init.Constant(0.),
+    hid_init=lasagne.init.Constant(0.), learn_init=False, peepholes=True,
+    gradient_steps=-1, grad_clipping=0, unroll_scan=False,
+    precompute_input=True, mask_input=None, only_return_final=False,
+    **kwargs)
+
+    A bidirectional long short-term memory (LSTM) layer.
+
+    Computes the same output as a forward :class:`LSTMLayer` and a backward
+    :class:`LSTMLayer` (``backwards=True``) whose outputs are joined by a
+    :class:`ConcatLayer` along the last axis, but runs both directions in a
+    single scan: The input projections of both directions are computed with
+    one stacked dot product before iterating, and in each step the hidden
+    states of both directions are advanced with one dot product against a
+    block-diagonal hidden-to-hidden matrix.
+
+    Each direction has its own set of parameters, named like those of
+    :class:`LSTMLayer` with a ``_fwd`` or ``_bwd`` suffix (e.g.,
+    ``W_in_to_ingate_fwd``), so weights can be copied from and to a pair of
+    :class:`LSTMLayer` instances.
+
+    Parameters
+    ----------
+    incoming : a :class:`lasagne.layers.Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_units : int
+        Number of hidden/cell units per direction. The output of the layer
+        has ``2*num_units`` features, the forward direction's output
+        followed by the backward direction's output.
+    ingate : Gate
+        Parameters for the input gate, used for both directions.
+    forgetgate : Gate
+        Parameters for the forget gate, used for both directions.
+    cell : Gate
+        Parameters for the cell computation, used for both directions.
+    outgate : Gate
+        Parameters for the output gate, used for both directions.
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the output. If None is provided,
+        no nonlinearity will be applied.
+    cell_init : callable, np.ndarray, theano.shared or :class:`Layer`
+        Initializer for initial cell state of shape ``(1, 2*num_units)``
+        (or ``(batch_size, 2*num_units)`` when given as a :class:`Layer`),
+        holding the forward direction's state followed by the backward one's.
+    hid_init : callable, np.ndarray, theano.shared or :class:`Layer`
+        Initializer for initial hidden state, laid out like `cell_init`.
+    learn_init : bool
+        If True, initial hidden values are learned.
+    peepholes : bool
+        If True, the LSTM uses peephole connections.
+    gradient_steps : int
+        Number of timesteps to include in the backpropagated gradient.
+        If -1, backpropagate through the entire sequence.
+    grad_clipping : float
+        If nonzero, the gradient messages are clipped to the given value during
+        the backward pass.
+    unroll_scan : bool
+        If True the recursion is unrolled instead of using scan.
+    precompute_input : bool
+        If True, precompute input_to_hid before iterating through
+        the sequence. This can result in a speedup at the expense of
+        an increase in memory usage.
+    mask_input : :class:`lasagne.layers.Layer`
+        Layer which allows for a sequence mask to be input, for when sequences
+        are of variable length.  Default `None`, which means no mask will be
+        supplied (i.e. all sequences are of the same length).
+    only_return_final : bool
+        If True, only return the final state of each direction, i.e., the
+        forward direction's output at the last time step and the backward
+        direction's output at the first time step.
+
+    Notes
+    -----
+    Since the hidden-to-hidden matrix is block-diagonal, each step performs
+    twice the multiply-adds of a single direction's hidden product, but in a
+    single matrix product of twice the width, which is usually faster than
+    two separate scans on parallel hardware.
+    """
+    def __init__(self, incoming, num_units,
+                 ingate=Gate(),
+                 forgetgate=Gate(),
+                 cell=Gate(W_cell=None, nonlinearity=nonlinearities.tanh),
+                 outgate=Gate(),
+                 nonlinearity=nonlinearities.tanh,
+                 cell_init=init.Constant(0.),
+                 hid_init=init.Constant(0.),
+                 learn_init=False,
+                 peepholes=True,
+                 gradient_steps=-1,
+                 grad_clipping=0,
+                 unroll_scan=False,
+                 precompute_input=True,
+                 mask_input=None,
+                 only_return_final=False,
+                 **kwargs):
+
+        # As for LSTMLayer, the mask and initial states are optional inputs
+        incomings = [incoming]
+        self.mask_incoming_index = -1
+        self.hid_init_incoming_index = -1
+        self.cell_init_incoming_index = -1
+        if mask_input is not None:
+            incomings.append(mask_input)
+            self.mask_incoming_index = len(incomings)-1
+        if isinstance(hid_init, Layer):
+            incomings.append(hid_init)
+            self.hid_init_incoming_index = len(incomings)-1
+        if isinstance(cell_init, Layer):
+            incomings.append(cell_init)
+            self.cell_init_incoming_index = len(incomings)-1
+
+        super(BidirectionalLSTMLayer, self).__init__(incomings, **kwargs)
+
+        if nonlinearity is None:
+            self.nonlinearity = nonlinearities.identity
+        else:
+            self.nonlinearity = nonlinearity
+
+        self.learn_init = learn_init
+        self.num_units = num_units
+        self.peepholes = peepholes
+        self.gradient_steps = gradient_steps
+        self.grad_clipping = grad_clipping
+        self.unroll_scan = unroll_scan
+        self.precompute_input = precompute_input
+        self.only_return_final = only_return_final
+
+        if unroll_scan and gradient_steps != -1:
+            raise ValueError(
+                "Gradient steps must be -1 when unroll_scan is true.")
+
+        input_shape = self.input_shapes[0]
+
+        if unroll_scan and input_shape[1] is None:
+            raise ValueError("Input sequence length cannot be specified as "
+                             "None when unroll_scan is True")
+
+        num_inputs = np.prod(input_shape[2:])
+
+        # Add parameters for both directions, e.g. self.W_in_to_ingate_fwd,
+        # self.W_hid_to_ingate_bwd or self.W_cell_to_outgate_fwd
+        for direction in ('fwd', 'bwd'):
+            for gate, gate_name in ((ingate, 'ingate'),
+                                    (forgetgate, 'forgetgate'),
+                                    (cell, 'cell'),
+                                    (outgate, 'outgate')):
+                for name, spec, shape, regularizable in (
+                        ('W_in_to', gate.W_in, (num_inputs, num_units), True),
+                        ('W_hid_to', gate.W_hid, (num_units, num_units),
+                         True),
+                        ('b', gate.b, (num_units,), False)):
+                    name = "{}_{}_{}".format(name, gate_name, direction)
+                    setattr(self, name, self.add_param(
+                        spec, shape, name=name, regularizable=regularizable))
+                if self.peepholes and gate_name != 'cell':
+                    name = "W_cell_to_{}_{}".format(gate_name, direction)
+                    setattr(self, name, self.add_param(
+                        gate.W_cell, (num_units, ), name=name))
+
+        self.nonlinearity_ingate = ingate.nonlinearity
+        self.nonlinearity_forgetgate = forgetgate.nonlinearity
+        self.nonlinearity_cell = cell.nonlinearity
+        self.nonlinearity_outgate = outgate.nonlinearity
+
+        # Setup initial values for the cell and the hidden units
+        if isinstance(cell_init, Layer):
+            self.cell_init = cell_init
+        else:
+            self.cell_init = self.add_param(
+                cell_init, (1, 2*num_units), name="cell_init",
+                trainable=learn_init, regularizable=False)
+
+        if isinstance(hid_init, Layer):
+            self.hid_init = hid_init
+        else:
+            self.hid_init = self.add_param(
+                hid_init, (1, 2*num_units), name="hid_init",
+                trainable=learn_init, regularizable=False)
+
+    def get_output_shape_for(self, input_shapes):
+        input_shape = input_shapes[0]
+        if self.only_return_final:
+            return input_shape[0], 2*self.num_units
+        else:
+            return input_shape[0], input_shape[1], 2*self.num_units
+
+    def _stacked(self, prefix, direction):
+        return T.concatenate(
+            [getattr(self, "{}_{}_{}".format(prefix, gate_name, direction))
+             for gate_name in ('ingate', 'forgetgate', 'cell', 'outgate')],
+            axis=-1)
+
+    def get_output_for(self, inputs, **kwargs):
+        """
+        Compute this layer's output function given a symbolic input variable
+
+        Parameters
+        ----------
+        inputs : list of theano.TensorType
+            `inputs[0]` should always be the symbolic input variable. The
+            mask and initial states, if any, follow in the same order as for
+            :class:`LSTMLayer`.
+
+        Returns
+        -------
+        layer_output : theano.TensorType
+            Symbolic output variable.
+        """
+        input = inputs[0]
+        mask = None
+        hid_init = None
+        cell_init = None
+        if self.mask_incoming_index > 0:
+            mask = inputs[self.mask_incoming_index]
+        if self.hid_init_incoming_index > 0:
+            hid_init = inputs[self.hid_init_incoming_index]
+        if self.cell_init_incoming_index > 0:
+            cell_init = inputs[self.cell_init_incoming_index]
+
+        if input.ndim > 3:
+            input = T.flatten(input, 3)
+
+        # (n_time_steps, n_batch, n_features)
+        input = input.dimshuffle(1, 0, 2)
+        seq_len, num_batch, _ = input.shape
+        num_units = self.num_units
+
+        # Stacked (num_inputs, 4*num_units) input weights per direction
+        W_in_fwd = self._stacked('W_in_to', 'fwd')
+        W_in_bwd = self._stacked('W_in_to', 'bwd')
+        b_fwd = self._stacked('b', 'fwd')
+        b_bwd = self._stacked('b', 'bwd')
+
+        # Block-diagonal (2*num_units, 8*num_units) hidden weights in
+        # gate-major layout: each gate's slice holds both directions, so the
+        # cell and hidden states are (n_batch, 2*num_units) matrices holding
+        # the forward state followed by the backward state.
+        W_hid_block = _block_interleave_directions(
+            self._stacked('W_hid_to', 'fwd'), self._stacked('W_hid_to', 'bwd'),
+            4, num_units)
+
+        if self.precompute_input:
+            # Project the input for both directions in a single dot, then
+            # pair time step t of the forward projection with time step
+            # seq_len - 1 - t of the backward projection.
+            W_in_both = T.concatenate([W_in_fwd, W_in_bwd], axis=1)
+            b_both = T.concatenate([b_fwd, b_bwd])
+            input = T.dot(input, W_in_both) + b_both
+            input = _interleave_directions(input[:, :, :4*num_units],
+                                           input[::-1, :, 4*num_units:],
+                                           4, num_units)
+            sequences = [input]
+        else:
+            W_in_block = _block_interleave_directions(W_in_fwd, W_in_bwd,
+                                                      4, num_units)
+            b_block = _interleave_directions(b_fwd, b_bwd, 4, num_units)
+            sequences = [T.concatenate([input, input[::-1]], axis=2)]
+
+        if self.peepholes:
+            W_cell_to_ingate = T.concatenate(
+                [self.W_cell_to_ingate_fwd, self.W_cell_to_ingate_bwd])
+            W_cell_to_forgetgate = T.concatenate(
+                [self.W_cell_to_forgetgate_fwd, self.W_cell_to_forgetgate_bwd])
+            W_cell_to_outgate = T.concatenate(
+                [self.W_cell_to_outgate_fwd, self.W_cell_to_outgate_bwd])
+
+        def slice_w(x, n):
+            return x[:, n*2*num_units:(n+1)*2*num_units]
+
+        def step(input_n, cell_previous, hid_previous, *args):
+            if not self.precompute_input:
+                input_n = T.dot(input_n, W_in_block) + b_block
+
+            gates = input_n + T.dot(hid_previous, W_hid_block)
+
+            if self.grad_clipping:
+                gates = theano.gradient.grad_clip(
+                    gates, -self.grad_clipping, self.grad_clipping)
+
+            ingate = slice_w(gates, 0)
+            forgetgate = slice_w(gates, 1)
+            cell_input = slice_w(gates, 2)
+            outgate = slice_w(gates, 3)
+
+            if self.peepholes:
+                ingate += cell_previous*W_cell_to_ingate
+                forgetgate += cell_previous*W_cell_to_forgetgate
+
+            ingate = self.nonlinearity_ingate(ingate)
+            forgetgate = self.nonlinearity_forgetgate(forgetgate)
+            cell_input = self.nonlinearity_cell(cell_input)
+
+            cell = forgetgate*cell_previous + ingate*cell_input
+
+            if self.peepholes:
+                outgate += cell*W_cell_to_outgate
+            outgate = self.nonlinearity_outgate(outgate)
+
+            hid = outgate*self.nonlinearity(cell)
+            return [cell, hid]
+
+        def step_masked(input_n, mask_n, cell_previous, hid_previous, *args):
+            cell, hid = step(input_n, cell_previous, hid_previous, *args)
+
+            cell = T.switch(mask_n, cell, cell_previous)
+            hid = T.switch(mask_n, hid, hid_previous)
+
+            return [cell, hid]
+
+        if mask is not None:
+            # Expand the (batch_size, seq_len) mask to a (seq_len,
+            # batch_size, 2*num_units) tensor covering both directions
+            mask = mask.dimshuffle(1, 0, 'x')
+            ones = T.ones((num_units,), dtype=mask.dtype)
+            mask = T.concatenate([mask * ones, mask[::-1] * ones], axis=2)
+            sequences.append(mask)
+            step_fun = step_masked
+        else:
+            step_fun = step
+
+        ones = T.ones((num_batch, 1))
+        if not isinstance(self.cell_init, Layer):
+            cell_init = T.dot(ones, self.cell_init)
+
+        if not isinstance(self.hid_init, Layer):
+            hid_init = T.dot(ones, self.hid_init)
+
+        non_seqs = [W_hid_block]
+        if self.peepholes:
+            non_seqs += [W_cell_to_ingate,
+                         W_cell_to_forgetgate,
+                         W_cell_to_outgate]
+        if not self.precompute_input:
+            non_seqs += [W_in_block, b_block]
+
+        if self.unroll_scan:
+            input_shape = self.input_shapes[0]
+            cell_out, hid_out = unroll_scan(
+                fn=step_fun,
+                sequences=sequences,
+                outputs_info=[cell_init, hid_init],
+                go_backwards=False,
+                non_sequences=non_seqs,
+                n_steps=input_shape[1])
+        else:
+            cell_out, hid_out = theano.scan(
+                fn=step_fun,
+                sequences=sequences,
+                outputs_info=[cell_init, hid_init],
+                truncate_gradient=self.gradient_steps,
+                non_sequences=non_seqs,
+                strict=True)[0]
+
+        if self.only_return_final:
+            hid_out = hid_out[-1]
+        else:
+            # The backward direction's outputs are in reverse time order
+            hid_out = T.concatenate([hid_out[:, :, :num_units],
+                                     hid_out[::-1, :, num_units:]], axis=2)
+            hid_out = hid_out.dimshuffle(1, 0, 2)
+
+        return hid_out
+
+
+class BidirectionalGRULayer(MergeLayer):
+    r"""
+    lasagne.layers.recurrent.BidirectionalGRULayer(incoming, num_units,
+    resetgate=lasagne.layers.Gate(W_cell=None),
+    updategate=lasagne.layers.Gate(W_cell=None),
+    hidden_update=lasagne.layers.Gate(
+    W_cell=None, lasagne.nonlinearities.tanh),
+    hid_init=lasagne.init.Constant(0.), learn_init=False,
+    gradient_steps=-1, grad_clipping=0, unroll_scan=False,
+    precompute_input=True, mask_input=None, only_return_final=False, **kwargs)
+
+    A bidirectional Gated Recurrent Unit (GRU) layer.
+
+    Computes the same output as a forward :class:`GRULayer` and a backward
+    :class:`GRULayer` (``backwards=True``) whose outputs are joined by a
+    :class:`ConcatLayer` along the last axis, but runs both directions in a
+    single scan. See :class:`BidirectionalLSTMLayer` for details. Parameters
+    are named like those of :class:`GRULayer` with a ``_fwd`` or ``_bwd``
+    suffix.
+
+    Parameters
+    ----------
+    incoming : a :class:`lasagne.layers.Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_units : int
+        Number of hidden units per direction. The output of the layer has
+        ``2*num_units`` features.
+    resetgate : Gate
+        Parameters for the reset gate, used for both directions.
+    updategate : Gate
+        Parameters for the update gate, used for both directions.
+    hidden_update : Gate
+        Parameters for the hidden update, used for both directions.
+    hid_init : callable, np.ndarray, theano.shared or :class:`Layer`
+        Initializer for initial hidden state of shape ``(1, 2*num_units)``
+        (or ``(batch_size, 2*num_units)`` when given as a :class:`Layer`),
+        holding the forward direction's state followed by the backward one's.
+    learn_init : bool
+        If True, initial hidden values are learned.
+    gradient_steps : int
+        Number of timesteps to include in the backpropagated gradient.
+        If -1, backpropagate through the entire sequence.
+    grad_clipping : float
+        If nonzero, the gradient messages are clipped to the given value during
+        the backward pass.
+    unroll_scan : bool
+        If True the recursion is unrolled instead of using scan.
+    precompute_input : bool
+        If True, precompute input_to_hid before iterating through
+        the sequence.
+    mask_input : :class:`lasagne.layers.Layer`
+        Layer which allows for a sequence mask to be input, for when sequences
+        are of variable length.
+    only_return_final : bool
+        If True, only return the final state of each direction.
+    """
+    def __init__(self, incoming, num_units,
+                 resetgate=Gate(W_cell=None),
+                 updategate=Gate(W_cell=None),
+                 hidden_update=Gate(W_cell=None,
+                                    nonlinearity=nonlinearities.tanh),
+                 hid_init=init.Constant(0.),
+                 learn_init=False,
+                 gradient_steps=-1,
+                 grad_clipping=0,
+                 unroll_scan=False,
+                 precompute_input=True,
+                 mask_input=None,
+                 only_return_final=False,
+                 **kwargs):
+
+        incomings = [incoming]
+        self.mask_incoming_index = -1
+        self.hid_init_incoming_index = -1
+        if mask_input is not None:
+            incomings.append(mask_input)
+            self.mask_incoming_index = len(incomings)-1
+        if isinstance(hid_init, Layer):
+            incomings.append(hid_init)
+            self.hid_init_incoming_index = len(incomings)-1
+
+        super(BidirectionalGRULayer, self).__init__(incomings, **kwargs)
+
+        self.learn_init = learn_init
+        self.num_units = num_units
+        self.grad_clipping = grad_clipping
+        self.gradient_steps = gradient_steps
+        self.unroll_scan = unroll_scan
+        self.precompute_input = precompute_input
+        self.only_return_final = only_return_final
+
+        if unroll_scan and gradient_steps != -1:
+            raise ValueError(
+                "Gradient steps must be -1 when unroll_scan is true.")
+
+        input_shape = self.input_shapes[0]
+
+        if unroll_scan and input_shape[1] is None:
+            raise ValueError("Input sequence length cannot be specified as "
+                             "None when unroll_scan is True")
+
+        num_inputs = np.prod(input_shape[2:])
+
+        # Add parameters for both directions, e.g. self.W_in_to_resetgate_fwd
+        for direction in ('fwd', 'bwd'):
+            for gate, gate_name in ((updategate, 'updategate'),
+                                    (resetgate, 'resetgate'),
+                                    (hidden_update, 'hidden_update')):
+                for name, spec, shape, regularizable in (
+                        ('W_in_to', gate.W_in, (num_inputs, num_units), True),
+                        ('W_hid_to', gate.W_hid, (num_units, num_units),
+                         True),
+                        ('b', gate.b, (num_units,), False)):
+                    name = "{}_{}_{}".format(name, gate_name, direction)
+                    setattr(self, name, self.add_param(
+                        spec, shape, name=name, regularizable=regularizable))
+
+        self.nonlinearity_updategate = updategate.nonlinearity
+        self.nonlinearity_resetgate = resetgate.nonlinearity
+        self.nonlinearity_hid = hidden_update.nonlinearity
+
+        if isinstance(hid_init, Layer):
+            self.hid_init = hid_init
+        else:
+            self.hid_init = self.add_param(
+                hid_init, (1, 2*self.num_units), name="hid_init",
+                trainable=learn_init, regularizable=False)
+
+    def get_output_shape_for(self, input_shapes):
+        input_shape = input_shapes[0]
+        if self.only_return_final:
+            return input_shape[0], 2*self.num_units
+        else:
+            return input_shape[0], input_shape[1], 2*self.num_units
+
+    def _stacked(self, prefix, direction):
+        return T.concatenate(
+            [getattr(self, "{}_{}_{}".format(prefix, gate_name, direction))
+             for gate_name in ('resetgate', 'updategate', 'hidden_update')],
+            axis=-1)
+
+    def get_output_for(self, inputs, **kwargs):
+        """
+        Compute this layer's output function given a symbolic input variable
+
+        Parameters
+        ----------
+        inputs : list of theano.TensorType
+            `inputs[0]` should always be the symbolic input variable. The
+            mask and initial state, if any, follow in the same order as for
+            :class:`GRULayer`.
+
+        Returns
+        -------
+        layer_output : theano.TensorType
+            Symbolic output variable.
+        """
+        input = inputs[0]
+        mask = None
+        hid_init = None
+        if self.mask_incoming_index > 0:
+            mask = inputs[self.mask_incoming_index]
+        if self.hid_init_incoming_index > 0:
+            hid_init = inputs[self.hid_init_incoming_index]
+
+        if input.ndim > 3:
+            input = T.flatten(input, 3)
+
+        input = input.dimshuffle(1, 0, 2)
+        seq_len, num_batch, _ = input.shape
+        num_units = self.num_units
+
+        W_in_fwd = self._stacked('W_in_to', 'fwd')
+        W_in_bwd = self._stacked('W_in_to', 'bwd')
+        b_fwd = self._stacked('b', 'fwd')
+        b_bwd = self._stacked('b', 'bwd')
+
+        # Block-diagonal hidden weights in gate-major layout, see
+        # BidirectionalLSTMLayer.get_output_for()
+        W_hid_block = _block_interleave_directions(
+            self._stacked('W_hid_to', 'fwd'), self._stacked('W_hid_to', 'bwd'),
+            3, num_units)
+
+        if self.precompute_input:
+            W_in_both = T.concatenate([W_in_fwd, W_in_bwd], axis=1)
+            b_both = T.concatenate([b_fwd, b_bwd])
+            input = T.dot(input, W_in_both) + b_both
+            input = _interleave_directions(input[:, :, :3*num_units],
+                                           input[::-1, :, 3*num_units:],
+                                           3, num_units)
+            sequences = [input]
+        else:
+            W_in_block = _block_interleave_directions(W_in_fwd, W_in_bwd,
+                                                      3, num_units)
+            b_block = _interleave_directions(b_fwd, b_bwd, 3, num_units)
+            sequences = [T.concatenate([input, input[::-1]], axis=2)]
+
+        def slice_w(x, n):
+            return x[:, n*2*num_units:(n+1)*2*num_units]
+
+        def step(input_n, hid_previous, *args):
+            hid_input = T.dot(hid_previous, W_hid_block)
+
+            if self.grad_clipping:
+                input_n = theano.gradient.grad_clip(
+                    input_n, -self.grad_clipping, self.grad_clipping)
+                hid_input = theano.gradient.grad_clip(
+                    hid_input, -self.grad_clipping, self.grad_clipping)
+
+            if not self.precompute_input:
+                input_n = T.dot(input_n, W_in_block) + b_block
+
+            resetgate = slice_w(hid_input, 0) + slice_w(input_n, 0)
+            updategate = slice_w(hid_input, 1) + slice_w(input_n, 1)
+            resetgate = self.nonlinearity_resetgate(resetgate)
+            updategate = self.nonlinearity_updategate(updategate)
+
+            hidden_update_in = slice_w(input_n, 2)
+            hidden_update_hid = slice_w(hid_input, 2)
+            hidden_update = hidden_update_in + resetgate*hidden_update_hid
+            if self.grad_clipping:
+                hidden_update = theano.gradient.grad_clip(
+                    hidden_update, -self.grad_clipping, self.grad_clipping)
+            hidden_update = self.nonlinearity_hid(hidden_update)
+
+            hid = (1 - updategate)*hid_previous + updategate*hidden_update
+            return hid
+
+        def step_masked(input_n, mask_n, hid_previous, *args):
+            hid = step(input_n, hid_previous, *args)
+            hid = T.switch(mask_n, hid, hid_previous)
+            return hid
+
+        if mask is not None:
+            mask = mask.dimshuffle(1, 0, 'x')
+            ones = T.ones((num_units,), dtype=mask.dtype)
+            mask = T.concatenate([mask * ones, mask[::-1] * ones], axis=2)
+            sequences.append(mask)
+            step_fun = step_masked
+        else:
+            step_fun = step
+
+        if not isinstance(self.hid_init, Layer):
+            hid_init = T.dot(T.ones((num_batch, 1)), self.hid_init)
+
+        non_seqs = [W_hid_block]
+        if not self.precompute_input:
+            non_seqs += [W_in_block, b_block]
+
+        if self.unroll_scan:
+            input_shape = self.input_shapes[0]
+            hid_out = unroll_scan(
+                fn=step_fun,
+                sequences=sequences,
+                outputs_info=[hid_init],
+                go_backwards=False,
+                non_sequences=non_seqs,
+                n_steps=input_shape[1])[0]
+        else:
+            hid_out = theano.scan(
+                fn=step_fun,
+                sequences=sequences,
+                outputs_info=[hid_init],
+                non_sequences=non_seqs,
+                truncate_gradient=self.gradient_steps,
+                strict=True)[0]
+
+        if self.only_return_final:
+            hid_out = hid_out[-1]
+        else:
+            hid_out = T.concatenate([hid_out[:, :, :num_units],
+                                     hid_out[::-1, :, num_units:]], axis=2)
+            hid_out = hid_out.dimshuffle(1, 0, 2)
+
+        return hid_out
+
+
+class StackedLSTMLayer(MergeLayer):
+    r"""
+    lasagne.layers.recurrent.StackedLSTMLayer(incoming, num_units, num_layers,
+    ingate=lasagne.layers.Gate(), forgetgate=lasagne.layers.Gate(),
+    cell=lasagne.layers.Gate(
+    W_cell=None, nonlinearity=lasagne.nonlinearities.tanh),
+    outgate=lasagne.layers.Gate(),
+    nonlinearity=lasagne.nonlinearities.tanh,
+    cell_init=lasagne.init.Constant(0.),
+    hid_init=lasagne.init.Constant(0.), learn_init=False, peepholes=True,
+    gradient_steps=-1, grad_clipping=0, unroll_scan=False, mask_input=None,
+    only_return_final=False, return_all_layers=False, **kwargs)
+
+    A stack of long short-term memory (LSTM) layers computed in a single scan.
+
+    Computes the same output as `num_layers` :class:`LSTMLayer` instances
+    stacked on top of each other, but instead of running one scan per layer
+    (each materializing its full output sequence), all layers are advanced
+    within the same scan using a wavefront schedule: in iteration :math:`k`,
+    layer :math:`l` processes time step :math:`k - l`, consuming the output
+    layer :math:`l - 1` produced in the previous iteration. The layers of
+    an iteration are thus independent of each other, and the scan takes
+    ``sequence_length + num_layers - 1`` iterations.
+
+    Only the top layer's output sequence is returned (unless
+    `return_all_layers` is set); the states of the lower layers are only
+    carried from one iteration to the next, which allows Theano to avoid
+    storing their full sequences when no gradient is required.
+
+    Each layer has its own set of parameters with the stacked-gate layout
+    of :class:`LSTMLayer`. They are stored in lists indexed by layer (e.g.,
+    ``self.W_in_to_ingate[1]`` for the second layer) and named like those of
+    :class:`LSTMLayer` with a layer index suffix (e.g., ``W_in_to_ingate_1``).
+
+    Parameters
+    ----------
+    incoming : a :class:`lasagne.layers.Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape.
+    num_units : int
+        Number of hidden/cell units in each layer.
+    num_layers : int
+        Number of stacked LSTM layers.
+    ingate : Gate
+        Parameters for the input gate, used for all layers.
+    forgetgate : Gate
+        Parameters for the forget gate, used for all layers.
+    cell : Gate
+        Parameters for the cell computation, used for all layers.
+    outgate : Gate
+        Parameters for the output gate, used for all layers.
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the output. If None is provided,
+        no nonlinearity will be applied.
+    cell_init : callable, np.ndarray or theano.shared
+        Initializer for initial cell states, of shape
+        ``(num_layers, num_units)``.
+    hid_init : callable, np.ndarray or theano.shared
+        Initializer for initial hidden states, of shape
+        ``(num_layers, num_units)``.
+    learn_init : bool
+        If True, initial hidden values are learned.
+    peepholes : bool
+        If True, the LSTMs use peephole connections.
+    gradient_steps : int
+        Number of iterations to include in the backpropagated gradient.
+        If -1, backpropagate through the entire sequence.
+    grad_clipping : float
+        If nonzero, the gradient messages are clipped to the given value during
+        the backward pass.
+    unroll_scan : bool
+        If True the recursion is unrolled instead of using scan.
+    mask_input : :class:`lasagne.layers.Layer`
+        Layer which allows for a sequence mask to be input, for when sequences
+        are of variable length.  Default `None`, which means no mask will be
+        supplied (i.e. all sequences are of the same length).
+    only_return_final : bool
+        If True, only return the final sequential output of the top layer.
+    return_all_layers : bool
+        If True, return the outputs of all layers concatenated along the last
+        axis (bottom layer first), i.e., ``num_layers*num_units`` features.
+    """
+    def __init__(self, incoming, num_units, num_layers,
+                 ingate=Gate(),
+                 forgetgate=Gate(),
+                 cell=Gate(W_cell=None, nonlinearity=nonlinearities.tanh),
+                 outgate=Gate(),
+                 nonlinearity=nonlinearities.tanh,
+                 cell_init=init.Constant(0.),
+                 hid_init=init.Constant(0.),
+                 learn_init=False,
+                 peepholes=True,
+                 gradient_steps=-1,
+                 grad_clipping=0,
+                 unroll_scan=False,
+                 mask_input=None,
+                 only_return_final=False,
+                 return_all_layers=False,
+                 **kwargs):
+
+        incomings = [incoming]
+        self.mask_incoming_index = -1
+        if mask_input is not None:
+            incomings.append(mask_input)
+            self.mask_incoming_index = len(incomings)-1
+
+        super(StackedLSTMLayer, self).__init__(incomings, **kwargs)
+
+        if nonlinearity is None:
+            self.nonlinearity = nonlinearities.identity
+        else:
+            self.nonlinearity = nonlinearity
+
+        if num_layers < 1:
+            raise ValueError("num_layers must be positive, got %r" %
+                             num_layers)
+
+        self.learn_init = learn_init
+        self.num_units = num_units
+        self.num_layers = num_layers
+        self.peepholes = peepholes
+        self.gradient_steps = gradient_steps
+        self.grad_clipping = grad_clipping
+        self.unroll_scan = unroll_scan
+        self.only_return_final = only_return_final
+        self.return_all_layers = return_all_layers
+
+        if unroll_scan and gradient_steps != -1:
+            raise ValueError(
+                "Gradient steps must be -1 when unroll_scan is true.")
+
+        input_shape = self.input_shapes[0]
+
+        if unroll_scan and input_shape[1] is None:
+            raise ValueError("Input sequence length cannot be specified as "
+                             "None when unroll_scan is True")
+
+        num_inputs = np.prod(input_shape[2:])
+
+        # Add parameters for all layers, e.g. self.W_in_to_ingate[0] or
+        # self.W_cell_to_outgate[1]
+        gates = ((ingate, 'ingate'), (forgetgate, 'forgetgate'),
+                 (cell, 'cell'), (outgate, 'outgate'))
+        for gate, gate_name in gates:
+            for name in ('W_in_to', 'W_hid_to', 'b', 'W_cell_to'):
+                setattr(self, "{}_{}".format(name, gate_name), [])
+        for layer in range(num_layers):
+            layer_inputs = num_inputs if layer == 0 else num_units
+            for gate, gate_name in gates:
+                for name, spec, shape, regularizable in (
+                        ('W_in_to', gate.W_in, (layer_inputs, num_units),
+                         True),
+                        ('W_hid_to', gate.W_hid, (num_units, num_units),
+                         True),
+                        ('b', gate.b, (num_units,), False)):
+                    name = "{}_{}".format(name, gate_name)
+                    getattr(self, name).append(self.add_param(
+                        spec, shape, name="{}_{}".format(name, layer),
+                        regularizable=regularizable))
+                if self.peepholes and gate_name != 'cell':
+                    name = "W_cell_to_{}".format(gate_name)
+                    getattr(self, name).append(self.add_param(
+                        gate.W_cell, (num_units, ),
+                        name="{}_{}".format(name, layer)))
+
+        self.nonlinearity_ingate = ingate.nonlinearity
+        self.nonlinearity_forgetgate = forgetgate.nonlinearity
+        self.nonlinearity_cell = cell.nonlinearity
+        self.nonlinearity_outgate = outgate.nonlinearity
+
+        self.cell_init = self.add_param(
+            cell_init, (num_layers, num_units), name="cell_init",
+            trainable=learn_init, regularizable=False)
+        self.hid_init = self.add_param(
+            hid_init, (num_layers, num_units), name="hid_init",
+            trainable=learn_init, regularizable=False)
+
+    def get_output_shape_for(self, input_shapes):
+        input_shape = input_shapes[0]
+        if self.return_all_layers:
+            num_outputs = self.num_layers * self.num_units
+        else:
+            num_outputs = self.num_units
+        if self.only_return_final:
+            return input_shape[0], num_outputs
+        else:
+            return input_shape[0], input_shape[1], num_outputs
+
+    def get_output_for(self, inputs, **kwargs):
+        """
+        Compute this layer's output function given a symbolic input variable
+
+        Parameters
+        ----------
+        inputs : list of theano.TensorType
+            `inputs[0]` should always be the symbolic input variable.  When
+            this layer has a mask input, `inputs[1]` is the mask of shape
+            ``(n_batch, n_time_steps)``.
+
+        Returns
+        -------
+        layer_output : theano.TensorType
+            Symbolic output variable.
+        """
+        input = inputs[0]
+        mask = None
+        if self.mask_incoming_index > 0:
+            mask = inputs[self.mask_incoming_index]
+
+        if input.ndim > 3:
+            input = T.flatten(input, 3)
+
+        # (n_time_steps, n_batch, n_features)
+        input = input.dimshuffle(1, 0, 2)
+        seq_len, num_batch, _ = input.shape
+        num_units = self.num_units
+        num_layers = self.num_layers
+        gate_names = ('ingate', 'forgetgate', 'cell', 'outgate')
+
+        def stacked(prefix, layer):
+            return T.concatenate(
+                [getattr(self, "{}_{}".format(prefix, gate_name))[layer]
+                 for gate_name in gate_names], axis=-1)
+
+        # The first layer's input projection is precomputed for the whole
+        # sequence and padded with (num_layers - 1) steps for the wavefront
+        # to drain.  Higher layers project the previous iteration's hidden
+        # state of the layer below together with their own hidden state,
+        # using a vertically stacked (2*num_units, 4*num_units) matrix.
+        input = T.dot(input, stacked('W_in_to', 0)) + stacked('b', 0)
+        input = T.concatenate(
+            [input, T.zeros((num_layers - 1, num_batch, 4*num_units),
+                            dtype=input.dtype)], axis=0)
+        W_stacked = [stacked('W_hid_to', 0)]
+        b_stacked = [None]
+        for layer in range(1, num_layers):
+            W_stacked.append(T.concatenate([stacked('W_in_to', layer),
+                                            stacked('W_hid_to', layer)],
+                                           axis=0))
+            b_stacked.append(stacked('b', layer))
+
+        # Layer l is active in iteration k iff 0 <= k - l < seq_len (and the
+        # user-supplied mask allows it); this yields a (seq_len + num_layers
+        # - 1, n_batch, num_layers) mask of shifted copies.
+        if mask is None:
+            mask = T.ones((seq_len, num_batch), dtype=theano.config.floatX)
+        else:
+            mask = mask.dimshuffle(1, 0)
+        mask = T.stack([T.concatenate(
+            [T.zeros((layer, num_batch), dtype=mask.dtype), mask,
+             T.zeros((num_layers - 1 - layer, num_batch), dtype=mask.dtype)],
+            axis=0) for layer in range(num_layers)], axis=2)
+
+        def slice_w(x, n):
+            return x[:, n*num_units:(n+1)*num_units]
+
+        def lstm_step(gates, cell_previous, layer):
+            if self.grad_clipping:
+                gates = theano.gradient.grad_clip(
+                    gates, -self.grad_clipping, self.grad_clipping)
+
+            ingate = slice_w(gates, 0)
+            forgetgate = slice_w(gates, 1)
+            cell_input = slice_w(gates, 2)
+            outgate = slice_w(gates, 3)
+
+            if self.peepholes:
+                ingate += cell_previous*self.W_cell_to_ingate[layer]
+                forgetgate += cell_previous*self.W_cell_to_forgetgate[layer]
+
+            ingate = self.nonlinearity_ingate(ingate)
+            forgetgate = self.nonlinearity_forgetgate(forgetgate)
+            cell_input = self.nonlinearity_cell(cell_input)
+
+            cell = forgetgate*cell_previous + ingate*cell_input
+
+            if self.peepholes:
+                outgate += cell*self.W_cell_to_outgate[layer]
+            outgate = self.nonlinearity_outgate(outgate)
+
+            hid = outgate*self.nonlinearity(cell)
+            return cell, hid
+
+        def step(input_n, mask_n, *args):
+            cells_previous = args[:num_layers]
+            hids_previous = args[num_layers:2*num_layers]
+            cells, hids = [], []
+            for layer in range(num_layers):
+                if layer == 0:
+                    gates = input_n + T.dot(hids_previous[0], W_stacked[0])
+                else:
+                    gates = T.dot(T.concatenate([hids_previous[layer - 1],
+                                                 hids_previous[layer]],
+                                                axis=1),
+                                  W_stacked[layer]) + b_stacked[layer]
+                cell, hid = lstm_step(gates, cells_previous[layer], layer)
+                # Keep the previous state for inactive layers and inputs
+                active = mask_n[:, layer].dimshuffle(0, 'x')
+                cells.append(T.switch(active, cell, cells_previous[layer]))
+                hids.append(T.switch(active, hid, hids_previous[layer]))
+            return cells + hids
+
+        ones = T.ones((num_batch, 1))
+        outputs_info = ([T.dot(ones, self.cell_init[layer:layer + 1])
+                         for layer in range(num_layers)] +
+                        [T.dot(ones, self.hid_init[layer:layer + 1])
+                         for layer in range(num_layers)])
+
+        non_seqs = W_stacked + b_stacked[1:]
+        if self.peepholes:
+            non_seqs += (self.W_cell_to_ingate + self.W_cell_to_forgetgate +
+                         self.W_cell_to_outgate)
+
+        if self.unroll_scan:
+            input_shape = self.input_shapes[0]
+            outputs = unroll_scan(
+                fn=step,
+                sequences=[input, mask],
+                outputs_info=outputs_info,
+                go_backwards=False,
+                non_sequences=non_seqs,
+                n_steps=input_shape[1] + num_layers - 1)
+        else:
+            outputs = theano.scan(
+                fn=step,
+                sequences=[input, mask],
+                outputs_info=outputs_info,
+                truncate_gradient=self.gradient_steps,
+                non_sequences=non_seqs,
+                strict=True)[0]
+        hid_outs = outputs[num_layers:]
+
+        # Layer l has produced time step t in iteration t + l
+        if self.return_all_layers:
+            hid_outs = [hid_out[layer:layer + seq_len]
+                        for layer, hid_out in enumerate(hid_outs)]
+            hid_out = T.concatenate(hid_outs, axis=2)
+        else:
+            hid_out = hid_outs[-1][num_layers - 1:]
+
+        if self.only_return_final:
+            hid_out = hid_out[-1]
+        else:
+            hid_out = hid_out.dimshuffle(1, 0, 2)
+
+        return hid_out
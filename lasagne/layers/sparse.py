@@ -0,0 +1,145 @@
+import numpy as np
+import theano
+import theano.tensor as T
+
+from .. import init
+from .. import nonlinearities
+
+from .base import Layer
+
+
+__all__ = [
+    "SparseDenseLayer",
+]
+
+
+class SparseDenseLayer(Layer):
+    """
+    lasagne.layers.SparseDenseLayer(incoming, num_units, W,
+    b=lasagne.init.Constant(0.), nonlinearity=lasagne.nonlinearities.rectify,
+    num_leading_axes=1, **kwargs)
+
+    A fully connected layer with sparse weights, for inference.
+
+    Computes the same as :class:`DenseLayer`, but stores the weight matrix in
+    compressed sparse row (CSR) format and multiplies the input with it in a
+    sparse-dense product, whose cost is proportional to the number of
+    nonzero weights. This is what :func:`sparsify_network()
+    <lasagne.pruning.sparsify_network>` replaces a pruned
+    :class:`DenseLayer` with.
+
+    Parameters
+    ----------
+    incoming : a :class:`Layer` instance or a tuple
+        The layer feeding into this layer, or the expected input shape
+
+    num_units : int
+        The number of units of the layer
+
+    W : scipy sparse matrix, numpy array or Theano sparse shared variable
+        The weights, a matrix of shape ``(num_inputs, num_units)``. Dense
+        arrays and other sparse formats are converted to CSR, dropping the
+        zeros.
+
+    b : Theano shared variable, expression, numpy array, callable or ``None``
+        Initial value, expression or initializer for the biases. If set to
+        ``None``, the layer will have no biases. Otherwise, biases should be
+        a 1D array with shape ``(num_units,)``.
+        See :func:`lasagne.utils.create_param` for more information.
+
+    nonlinearity : callable or None
+        The nonlinearity that is applied to the layer activations. If None
+        is provided, the layer will be linear.
+
+    num_leading_axes : int
+        Number of leading axes to distribute the dot product over, as for
+        :class:`DenseLayer`.
+
+    **kwargs
+        Any additional keyword arguments are passed to the `Layer` superclass.
+
+    Notes
+    -----
+    The weights are not trainable: the gradient with respect to them would
+    be a dense matrix. To fine-tune a pruned network, train the
+    :class:`DenseLayer` with :func:`lasagne.updates.magnitude_constraint()`
+    and convert it afterwards.
+
+    Whether the sparse product is faster than the dense one depends on the
+    sparsity, the shapes and the BLAS implementation; typically, fewer than a
+    fifth of the weights need to be nonzero.
+    """
+    def __init__(self, incoming, num_units, W, b=init.Constant(0.),
+                 nonlinearity=nonlinearities.rectify, num_leading_axes=1,
+                 **kwargs):
+        # imported on demand, importing theano.sparse takes a while
+        import scipy.sparse
+        import theano.sparse
+        super(SparseDenseLayer, self).__init__(incoming, **kwargs)
+        self.nonlinearity = (nonlinearities.identity if nonlinearity is None
+                             else nonlinearity)
+
+        self.num_units = num_units
+
+        if num_leading_axes >= len(self.input_shape):
+            raise ValueError(
+                    "Got num_leading_axes=%d for a %d-dimensional input, "
+                    "leaving no trailing axes for the dot product." %
+                    (num_leading_axes, len(self.input_shape)))
+        elif num_leading_axes < -len(self.input_shape):
+            raise ValueError(
+                    "Got num_leading_axes=%d for a %d-dimensional input, "
+                    "requesting more trailing axes than there are input "
+                    "dimensions." % (num_leading_axes, len(self.input_shape)))
+        self.num_leading_axes = num_leading_axes
+
+        if any(s is None for s in self.input_shape[num_leading_axes:]):
+            raise ValueError(
+                    "A SparseDenseLayer requires a fixed input shape (except "
+                    "for the leading axes). Got %r for num_leading_axes=%d." %
+                    (self.input_shape, self.num_leading_axes))
+        num_inputs = int(np.prod(self.input_shape[num_leading_axes:]))
+
+        if not isinstance(W, theano.Variable):
+            W = scipy.sparse.csr_matrix(W, dtype=theano.config.floatX)
+            W.eliminate_zeros()
+            if W.shape != (num_inputs, num_units):
+                raise ValueError("W has shape %r, should be %r" %
+                                 (W.shape, (num_inputs, num_units)))
+            W = theano.sparse.shared(W)
+        self.W = self.add_param(W, (num_inputs, num_units), name="W",
+                                trainable=False, regularizable=False)
+        if b is None:
+            self.b = None
+        else:
+            self.b = self.add_param(b, (num_units,), name="b",
+                                    regularizable=False)
+
+    @property
+    def density(self):
+        """
+        The fraction of nonzero weights.
+        """
+        W = self.W.get_value(borrow=True)
+        return W.nnz / float(np.prod(W.shape))
+
+    def get_output_shape_for(self, input_shape):
+        return input_shape[:self.num_leading_axes] + (self.num_units,)
+
+    def get_output_for(self, input, **kwargs):
+        import theano.sparse
+        num_leading_axes = self.num_leading_axes
+        if num_leading_axes < 0:
+            num_leading_axes += input.ndim
+        # the sparse product is only defined for matrices
+        leading_shape = input.shape[:num_leading_axes]
+        input = input.reshape((T.prod(leading_shape), -1))
+
+        activation = theano.sparse.dot(input, self.W)
+        if self.b is not None:
+            activation = activation + self.b.dimshuffle('x', 0)
+        if num_leading_axes > 1:
+            activation = activation.reshape(
+                T.concatenate([leading_shape, [self.num_units]]),
+                ndim=num_leading_axes + 1)
+        return self.nonlinearity(activation)
@@ -5,9 +5,12 @@ import numpy as np
 from .. import init
 from .. import nonlinearities
 from ..utils import as_tuple, floatX
-from ..random import get_rng
+from ..random import get_rng, _RandomStreams
 from .base import Layer, MergeLayer
-from theano.sandbox.rng_mrg import MRG_RandomStreams as RandomStreams
+from .conv import Conv2DLayer
+from .dense import DenseLayer
+from .pool import MaxPool2DLayer
+from theano.tensor.signal.pool import MaxPoolGrad
 
 
 __all__ = [
@@ -319,6 +322,18 @@ class InverseLayer(MergeLayer):
     and/or a bias, the :class:`InverseLayer` will include the derivative
     of that in its computation.
 
+    For a :class:`DenseLayer`, an ungrouped :class:`Conv2DLayer` with the
+    default `convolution` and a :class:`MaxPool2DLayer` (but not their
+    subclasses), the inverse is computed directly as a
+    transposed matrix product, a transposed convolution and an unpooling
+    operation placing values at the positions of the maxima, respectively,
+    instead of differentiating the forward expression. This requires the
+    nonlinearity of a dense or convolutional layer to be the identity, or
+    the rectifier, sigmoid or tanh, whose derivatives are computed from
+    the layer's output (taking the derivative of the rectifier to be zero
+    for an input of exactly zero). All other layers and nonlinearities use
+    the partial derivative computed by :func:`theano.grad`.
+
     Parameters
     ----------
     incoming : a :class:`Layer` instance or a tuple
@@ -342,22 +357,77 @@ class InverseLayer(MergeLayer):
 
         super(InverseLayer, self).__init__(
             [incoming, layer, layer.input_layer], **kwargs)
+        self.layer = layer
 
     def get_output_shape_for(self, input_shapes):
         return input_shapes[2]
 
     def get_output_for(self, inputs, **kwargs):
         input, layer_out, layer_in = inputs
+        inverse = self._get_direct_inverse(input, layer_out, layer_in)
+        if inverse is not None:
+            return inverse
         return theano.grad(None, wrt=layer_in, known_grads={layer_out: input})
 
+    def _get_direct_inverse(self, input, layer_out, layer_in):
+        # Returns the inverse computed without differentiating the forward
+        # expression of the layer to be inverted, or None if unsupported
+        # subclasses and custom convolutions may compute something else, so
+        # they are only supported by differentiating
+        layer = self.layer
+        if type(layer) is MaxPool2DLayer:
+            op = MaxPoolGrad(ignore_border=layer.ignore_border, ndim=2)
+            return op(layer_in, layer_out, input,
+                      layer.pool_size, layer.stride, layer.pad)
+
+        if type(layer) is Conv2DLayer and (layer.num_groups > 1 or
+                                           layer.convolution is not
+                                           T.nnet.conv2d):
+            return None
+        if type(layer) in (DenseLayer, Conv2DLayer):
+            if layer.nonlinearity is nonlinearities.identity:
+                delta = input
+            elif layer.nonlinearity in _output_derivatives:
+                delta = input * _output_derivatives[layer.nonlinearity](
+                    layer_out)
+            else:
+                return None
+
+        if type(layer) is DenseLayer:
+            return T.dot(delta, layer.W.T).reshape(layer_in.shape,
+                                                   ndim=layer_in.ndim)
+
+        if type(layer) is Conv2DLayer:
+            input_shape = layer.input_shape[:2] + tuple(
+                symb if fixed is None else fixed
+                for fixed, symb in zip(layer.input_shape[2:],
+                                       layer_in.shape[2:]))
+            border_mode = 'half' if layer.pad == 'same' else layer.pad
+            return T.nnet.abstract_conv.conv2d_grad_wrt_inputs(
+                delta, layer.W, input_shape, layer.get_W_shape(),
+                border_mode=border_mode, subsample=layer.stride,
+                filter_flip=layer.flip_filters)
+
+        return None
+
+
+# derivatives of nonlinearities in terms of their output, for InverseLayer
+_output_derivatives = {
+    nonlinearities.rectify: lambda output: T.gt(output, 0),
+    nonlinearities.sigmoid: lambda output: output * (1 - output),
+    nonlinearities.tanh: lambda output: 1 - T.sqr(output),
+}
+
 
 class TransformerLayer(MergeLayer):
     """
     Spatial transformer layer
 
     The layer applies an affine transformation on the input. The affine
-    transformation is parameterized with six learned parameters [1]_.
-    The output is interpolated with a bilinear transformation.
+    transformation is parameterized with six learned parameters [1]_, or
+    four parameters for a transformation that only scales and translates.
+    The output is interpolated with a bilinear or nearest neighbor
+    transformation.
 
     Parameters
     ----------
@@ -369,7 +439,9 @@ class TransformerLayer(MergeLayer):
     localization_network : a :class:`Layer` instance
         The network that calculates the parameters of the affine
         transformation. See the example for how to initialize to the identity
-        transform.
+        transform. Its output shape must be ``(batch_size, 6)``, or
+        ``(batch_size, 4)`` for a transformation that only scales and
+        translates (see Notes).
 
     downsample_factor : float or iterable of float
         A float or a 2-element tuple specifying the downsample factor for the
@@ -377,6 +449,21 @@ class TransformerLayer(MergeLayer):
         original size of the input. Values larger than 1 will downsample the
         input. Values below 1 will upsample the input.
 
+    interpolation : {'bilinear', 'nearest'}
+        How to interpolate the input at the transformed coordinates:
+        ``'bilinear'`` blends the four nearest input pixels, ``'nearest'``
+        takes the nearest input pixel, which is cheaper but does not provide
+        a gradient with respect to the transformation parameters.
+
+    Notes
+    -----
+    If the localization network has four outputs ``[s_x, t_x, s_y, t_y]``,
+    they are interpreted as the affine transformation ``[s_x, 0, t_x, 0,
+    s_y, t_y]``. Each output row then samples the same input rows and each
+    output column the same input columns, so the input is interpolated by
+    gathering whole rows and then whole columns instead of single pixels,
+    which is considerably faster.
+
     References
     ----------
     .. [1]  Max Jaderberg, Karen Simonyan, Andrew Zisserman,
@@ -405,16 +492,18 @@ class TransformerLayer(MergeLayer):
     >>> l_trans = lasagne.layers.TransformerLayer(l_in, l_loc)
     """
     def __init__(self, incoming, localization_network, downsample_factor=1,
-                 **kwargs):
+                 interpolation='bilinear', **kwargs):
         super(TransformerLayer, self).__init__(
             [incoming, localization_network], **kwargs)
         self.downsample_factor = as_tuple(downsample_factor, 2)
+        self.interpolation = _check_interpolation(interpolation)
 
         input_shp, loc_shp = self.input_shapes
 
-        if loc_shp[-1] != 6 or len(loc_shp) != 2:
+        if loc_shp[-1] not in (4, 6) or len(loc_shp) != 2:
             raise ValueError("The localization network must have "
-                             "output shape: (batch_size, 6)")
+                             "output shape: (batch_size, 6) or "
+                             "(batch_size, 4)")
         if len(input_shp) != 4:
             raise ValueError("The input network must have a 4-dimensional "
                              "output shape: (batch_size, num_input_channels, "
@@ -429,10 +518,33 @@ class TransformerLayer(MergeLayer):
     def get_output_for(self, inputs, **kwargs):
         # see eq. (1) and sec 3.1 in [1]
         input, theta = inputs
-        return _transform_affine(theta, input, self.downsample_factor)
+        index_dtype = _index_dtype(self.input_shapes[0])
+        if self.input_shapes[1][-1] == 4:
+            return _transform_scale_translate(
+                theta, input, self.downsample_factor, self.interpolation,
+                index_dtype)
+        return _transform_affine(theta, input, self.downsample_factor,
+                                 self.interpolation, index_dtype)
+
+
+def _check_interpolation(interpolation):
+    if interpolation not in ('bilinear', 'nearest'):
+        raise ValueError("interpolation must be 'bilinear' or 'nearest', "
+                         "got %r" % (interpolation,))
+    return interpolation
+
 
+def _index_dtype(input_shape):
+    # int32 indices halve the memory traffic of gathering from the flattened
+    # input, but can only be used if its size is known to be small enough
+    if (all(s is not None for s in input_shape) and
+            np.prod(input_shape, dtype='int64') < 2**31):
+        return 'int32'
+    return 'int64'
 
-def _transform_affine(theta, input, downsample_factor):
+
+def _transform_affine(theta, input, downsample_factor,
+                      interpolation='bilinear', index_dtype='int64'):
     num_batch, num_channels, height, width = input.shape
     theta = T.reshape(theta, (-1, 2, 3))
 
@@ -452,7 +564,7 @@ def _transform_affine(theta, input, downsample_factor):
     input_dim = input.dimshuffle(0, 2, 3, 1)
     input_transformed = _interpolate(
         input_dim, x_s_flat, y_s_flat,
-        out_height, out_width)
+        out_height, out_width, interpolation, index_dtype)
 
     output = T.reshape(
         input_transformed, (num_batch, out_height, out_width, num_channels))
@@ -460,60 +572,107 @@ def _transform_affine(theta, input, downsample_factor):
     return output
 
 
-def _interpolate(im, x, y, out_height, out_width):
-    # *_f are floats
+def _transform_scale_translate(theta, input, downsample_factor,
+                               interpolation='bilinear', index_dtype='int64'):
+    num_batch, num_channels, height, width = input.shape
+    theta = T.reshape(theta, (-1, 2, 2))
+
+    # The source x coordinates only depend on the output column and the
+    # source y coordinates only on the output row
+    out_height = T.cast(height // downsample_factor[0], 'int64')
+    out_width = T.cast(width // downsample_factor[1], 'int64')
+    x_t = _linspace(-1.0, 1.0, out_width)
+    y_t = _linspace(-1.0, 1.0, out_height)
+    x_s = (theta[:, 0, 0].dimshuffle(0, 'x') * x_t.dimshuffle('x', 0) +
+           theta[:, 0, 1].dimshuffle(0, 'x'))
+    y_s = (theta[:, 1, 0].dimshuffle(0, 'x') * y_t.dimshuffle('x', 0) +
+           theta[:, 1, 1].dimshuffle(0, 'x'))
+
+    # Interpolate whole rows of each input channel, i.e., gather from the
+    # input flattened to (num_batch*num_channels*height, width)
+    rows = input.reshape((-1, width))
+    rows = _gather_interpolated(rows, T.repeat(y_s, num_channels, axis=0),
+                                height, interpolation, index_dtype)
+
+    # Then interpolate whole columns of the result, gathering from it
+    # transposed and flattened to (num_batch*width, num_channels*out_height)
+    cols = rows.reshape((num_batch, num_channels, out_height, width))
+    cols = cols.dimshuffle(0, 3, 1, 2).reshape((num_batch * width, -1))
+    cols = _gather_interpolated(cols, x_s, width, interpolation,
+                                index_dtype)
+
+    output = cols.reshape((num_batch, out_width, num_channels, out_height))
+    return output.dimshuffle(0, 2, 3, 1)
+
+
+def _gather_interpolated(table, coords, size, interpolation, index_dtype):
+    # table is (num_batch*size, dim) and coords is (num_batch, num_coords);
+    # returns the rows of table interpolated at the coordinates of each
+    # batch item as a (num_batch*num_coords, dim) matrix
+    num_batch, num_coords = coords.shape
+    indices, weights = _sampling_taps(coords.flatten(), size, interpolation,
+                                      index_dtype)
+    base = T.repeat(T.arange(num_batch, dtype=index_dtype) *
+                    T.cast(size, index_dtype), num_coords)
+    return _gather_weighted(table, [base + idx for idx in indices], weights)
+
+
+def _sampling_taps(coords, size, interpolation, index_dtype):
+    # Returns the indices and weights of the input pixels contributing to
+    # the given coordinates along one axis of the given size
+    size_f = T.cast(size, theano.config.floatX)
+
+    # clip coordinates to [-1, 1] and scale them to [0, size - 1]
+    coords = (T.clip(coords, -1, 1) + 1) / 2 * (size_f - 1)
+
+    if interpolation == 'nearest':
+        return [T.cast(T.floor(coords + 0.5), index_dtype)], [None]
+
+    # for the neighboring pixels, we need to take care they do not extend
+    # past the image
+    c0_f = T.floor(coords)
+    c0 = T.cast(c0_f, index_dtype)
+    c1 = T.cast(T.minimum(c0_f + 1, size_f - 1), index_dtype)
+    w1 = coords - c0_f
+    return [c0, c1], [1 - w1, w1]
+
+
+def _gather_weighted(table, indices, weights):
+    # Gathers the rows of table at all indices and returns their sum
+    # weighted by the corresponding weights (None for a single tap). Theano
+    # fuses the weighting and summation into a single elementwise loop.
+    if len(indices) == 1:
+        return table[indices[0]]
+    return sum(weight.dimshuffle(0, 'x') * table[idx]
+               for idx, weight in zip(indices, weights))
+
+
+def _interpolate(im, x, y, out_height, out_width, interpolation='bilinear',
+                 index_dtype='int64'):
     num_batch, height, width, channels = im.shape
-    height_f = T.cast(height, theano.config.floatX)
-    width_f = T.cast(width, theano.config.floatX)
-
-    # clip coordinates to [-1, 1]
-    x = T.clip(x, -1, 1)
-    y = T.clip(y, -1, 1)
-
-    # scale coordinates from [-1, 1] to [0, width/height - 1]
-    x = (x + 1) / 2 * (width_f - 1)
-    y = (y + 1) / 2 * (height_f - 1)
-
-    # obtain indices of the 2x2 pixel neighborhood surrounding the coordinates;
-    # we need those in floatX for interpolation and in int64 for indexing. for
-    # indexing, we need to take care they do not extend past the image.
-    x0_f = T.floor(x)
-    y0_f = T.floor(y)
-    x1_f = x0_f + 1
-    y1_f = y0_f + 1
-    x0 = T.cast(x0_f, 'int64')
-    y0 = T.cast(y0_f, 'int64')
-    x1 = T.cast(T.minimum(x1_f, width_f - 1), 'int64')
-    y1 = T.cast(T.minimum(y1_f, height_f - 1), 'int64')
+
+    # obtain indices and weights of the 2x2 pixel neighborhood surrounding
+    # the coordinates (or of the nearest pixel)
+    x_indices, x_weights = _sampling_taps(x, width, interpolation,
+                                          index_dtype)
+    y_indices, y_weights = _sampling_taps(y, height, interpolation,
+                                          index_dtype)
 
     # The input is [num_batch, height, width, channels]. We do the lookup in
     # the flattened input, i.e [num_batch*height*width, channels]. We need
     # to offset all indices to match the flat version
-    dim2 = width
-    dim1 = width*height
+    dim2 = T.cast(width, index_dtype)
+    dim1 = T.cast(width*height, index_dtype)
     base = T.repeat(
-        T.arange(num_batch, dtype='int64')*dim1, out_height*out_width)
-    base_y0 = base + y0*dim2
-    base_y1 = base + y1*dim2
-    idx_a = base_y0 + x0
-    idx_b = base_y1 + x0
-    idx_c = base_y0 + x1
-    idx_d = base_y1 + x1
-
-    # use indices to lookup pixels for all samples
+        T.arange(num_batch, dtype=index_dtype)*dim1, out_height*out_width)
+    indices = [base + y_idx*dim2 + x_idx
+               for y_idx in y_indices for x_idx in x_indices]
+    weights = [None if y_w is None else y_w * x_w
+               for y_w in y_weights for x_w in x_weights]
+
+    # use indices to lookup pixels for all samples and interpolate them
     im_flat = im.reshape((-1, channels))
-    Ia = im_flat[idx_a]
-    Ib = im_flat[idx_b]
-    Ic = im_flat[idx_c]
-    Id = im_flat[idx_d]
-
-    # calculate interpolated values
-    wa = ((x1_f-x) * (y1_f-y)).dimshuffle(0, 'x')
-    wb = ((x1_f-x) * (y-y0_f)).dimshuffle(0, 'x')
-    wc = ((x-x0_f) * (y1_f-y)).dimshuffle(0, 'x')
-    wd = ((x-x0_f) * (y-y0_f)).dimshuffle(0, 'x')
-    output = T.sum([wa*Ia, wb*Ib, wc*Ic, wd*Id], axis=0)
-    return output
+    return _gather_weighted(im_flat, indices, weights)
 
 
 def _linspace(start, stop, num):
@@ -591,6 +750,10 @@ class TPSTransformerLayer(MergeLayer):
         substantially slower as this computation scales with
         num_pixels*num_control_points. Default is 'auto'.
 
+    interpolation : {'bilinear', 'nearest'}
+        How to interpolate the input at the transformed coordinates, see
+        :class:`TransformerLayer`.
+
     References
     ----------
     .. [1]  Max Jaderberg, Karen Simonyan, Andrew Zisserman,
@@ -633,11 +796,13 @@ class TPSTransformerLayer(MergeLayer):
     """
 
     def __init__(self, incoming, localization_network, downsample_factor=1,
-                 control_points=16, precompute_grid='auto', **kwargs):
+                 control_points=16, precompute_grid='auto',
+                 interpolation='bilinear', **kwargs):
         super(TPSTransformerLayer, self).__init__(
                 [incoming, localization_network], **kwargs)
 
         self.downsample_factor = as_tuple(downsample_factor, 2)
+        self.interpolation = _check_interpolation(interpolation)
         self.control_points = control_points
 
         input_shp, loc_shp = self.input_shapes
@@ -668,8 +833,8 @@ class TPSTransformerLayer(MergeLayer):
         self.precompute_grid = precompute_grid
 
         # Create source points and L matrix
-        self.right_mat, self.L_inv, self.source_points, self.out_height, \
-            self.out_width = _initialize_tps(
+        self.right_mat, self.coefficient_mat, self.source_points, \
+            self.out_height, self.out_width = _initialize_tps(
                 control_points, input_shp, self.downsample_factor,
                 precompute_grid)
 
@@ -684,14 +849,16 @@ class TPSTransformerLayer(MergeLayer):
         # Get input and destination control points
         input, dest_offsets = inputs
         return _transform_thin_plate_spline(
-                dest_offsets, input, self.right_mat, self.L_inv,
+                dest_offsets, input, self.right_mat, self.coefficient_mat,
                 self.source_points, self.out_height, self.out_width,
-                self.precompute_grid, self.downsample_factor)
+                self.precompute_grid, self.downsample_factor,
+                self.interpolation, _index_dtype(self.input_shapes[0]))
 
 
 def _transform_thin_plate_spline(
-        dest_offsets, input, right_mat, L_inv, source_points, out_height,
-        out_width, precompute_grid, downsample_factor):
+        dest_offsets, input, right_mat, coefficient_mat, source_points,
+        out_height, out_width, precompute_grid, downsample_factor,
+        interpolation='bilinear', index_dtype='int64'):
 
     num_batch, num_channels, height, width = input.shape
     num_control_points = source_points.shape[1]
@@ -702,27 +869,23 @@ def _transform_thin_plate_spline(
             dest_offsets, (num_batch, 2, num_control_points))
 
     # Solve as in ref [2]
-    coefficients = T.dot(dest_points, L_inv[:, 3:].T)
-
-    if precompute_grid:
-
-        # Transform each point on the source grid (image_size x image_size)
-        right_mat = T.tile(right_mat.dimshuffle('x', 0, 1), (num_batch, 1, 1))
-        transformed_points = T.batched_dot(coefficients, right_mat)
+    coefficients = T.dot(dest_points, coefficient_mat)
 
-    else:
+    if not precompute_grid:
 
         # Transformed grid
         out_height = T.cast(height // downsample_factor[0], 'int64')
         out_width = T.cast(width // downsample_factor[1], 'int64')
         orig_grid = _meshgrid(out_height, out_width)
-        orig_grid = orig_grid[0:2, :]
-        orig_grid = T.tile(orig_grid, (num_batch, 1, 1))
 
-        # Transform each point on the source grid (image_size x image_size)
-        transformed_points = _get_transformed_points_tps(
-                orig_grid, source_points, coefficients, num_control_points,
-                num_batch)
+        # The grid is the same for all examples, so we compute the right
+        # matrix (1, x, y and the U function for each control point) once
+        right_mat = T.concatenate([orig_grid[2:], orig_grid[:2],
+                                   _U_func(orig_grid[:2], source_points)],
+                                  axis=0)
+
+    # Transform each point on the source grid (image_size x image_size)
+    transformed_points = T.dot(coefficients, right_mat)
 
     # Get out new points
     x_transformed = transformed_points[:, 0].flatten()
@@ -732,7 +895,7 @@ def _transform_thin_plate_spline(
     input_dim = input.dimshuffle(0, 2, 3, 1)
     input_transformed = _interpolate(
             input_dim, x_transformed, y_transformed,
-            out_height, out_width)
+            out_height, out_width, interpolation, index_dtype)
 
     output = T.reshape(input_transformed,
                        (num_batch, out_height, out_width, num_channels))
@@ -740,66 +903,37 @@ def _transform_thin_plate_spline(
     return output
 
 
-def _get_transformed_points_tps(new_points, source_points, coefficients,
-                                num_points, batch_size):
+def _U_func(points, source_points):
     """
-    Calculates the transformed points' value using the provided coefficients
-
-    :param new_points: num_batch x 2 x num_to_transform tensor
-    :param source_points: 2 x num_points array of source points
-    :param coefficients: coefficients (should be shape (num_batch, 2,
-        control_points + 3))
-    :param num_points: the number of points
+    Implements the U function from Bookstein paper for each pair of points
 
-    :return: the x and y coordinates of each transformed point. Shape (
-        num_batch, 2, num_to_transform)
+    :param points: 2 x num_points tensor of points
+    :param source_points: 2 x num_control_points array of control points
+    :return: U(r) = r^2 * log(r^2) of the squared Euclidean distance r^2
+        between each control point and each point. Shape (
+        num_control_points, num_points)
     """
+    # Expand ||p - s||^2 = ||p||^2 + ||s||^2 - 2 p.s, which avoids
+    # materializing the differences of all pairs of points
+    r_2 = (T.sum(points ** 2, axis=0).dimshuffle('x', 0) +
+           T.sum(source_points ** 2, axis=0).dimshuffle(0, 'x') -
+           2 * T.dot(source_points.T, points))
 
-    # Calculate the U function for the new point and each source point as in
-    # ref [2]
-    # The U function is simply U(r) = r^2 * log(r^2), where r^2 is the
-    # squared distance
+    # Take the product (r^2 * log(r^2)), which tends to zero for r^2 -> 0.
+    # Clipping r^2 also removes negative values caused by rounding errors.
+    r_2 = T.maximum(r_2, 1e-12)
+    return r_2 * T.log(r_2)
 
-    # Calculate the squared dist between the new point and the source points
-    to_transform = new_points.dimshuffle(0, 'x', 1, 2)
-    stacked_transform = T.tile(to_transform, (1, num_points, 1, 1))
-    r_2 = T.sum(((stacked_transform - source_points.dimshuffle(
-            'x', 1, 0, 'x')) ** 2), axis=2)
 
-    # Take the product (r^2 * log(r^2)), being careful to avoid NaNs
-    log_r_2 = T.log(r_2)
-    distances = T.switch(T.isnan(log_r_2), r_2 * log_r_2, 0.)
-
-    # Add in the coefficients for the affine translation (1, x, and y,
-    # corresponding to a_1, a_x, and a_y)
-    upper_array = T.concatenate([T.ones((batch_size, 1, new_points.shape[2]),
-                                        dtype=theano.config.floatX),
-                                 new_points], axis=1)
-    right_mat = T.concatenate([upper_array, distances], axis=1)
-
-    # Calculate the new value as the dot product
-    new_value = T.batched_dot(coefficients, right_mat)
-    return new_value
-
-
-def _U_func_numpy(x1, y1, x2, y2):
+def _U_func_numpy(points, source_points):
     """
-    Function which implements the U function from Bookstein paper
-    :param x1: x coordinate of the first point
-    :param y1: y coordinate of the first point
-    :param x2: x coordinate of the second point
-    :param y2: y coordinate of the second point
-    :return: value of z
+    Implements the U function from Bookstein paper for each pair of points,
+    see :func:`_U_func`.
     """
-
-    # Return zero if same point
-    if x1 == x2 and y1 == y2:
-        return 0.
-
-    # Calculate the squared Euclidean norm (r^2)
-    r_2 = (x2 - x1) ** 2 + (y2 - y1) ** 2
-
-    # Return the squared norm (r^2 * log r^2)
+    r_2 = (np.sum(points ** 2, axis=0)[np.newaxis, :] +
+           np.sum(source_points ** 2, axis=0)[:, np.newaxis] -
+           2 * np.dot(source_points.T, points))
+    r_2 = np.maximum(r_2, 1e-12)
     return r_2 * np.log(r_2)
 
 
@@ -807,8 +941,8 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
                     precompute_grid):
     """
     Initializes the thin plate spline calculation by creating the source
-    point array and the inverted L matrix used for calculating the
-    transformations as in ref [2]_
+    point array and the matrix mapping destination points to the
+    transformation coefficients as in ref [2]_
 
     :param num_control_points: the number of control points. Must be a
         perfect square. Points will be used to generate an evenly spaced grid.
@@ -819,7 +953,8 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
         grid matrix
     :return:
         right_mat: shape (num_control_points + 3, out_height*out_width) tensor
-        L_inv: shape (num_control_points + 3, num_control_points + 3) tensor
+        coefficient_mat: shape (num_control_points, num_control_points + 3)
+            tensor, the last num_control_points columns of L^-1, transposed
         source_points: shape (2, num_control_points) tensor
         out_height: tensor constant specifying the ouptut height
         out_width: tensor constant specifying the output width
@@ -830,7 +965,7 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
     _, _, height, width = input_shape
 
     # Create source grid
-    grid_size = np.sqrt(num_control_points)
+    grid_size = int(round(np.sqrt(num_control_points)))
     x_control_source, y_control_source = np.meshgrid(
         np.linspace(-1, 1, grid_size),
         np.linspace(-1, 1, grid_size))
@@ -839,14 +974,11 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
     source_points = np.vstack(
             (x_control_source.flatten(), y_control_source.flatten()))
 
-    # Convert to floatX
-    source_points = source_points.astype(theano.config.floatX)
-
     # Get number of equations
     num_equations = num_control_points + 3
 
     # Initialize L to be num_equations square matrix
-    L = np.zeros((num_equations, num_equations), dtype=theano.config.floatX)
+    L = np.zeros((num_equations, num_equations))
 
     # Create P matrix components
     L[0, 3:num_equations] = 1.
@@ -854,19 +986,19 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
     L[3:num_equations, 0] = 1.
     L[3:num_equations, 1:3] = source_points.T
 
-    # Loop through each pair of points and create the K matrix
-    for point_1 in range(num_control_points):
-        for point_2 in range(point_1, num_control_points):
+    # Create the K matrix of the U function for each pair of points
+    L[3:, 3:] = _U_func_numpy(source_points, source_points)
+    np.fill_diagonal(L[3:, 3:], 0.)
 
-            L[point_1 + 3, point_2 + 3] = _U_func_numpy(
-                    source_points[0, point_1], source_points[1, point_1],
-                    source_points[0, point_2], source_points[1, point_2])
+    # The coefficients are L^-1 (0, 0, 0, dest_points)^T, so we only need
+    # the last num_control_points columns of the inverse, which we obtain by
+    # solving the linear system rather than inverting L
+    rhs = np.eye(num_equations, num_control_points, -3)
+    coefficient_mat = np.linalg.solve(L, rhs).T
 
-            if point_1 != point_2:
-                L[point_2 + 3, point_1 + 3] = L[point_1 + 3, point_2 + 3]
-
-    # Invert
-    L_inv = np.linalg.inv(L)
+    # Convert to floatX
+    source_points = source_points.astype(theano.config.floatX)
+    coefficient_mat = coefficient_mat.astype(theano.config.floatX)
 
     if precompute_grid:
         # Construct grid
@@ -874,34 +1006,16 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
         out_width = np.array(width // downsample_factor[1]).astype('int64')
         x_t, y_t = np.meshgrid(np.linspace(-1, 1, out_width),
                                np.linspace(-1, 1, out_height))
-        ones = np.ones(np.prod(x_t.shape))
-        orig_grid = np.vstack([x_t.flatten(), y_t.flatten(), ones])
-        orig_grid = orig_grid[0:2, :]
-        orig_grid = orig_grid.astype(theano.config.floatX)
-
-        # Construct right mat
-
-        # First Calculate the U function for the new point and each source
-        # point as in ref [2]
-        # The U function is simply U(r) = r^2 * log(r^2), where r^2 is the
-        # squared distance
-        to_transform = orig_grid[:, :, np.newaxis].transpose(2, 0, 1)
-        stacked_transform = np.tile(to_transform, (num_control_points, 1, 1))
-        stacked_source_points = \
-            source_points[:, :, np.newaxis].transpose(1, 0, 2)
-        r_2 = np.sum((stacked_transform - stacked_source_points) ** 2, axis=1)
-
-        # Take the product (r^2 * log(r^2)), being careful to avoid NaNs
-        log_r_2 = np.log(r_2)
-        log_r_2[np.isinf(log_r_2)] = 0.
-        distances = r_2 * log_r_2
-
-        # Add in the coefficients for the affine translation (1, x, and y,
-        # corresponding to a_1, a_x, and a_y)
-        upper_array = np.ones(shape=(1, orig_grid.shape[1]),
-                              dtype=theano.config.floatX)
-        upper_array = np.concatenate([upper_array, orig_grid], axis=0)
-        right_mat = np.concatenate([upper_array, distances], axis=0)
+        orig_grid = np.vstack([x_t.flatten(), y_t.flatten()])
+
+        # Construct right mat of the coefficients for the affine translation
+        # (1, x, and y, corresponding to a_1, a_x, and a_y) and the U function
+        # for each point and each source point as in ref [2]
+        right_mat = np.concatenate([np.ones((1, orig_grid.shape[1])),
+                                    orig_grid,
+                                    _U_func_numpy(orig_grid, source_points)],
+                                   axis=0)
+        right_mat = right_mat.astype(theano.config.floatX)
 
         # Convert to tensors
         out_height = T.as_tensor_variable(out_height)
@@ -914,10 +1028,10 @@ def _initialize_tps(num_control_points, input_shape, downsample_factor,
         right_mat = None
 
     # Convert to tensors
-    L_inv = T.as_tensor_variable(L_inv)
+    coefficient_mat = T.as_tensor_variable(coefficient_mat)
     source_points = T.as_tensor_variable(source_points)
 
-    return right_mat, L_inv, source_points, out_height, out_width
+    return right_mat, coefficient_mat, source_points, out_height, out_width
 
 
 class ParametricRectifierLayer(Layer):
@@ -1075,10 +1189,12 @@ class RandomizedRectifierLayer(Layer):
        Empirical Evaluation of Rectified Activations in Convolutional Network,
        http://arxiv.org/abs/1505.00853
     """
+    _srng = _RandomStreams()
+
     def __init__(self, incoming, lower=0.3, upper=0.8, shared_axes='auto',
                  **kwargs):
         super(RandomizedRectifierLayer, self).__init__(incoming, **kwargs)
-        self._srng = RandomStreams(get_rng().randint(1, 2147462579))
+        self._srng_seed = get_rng().randint(1, 2147462579)
         self.lower = lower
         self.upper = upper
 
@@ -0,0 +1,166 @@
+"""
+Functions to compute the output of a network for large datasets.
+
+.. autosummary::
+    :nosignatures:
+
+    predict
+
+:func:`predict` streams a dataset through a network in batches of a fixed
+size. Unlike a minibatch iterator that drops the trailing partial batch,
+it computes every example: the last batch is padded to the full batch size
+in a buffer that is allocated once and reused for all batches, so the
+network is always called with the same input shape. The outputs are
+written into a single preallocated array, which can be a memory-mapped file
+for outputs too large for memory; the inputs can be memory-mapped as well.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer
+>>> from lasagne.prediction import predict
+>>> import numpy as np
+>>> import theano
+>>> l_in = InputLayer((None, 20))
+>>> l_out = DenseLayer(l_in, num_units=5)
+>>> x = np.random.rand(1000, 20).astype(theano.config.floatX)
+>>> predict(l_out, x, batch_size=128).shape
+(1000, 5)
+"""
+
+import numpy as np
+import theano
+
+from .layers import Layer, InputLayer, get_all_layers, get_output
+
+
+__all__ = [
+    "predict",
+]
+
+
+def _allocate(out, num, results):
+    """
+    Returns the arrays to write the outputs for `num` examples to, given the
+    `out` argument of :func:`predict` (a list) and the results of the first
+    batch.
+    """
+    if len(out) != len(results):
+        raise ValueError("Expected %d output arrays, got %d" %
+                         (len(results), len(out)))
+    outputs = []
+    for output, result in zip(out, results):
+        shape = (num,) + result.shape[1:]
+        if output is None:
+            output = np.empty(shape, dtype=result.dtype)
+        elif isinstance(output, str):
+            output = np.lib.format.open_memmap(output, mode='w+',
+                                               dtype=result.dtype,
+                                               shape=shape)
+        elif output.shape != shape:
+            raise ValueError("Expected an output array of shape %r, got %r"
+                             % (shape, output.shape))
+        outputs.append(output)
+    return outputs
+
+
+def predict(layer, inputs, batch_size=256, out=None):
+    """
+    Computes the deterministic output of a network for a dataset, in batches
+    of a fixed size.
+
+    Parameters
+    ----------
+    layer : Layer, list of Layer, or callable
+        The output layer (or layers) of the network, whose deterministic
+        output is compiled into a Theano function. Alternatively, a callable
+        taking a batch for each input and returning the batch of outputs
+        (or a list of them), e.g., a function compiled before, to avoid
+        compiling it on each call, or a :class:`lasagne.runtime.Executor`
+        for `batch_size` examples.
+    inputs : numpy array or list of numpy arrays
+        The dataset, for each input of the network (in the order of the
+        :class:`InputLayer` instances in :func:`get_all_layers()
+        <lasagne.layers.get_all_layers>`, or of the arguments of the
+        callable), with the examples along the first axis. Memory-mapped
+        arrays are read one batch at a time.
+    batch_size : int (default: 256)
+        The number of examples the network is called with at once.
+    out : None, numpy array, str, or a list of them
+        Where to write the output (a list for several outputs): None to
+        allocate a new array, an array of the shape and a type of the output
+        for the whole dataset (e.g., a :class:`numpy.memmap`), or a file name
+        to create a memory-mapped ``.npy`` file with
+        :func:`numpy.lib.format.open_memmap`.
+
+    Returns
+    -------
+    numpy array or list of numpy arrays
+        The output of the network for all examples, or a list of them for
+        several outputs. Output arrays that were passed in are returned
+        themselves, and memory-mapped ones are flushed.
+
+    Raises
+    ------
+    ValueError
+        If the inputs differ in length, or the arrays given for `out` do not
+        match the output.
+
+    Notes
+    -----
+    The batches are copied into the input buffers, converting them to the
+    type of the input variables of the network, and the rows that pad the
+    last batch hold examples of the previous batch. Any rows of the network
+    output beyond the examples are discarded, so the padding only affects
+    networks that mix the examples of a batch, e.g., by batch normalization
+    in training mode.
+    """
+    if isinstance(inputs, (list, tuple)):
+        inputs = list(inputs)
+    else:
+        inputs = [inputs]
+    num = len(inputs[0])
+    if any(len(x) != num for x in inputs):
+        raise ValueError("The inputs differ in length: %r" %
+                         [len(x) for x in inputs])
+
+    if isinstance(layer, (Layer, list, tuple)):
+        input_layers = [lay for lay in get_all_layers(layer)
+                        if isinstance(lay, InputLayer)]
+        dtypes = [input_layer.input_var.dtype for input_layer in input_layers]
+        function = theano.function(
+            [input_layer.input_var for input_layer in input_layers],
+            get_output(layer, deterministic=True))
+    else:
+        dtypes = [x.dtype for x in inputs]
+        function = layer
+    buffers = [np.zeros((batch_size,) + x.shape[1:], dtype=dtype)
+               for x, dtype in zip(inputs, dtypes)]
+
+    outputs = None
+    multiple = False
+    # a dataset of no examples is run as a batch of padding, for the shapes
+    for start in range(0, max(num, 1), batch_size):
+        stop = min(start + batch_size, num)
+        for buffer, x in zip(buffers, inputs):
+            buffer[:stop - start] = x[start:stop]
+        results = function(*buffers)
+        if outputs is None:
+            multiple = isinstance(results, (list, tuple))
+            if not multiple:
+                if isinstance(out, (list, tuple)):
+                    raise ValueError("Expected a single output array, got "
+                                     "%d" % len(out))
+                out = [out]
+            elif out is None:
+                out = [None] * len(results)
+            outputs = _allocate(list(out), num, results if multiple
+                                else [results])
+        if not multiple:
+            results = [results]
+        for output, result in zip(outputs, results):
+            output[start:stop] = result[:stop - start]
+
+    for output in outputs:
+        if isinstance(output, np.memmap):
+            output.flush()
+    return outputs if multiple else outputs[0]
@@ -0,0 +1,645 @@
+"""
+Functions to attribute the run time and memory of compiled Theano functions
+to the layers of a network, and to plan the batch size of training.
+
+.. autosummary::
+    :nosignatures:
+
+    tagged_grad
+    profiling_mode
+    profile_layers
+    format_layer_profile
+    estimate_training_memory
+    plan_batch_size
+
+Theano's profiler reports the time spent in each node of the optimized
+graph, but these nodes cannot easily be mapped back to the layers that
+created them. Attributing them requires three steps:
+
+1. Build the expressions with ``get_output(..., tag_layers=True)``, which
+   tags the forward nodes with the layer that created them.
+2. Compute the gradients with :func:`tagged_grad` instead of
+   :func:`theano.grad`. It backpropagates through one layer at a time, so
+   the nodes of the backward pass can be tagged with their layer as well.
+3. Compile with ``profile=True`` and the mode returned by
+   :func:`profiling_mode`, which passes the tags on to the nodes that the
+   graph optimizer substitutes for the tagged ones.
+
+:func:`profile_layers` then runs the function and aggregates the time and
+memory of its nodes per layer, separately for the forward and backward
+pass. Nodes that were not created by any layer, such as the loss and the
+parameter updates, are reported as unattributed.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.layers import get_all_params
+>>> from lasagne.profiling import tagged_grad, profiling_mode
+>>> from lasagne.profiling import profile_layers, format_layer_profile
+>>> import lasagne.updates
+>>> l_in = InputLayer((None, 20))
+>>> l_hid = DenseLayer(l_in, 30, name='hidden')
+>>> l_out = DenseLayer(l_hid, 10, name='output')
+>>> loss = get_output(l_out, tag_layers=True).sum()
+>>> params = get_all_params(l_out, trainable=True)
+>>> updates = lasagne.updates.sgd(tagged_grad(loss, params), params, 0.1)
+>>> train_fn = theano.function([l_in.input_var], loss, updates=updates,
+...                            mode=profiling_mode(), profile=True)
+>>> x = np.ones((8, 20), dtype=theano.config.floatX)
+>>> report = profile_layers(train_fn, [x], num_iterations=5)
+>>> sorted(set((row['layer'], row['pass']) for row in report))
+... # doctest: +NORMALIZE_WHITESPACE
+[('(unattributed)', 'forward'), ('hidden', 'backward'),
+ ('hidden', 'forward'), ('output', 'backward'), ('output', 'forward')]
+>>> print(format_layer_profile(report))  # doctest: +SKIP
+
+To find the batch size with the highest throughput that trains with Adam in
+at most 2 GiB of memory:
+
+>>> from functools import partial
+>>> update_fn = partial(lasagne.updates.adam, learning_rate=0.01)
+>>> plan = plan_batch_size(l_out, 2 * 2**30, update_fn)  # doctest: +SKIP
+>>> plan['batch_size']  # doctest: +SKIP
+4096
+"""
+
+import json
+import os
+import sys
+from itertools import chain
+from timeit import default_timer
+
+import numpy as np
+
+import theano
+from theano.gof.graph import io_toposort
+
+
+__all__ = [
+    "tagged_grad",
+    "profiling_mode",
+    "profile_layers",
+    "format_layer_profile",
+    "estimate_training_memory",
+    "plan_batch_size",
+]
+
+
+def tagged_grad(cost, wrt):
+    """
+    Computes the gradient of a cost like :func:`theano.grad`, tagging the
+    nodes of the backward pass with the layers they belong to.
+
+    The cost must have been built from expressions returned by
+    ``get_output(..., tag_layers=True)``. The gradient is first computed
+    with respect to the outputs of the tagged layers, and then propagated
+    through one layer at a time, so each node it creates can be tagged with
+    the layer being backpropagated through. If the cost does not depend on
+    any tagged layer, this is equivalent to :func:`theano.grad`.
+
+    Parameters
+    ----------
+    cost : Theano scalar expression
+        The cost to differentiate.
+    wrt : Theano variable or list of variables
+        The variables to compute the gradient with respect to, typically
+        the parameters of the network.
+
+    Returns
+    -------
+    Theano expression or list of Theano expressions
+        The gradient with respect to `wrt`, in the same structure.
+
+    Raises
+    ------
+    theano.gradient.DisconnectedInputError
+        If the cost does not depend on one of the variables in `wrt`.
+    """
+    wrt_list = list(wrt) if isinstance(wrt, (list, tuple)) else [wrt]
+    order = dict((node, i) for i, node in enumerate(io_toposort(
+        theano.gof.graph.inputs([cost]), [cost])))
+    outputs = sorted((var for var in theano.gof.graph.ancestors([cost])
+                      if var.owner is not None and
+                      getattr(var.tag, 'lasagne_layer', None) is not None and
+                      var not in wrt_list and _is_differentiable(var)),
+                     key=lambda var: order[var.owner])
+    if not outputs:
+        return theano.grad(cost, wrt)
+
+    # gradient with respect to the layer outputs and `wrt` of the cost
+    # computed on top of the layers, e.g., the loss and any regularization
+    placeholders = [var.type() for var in outputs]
+    cut_cost = theano.clone(cost, replace=dict(zip(outputs, placeholders)))
+    direct = theano.grad(cut_cost, placeholders + wrt_list,
+                         disconnected_inputs='ignore',
+                         return_disconnected='None')
+    keys = [var for var, g in zip(outputs + wrt_list, direct)
+            if g is not None]
+    direct = theano.clone([g for g in direct if g is not None],
+                          replace=dict(zip(placeholders, outputs)))
+    grads = dict(zip(keys, direct))
+
+    # backpropagation through one layer at a time
+    boundary = set(outputs) | set(wrt_list)
+    for var in reversed(outputs):
+        if var not in grads:
+            continue
+        layer = var.tag.lasagne_layer
+        used = set(inp for node in io_toposort(boundary - {var}, [var])
+                   for inp in node.inputs)
+        targets = [v for v in chain(outputs, wrt_list)
+                   if v in used and v is not var]
+        if not targets:
+            continue
+        known = grads[var]
+        new_grads = theano.grad(None, targets, known_grads={var: known},
+                                disconnected_inputs='ignore',
+                                return_disconnected='None')
+        results = []
+        for target, g in zip(targets, new_grads):
+            if g is not None:
+                grads[target] = g if target not in grads else (
+                    grads[target] + g)
+                results.append(grads[target])
+        _tag_nodes(results, layer, 'backward')
+
+    result = []
+    for i, var in enumerate(wrt_list):
+        if var not in grads:
+            raise theano.gradient.DisconnectedInputError(
+                "tagged_grad() was asked to compute the gradient with "
+                "respect to input %d of wrt, which the cost does not "
+                "depend on" % i)
+        result.append(grads[var])
+    return result if isinstance(wrt, (list, tuple)) else result[0]
+
+
+def _is_differentiable(var):
+    return getattr(var.type, 'dtype', None) in theano.tensor.float_dtypes
+
+
+def _tag_nodes(variables, layer, pass_, nodes=None):
+    """
+    Tags the untagged nodes computing the given variables, walking up the
+    graph until reaching tagged nodes. If `nodes` is given, only nodes in
+    this set are tagged and walked through.
+    """
+    stack = [var.owner for var in variables if var.owner is not None]
+    while stack:
+        node = stack.pop()
+        if getattr(node.tag, 'lasagne_layer', None) is not None:
+            continue
+        if nodes is not None:
+            if node not in nodes:
+                continue
+            nodes.discard(node)
+        node.tag.lasagne_layer = layer
+        node.tag.lasagne_pass = pass_
+        stack.extend(inp.owner for inp in node.inputs
+                     if inp.owner is not None)
+
+
+class _LayerTagFeature(theano.gof.toolbox.Feature):
+    """
+    Tags the nodes that a graph optimizer substitutes for tagged nodes with
+    the layer and pass of the node they replace.
+    """
+    def on_attach(self, fgraph):
+        self.imported = set()
+
+    def on_import(self, fgraph, node, reason):
+        if getattr(node.tag, 'lasagne_layer', None) is None:
+            self.imported.add(node)
+
+    def on_prune(self, fgraph, node, reason):
+        self.imported.discard(node)
+
+    def on_change_input(self, fgraph, node, i, r, new_r, reason=None):
+        layer = getattr(r.owner and r.owner.tag, 'lasagne_layer', None)
+        if layer is not None:
+            _tag_nodes([new_r], layer, r.owner.tag.lasagne_pass,
+                       self.imported)
+
+
+class _LayerTagOptimizer(theano.gof.Optimizer):
+    """
+    Runs a graph optimizer with a :class:`_LayerTagFeature` attached.
+    """
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+
+    def apply(self, fgraph):
+        fgraph.attach_feature(_LayerTagFeature())
+        return self.optimizer.optimize(fgraph)
+
+
+def profiling_mode(mode=None):
+    """
+    Returns a compilation mode preserving the layer tags of nodes through
+    graph optimization.
+
+    Parameters
+    ----------
+    mode : None, str or theano.compile.Mode
+        The mode to derive from, with the same linker and optimizer. If
+        None, uses Theano's default mode.
+
+    Returns
+    -------
+    theano.compile.Mode
+        The mode to pass to :func:`theano.function`, along with
+        ``profile=True``.
+    """
+    mode = theano.compile.get_mode(mode)
+    return theano.compile.Mode(linker=mode.linker,
+                               optimizer=_LayerTagOptimizer(mode.optimizer))
+
+
+def profile_layers(fn, inputs=(), num_iterations=10, json_file=None):
+    """
+    Runs a profiled Theano function and aggregates the time and memory of
+    its nodes per layer and pass.
+
+    Parameters
+    ----------
+    fn : theano.compile.Function
+        A function compiled with ``profile=True``, preferably from tagged
+        expressions (see the module documentation).
+    inputs : list (default: ())
+        The input values to call `fn` with.
+    num_iterations : int (default: 10)
+        The number of calls to average over. Earlier calls of `fn` do not
+        count, so `fn` can be warmed up before.
+    json_file : str or None (default: None)
+        If given, the report is also written to this file as JSON, along
+        with the number of iterations and the mean wall time of a call.
+
+    Returns
+    -------
+    list of dict
+        One dictionary per layer and pass, sorted by decreasing time, with
+        the keys ``'layer'`` (the layer name, or class name for unnamed
+        layers, or ``'(unattributed)'``), ``'type'`` (the class name),
+        ``'pass'`` (``'forward'`` or ``'backward'``), ``'time'`` (the mean
+        time per call in seconds), ``'fraction'`` (the fraction of the
+        time of all nodes), ``'nodes'`` (the number of nodes) and
+        ``'memory'`` (the size of the node outputs in bytes, or None unless
+        `fn` was compiled with the Theano flags ``profile=True`` and
+        ``profile_memory=True``).
+
+    Raises
+    ------
+    ValueError
+        If `fn` was not compiled with ``profile=True``.
+    """
+    profile = getattr(fn, 'profile', None)
+    if not profile:
+        raise ValueError("profile_layers() requires a function compiled "
+                         "with profile=True")
+    before = dict(profile.apply_time)
+    start = default_timer()
+    for _ in range(num_iterations):
+        fn(*inputs)
+    call_time = (default_timer() - start) / num_iterations
+    shapes = getattr(profile, 'variable_shape', None) or {}
+
+    rows = {}
+    for node in fn.maker.fgraph.toposort():
+        layer = getattr(node.tag, 'lasagne_layer', None)
+        pass_ = getattr(node.tag, 'lasagne_pass', 'forward')
+        row = rows.get((layer, pass_))
+        if row is None:
+            row = rows[layer, pass_] = {
+                'layer': ('(unattributed)' if layer is None else
+                          layer.name or type(layer).__name__),
+                'type': None if layer is None else type(layer).__name__,
+                'pass': pass_, 'time': 0., 'nodes': 0,
+                'memory': 0 if shapes else None}
+        row['time'] += ((profile.apply_time.get(node, 0.) -
+                         before.get(node, 0.)) / num_iterations)
+        row['nodes'] += 1
+        if shapes:
+            row['memory'] += sum(_nbytes(var, shapes.get(var))
+                                 for var in node.outputs)
+    total = sum(row['time'] for row in rows.values())
+    for row in rows.values():
+        row['fraction'] = row['time'] / total if total else 0.
+    report = sorted(rows.values(), key=lambda row: -row['time'])
+
+    if json_file is not None:
+        with open(json_file, 'w') as f:
+            json.dump({'num_iterations': num_iterations,
+                       'call_time': call_time,
+                       'layers': report}, f, indent=1)
+    return report
+
+
+def _nbytes(var, shape):
+    dtype = getattr(var.type, 'dtype', None)
+    if shape is None or dtype is None or None in shape:
+        return 0
+    return int(np.prod(shape)) * np.dtype(dtype).itemsize
+
+
+def format_layer_profile(report, sort_by='time'):
+    """
+    Formats the result of :func:`profile_layers` as a table.
+
+    Parameters
+    ----------
+    report : list of dict
+        The result of :func:`profile_layers`.
+    sort_by : str (default: 'time')
+        The key to sort the rows by: ``'time'``, ``'memory'`` or
+        ``'nodes'`` sort in decreasing order, ``'layer'`` and ``'pass'`` in
+        increasing order.
+
+    Returns
+    -------
+    str
+        The table, one line per layer and pass.
+    """
+    if sort_by in ('layer', 'pass'):
+        report = sorted(report, key=lambda row: (row[sort_by], row['pass']))
+    else:
+        report = sorted(report, key=lambda row: -(row[sort_by] or 0))
+    columns = ['layer', 'type', 'pass', 'time', 'fraction', 'nodes',
+               'memory']
+    lines = [columns]
+    for row in report:
+        lines.append([
+            row['layer'], '' if row['type'] is None else row['type'],
+            row['pass'],
+            '%.3f ms' % (row['time'] * 1e3),
+            '%.1f%%' % (row['fraction'] * 100),
+            str(row['nodes']),
+            '?' if row['memory'] is None else '{:,}'.format(row['memory'])])
+    widths = [max(len(line[i]) for line in lines)
+              for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) if i < 3 else cell.rjust(width)
+                  for i, (cell, width) in enumerate(zip(line, widths)))
+        for line in lines)
+
+
+def estimate_training_memory(layer, batch_size, update_fn=None,
+                             input_shapes=None, dtype=None):
+    """
+    Statically estimates the peak memory of a training step, without
+    compiling anything.
+
+    The estimate adds the parameters, their gradients, the optimizer state
+    and the activations kept for the backward pass (see
+    :func:`lasagne.layers.model_summary`), plus the largest pair of
+    activation gradients alive at the same time during the backward pass.
+    It does not cover temporary buffers of individual operations, such as
+    the unrolled input of a GEMM-based convolution; :func:`plan_batch_size`
+    can measure those with a probe run.
+
+    Parameters
+    ----------
+    layer : Layer or list
+        The output layer(s) of the network.
+    batch_size : int
+        The batch size to estimate the memory for.
+    update_fn : callable or None (default: None)
+        The update function used for training, called as
+        ``update_fn(grads, params)`` to count the size of the shared
+        variables it creates, such as the moment estimates of
+        :func:`lasagne.updates.adam`. Use :func:`functools.partial` to pass
+        other arguments. None stands for plain SGD without any state.
+    input_shapes : None or dict (default: None)
+        A dictionary mapping input layers to shape tuples to use instead of
+        their regular shape, as for :func:`lasagne.layers.model_summary`.
+    dtype : str or None (default: None)
+        The data type of activations. Defaults to ``theano.config.floatX``.
+
+    Returns
+    -------
+    dict
+        The sizes in bytes of the ``'params'``, ``'gradients'``,
+        ``'optimizer_state'``, ``'activations'`` and backward
+        ``'workspace'``, and their ``'total'``.
+
+    Raises
+    ------
+    ValueError
+        If the size of an activation depends on an unspecified shape, which
+        must then be given in `input_shapes`.
+    """
+    from .layers import get_all_params, model_summary
+    summary = model_summary(layer, batch_size, input_shapes, dtype)
+    itemsize = np.dtype(dtype or theano.config.floatX).itemsize
+    unknown = [row['name'] for row in summary
+               if row['forward_bytes'] is None or
+               row['backward_bytes'] is None]
+    if unknown:
+        raise ValueError("estimate_training_memory() cannot estimate the "
+                         "memory of layers with unspecified shapes (%s). "
+                         "Please specify their shapes in input_shapes."
+                         % ", ".join(unknown))
+    params = get_all_params(layer, trainable=True)
+    result = {
+        'params': _shared_bytes(get_all_params(layer)),
+        'gradients': _shared_bytes(params),
+        'optimizer_state': _optimizer_state_bytes(update_fn, params),
+        'activations': sum(row['forward_bytes'] for row in summary),
+        'workspace': max(row['backward_bytes'] - row['param_bytes'] +
+                         itemsize * int(np.prod(row['output_shape']))
+                         for row in summary),
+    }
+    result['total'] = sum(result.values())
+    return result
+
+
+def _optimizer_state_bytes(update_fn, params):
+    if update_fn is None or not params:
+        return 0
+    grads = [theano.tensor.zeros_like(p) for p in params]
+    return _shared_bytes(update_fn(grads, params), exclude=params)
+
+
+def _shared_bytes(variables, exclude=()):
+    # the size of the values of the given shared variables, skipping others
+    return sum(_nbytes(var, var.get_value(borrow=True,
+                                          return_internal_type=True).shape)
+               for var in variables if var not in exclude and
+               isinstance(var, theano.compile.SharedVariable))
+
+
+def plan_batch_size(layer, memory_limit, update_fn=None, batch_sizes=None,
+                    input_shapes=None, probe=True, num_iterations=3,
+                    dtype=None):
+    """
+    Recommends the training batch size with the highest throughput whose
+    peak memory stays within a limit.
+
+    The peak memory of each candidate batch size is estimated with
+    :func:`estimate_training_memory`. Unless `probe` is False, a training
+    step on random data is then compiled and run for the candidates whose
+    estimate fits, in increasing order, to measure their throughput and
+    the actual growth of the peak memory of the process. Probing stops at
+    the first batch size exceeding the limit. The parameters of the
+    network are restored afterwards.
+
+    The growth of the peak memory is measured from the resident memory of
+    the process when probing starts (read from ``/proc/self/statm``, so on
+    Linux only) to the high-water mark of the process after a candidate.
+    This only works if the candidate raised the high-water mark: if the
+    process has used more memory before, e.g., for loading the training
+    data, the peak of the candidate is hidden and it is not measured. The
+    decision whether it fits then rests on the estimate.
+
+    Parameters
+    ----------
+    layer : Layer or list
+        The output layer(s) of the network. The probe minimizes the sum of
+        the means of their outputs.
+    memory_limit : int
+        The memory available for training in bytes, i.e., the memory limit
+        of the process minus the memory used by everything else, such as
+        the training data.
+    update_fn : callable or None (default: None)
+        The update function used for training, called as
+        ``update_fn(grads, params)``, as for
+        :func:`estimate_training_memory`. None stands for plain SGD.
+    batch_sizes : list of int or None (default: None)
+        The candidate batch sizes. Defaults to the powers of two up to the
+        largest batch size whose estimate fits, and that batch size.
+    input_shapes : None or dict (default: None)
+        A dictionary mapping input layers to shape tuples to use instead of
+        their regular shape, e.g., to fill in unspecified sequence lengths.
+    probe : bool (default: True)
+        Whether to confirm the estimates with a probe run. Without probing,
+        the largest batch size whose estimate fits is recommended.
+    num_iterations : int (default: 3)
+        The number of timed training steps per candidate, after one
+        warm-up step.
+    dtype : str or None (default: None)
+        The data type of activations. Defaults to ``theano.config.floatX``.
+
+    Returns
+    -------
+    dict
+        The recommended ``'batch_size'`` (None if no candidate fits) and
+        the ``'candidates'``, a list with one dictionary per candidate with
+        the keys ``'batch_size'``, ``'estimated_bytes'``,
+        ``'measured_bytes'`` (the growth of the peak memory during the
+        probe plus the size of the parameters and optimizer state, or None
+        if not probed or not measurable, see above),
+        ``'samples_per_second'`` (None if not probed) and ``'fits'``.
+    """
+    def estimate(batch_size):
+        return estimate_training_memory(layer, batch_size, update_fn,
+                                        input_shapes, dtype)
+    if batch_sizes is None:
+        # the estimate is affine in the batch size
+        fixed = 2 * estimate(1)['total'] - estimate(2)['total']
+        per_sample = estimate(1)['total'] - fixed
+        largest = int((memory_limit - fixed) // max(per_sample, 1))
+        batch_sizes = [2 ** i for i in range(largest.bit_length())
+                       if 2 ** i < largest] + [largest]
+    candidates = []
+    for batch_size in sorted(set(b for b in batch_sizes if b > 0)):
+        total = estimate(batch_size)['total']
+        candidates.append({'batch_size': batch_size,
+                           'estimated_bytes': total,
+                           'measured_bytes': None,
+                           'samples_per_second': None,
+                           'fits': total <= memory_limit})
+    if probe and any(c['fits'] for c in candidates):
+        _probe_batch_sizes(layer, memory_limit, update_fn, input_shapes,
+                           num_iterations, candidates)
+    fitting = [c for c in candidates if c['fits']]
+    if not fitting:
+        best = None
+    elif probe:
+        best = max(fitting, key=lambda c: c['samples_per_second'] or 0)
+    else:
+        best = fitting[-1]
+    return {'batch_size': best and best['batch_size'],
+            'candidates': candidates}
+
+
+def _probe_batch_sizes(layer, memory_limit, update_fn, input_shapes,
+                       num_iterations, candidates):
+    from .layers import InputLayer, get_all_layers, get_all_params, get_output
+    from .updates import sgd
+    input_layers = [lay for lay in get_all_layers(layer)
+                    if isinstance(lay, InputLayer)]
+    outputs = get_output(layer)
+    if not isinstance(outputs, list):
+        outputs = [outputs]
+    loss = sum(output.mean() for output in outputs)
+    params = get_all_params(layer, trainable=True)
+    grads = theano.grad(loss, params)
+    if update_fn is None:
+        updates = sgd(grads, params, learning_rate=0)
+    else:
+        updates = update_fn(grads, params)
+    known_bytes = (_shared_bytes(get_all_params(layer)) +
+                   _shared_bytes(updates, exclude=params))
+    fn = theano.function([lay.input_var for lay in input_layers], loss,
+                         updates=updates)
+
+    rng = np.random.RandomState(0)
+    backup = [p.get_value() for p in params]
+    baseline = _current_memory()
+    exceeded = False
+    try:
+        for candidate in candidates:
+            if exceeded or not candidate['fits']:
+                candidate['fits'] = False
+                continue
+            batch_size = candidate['batch_size']
+            inputs = []
+            for lay in input_layers:
+                shape = (input_shapes or {}).get(lay, lay.shape)
+                shape = (batch_size,) + tuple(shape[1:])
+                dtype = lay.input_var.dtype
+                if dtype in theano.tensor.float_dtypes:
+                    inputs.append(rng.randn(*shape).astype(dtype))
+                else:
+                    inputs.append(np.zeros(shape, dtype))
+            previous_peak = _peak_memory()
+            fn(*inputs)  # warm up
+            start = default_timer()
+            for _ in range(num_iterations):
+                fn(*inputs)
+            elapsed = default_timer() - start
+            del inputs
+            candidate['samples_per_second'] = (batch_size * num_iterations /
+                                               elapsed)
+            # the high-water mark of the process only tells the peak of
+            # this candidate if the candidate raised it; otherwise an
+            # earlier peak hides it
+            peak = _peak_memory()
+            if (baseline is not None and peak is not None and
+                    peak > previous_peak):
+                candidate['measured_bytes'] = peak - baseline + known_bytes
+                if candidate['measured_bytes'] > memory_limit:
+                    candidate['fits'] = False
+                    exceeded = True
+    finally:
+        for p, value in zip(params, backup):
+            p.set_value(value)
+
+
+def _current_memory():
+    # the current resident memory of the process in bytes, if available
+    try:
+        with open('/proc/self/statm') as f:
+            resident = int(f.read().split()[1])
+        return resident * os.sysconf('SC_PAGE_SIZE')
+    except (EnvironmentError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def _peak_memory():
+    # the peak resident memory of the process in bytes, if available
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
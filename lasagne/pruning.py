@@ -0,0 +1,298 @@
+"""
+Functions to prune the weights of networks by magnitude and to execute the
+pruned layers with sparse weights.
+
+.. autosummary::
+    :nosignatures:
+
+    magnitude_mask
+    prune_network
+    gradual_sparsity
+    sparsify_network
+
+Magnitude pruning sets the weights of the smallest absolute value to zero.
+:func:`prune_network` prunes a trained network at once, typically followed
+by some fine-tuning. Alternatively, a network can be pruned gradually during
+training by applying :func:`lasagne.updates.magnitude_constraint` to the
+weight updates, with a sparsity raised over the course of training as given
+by :func:`gradual_sparsity`.
+
+:func:`sparsify_network` then replaces the pruned :class:`DenseLayer`
+instances with :class:`SparseDenseLayer` instances (see
+:mod:`lasagne.layers`), which store the weights in CSR format and compute a
+sparse-dense product, but only for those layers where this is actually
+faster than the dense product.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.pruning import prune_network, sparsify_network
+>>> import numpy as np
+>>> import theano
+>>> l_in = InputLayer((None, 500))
+>>> l_hid = DenseLayer(l_in, num_units=500)
+>>> l_out = DenseLayer(l_hid, num_units=10, nonlinearity=None)
+>>> masks = prune_network(l_out, 0.95)
+>>> np.count_nonzero(l_hid.W.get_value())
+12500
+>>> l_sparse, report = sparsify_network(l_out)
+>>> predict = theano.function([l_in.input_var], get_output(l_sparse))
+>>> predict(np.ones((2, 500), dtype=theano.config.floatX)).shape
+(2, 10)
+
+To prune gradually, from 0 to 90% sparsity over the first ten epochs:
+
+>>> from lasagne.layers import get_all_params
+>>> from lasagne.pruning import gradual_sparsity
+>>> from lasagne.updates import sgd, magnitude_constraint
+>>> sparsity = theano.shared(0.)
+>>> loss = get_output(l_out).norm(2)
+>>> updates = sgd(loss, get_all_params(l_out), learning_rate=0.01)
+>>> for layer in l_hid, l_out:
+...     updates[layer.W] = magnitude_constraint(updates[layer.W], sparsity)
+>>> train = theano.function([l_in.input_var], loss, updates=updates)
+>>> for epoch in range(15):
+...     sparsity.set_value(gradual_sparsity(epoch + 1, 0.9, 0, 10))
+...     # train for one epoch
+"""
+
+import functools
+import timeit
+
+import numpy as np
+import theano
+import theano.tensor as T
+
+from .layers import DenseLayer, SparseDenseLayer, get_all_layers
+from .quantization import _replace_layers, _value
+
+
+__all__ = [
+    "magnitude_mask",
+    "prune_network",
+    "gradual_sparsity",
+    "sparsify_network",
+]
+
+
+def magnitude_mask(W, sparsity):
+    """
+    Computes which weights to keep when pruning by magnitude.
+
+    Parameters
+    ----------
+    W : numpy array
+        The weights.
+    sparsity : float
+        The fraction of weights to prune, between 0 and 1.
+
+    Returns
+    -------
+    numpy array of type bool
+        A mask of the shape of `W` which is False for the
+        ``round(sparsity * W.size)`` weights of the smallest absolute value,
+        and True for all others. Of equal weights, the first ones in C order
+        are pruned first.
+    """
+    if not 0 <= sparsity <= 1:
+        raise ValueError("sparsity must be between 0 and 1, got %r" %
+                         sparsity)
+    W = np.asarray(W)
+    num_pruned = int(np.floor(sparsity * W.size + 0.5))
+    mask = np.ones(W.shape, dtype=bool)
+    order = np.argsort(np.abs(W), axis=None, kind='mergesort')
+    mask.flat[order[:num_pruned]] = False
+    return mask
+
+
+def prune_network(layer, sparsity, layers=None):
+    """
+    Prunes the weights of a network by magnitude, in place.
+
+    Parameters
+    ----------
+    layer : Layer
+        The output layer of the network.
+    sparsity : float
+        The fraction of weights to prune in each layer, between 0 and 1.
+    layers : iterable of Layer or None (default: None)
+        The layers whose weights ``W`` to prune. By default, all instances of
+        :class:`DenseLayer` (but not its subclasses) are pruned.
+
+    Returns
+    -------
+    dict
+        Maps each pruned layer to the mask returned by
+        :func:`magnitude_mask`, which can be used to keep the pruned weights
+        at zero when fine-tuning, e.g., by multiplying it with the updates.
+    """
+    if layers is None:
+        layers = [lay for lay in get_all_layers(layer)
+                  if type(lay) is DenseLayer]
+    masks = {}
+    for target in layers:
+        W = target.W.get_value()
+        mask = magnitude_mask(W, sparsity)
+        W[~mask] = 0
+        target.W.set_value(W)
+        masks[target] = mask
+    return masks
+
+
+def gradual_sparsity(step, final_sparsity, begin_step, end_step,
+                     initial_sparsity=0., exponent=3):
+    """
+    Computes the sparsity of a gradual pruning schedule.
+
+    The sparsity rises from `initial_sparsity` to `final_sparsity` between
+    `begin_step` and `end_step`, quickly at first and slower towards the end,
+    when fewer weights are left to prune [1]_.
+
+    Parameters
+    ----------
+    step : int
+        The current step, e.g., the epoch or the number of updates done.
+    final_sparsity : float
+        The sparsity at and after `end_step`.
+    begin_step : int
+        The step at which pruning starts.
+    end_step : int
+        The step at which `final_sparsity` is reached.
+    initial_sparsity : float (default: 0)
+        The sparsity at and before `begin_step`.
+    exponent : float (default: 3)
+        The exponent of the polynomial decay of the remaining sparsity.
+
+    Returns
+    -------
+    float
+        ``final_sparsity + (initial_sparsity - final_sparsity) * (1 -
+        progress)**exponent``, where ``progress`` is the fraction of the steps
+        from `begin_step` to `end_step` done, clipped to ``[0, 1]``.
+
+    References
+    ----------
+    .. [1] Zhu, M., & Gupta, S. (2017): To prune, or not to prune: exploring
+       the efficacy of pruning for model compression. arXiv:1710.01878.
+    """
+    if end_step <= begin_step:
+        raise ValueError("end_step must be larger than begin_step")
+    progress = min(max((step - begin_step) / float(end_step - begin_step),
+                       0.), 1.)
+    return (initial_sparsity + (final_sparsity - initial_sparsity) *
+            (1 - (1 - progress) ** exponent))
+
+
+def _time(function, value, number, repeat):
+    return min(timeit.repeat(lambda: function(value), number=number,
+                             repeat=repeat)) / number
+
+
+def _benchmark(W, batch_size, number, repeat):
+    """
+    Returns the time of the dense and the sparse product of a batch with the
+    weight matrix `W`.
+    """
+    # imported on demand, importing theano.sparse takes a while
+    import scipy.sparse
+    import theano.sparse
+    x = T.matrix('x', dtype=W.dtype)
+    dense = theano.function([x], T.dot(x, theano.shared(W)))
+    sparse = theano.function(
+        [x], theano.sparse.dot(x, theano.sparse.shared(
+            scipy.sparse.csr_matrix(W))))
+    value = np.random.RandomState(0).rand(batch_size, len(W)).astype(W.dtype)
+    return (_time(dense, value, number, repeat),
+            _time(sparse, value, number, repeat))
+
+
+def _sparsify_dense(layer, incoming):
+    return SparseDenseLayer(incoming, layer.num_units, _value(layer.W),
+                            b=layer.b, nonlinearity=layer.nonlinearity,
+                            num_leading_axes=layer.num_leading_axes,
+                            name=layer.name)
+
+
+def sparsify_network(layer, layers=None, batch_size=64, min_speedup=1.,
+                     number=10, repeat=3):
+    """
+    Replaces pruned dense layers by sparse ones where this is faster.
+
+    For each candidate layer, the product of a random batch with its weights
+    is timed with the dense weight matrix and with the weights in CSR
+    format, and the layer is replaced by a :class:`SparseDenseLayer` if the
+    sparse product is faster.
+
+    Parameters
+    ----------
+    layer : Layer
+        The output layer of the pruned network.
+    layers : iterable of Layer or None (default: None)
+        The layers to consider. By default, all instances of
+        :class:`DenseLayer` (but not its subclasses) are.
+    batch_size : int (default: 64)
+        The number of examples of the batches to time, which should match
+        the batch size the network will be used with.
+    min_speedup : float (default: 1)
+        How many times faster the sparse product has to be for a layer to be
+        replaced. Pass 0 to replace all candidate layers with any pruned
+        weights.
+    number : int (default: 10)
+        The number of products per timing.
+    repeat : int (default: 3)
+        The number of timings, of which the fastest is used.
+
+    Returns
+    -------
+    sparse : Layer
+        The output layer of a copy of the network with the sparse layers.
+        The copy shares the input layers, the biases, the parameters of all
+        other layers, and the layers not depending on any sparse layer with
+        the original network.
+    report : list of dict
+        One dictionary per candidate layer, in topological order, with the
+        keys ``'layer'`` (the layer name, or class name for unnamed layers),
+        ``'density'`` (the fraction of nonzero weights), ``'dense_time'``
+        and ``'sparse_time'`` (the time of a product in seconds, None if not
+        timed) and ``'sparse'`` (whether the layer was replaced).
+
+    Raises
+    ------
+    ValueError
+        If `layers` contains a layer that is not a :class:`DenseLayer`.
+
+    Notes
+    -----
+    Layers without any zero weights are never replaced, and not timed.
+    """
+    all_layers = get_all_layers(layer)
+    if layers is None:
+        candidates = [lay for lay in all_layers if type(lay) is DenseLayer]
+    else:
+        layers = set(layers)
+        for lay in layers:
+            if type(lay) is not DenseLayer:
+                raise ValueError("Cannot sparsify %r, only layers of type "
+                                 "DenseLayer" % lay)
+        candidates = [lay for lay in all_layers if lay in layers]
+
+    replace = {}
+    report = []
+    for candidate in candidates:
+        W = _value(candidate.W)
+        density = np.count_nonzero(W) / float(W.size)
+        dense_time = sparse_time = None
+        if density < 1:
+            dense_time, sparse_time = _benchmark(W, batch_size, number,
+                                                 repeat)
+            if sparse_time * min_speedup < dense_time:
+                replace[candidate] = functools.partial(_sparsify_dense,
+                                                       candidate)
+        report.append({
+            'layer': candidate.name or type(candidate).__name__,
+            'density': density,
+            'dense_time': dense_time,
+            'sparse_time': sparse_time,
+            'sparse': candidate in replace})
+    sparse, _ = _replace_layers(layer, replace)
+    return sparse, report
@@ -0,0 +1,362 @@
+"""
+Functions to quantize trained networks to int8 for inference.
+
+.. autosummary::
+    :nosignatures:
+
+    quantize_weights
+    quantize_network
+    format_quantization_report
+
+:func:`quantize_network` performs post-training quantization: it runs a
+sample of the data through the trained network to calibrate the range of
+the input of each :class:`DenseLayer`, :class:`Conv2DLayer` and
+:class:`NINLayer`, quantizes their weights to int8 with one scale per output
+channel, and returns a copy of the network in which these layers are
+replaced by :class:`QuantizedDenseLayer`, :class:`QuantizedConv2DLayer` and
+:class:`QuantizedNINLayer` (see :mod:`lasagne.layers`), along with a report
+of how far the output of each quantized layer drifts from the original.
+
+Quantization is symmetric: a real value ``x`` is represented by the integer
+``round(x / scale)``, clipped to ``[-127, 127]``. The input scale of each
+layer is the largest absolute input value seen during calibration divided
+by 127, the weight scale of each output channel is the largest absolute
+weight of that channel divided by 127, and the biases are stored as int32
+in units of the product of both scales, so they can be added to the int32
+accumulator directly.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.quantization import quantize_network
+>>> import numpy as np
+>>> import theano
+>>> l_in = InputLayer((None, 20))
+>>> l_hid = DenseLayer(l_in, num_units=30)
+>>> l_out = DenseLayer(l_hid, num_units=5, nonlinearity=None)
+>>> x = np.random.rand(100, 20).astype(theano.config.floatX)
+>>> l_quantized, report = quantize_network(l_out, x)
+>>> [row['type'] for row in report]
+['DenseLayer', 'DenseLayer']
+>>> l_quantized.W.dtype
+'int8'
+>>> predict = theano.function([l_in.input_var],
+...                           get_output(l_quantized, deterministic=True))
+>>> predict(x).shape
+(100, 5)
+"""
+
+import copy
+
+import numpy as np
+import theano
+
+from .layers import (InputLayer, DenseLayer, Conv2DLayer, NINLayer,
+                     QuantizedDenseLayer, QuantizedConv2DLayer,
+                     QuantizedNINLayer, get_all_layers, get_output)
+from .layers.quantized import QMAX
+
+
+__all__ = [
+    "quantize_weights",
+    "quantize_network",
+    "format_quantization_report",
+]
+
+
+def quantize_weights(W, axis):
+    """
+    Quantizes weights to int8 with one scale per output channel.
+
+    Parameters
+    ----------
+    W : numpy array
+        The weights.
+    axis : int
+        The axis of the output channels, e.g., 1 for the weights of a
+        :class:`DenseLayer` and 0 for those of a :class:`Conv2DLayer`.
+
+    Returns
+    -------
+    W_q : numpy array of type int8
+        The quantized weights, ``round(W / W_scale)`` with `W_scale`
+        broadcast along `axis`, in ``[-127, 127]``.
+    W_scale : numpy array
+        The scale of each output channel, the largest absolute weight of the
+        channel divided by 127 (or 1 for a channel of zeros).
+    """
+    W = np.asarray(W)
+    axis = axis % W.ndim
+    other_axes = tuple(a for a in range(W.ndim) if a != axis)
+    W_scale = np.abs(W).max(axis=other_axes) / QMAX
+    W_scale[W_scale == 0] = 1
+    W_scale = W_scale.astype(W.dtype)
+    shape = [-1 if a == axis else 1 for a in range(W.ndim)]
+    W_q = np.clip(np.round(W / W_scale.reshape(shape)), -QMAX, QMAX)
+    return W_q.astype(np.int8), W_scale
+
+
+def _value(param):
+    return param.get_value() if hasattr(param, 'get_value') else param.eval()
+
+
+def _quantize_biases(b, scale):
+    # biases in units of the accumulator, one scale per output channel
+    if b is None:
+        return None
+    b = _value(b)
+    scale = scale.reshape((-1,) + (1,) * (b.ndim - 1))
+    info = np.iinfo(np.int32)
+    return np.clip(np.round(b / scale), info.min, info.max).astype(np.int32)
+
+
+def _quantize_dense(layer, incoming, input_scale):
+    W, W_scale = quantize_weights(_value(layer.W), axis=1)
+    b = _quantize_biases(layer.b, input_scale * W_scale)
+    return QuantizedDenseLayer(incoming, layer.num_units, W, W_scale,
+                               input_scale, b,
+                               nonlinearity=layer.nonlinearity,
+                               num_leading_axes=layer.num_leading_axes,
+                               name=layer.name)
+
+
+def _quantize_nin(layer, incoming, input_scale):
+    W, W_scale = quantize_weights(_value(layer.W), axis=1)
+    b = _quantize_biases(layer.b, input_scale * W_scale)
+    return QuantizedNINLayer(incoming, layer.num_units, W, W_scale,
+                             input_scale, b, untie_biases=layer.untie_biases,
+                             nonlinearity=layer.nonlinearity, name=layer.name)
+
+
+def _quantize_conv2d(layer, incoming, input_scale):
+    W, W_scale = quantize_weights(_value(layer.W), axis=0)
+    b = _quantize_biases(layer.b, input_scale * W_scale)
+    return QuantizedConv2DLayer(incoming, layer.num_filters,
+                                layer.filter_size, W, W_scale, input_scale, b,
+                                stride=layer.stride, pad=layer.pad,
+                                untie_biases=layer.untie_biases,
+                                nonlinearity=layer.nonlinearity,
+                                flip_filters=layer.flip_filters,
+                                convolution=layer.convolution,
+                                num_groups=layer.num_groups, name=layer.name)
+
+
+# Maps the exact layer classes to functions returning their quantized
+# variant; subclasses usually change the computation and are not included.
+_QUANTIZERS = {
+    DenseLayer: _quantize_dense,
+    NINLayer: _quantize_nin,
+    Conv2DLayer: _quantize_conv2d,
+}
+
+
+def _replace_layers(layer, replace):
+    """
+    Returns a copy of the network of `layer` in which each layer in the
+    dictionary `replace` is substituted by the result of calling its value
+    with the (copied) incoming layer. Layers depending on a substituted layer
+    are shallow copies sharing their parameters with the original; all
+    other layers are shared with the original network.
+    """
+    copies = {}
+    for original in get_all_layers(layer):
+        if isinstance(original, InputLayer):
+            continue
+        if hasattr(original, 'input_layers'):
+            incomings = original.input_layers
+        else:
+            incomings = [original.input_layer]
+        mapped = [copies.get(incoming, incoming) for incoming in incomings]
+        if original in replace:
+            copies[original] = replace[original](*mapped)
+        elif any(new is not old for new, old in zip(mapped, incomings)):
+            new = copy.copy(original)
+            if hasattr(original, 'input_layers'):
+                new.input_layers = mapped
+            else:
+                new.input_layer = mapped[0]
+            copies[original] = new
+    return copies.get(layer, layer), copies
+
+
+def _batches(inputs, batch_size):
+    size = len(inputs[0])
+    batch_size = batch_size or size
+    for start in range(0, size, batch_size):
+        yield [x[start:start + batch_size] for x in inputs]
+
+
+def quantize_network(layer, inputs, layers=None, batch_size=None):
+    """
+    Quantizes the weights of a trained network to int8, calibrating the
+    input scales on sample data.
+
+    Parameters
+    ----------
+    layer : Layer
+        The output layer of the trained network.
+    inputs : numpy array or dict
+        The calibration data: an array for a network with a single
+        :class:`InputLayer`, or a dictionary mapping each
+        :class:`InputLayer` to an array. It should be representative of the
+        data the network will be used on, e.g., a few hundred training
+        examples.
+    layers : iterable of Layer or None (default: None)
+        The layers to quantize. By default, all instances of
+        :class:`DenseLayer`, :class:`Conv2DLayer` and :class:`NINLayer`
+        (but not their subclasses) are quantized.
+    batch_size : int or None (default: None)
+        The number of examples to pass through the network at once, or
+        None for all at once.
+
+    Returns
+    -------
+    quantized : Layer
+        The output layer of a copy of the network with the quantized layers.
+        The copy shares the input layers, the parameters of all other
+        layers, and the layers not depending on any quantized layer with the
+        original network. Use it with ``deterministic=True``.
+    report : list of dict
+        One dictionary per quantized layer, in topological order, followed
+        by one for the output layer unless it was quantized, with the keys
+        ``'layer'`` (the layer name, or class name for unnamed layers),
+        ``'type'`` (the class name of the original layer),
+        ``'input_scale'`` (None for the output row), ``'weight_bytes'`` and
+        ``'quantized_weight_bytes'`` (the size of the weights before and
+        after quantization, 0 for the output row), and the drift of the
+        layer output on the calibration data from that of the original
+        network, accumulated over all quantized layers before it:
+        ``'max_error'`` and ``'mean_error'`` (the largest and mean absolute
+        difference) and ``'relative_error'`` (the norm of the difference
+        divided by the norm of the original output). For outputs of two
+        dimensions, the key ``'agreement'`` gives the fraction of examples
+        whose largest output (e.g., the predicted class) is unchanged; it is
+        None otherwise.
+
+    Raises
+    ------
+    ValueError
+        If `layers` contains a layer that cannot be quantized, or if
+        `inputs` does not provide data for each input layer.
+    """
+    all_layers = get_all_layers(layer)
+    input_layers = [lay for lay in all_layers if isinstance(lay, InputLayer)]
+    if not isinstance(inputs, dict):
+        if len(input_layers) != 1:
+            raise ValueError("The network has %d input layers, pass a "
+                             "dictionary of calibration data" %
+                             len(input_layers))
+        inputs = {input_layers[0]: inputs}
+    if any(lay not in inputs for lay in input_layers):
+        raise ValueError("No calibration data given for some input layers")
+    inputs = [inputs[lay] for lay in input_layers]
+    input_vars = [lay.input_var for lay in input_layers]
+
+    if layers is None:
+        targets = [lay for lay in all_layers if type(lay) in _QUANTIZERS]
+    else:
+        layers = set(layers)
+        for lay in layers:
+            if type(lay) not in _QUANTIZERS:
+                raise ValueError("Cannot quantize %r, only layers of type %s"
+                                 % (lay, ', '.join(sorted(
+                                     cls.__name__ for cls in _QUANTIZERS))))
+        targets = [lay for lay in all_layers if lay in layers]
+
+    # Calibrate the input scales
+    calibrate = theano.function(
+        input_vars, get_output([lay.input_layer for lay in targets],
+                               deterministic=True),
+        on_unused_input='ignore')
+    ranges = np.zeros(len(targets))
+    for batch in _batches(inputs, batch_size):
+        for i, value in enumerate(calibrate(*batch)):
+            ranges[i] = max(ranges[i], np.abs(value).max())
+    scales = np.where(ranges > 0, ranges / QMAX, 1)
+
+    replace = {}
+    for target, scale in zip(targets, scales):
+        def quantizer(incoming, target=target, scale=float(scale)):
+            return _QUANTIZERS[type(target)](target, incoming, scale)
+        replace[target] = quantizer
+    quantized, copies = _replace_layers(layer, replace)
+
+    # Measure the drift of each quantized layer and of the output
+    rows = [(lay, copies[lay]) for lay in targets]
+    if layer not in replace:
+        rows.append((layer, quantized))
+    originals, replacements = zip(*rows)
+    outputs = theano.function(
+        input_vars,
+        get_output(list(originals), deterministic=True) +
+        get_output(list(replacements), deterministic=True),
+        on_unused_input='ignore')
+    stats = np.zeros((len(rows), 7))
+    for batch in _batches(inputs, batch_size):
+        values = outputs(*batch)
+        for i, (expected, actual) in enumerate(zip(values[:len(rows)],
+                                                   values[len(rows):])):
+            error = np.abs(actual - expected)
+            stats[i, 0] = max(stats[i, 0], error.max())
+            stats[i, 1:5] += [error.sum(), error.size, (error ** 2).sum(),
+                              (expected ** 2).sum()]
+            if expected.ndim == 2:
+                stats[i, 5:] += [(expected.argmax(axis=1) ==
+                                  actual.argmax(axis=1)).sum(), len(expected)]
+
+    report = []
+    for (original, replacement), row in zip(rows, stats):
+        max_error, sum_error, count, sum_sq_error, sum_sq, agree, num = row
+        quantized_layer = original in replace
+        report.append({
+            'layer': original.name or type(original).__name__,
+            'type': type(original).__name__,
+            'input_scale': (float(replacement.input_scale.get_value())
+                            if quantized_layer else None),
+            'weight_bytes': (_value(original.W).nbytes
+                             if quantized_layer else 0),
+            'quantized_weight_bytes': (
+                replacement.W.get_value(borrow=True).nbytes +
+                replacement.W_scale.get_value(borrow=True).nbytes
+                if quantized_layer else 0),
+            'max_error': float(max_error),
+            'mean_error': float(sum_error / count),
+            'relative_error': float(np.sqrt(sum_sq_error / sum_sq)
+                                    if sum_sq else np.sqrt(sum_sq_error)),
+            'agreement': float(agree / num) if num else None})
+    return quantized, report
+
+
+def format_quantization_report(report):
+    """
+    Formats the result of :func:`quantize_network` as a table.
+
+    Parameters
+    ----------
+    report : list of dict
+        The report returned by :func:`quantize_network`.
+
+    Returns
+    -------
+    str
+        The table, one line per quantized layer and one for the output.
+    """
+    columns = ['layer', 'type', 'input scale', 'weights', 'quantized',
+               'max error', 'mean error', 'rel. error', 'agreement']
+    lines = [columns]
+    for row in report:
+        lines.append([
+            row['layer'], row['type'],
+            '' if row['input_scale'] is None else '%.4g' % row['input_scale'],
+            '{:,}'.format(row['weight_bytes']),
+            '{:,}'.format(row['quantized_weight_bytes']),
+            '%.4g' % row['max_error'], '%.4g' % row['mean_error'],
+            '%.2f%%' % (row['relative_error'] * 100),
+            ('' if row['agreement'] is None else
+             '%.1f%%' % (row['agreement'] * 100))])
+    widths = [max(len(line[i]) for line in lines)
+              for i in range(len(columns))]
+    return '\n'.join(
+        '  '.join(cell.ljust(width) if i < 2 else cell.rjust(width)
+                  for i, (cell, width) in enumerate(zip(line, widths)))
+        for line in lines)
@@ -34,3 +34,22 @@ def set_rng(new_rng):
     """
     global _rng
     _rng = new_rng
+
+
+class _RandomStreams(object):
+    """
+    Descriptor providing the Theano random stream of a noise layer.
+
+    The stream is seeded with the ``_srng_seed`` attribute of the layer,
+    which should be drawn from :func:`get_rng` in the constructor, and is
+    only created on first access: importing Theano's random streams probes
+    the GPU backends, which is slow and not needed for networks that are
+    only used deterministically. Assigning to the attribute replaces the
+    stream.
+    """
+    def __get__(self, layer, owner=None):
+        if layer is None:
+            return self
+        from theano.sandbox.rng_mrg import MRG_RandomStreams
+        srng = layer.__dict__['_srng'] = MRG_RandomStreams(layer._srng_seed)
+        return srng
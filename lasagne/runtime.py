@@ -0,0 +1,1139 @@
+"""
+Functions to run trained networks for inference with NumPy only, without
+Theano or a compiler.
+
+.. autosummary::
+    :nosignatures:
+
+    export_network
+    save_network
+    load_network
+    Executor
+
+:func:`export_network` walks the layers of a trained network and turns them
+into a compact execution plan: a JSON-serializable list of operations, each
+giving its kind, the names of its inputs, its output shape and references
+to its parameters. :func:`save_network` stores the plan and the parameter
+values in a single ``.npz`` file. An :class:`Executor` then runs the plan
+with NumPy, in deterministic mode (dropout and noise layers pass their
+input through, batch normalization uses the stored statistics).
+
+The executor allocates all buffers when it is created, for a fixed shape of
+each input, and computes every operation into these buffers with ``out=``
+arguments, so running a network allocates no new arrays at steady state.
+(NumPy may still use its fixed-size ufunc buffer, see :func:`numpy.setbufsize`,
+for broadcasting operations.)
+
+This module imports nothing but NumPy, except for :func:`export_network`.
+On a host without Theano, it can be copied along with the ``.npz`` file, or
+loaded from its file path, e.g., with ``imp.load_source('runtime',
+'lasagne/runtime.py')``, so that importing the :mod:`lasagne` package is
+avoided.
+
+The supported layers are :class:`InputLayer`, :class:`DenseLayer`,
+:class:`NINLayer`, :class:`Conv1DLayer`, :class:`Conv2DLayer` (including
+grouped convolutions), :class:`Pool1DLayer`, :class:`Pool2DLayer`,
+:class:`MaxPool1DLayer`, :class:`MaxPool2DLayer`, :class:`GlobalPoolLayer`,
+:class:`BatchNormLayer`, :class:`BiasLayer`, :class:`ScaleLayer`,
+:class:`NonlinearityLayer`, :class:`EmbeddingLayer`, :class:`ConcatLayer`,
+:class:`ElemwiseSumLayer`, :class:`ElemwiseMergeLayer`, the shape layers
+:class:`ReshapeLayer`, :class:`FlattenLayer`, :class:`DimshuffleLayer` and
+:class:`SliceLayer`, :class:`DropoutLayer`, :class:`GaussianNoiseLayer`,
+:class:`LSTMLayer` and :class:`GRULayer`, with the nonlinearities
+:func:`linear`, :func:`rectify`, :func:`sigmoid`, :func:`tanh`,
+:func:`softmax`, :func:`elu`, :func:`softplus`, :class:`LeakyRectify` and
+:class:`ScaledTanH` (all from :mod:`lasagne.nonlinearities`). Exporting any
+other layer raises a ``NotImplementedError``.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.nonlinearities import softmax
+>>> from lasagne.runtime import export_network, Executor
+>>> import theano
+>>> import numpy as np
+>>> l_in = InputLayer((None, 20))
+>>> l_hid = DenseLayer(l_in, num_units=30)
+>>> l_out = DenseLayer(l_hid, num_units=5,
+...                    nonlinearity=softmax)
+>>> plan, params = export_network(l_out)
+>>> [op['op'] for op in plan['ops']]
+['dense', 'dense']
+>>> executor = Executor(plan, params, batch_size=8)
+>>> x = np.random.rand(8, 20).astype(theano.config.floatX)
+>>> predict = theano.function([l_in.input_var],
+...                           get_output(l_out, deterministic=True))
+>>> np.allclose(executor(x), predict(x), atol=1e-5)
+True
+"""
+
+import json
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+__all__ = [
+    "export_network",
+    "save_network",
+    "load_network",
+    "Executor",
+]
+
+
+#: The version of the execution plan format written by :func:`export_network`
+PLAN_VERSION = 1
+
+
+# Exporting networks
+
+def export_network(layer_or_layers):
+    """
+    Exports a trained network to an execution plan for the :class:`Executor`.
+
+    Parameters
+    ----------
+    layer_or_layers : Layer or list
+        the :class:`Layer` instance whose output the plan computes, or a list
+        of :class:`Layer` instances.
+
+    Returns
+    -------
+    plan : dict
+        A JSON-serializable dictionary with the keys ``'version'``,
+        ``'dtype'`` (the floating-point type of the network), ``'inputs'``
+        (a list of dictionaries giving the ``'name'``, ``'shape'`` and
+        ``'dtype'`` of each :class:`InputLayer`, with ``None`` for unknown
+        dimensions), ``'ops'`` (a list of dictionaries giving the kind of
+        the operation as ``'op'``, the ``'name'`` of its output, the names
+        of its ``'inputs'``, the ``'shape'`` of its output, the names of its
+        ``'params'`` and its ``'attrs'``, in the order of execution) and
+        ``'outputs'`` (the names of the network outputs).
+    params : dict
+        A dictionary mapping the parameter names referenced by the plan to
+        NumPy arrays. Some parameters are precomputed from the parameters of
+        the layer, e.g., batch normalization is folded into a scale and a
+        shift.
+
+    Raises
+    ------
+    NotImplementedError
+        If the network contains a layer, a nonlinearity or a layer setting
+        that the :class:`Executor` does not support.
+    ValueError
+        If the network has an input that is not an :class:`InputLayer`.
+    """
+    import theano
+    from .layers import InputLayer, get_all_layers
+
+    outputs = (layer_or_layers if isinstance(layer_or_layers, (list, tuple))
+               else [layer_or_layers])
+    all_layers = get_all_layers(outputs)
+    exporters = _exporters()
+
+    names = {}
+    plan = {'version': PLAN_VERSION,
+            'dtype': theano.config.floatX,
+            'inputs': [],
+            'ops': [],
+            'outputs': []}
+    params = {}
+    for layer in all_layers:
+        name = _unique_name(layer, names)
+        if isinstance(layer, InputLayer):
+            names[layer] = name
+            plan['inputs'].append({'name': name,
+                                   'shape': _shape(layer.shape),
+                                   'dtype': layer.input_var.dtype})
+            continue
+        incomings = getattr(layer, 'input_layers', None)
+        if incomings is None:
+            incomings = [layer.input_layer]
+        if any(incoming is None for incoming in incomings):
+            raise ValueError("Layer %r gets an input that is not an "
+                             "InputLayer, which cannot be exported" % layer)
+        exporter = exporters.get(type(layer))
+        if exporter is None:
+            raise NotImplementedError("There is no NumPy implementation of "
+                                      "%s" % type(layer).__name__)
+        op, attrs, layer_params = exporter(layer)
+        names[layer] = name
+        param_names = {}
+        for key, value in layer_params.items():
+            if value is None:
+                continue
+            param_names[key] = '%s.%s' % (name, key)
+            params[param_names[key]] = np.asarray(value)
+        plan['ops'].append({'op': op,
+                            'name': name,
+                            'inputs': [names[incoming]
+                                       for incoming in incomings],
+                            'shape': _shape(layer.output_shape),
+                            'params': param_names,
+                            'attrs': attrs})
+    plan['outputs'] = [names[layer] for layer in outputs]
+    return plan, params
+
+
+def _shape(shape):
+    return [None if s is None else int(s) for s in shape]
+
+
+def _unique_name(layer, names):
+    taken = set(names.values())
+    name = layer.name or '%s_%d' % (type(layer).__name__, len(names))
+    base, suffix = name, 1
+    while name in taken:
+        name = '%s_%d' % (base, suffix)
+        suffix += 1
+    return name
+
+
+def _export_nonlinearity(nonlinearity):
+    from . import nonlinearities
+    if nonlinearity is None or nonlinearity is nonlinearities.linear:
+        return ['linear']
+    for name in ('rectify', 'sigmoid', 'tanh', 'softmax', 'elu', 'softplus'):
+        if nonlinearity is getattr(nonlinearities, name):
+            return [name]
+    if isinstance(nonlinearity, nonlinearities.LeakyRectify):
+        return ['leaky_rectify', float(nonlinearity.leakiness)]
+    if isinstance(nonlinearity, nonlinearities.ScaledTanH):
+        return ['scaled_tanh', float(nonlinearity.scale_in),
+                float(nonlinearity.scale_out)]
+    raise NotImplementedError("There is no NumPy implementation of the "
+                              "nonlinearity %r" % (nonlinearity,))
+
+
+def _value(param):
+    return None if param is None else param.get_value()
+
+
+def _broadcastable(value, ndim, axes):
+    # inserts broadcastable axes into a parameter, like the dimshuffle
+    # patterns of BiasLayer, ScaleLayer and BatchNormLayer
+    shape = list(value.shape)
+    return value.reshape([1 if axis in axes else shape.pop(0)
+                          for axis in range(ndim)])
+
+
+def _export_dense(layer):
+    attrs = {'num_leading_axes': layer.num_leading_axes,
+             'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    return 'dense', attrs, {'W': _value(layer.W), 'b': _value(layer.b)}
+
+
+def _export_nin(layer):
+    # a NINLayer is a DenseLayer applied over the channel axis
+    if layer.untie_biases:
+        raise NotImplementedError("NINLayer with untie_biases=True is not "
+                                  "supported")
+    attrs = {'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    return 'nin', attrs, {'W': _value(layer.W), 'b': _value(layer.b)}
+
+
+def _export_conv(layer):
+    if layer.pad == 'same':
+        pad = [size // 2 for size in layer.filter_size]
+    elif layer.pad == 'full':
+        pad = [size - 1 for size in layer.filter_size]
+    else:
+        pad = list(layer.pad)
+    W = layer.W.get_value()
+    if layer.flip_filters:
+        # the executor computes a correlation
+        W = W[(slice(None), slice(None)) +
+              (slice(None, None, -1),) * layer.n].copy()
+    attrs = {'stride': list(layer.stride),
+             'pad': pad,
+             'num_groups': layer.num_groups,
+             'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    return 'conv', attrs, {'W': W, 'b': _value(layer.b)}
+
+
+def _export_pool(layer):
+    if not layer.ignore_border and (layer.mode != 'max' or any(layer.pad)):
+        raise NotImplementedError("Pooling with ignore_border=False is only "
+                                  "supported for mode='max' and no padding")
+    attrs = {'pool_size': list(layer.pool_size),
+             'stride': list(layer.stride),
+             'pad': list(layer.pad),
+             'ignore_border': layer.ignore_border,
+             'mode': layer.mode}
+    return 'pool', attrs, {}
+
+
+def _export_global_pool(layer):
+    import theano.tensor as T
+    functions = {T.mean: 'mean', T.max: 'max', T.min: 'min', T.sum: 'sum'}
+    function = functions.get(layer.pool_function)
+    if function is None:
+        raise NotImplementedError("GlobalPoolLayer with pool_function=%r is "
+                                  "not supported" % (layer.pool_function,))
+    return 'global_pool', {'function': function}, {}
+
+
+def _export_batch_norm(layer):
+    ndim = len(layer.input_shape)
+    inv_std = layer.inv_std.get_value()
+    scale = inv_std if layer.gamma is None else (layer.gamma.get_value() *
+                                                 inv_std)
+    shift = -layer.mean.get_value() * scale
+    if layer.beta is not None:
+        shift += layer.beta.get_value()
+    return 'affine', {}, {'scale': _broadcastable(scale, ndim, layer.axes),
+                          'shift': _broadcastable(shift, ndim, layer.axes)}
+
+
+def _export_bias(layer):
+    ndim = len(layer.input_shape)
+    shift = None
+    if layer.b is not None:
+        shift = _broadcastable(layer.b.get_value(), ndim, layer.shared_axes)
+    return 'affine', {}, {'shift': shift}
+
+
+def _export_scale(layer):
+    ndim = len(layer.input_shape)
+    return 'affine', {}, {'scale': _broadcastable(layer.scales.get_value(),
+                                                  ndim, layer.shared_axes)}
+
+
+def _export_nonlinearity_layer(layer):
+    attrs = {'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    return 'nonlinearity', attrs, {}
+
+
+def _export_identity(layer):
+    return 'identity', {}, {}
+
+
+def _export_embedding(layer):
+    return 'embedding', {}, {'W': _value(layer.W)}
+
+
+def _export_concat(layer):
+    if layer.cropping is not None:
+        raise NotImplementedError("ConcatLayer with cropping is not "
+                                  "supported")
+    return 'concat', {'axis': layer.axis}, {}
+
+
+def _export_merge(layer):
+    import theano.tensor as T
+    from .layers import ElemwiseSumLayer
+    if layer.cropping is not None:
+        raise NotImplementedError("Merging with cropping is not supported")
+    if isinstance(layer, ElemwiseSumLayer):
+        function, coeffs = 'add', [float(c) for c in layer.coeffs]
+    else:
+        functions = {T.add: 'add', T.mul: 'multiply', T.maximum: 'maximum',
+                     T.minimum: 'minimum'}
+        function = functions.get(layer.merge_function)
+        if function is None:
+            raise NotImplementedError(
+                "ElemwiseMergeLayer with merge_function=%r is not "
+                "supported" % (layer.merge_function,))
+        coeffs = None
+    return 'elemwise', {'function': function, 'coeffs': coeffs}, {}
+
+
+def _export_reshape(layer):
+    shape = []
+    for s in layer.shape:
+        if isinstance(s, list):
+            shape.append([int(s[0])])
+        elif isinstance(s, (int, np.integer)):
+            shape.append(int(s))
+        else:
+            raise NotImplementedError("ReshapeLayer with a symbolic shape "
+                                      "is not supported")
+    return 'reshape', {'shape': shape}, {}
+
+
+def _export_flatten(layer):
+    return 'flatten', {'outdim': layer.outdim}, {}
+
+
+def _export_dimshuffle(layer):
+    return 'dimshuffle', {'pattern': list(layer.pattern)}, {}
+
+
+def _export_slice(layer):
+    indices = layer.slice
+    if isinstance(indices, slice):
+        indices = [indices.start, indices.stop, indices.step]
+    return 'slice', {'indices': indices, 'axis': layer.axis}, {}
+
+
+def _check_recurrent(layer, inits):
+    from .layers import Layer
+    if layer.fold_embedding:
+        raise NotImplementedError("%s with fold_embedding=True is not "
+                                  "supported" % type(layer).__name__)
+    for init in inits:
+        if isinstance(getattr(layer, init), Layer):
+            raise NotImplementedError("%s with %s given by a layer is not "
+                                      "supported" % (type(layer).__name__,
+                                                     init))
+
+
+def _export_lstm(layer):
+    _check_recurrent(layer, ('hid_init', 'cell_init'))
+    gates = 'ingate', 'forgetgate', 'cell', 'outgate'
+    params = {
+        'W_in': np.concatenate([getattr(layer, 'W_in_to_' + gate).get_value()
+                                for gate in gates], axis=1),
+        'W_hid': np.concatenate([getattr(layer, 'W_hid_to_' + gate)
+                                 .get_value() for gate in gates], axis=1),
+        'b': np.concatenate([getattr(layer, 'b_' + gate).get_value()
+                             for gate in gates]),
+        'hid_init': layer.hid_init.get_value(),
+        'cell_init': layer.cell_init.get_value()}
+    if layer.peepholes:
+        for gate in 'ingate', 'forgetgate', 'outgate':
+            params['W_cell_to_' + gate] = getattr(
+                layer, 'W_cell_to_' + gate).get_value()
+    attrs = {'num_units': layer.num_units,
+             'backwards': layer.backwards,
+             'only_return_final': layer.only_return_final,
+             'peepholes': bool(layer.peepholes),
+             'nonlinearity': _export_nonlinearity(layer.nonlinearity)}
+    for gate in gates:
+        attrs['nonlinearity_' + gate] = _export_nonlinearity(
+            getattr(layer, 'nonlinearity_' + gate))
+    return 'lstm', attrs, params
+
+
+def _export_gru(layer):
+    _check_recurrent(layer, ('hid_init',))
+    gates = 'resetgate', 'updategate', 'hidden_update'
+    params = {
+        'W_in': np.concatenate([getattr(layer, 'W_in_to_' + gate).get_value()
+                                for gate in gates], axis=1),
+        'W_hid': np.concatenate([getattr(layer, 'W_hid_to_' + gate)
+                                 .get_value() for gate in gates], axis=1),
+        'b': np.concatenate([getattr(layer, 'b_' + gate).get_value()
+                             for gate in gates]),
+        'hid_init': layer.hid_init.get_value()}
+    attrs = {'num_units': layer.num_units,
+             'backwards': layer.backwards,
+             'only_return_final': layer.only_return_final}
+    for gate in 'resetgate', 'updategate', 'hid':
+        attrs['nonlinearity_' + gate] = _export_nonlinearity(
+            getattr(layer, 'nonlinearity_' + gate))
+    return 'gru', attrs, params
+
+
+def _exporters():
+    # Maps the exact layer classes to their exporters; subclasses are not
+    # included, since they usually change the computation.
+    from . import layers as L
+    return {L.DenseLayer: _export_dense,
+            L.NINLayer: _export_nin,
+            L.Conv1DLayer: _export_conv,
+            L.Conv2DLayer: _export_conv,
+            L.Pool1DLayer: _export_pool,
+            L.MaxPool1DLayer: _export_pool,
+            L.Pool2DLayer: _export_pool,
+            L.MaxPool2DLayer: _export_pool,
+            L.GlobalPoolLayer: _export_global_pool,
+            L.BatchNormLayer: _export_batch_norm,
+            L.BiasLayer: _export_bias,
+            L.ScaleLayer: _export_scale,
+            L.NonlinearityLayer: _export_nonlinearity_layer,
+            L.DropoutLayer: _export_identity,
+            L.GaussianNoiseLayer: _export_identity,
+            L.EmbeddingLayer: _export_embedding,
+            L.ConcatLayer: _export_concat,
+            L.ElemwiseSumLayer: _export_merge,
+            L.ElemwiseMergeLayer: _export_merge,
+            L.ReshapeLayer: _export_reshape,
+            L.FlattenLayer: _export_flatten,
+            L.DimshuffleLayer: _export_dimshuffle,
+            L.SliceLayer: _export_slice,
+            L.LSTMLayer: _export_lstm,
+            L.GRULayer: _export_gru}
+
+
+def save_network(filename, plan, params):
+    """
+    Saves an execution plan and its parameters to a ``.npz`` file.
+
+    Parameters
+    ----------
+    filename : str or file
+        The file to write to.
+    plan, params : dict
+        The execution plan and parameters returned by
+        :func:`export_network`.
+    """
+    arrays = dict(params)
+    arrays['__plan__'] = np.array(json.dumps(plan))
+    np.savez(filename, **arrays)
+
+
+def load_network(filename):
+    """
+    Loads an execution plan and its parameters from a ``.npz`` file written
+    by :func:`save_network`.
+
+    Parameters
+    ----------
+    filename : str or file
+        The file to read from.
+
+    Returns
+    -------
+    plan, params : dict
+        The execution plan and parameters, to be passed to
+        :class:`Executor`.
+    """
+    with np.load(filename) as f:
+        plan = json.loads(str(f['__plan__']))
+        params = dict((key, f[key]) for key in f.files if key != '__plan__')
+    if plan.get('version') != PLAN_VERSION:
+        raise ValueError("Unsupported execution plan version %r" %
+                         plan.get('version'))
+    return plan, params
+
+
+# Running networks
+
+class Executor(object):
+    """
+    Runs an execution plan for inputs of a fixed shape with NumPy.
+
+    Parameters
+    ----------
+    plan, params : dict
+        The execution plan and parameters returned by :func:`export_network`
+        or :func:`load_network`.
+    batch_size : int or None
+        The size of the first dimension of all inputs whose first dimension
+        is unknown in the plan.
+    input_shapes : dict or None
+        A dictionary mapping input names to their shapes, required for any
+        input that has unknown dimensions other than the first one, e.g.,
+        the number of time steps of a recurrent network.
+
+    Attributes
+    ----------
+    inputs : list of numpy.ndarray
+        The buffers the inputs are copied to.
+    outputs : list of numpy.ndarray
+        The buffers holding the outputs of the last call.
+
+    Notes
+    -----
+    All buffers are allocated once, when the executor is created, and
+    calling the executor allocates no further arrays, apart from the
+    fixed-size buffer NumPy's ufuncs use for broadcasting. The returned arrays
+    are the output buffers themselves, so they are overwritten by the next
+    call; copy them to keep them.
+
+    The buffers of all operations are kept alive, so the memory used is the
+    sum of the sizes of all intermediate outputs (reshaping, flattening and
+    noise layers share the buffers of their inputs). For large inputs,
+    create one executor per batch size and reuse it.
+    """
+    def __init__(self, plan, params, batch_size=None, input_shapes=None):
+        if plan.get('version') != PLAN_VERSION:
+            raise ValueError("Unsupported execution plan version %r" %
+                             plan.get('version'))
+        self.plan = plan
+        self.dtype = np.dtype(plan['dtype'])
+        input_shapes = input_shapes or {}
+        buffers = {}
+        self.inputs = []
+        for spec in plan['inputs']:
+            shape = list(input_shapes.get(spec['name'], spec['shape']))
+            if shape and shape[0] is None:
+                shape[0] = batch_size
+            if len(shape) != len(spec['shape']) or any(
+                    s is None or (t is not None and s != t)
+                    for s, t in zip(shape, spec['shape'])):
+                raise ValueError("Input %r of shape %r needs a shape "
+                                 "matching %r" % (spec['name'], tuple(shape),
+                                                  tuple(spec['shape'])))
+            buffers[spec['name']] = np.zeros(shape, spec['dtype'])
+            self.inputs.append(buffers[spec['name']])
+
+        self._steps = []
+        for op in plan['ops']:
+            builder = _BUILDERS.get(op['op'])
+            if builder is None:
+                raise NotImplementedError("Unsupported operation %r" %
+                                          op['op'])
+            inputs = [buffers[name] for name in op['inputs']]
+            op_params = dict((key, np.asarray(params[name], self.dtype))
+                             for key, name in op['params'].items())
+            output, steps = builder(inputs, op_params, op['attrs'],
+                                    self.dtype)
+            if len(output.shape) != len(op['shape']) or any(
+                    t is not None and s != t
+                    for s, t in zip(output.shape, op['shape'])):
+                raise ValueError("Operation %r computes an output of shape "
+                                 "%r instead of %r" % (op['name'],
+                                                       output.shape,
+                                                       tuple(op['shape'])))
+            buffers[op['name']] = output
+            self._steps.extend(steps)
+        self.outputs = [buffers[name] for name in plan['outputs']]
+
+    def __call__(self, *inputs):
+        """
+        Runs the network.
+
+        Parameters
+        ----------
+        *inputs : array_like
+            One array per input of the plan, in the order of
+            ``plan['inputs']``, of the shapes given when creating the
+            executor.
+
+        Returns
+        -------
+        numpy.ndarray or list of numpy.ndarray
+            The output buffers, or the single output buffer if the plan has
+            a single output.
+        """
+        if len(inputs) != len(self.inputs):
+            raise ValueError("Expected %d inputs, got %d" %
+                             (len(self.inputs), len(inputs)))
+        for buffer, value in zip(self.inputs, inputs):
+            if np.shape(value) != buffer.shape:
+                raise ValueError("Expected an input of shape %r, got %r" %
+                                 (buffer.shape, np.shape(value)))
+            np.copyto(buffer, value, casting='same_kind')
+        for step in self._steps:
+            step()
+        return self.outputs[0] if len(self.outputs) == 1 else self.outputs
+
+
+# Nonlinearities, applied in place
+
+def _activation(spec, x):
+    """
+    Returns a function applying the nonlinearity `spec` to the array `x` in
+    place, with any temporary buffers it needs allocated upfront.
+    """
+    name, args = spec[0], spec[1:]
+    if name == 'linear':
+        return None
+    elif name == 'rectify':
+        return lambda: np.maximum(x, 0, out=x)
+    elif name == 'tanh':
+        return lambda: np.tanh(x, out=x)
+    elif name == 'softplus':
+        return lambda: np.logaddexp(x, 0, out=x)
+    elif name == 'sigmoid':
+        def sigmoid():
+            np.negative(x, out=x)
+            with np.errstate(over='ignore'):
+                np.exp(x, out=x)
+            np.add(x, 1, out=x)
+            np.reciprocal(x, out=x)
+        return sigmoid
+    elif name == 'softmax':
+        if x.ndim != 2:
+            raise ValueError("softmax needs a 2D input, got %dD" % x.ndim)
+        tmp = np.empty((x.shape[0], 1), x.dtype)
+
+        def softmax():
+            np.max(x, axis=1, keepdims=True, out=tmp)
+            np.subtract(x, tmp, out=x)
+            np.exp(x, out=x)
+            np.sum(x, axis=1, keepdims=True, out=tmp)
+            np.divide(x, tmp, out=x)
+        return softmax
+    elif name == 'leaky_rectify':
+        leakiness, = args
+        tmp = np.empty(x.shape, x.dtype)
+
+        def leaky_rectify():
+            np.multiply(x, leakiness, out=tmp)
+            if leakiness <= 1:
+                np.maximum(x, tmp, out=x)
+            else:
+                np.minimum(x, tmp, out=x)
+        return leaky_rectify
+    elif name == 'elu':
+        tmp = np.empty(x.shape, x.dtype)
+
+        def elu():
+            np.minimum(x, 0, out=tmp)
+            np.expm1(tmp, out=tmp)
+            np.maximum(x, 0, out=x)
+            np.add(x, tmp, out=x)
+        return elu
+    elif name == 'scaled_tanh':
+        scale_in, scale_out = args
+
+        def scaled_tanh():
+            np.multiply(x, scale_in, out=x)
+            np.tanh(x, out=x)
+            np.multiply(x, scale_out, out=x)
+        return scaled_tanh
+    raise NotImplementedError("Unsupported nonlinearity %r" % name)
+
+
+def _with_activation(steps, spec, x):
+    activation = _activation(spec, x)
+    if activation is not None:
+        steps.append(activation)
+    return steps
+
+
+# Builders: each returns the output buffer of an operation and the list of
+# functions computing it, given the input buffers (C-contiguous arrays).
+
+def _build_identity(inputs, params, attrs, dtype):
+    return inputs[0], []
+
+
+def _build_dense(inputs, params, attrs, dtype):
+    x, = inputs
+    W, b = params['W'], params.get('b')
+    leading = attrs['num_leading_axes']
+    if leading < 0:
+        leading += x.ndim
+    out = np.zeros(x.shape[:leading] + (W.shape[1],), dtype)
+    x2 = x.reshape(-1, W.shape[0])
+    out2 = out.reshape(-1, W.shape[1])
+    steps = [lambda: np.dot(x2, W, out=out2)]
+    if b is not None:
+        steps.append(lambda: np.add(out2, b, out=out2))
+    return out, _with_activation(steps, attrs['nonlinearity'], out)
+
+
+def _build_nin(inputs, params, attrs, dtype):
+    # a dot product over the channel axis: (batch, channels, rest) times
+    # (channels, units) into the transposed (batch, units, rest) output
+    x, = inputs
+    W, b = params['W'], params.get('b')
+    num_units = W.shape[1]
+    out = np.zeros((x.shape[0], num_units) + x.shape[2:], dtype)
+    x3 = x.reshape(x.shape[0], x.shape[1], -1)
+    out3 = out.reshape(x.shape[0], num_units, -1)
+    W_T = np.ascontiguousarray(W.T)
+    matmul = [(x3[n], out3[n]) for n in range(x.shape[0])]
+
+    def nin():
+        for x_n, out_n in matmul:
+            np.dot(W_T, x_n, out=out_n)
+    steps = [nin]
+    if b is not None:
+        b3 = b.reshape(1, -1, 1)
+        steps.append(lambda: np.add(out3, b3, out=out3))
+    return out, _with_activation(steps, attrs['nonlinearity'], out)
+
+
+def _padded(x, pad, value, dtype, extra=None):
+    """
+    Returns a buffer holding `x` with padding along its trailing axes, and
+    the functions copying `x` into it. The padding is filled with `value`
+    once, upfront.
+    """
+    extra = extra or [0] * len(pad)
+    if not any(pad) and not any(extra):
+        return x, []
+    spatial = x.shape[-len(pad):]
+    shape = x.shape[:-len(pad)] + tuple(s + 2 * p + e for s, p, e in
+                                        zip(spatial, pad, extra))
+    padded = np.full(shape, value, dtype)
+    interior = padded[(Ellipsis,) + tuple(slice(p, p + s) for s, p in
+                                          zip(spatial, pad))]
+    return padded, [lambda: np.copyto(interior, x)]
+
+
+def _build_conv(inputs, params, attrs, dtype):
+    x, = inputs
+    W, b = params['W'], params.get('b')
+    if x.ndim == 3:
+        # run 1D convolutions as 2D convolutions of height one
+        x4 = x.reshape(x.shape[0], x.shape[1], 1, x.shape[2])
+        W = W.reshape(W.shape[0], W.shape[1], 1, W.shape[2])
+        stride = [1] + attrs['stride']
+        pad = [0] + attrs['pad']
+    else:
+        x4 = x
+        stride = attrs['stride']
+        pad = attrs['pad']
+    num_groups = attrs['num_groups']
+    batch_size, channels = x4.shape[:2]
+    num_filters, group_channels, kh, kw = W.shape
+    group_filters = num_filters // num_groups
+    padded, steps = _padded(x4, pad, 0, dtype)
+    oh = (padded.shape[2] - kh) // stride[0] + 1
+    ow = (padded.shape[3] - kw) // stride[1] + 1
+    out = np.zeros((batch_size, num_filters) + (oh, ow)[4 - x.ndim:], dtype)
+    out4 = out.reshape(batch_size, num_filters, oh, ow)
+
+    # im2col: a strided view of all windows, copied into a column buffer
+    s = padded.strides
+    windows = as_strided(padded, (batch_size, oh, ow, channels, kh, kw),
+                         (s[0], s[2] * stride[0], s[3] * stride[1], s[1],
+                          s[2], s[3]))
+    groups = []
+    for g in range(num_groups):
+        cols = np.zeros((batch_size, oh, ow, group_channels, kh, kw), dtype)
+        result = np.zeros((batch_size * oh * ow, group_filters), dtype)
+        filters = slice(g * group_filters, (g + 1) * group_filters)
+        groups.append((
+            windows[..., g * group_channels:(g + 1) * group_channels, :, :],
+            cols, cols.reshape(result.shape[0], -1),
+            np.ascontiguousarray(W[filters].reshape(group_filters, -1).T),
+            result,
+            result.reshape(batch_size, oh, ow, group_filters).transpose(
+                0, 3, 1, 2),
+            out4[:, filters]))
+
+    def conv():
+        for window, cols, cols2, W_g, result, result4, out_g in groups:
+            np.copyto(cols, window)
+            np.dot(cols2, W_g, out=result)
+            np.copyto(out_g, result4)
+    steps.append(conv)
+    if b is not None:
+        b4 = b.reshape((num_filters,) + (1,) * 2 if b.ndim == 1 else
+                       (num_filters,) + out4.shape[2:])
+        steps.append(lambda: np.add(out4, b4, out=out4))
+    return out, _with_activation(steps, attrs['nonlinearity'], out)
+
+
+def _build_pool(inputs, params, attrs, dtype):
+    x, = inputs
+    if x.ndim == 3:
+        x4 = x.reshape(x.shape[0], x.shape[1], 1, x.shape[2])
+        pool_size = [1] + attrs['pool_size']
+        stride = [1] + attrs['stride']
+        pad = [0] + attrs['pad']
+    else:
+        x4 = x
+        pool_size = attrs['pool_size']
+        stride = attrs['stride']
+        pad = attrs['pad']
+    mode = attrs['mode']
+    size = [s + 2 * p for s, p in zip(x4.shape[2:], pad)]
+    if attrs['ignore_border']:
+        extra = [0, 0]
+        oh, ow = [(s - k) // st + 1
+                  for s, k, st in zip(size, pool_size, stride)]
+    else:
+        # partial windows at the end, as in theano.tensor.signal.pool
+        oh, ow = [(s + st - 1) // st if st >= k else
+                  max(0, (s - k + st - 1) // st) + 1
+                  for s, k, st in zip(size, pool_size, stride)]
+        extra = [max(0, (o - 1) * st + k - s) for o, k, st, s in
+                 zip((oh, ow), pool_size, stride, size)]
+    padded, steps = _padded(x4, pad, -np.inf if mode == 'max' else 0, dtype,
+                            extra)
+    out = np.zeros(x.shape[:2] + (oh, ow)[4 - x.ndim:], dtype)
+    out4 = out.reshape(x.shape[:2] + (oh, ow))
+    # one strided view per window offset, reduced elementwise
+    views = [padded[:, :, i:i + stride[0] * (oh - 1) + 1:stride[0],
+                    j:j + stride[1] * (ow - 1) + 1:stride[1]]
+             for i in range(pool_size[0]) for j in range(pool_size[1])]
+    reduce = np.maximum if mode == 'max' else np.add
+
+    def pool():
+        np.copyto(out4, views[0])
+        for view in views[1:]:
+            reduce(out4, view, out=out4)
+    steps.append(pool)
+    if mode == 'average_exc_pad':
+        counts = np.zeros((oh, ow), dtype)
+        ones = np.zeros(padded.shape[2:], dtype)
+        ones[pad[0]:pad[0] + x4.shape[2], pad[1]:pad[1] + x4.shape[3]] = 1
+        for i in range(pool_size[0]):
+            for j in range(pool_size[1]):
+                counts += ones[i:i + stride[0] * (oh - 1) + 1:stride[0],
+                               j:j + stride[1] * (ow - 1) + 1:stride[1]]
+        steps.append(lambda: np.divide(out4, counts, out=out4))
+    elif mode != 'max':
+        scale = 1. / (pool_size[0] * pool_size[1])
+        steps.append(lambda: np.multiply(out4, scale, out=out4))
+    return out, steps
+
+
+def _build_global_pool(inputs, params, attrs, dtype):
+    x, = inputs
+    function = {'mean': np.mean, 'max': np.max, 'min': np.min,
+                'sum': np.sum}[attrs['function']]
+    out = np.zeros(x.shape[:2], dtype)
+    x3 = x.reshape(x.shape[0], x.shape[1], -1)
+    return out, [lambda: function(x3, axis=2, out=out)]
+
+
+def _build_affine(inputs, params, attrs, dtype):
+    x, = inputs
+    scale, shift = params.get('scale'), params.get('shift')
+    out = np.zeros(x.shape, dtype)
+    if scale is not None:
+        steps = [lambda: np.multiply(x, scale, out=out)]
+        if shift is not None:
+            steps.append(lambda: np.add(out, shift, out=out))
+    elif shift is not None:
+        steps = [lambda: np.add(x, shift, out=out)]
+    else:
+        steps = [lambda: np.copyto(out, x)]
+    return out, steps
+
+
+def _build_nonlinearity(inputs, params, attrs, dtype):
+    x, = inputs
+    out = np.zeros(x.shape, dtype)
+    return out, _with_activation([lambda: np.copyto(out, x)],
+                                 attrs['nonlinearity'], out)
+
+
+def _build_embedding(inputs, params, attrs, dtype):
+    x, = inputs
+    W = params['W']
+    if x.dtype.kind not in 'iu':
+        raise ValueError("EmbeddingLayer needs an integer input, got %s" %
+                         x.dtype)
+    out = np.zeros(x.shape + W.shape[1:], dtype)
+    # mode='clip' avoids the temporary copy np.take makes for mode='raise'
+    return out, [lambda: np.take(W, x, axis=0, out=out, mode='clip')]
+
+
+def _build_concat(inputs, params, attrs, dtype):
+    axis = attrs['axis']
+    if axis < 0:
+        axis += inputs[0].ndim
+    shape = list(inputs[0].shape)
+    shape[axis] = sum(x.shape[axis] for x in inputs)
+    out = np.zeros(shape, dtype)
+    parts, start = [], 0
+    for x in inputs:
+        index = (slice(None),) * axis + (slice(start, start + x.shape[axis]),)
+        parts.append((out[index], x))
+        start += x.shape[axis]
+
+    def concat():
+        for part, x in parts:
+            np.copyto(part, x)
+    return out, [concat]
+
+
+def _build_elemwise(inputs, params, attrs, dtype):
+    function = getattr(np, attrs['function'])
+    coeffs = attrs['coeffs'] or [1] * len(inputs)
+    out = np.zeros(inputs[0].shape, dtype)
+    tmp = (np.zeros(out.shape, dtype) if any(c != 1 for c in coeffs[1:])
+           else None)
+    first, rest = (inputs[0], coeffs[0]), list(zip(inputs[1:], coeffs[1:]))
+
+    def elemwise():
+        x, coeff = first
+        if coeff != 1:
+            np.multiply(x, coeff, out=out)
+        else:
+            np.copyto(out, x)
+        for x, coeff in rest:
+            if coeff != 1:
+                np.multiply(x, coeff, out=tmp)
+                x = tmp
+            function(out, x, out=out)
+    return out, [elemwise]
+
+
+def _build_reshape(inputs, params, attrs, dtype):
+    x, = inputs
+    shape = [x.shape[s[0]] if isinstance(s, list) else s
+             for s in attrs['shape']]
+    return x.reshape(shape), []
+
+
+def _build_flatten(inputs, params, attrs, dtype):
+    x, = inputs
+    outdim = attrs['outdim']
+    return x.reshape(x.shape[:outdim - 1] + (-1,)), []
+
+
+def _build_dimshuffle(inputs, params, attrs, dtype):
+    x, = inputs
+    pattern = attrs['pattern']
+    kept = sorted(p for p in pattern if p != 'x')
+    # drop the collapsed (broadcastable) axes, then transpose
+    view = x.reshape([x.shape[d] for d in kept]).transpose(
+        [kept.index(p) for p in pattern if p != 'x'])
+    out = np.zeros([1 if p == 'x' else x.shape[p] for p in pattern], dtype)
+    out_view = out.reshape(view.shape)
+    return out, [lambda: np.copyto(out_view, view)]
+
+
+def _build_slice(inputs, params, attrs, dtype):
+    x, = inputs
+    axis = attrs['axis']
+    if axis < 0:
+        axis += x.ndim
+    indices = attrs['indices']
+    if isinstance(indices, list):
+        indices = slice(*indices)
+    view = x[(slice(None),) * axis + (indices,)]
+    out = np.zeros(view.shape, dtype)
+    return out, [lambda: np.copyto(out, view)]
+
+
+def _recurrent_buffers(inputs, params, attrs, num_gates, dtype):
+    # Computes the input projections of all time steps in a single dot
+    # product, and prepares the order of steps and the mask.
+    x = inputs[0]
+    batch_size, seq_len = x.shape[:2]
+    num_units = attrs['num_units']
+    x2 = x.reshape(batch_size * seq_len, -1)
+    projected = np.zeros((batch_size, seq_len, num_gates * num_units), dtype)
+    projected2 = projected.reshape(batch_size * seq_len, -1)
+    W_in, b = params['W_in'], params['b']
+    steps = [lambda: np.dot(x2, W_in, out=projected2),
+             lambda: np.add(projected2, b, out=projected2)]
+    order = range(seq_len)
+    if attrs['backwards']:
+        order = reversed(order)
+    order = list(order)
+    mask = None
+    if len(inputs) > 1:
+        mask = np.zeros((batch_size, seq_len, 1), bool)
+        mask_input = inputs[1]
+        steps.append(lambda: np.not_equal(mask_input, 0, out=mask[..., 0]))
+    if attrs['only_return_final']:
+        out = np.zeros((batch_size, num_units), dtype)
+    else:
+        out = np.zeros((batch_size, seq_len, num_units), dtype)
+    return projected, order, mask, out, steps
+
+
+def _gates(x, num_gates, num_units):
+    return [x[:, k * num_units:(k + 1) * num_units] for k in range(num_gates)]
+
+
+def _build_lstm(inputs, params, attrs, dtype):
+    projected, order, mask, out, steps = _recurrent_buffers(
+        inputs, params, attrs, 4, dtype)
+    batch_size = projected.shape[0]
+    num_units = attrs['num_units']
+    W_hid = params['W_hid']
+    peepholes = attrs['peepholes']
+    w_ci = params.get('W_cell_to_ingate')
+    w_cf = params.get('W_cell_to_forgetgate')
+    w_co = params.get('W_cell_to_outgate')
+    hid_init, cell_init = params['hid_init'], params['cell_init']
+    hid, cell, hid_new, cell_new, tmp = [
+        np.zeros((batch_size, num_units), dtype) for _ in range(5)]
+    gates = np.zeros((batch_size, 4 * num_units), dtype)
+    ingate, forgetgate, cell_input, outgate = _gates(gates, 4, num_units)
+    activations = [_activation(attrs['nonlinearity_' + name], gate)
+                   for name, gate in zip(('ingate', 'forgetgate', 'cell'),
+                                         (ingate, forgetgate, cell_input))]
+    activations = [a for a in activations if a is not None]
+    outgate_activation = _activation(attrs['nonlinearity_outgate'], outgate)
+    hid_activation = _activation(attrs['nonlinearity'], hid_new)
+    per_step = [(projected[:, t], True if mask is None else mask[:, t],
+                 out if attrs['only_return_final'] else out[:, t])
+                for t in order]
+
+    def lstm():
+        np.copyto(hid, hid_init)
+        np.copyto(cell, cell_init)
+        for projected_t, mask_t, out_t in per_step:
+            np.dot(hid, W_hid, out=gates)
+            np.add(gates, projected_t, out=gates)
+            if peepholes:
+                np.multiply(cell, w_ci, out=tmp)
+                np.add(ingate, tmp, out=ingate)
+                np.multiply(cell, w_cf, out=tmp)
+                np.add(forgetgate, tmp, out=forgetgate)
+            for activation in activations:
+                activation()
+            np.multiply(forgetgate, cell, out=cell_new)
+            np.multiply(ingate, cell_input, out=tmp)
+            np.add(cell_new, tmp, out=cell_new)
+            if peepholes:
+                np.multiply(cell_new, w_co, out=tmp)
+                np.add(outgate, tmp, out=outgate)
+            if outgate_activation is not None:
+                outgate_activation()
+            np.copyto(hid_new, cell_new)
+            if hid_activation is not None:
+                hid_activation()
+            np.multiply(hid_new, outgate, out=hid_new)
+            # keep the previous state where the mask is zero
+            np.copyto(cell, cell_new, where=mask_t)
+            np.copyto(hid, hid_new, where=mask_t)
+            if out_t is not out:
+                np.copyto(out_t, hid)
+        if out.ndim == 2:
+            np.copyto(out, hid)
+    steps.append(lstm)
+    return out, steps
+
+
+def _build_gru(inputs, params, attrs, dtype):
+    projected, order, mask, out, steps = _recurrent_buffers(
+        inputs, params, attrs, 3, dtype)
+    batch_size = projected.shape[0]
+    num_units = attrs['num_units']
+    W_hid, hid_init = params['W_hid'], params['hid_init']
+    hid, hid_new, resetgate, updategate, hidden_update = [
+        np.zeros((batch_size, num_units), dtype) for _ in range(5)]
+    hid_input = np.zeros((batch_size, 3 * num_units), dtype)
+    hid_r, hid_u, hid_c = _gates(hid_input, 3, num_units)
+    resetgate_activation = _activation(attrs['nonlinearity_resetgate'],
+                                       resetgate)
+    updategate_activation = _activation(attrs['nonlinearity_updategate'],
+                                        updategate)
+    hid_activation = _activation(attrs['nonlinearity_hid'], hidden_update)
+    per_step = [(_gates(projected[:, t], 3, num_units),
+                 True if mask is None else mask[:, t],
+                 out if attrs['only_return_final'] else out[:, t])
+                for t in order]
+
+    def gru():
+        np.copyto(hid, hid_init)
+        for (in_r, in_u, in_c), mask_t, out_t in per_step:
+            np.dot(hid, W_hid, out=hid_input)
+            np.add(hid_r, in_r, out=resetgate)
+            np.add(hid_u, in_u, out=updategate)
+            if resetgate_activation is not None:
+                resetgate_activation()
+            if updategate_activation is not None:
+                updategate_activation()
+            np.multiply(resetgate, hid_c, out=hidden_update)
+            np.add(hidden_update, in_c, out=hidden_update)
+            if hid_activation is not None:
+                hid_activation()
+            # (1 - u) * h + u * c  ==  h + u * (c - h)
+            np.subtract(hidden_update, hid, out=hidden_update)
+            np.multiply(hidden_update, updategate, out=hidden_update)
+            np.add(hid, hidden_update, out=hid_new)
+            np.copyto(hid, hid_new, where=mask_t)
+            if out_t is not out:
+                np.copyto(out_t, hid)
+        if out.ndim == 2:
+            np.copyto(out, hid)
+    steps.append(gru)
+    return out, steps
+
+
+_BUILDERS = {
+    'identity': _build_identity,
+    'dense': _build_dense,
+    'nin': _build_nin,
+    'conv': _build_conv,
+    'pool': _build_pool,
+    'global_pool': _build_global_pool,
+    'affine': _build_affine,
+    'nonlinearity': _build_nonlinearity,
+    'embedding': _build_embedding,
+    'concat': _build_concat,
+    'elemwise': _build_elemwise,
+    'reshape': _build_reshape,
+    'flatten': _build_flatten,
+    'dimshuffle': _build_dimshuffle,
+    'slice': _build_slice,
+    'lstm': _build_lstm,
+    'gru': _build_gru,
+}
@@ -0,0 +1,500 @@
+"""
+A server batching concurrent requests to a network for online inference.
+
+.. autosummary::
+    :nosignatures:
+
+    BatchingServer
+    Request
+
+A compiled network computes a batch of examples in little more time than a
+single example, so calling it once per request of an online service wastes
+most of its throughput. A :class:`BatchingServer` queues the requests of
+any number of threads (or asyncio tasks), and a worker thread coalesces them
+into batches: it waits for more requests until either the largest batch
+size is reached or the oldest request has waited for ``max_delay`` seconds.
+Each batch is padded to the smallest of a few fixed batch sizes, so the
+network only ever sees these shapes and the input buffers are allocated
+once. Each batch is computed in a single call, and the results are split up
+among its requests.
+
+The server keeps track of the latency of the requests (from submission to
+completion) and of how well the batches are filled, see
+:meth:`BatchingServer.stats`. A larger ``max_delay`` fills the batches better
+under light load, at the cost of latency.
+
+Examples
+--------
+>>> from lasagne.layers import InputLayer, DenseLayer, get_output
+>>> from lasagne.nonlinearities import softmax
+>>> from lasagne.serving import BatchingServer
+>>> from multiprocessing.pool import ThreadPool
+>>> import numpy as np
+>>> import theano
+>>> l_in = InputLayer((None, 20))
+>>> l_out = DenseLayer(l_in, num_units=5, nonlinearity=softmax)
+>>> examples = np.random.rand(100, 20).astype(theano.config.floatX)
+>>> with BatchingServer(l_out, batch_sizes=(1, 8, 32)) as server:
+...     results = ThreadPool(16).map(server.predict, examples)
+...     stats = server.stats()
+>>> results[0].shape
+(5,)
+>>> predict = theano.function([l_in.input_var],
+...                           get_output(l_out, deterministic=True))
+>>> np.allclose(results, predict(examples))
+True
+>>> stats['requests']
+100
+"""
+
+import bisect
+import collections
+import threading
+import timeit
+import warnings
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+import numpy as np
+import theano
+
+from .layers import Layer, InputLayer, get_all_layers, get_output
+
+
+__all__ = [
+    "BatchingServer",
+    "Request",
+]
+
+
+class Request(object):
+    """
+    The pending result of a request to a :class:`BatchingServer`.
+
+    Requests are returned by :meth:`BatchingServer.submit`, they are not
+    created directly.
+
+    Attributes
+    ----------
+    inputs : list of numpy arrays
+        The example given for each input of the network.
+    submitted : float
+        The time the request was submitted, as given by
+        :func:`timeit.default_timer`.
+    completed : float or None
+        The time its result was available, or None if it is pending.
+    """
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.submitted = timeit.default_timer()
+        self.completed = None
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+
+    def done(self):
+        """
+        Returns whether the result is available.
+        """
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Waits for the result and returns it.
+
+        Parameters
+        ----------
+        timeout : float or None
+            The number of seconds to wait at most, or None to wait for as
+            long as it takes.
+
+        Returns
+        -------
+        numpy array or list of numpy arrays
+            The output of the network for the example, without the batch
+            axis, or a list of them for a network with several outputs.
+
+        Raises
+        ------
+        RuntimeError
+            If the result is not available after `timeout` seconds.
+        Exception
+            Any exception raised by the network for the batch of the
+            request.
+        """
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Waits for the result and returns the exception raised by the network
+        for the batch of the request, or None.
+
+        Raises
+        ------
+        RuntimeError
+            If the result is not available after `timeout` seconds.
+        """
+        if not self._event.wait(timeout):
+            raise RuntimeError("The request is still pending after %g "
+                               "seconds" % timeout)
+        return self._exception
+
+    def add_done_callback(self, callback):
+        """
+        Calls `callback` with the request once its result is available (at
+        once if it is already). The callback is called from the worker
+        thread of the server and should return quickly.
+        """
+        with self._lock:
+            if not self.done():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _set(self, completed, result=None, exception=None):
+        with self._lock:
+            self._result = result
+            self._exception = exception
+            self.completed = completed
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                # do not let a callback take down the worker thread
+                warnings.warn("Exception in a request callback: %r" % e)
+
+    @property
+    def latency(self):
+        """
+        The time in seconds from submission to completion, or None if the
+        request is pending.
+        """
+        if self.completed is None:
+            return None
+        return self.completed - self.submitted
+
+
+def _copy_to_future(request, future):
+    if future.cancelled():
+        return
+    if request._exception is not None:
+        future.set_exception(request._exception)
+    else:
+        future.set_result(request._result)
+
+
+class BatchingServer(object):
+    """
+    Serves a network, batching concurrent requests.
+
+    Parameters
+    ----------
+    layer : Layer, list of Layer, or callable
+        The output layer (or layers) of the network, whose deterministic
+        output is compiled into a Theano function. Alternatively, a callable
+        taking a batch for each input and returning the batch of outputs
+        (or a list of them), e.g., a compiled Theano function.
+    batch_sizes : sequence of int (default: (1, 4, 16, 64))
+        The batch sizes the network is called with; each batch is padded to
+        the smallest of them that holds all its requests. The largest one is
+        the maximum number of requests per batch.
+    max_delay : float (default: 0.005)
+        The maximum time in seconds a request waits for others to join its
+        batch. It does not include the time waiting for the previous batch
+        to be computed.
+    window : int (default: 10000)
+        The number of most recent requests (and batches) the statistics of
+        :meth:`stats` are computed over.
+
+    Notes
+    -----
+    The network is only called from the worker thread of the server, which
+    is started by :meth:`start` or when entering a ``with`` block, and
+    stopped by :meth:`stop` or when leaving it. Requests still queued when
+    stopping are computed first.
+
+    The examples of a request are copied into a padding buffer allocated
+    once per batch size; the padding rows of a batch hold earlier examples
+    and their outputs are discarded. The results are copies, independent
+    of any buffers of the network.
+
+    With a :class:`Layer`, the shapes and types of the examples are those
+    of the :class:`InputLayer` instances, which must only leave the batch
+    size unspecified. With a callable, they are taken from the first
+    request.
+    """
+    def __init__(self, layer, batch_sizes=(1, 4, 16, 64), max_delay=0.005,
+                 window=10000):
+        self.batch_sizes = sorted(set(int(size) for size in batch_sizes))
+        if not self.batch_sizes or self.batch_sizes[0] < 1:
+            raise ValueError("batch_sizes must be positive integers, got %r" %
+                             (batch_sizes,))
+        self.max_delay = max_delay
+        if isinstance(layer, (Layer, list, tuple)):
+            input_layers = [lay for lay in get_all_layers(layer)
+                            if isinstance(lay, InputLayer)]
+            self._examples = []
+            for input_layer in input_layers:
+                shape = input_layer.shape[1:]
+                if any(s is None for s in shape):
+                    raise ValueError("The input layers must have a fixed "
+                                     "shape except for the batch size, got "
+                                     "%r" % (input_layer.shape,))
+                self._examples.append((tuple(shape),
+                                       input_layer.input_var.dtype))
+            self.function = theano.function(
+                [input_layer.input_var for input_layer in input_layers],
+                get_output(layer, deterministic=True))
+        else:
+            self._examples = None
+            self.function = layer
+        self._queue = queue.Queue()
+        self._buffers = {}
+        self._thread = None
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=window)
+        self._batches = collections.deque(maxlen=window)
+        self.reset_stats()
+
+    @property
+    def running(self):
+        """
+        Whether the worker thread is running.
+        """
+        return self._thread is not None
+
+    def start(self):
+        """
+        Starts the worker thread.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve,
+                                                name="BatchingServer")
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        """
+        Computes the queued requests and stops the worker thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, *inputs):
+        """
+        Queues a request for a single example.
+
+        Parameters
+        ----------
+        *inputs : numpy arrays
+            The example for each input of the network, without the batch
+            axis.
+
+        Returns
+        -------
+        Request
+            The pending result.
+
+        Raises
+        ------
+        ValueError
+            If the number or shapes of the inputs do not match the network.
+        RuntimeError
+            If the server is not running.
+        """
+        with self._lock:
+            if self._examples is None:
+                self._examples = [(np.shape(x), np.asarray(x).dtype)
+                                  for x in inputs]
+            if len(inputs) != len(self._examples):
+                raise ValueError("Expected %d inputs, got %d" %
+                                 (len(self._examples), len(inputs)))
+            inputs = [np.asarray(x, dtype=dtype)
+                      for x, (shape, dtype) in zip(inputs, self._examples)]
+            for x, (shape, dtype) in zip(inputs, self._examples):
+                if x.shape != shape:
+                    raise ValueError("Expected an input of shape %r, got %r"
+                                     % (shape, x.shape))
+            if self._thread is None:
+                raise RuntimeError("The server is not running, call start() "
+                                   "first")
+            request = Request(inputs)
+            self._queue.put(request)
+        return request
+
+    def predict(self, *inputs):
+        """
+        Computes the output of the network for a single example, waiting for
+        the batch it is computed in.
+
+        Parameters
+        ----------
+        *inputs : numpy arrays
+            The example for each input of the network, without the batch
+            axis.
+
+        Returns
+        -------
+        numpy array or list of numpy arrays
+            The output of the network, without the batch axis, or a list of
+            them for a network with several outputs.
+        """
+        return self.submit(*inputs).result()
+
+    def predict_async(self, *inputs):
+        """
+        Computes the output of the network for a single example in an
+        asyncio event loop (Python 3.4 and later).
+
+        Must be called from the thread of the event loop.
+
+        Parameters
+        ----------
+        *inputs : numpy arrays
+            The example for each input of the network, without the batch
+            axis.
+
+        Returns
+        -------
+        asyncio.Future
+            A future for the result of :meth:`predict`.
+        """
+        import asyncio
+        loop = asyncio.get_event_loop()
+        future = asyncio.Future(loop=loop)
+        request = self.submit(*inputs)
+        request.add_done_callback(lambda request: loop.call_soon_threadsafe(
+            _copy_to_future, request, future))
+        return future
+
+    def _serve(self):
+        max_size = self.batch_sizes[-1]
+        stopping = False
+        while not stopping:
+            request = self._queue.get()
+            if request is None:
+                break
+            batch = [request]
+            deadline = request.submitted + self.max_delay
+            while len(batch) < max_size:
+                try:
+                    request = self._queue.get(
+                        timeout=max(deadline - timeit.default_timer(), 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._run(batch)
+
+    def _run(self, batch):
+        num = len(batch)
+        size = self.batch_sizes[bisect.bisect_left(self.batch_sizes, num)]
+        buffers = self._buffers.get(size)
+        if buffers is None:
+            buffers = self._buffers[size] = [
+                np.zeros((size,) + shape, dtype=dtype)
+                for shape, dtype in self._examples]
+        for i, request in enumerate(batch):
+            for buffer, x in zip(buffers, request.inputs):
+                buffer[i] = x
+
+        results = [None] * num
+        exception = None
+        try:
+            outputs = self.function(*buffers)
+            if isinstance(outputs, (list, tuple)):
+                results = [[np.array(output[i]) for output in outputs]
+                           for i in range(num)]
+            else:
+                results = [np.array(outputs[i]) for i in range(num)]
+        except Exception as e:
+            exception = e
+
+        completed = timeit.default_timer()
+        with self._lock:
+            self._num_requests += num
+            self._num_batches += 1
+            self._size_counts[size] += 1
+            self._latencies.extend(completed - request.submitted
+                                   for request in batch)
+            self._batches.append((num, size))
+        for request, result in zip(batch, results):
+            request._set(completed, result, exception)
+
+    def stats(self, percentiles=(50, 90, 99)):
+        """
+        Returns statistics of the requests served so far.
+
+        Parameters
+        ----------
+        percentiles : sequence of float (default: (50, 90, 99))
+            The percentiles of the latency to compute.
+
+        Returns
+        -------
+        dict
+            With the keys ``'requests'`` and ``'batches'`` (the numbers of
+            requests and batches computed), ``'batch_sizes'`` (a dictionary
+            mapping each batch size to the number of batches computed with
+            it), and, computed over the most recent `window` requests or
+            batches: ``'latency'`` (a dictionary mapping each percentile to
+            the latency in seconds, NaN before the first request),
+            ``'mean_latency'``, ``'mean_batch'`` (the mean number of
+            requests per batch), and ``'batch_fill'`` (the fraction of the
+            padded batches taken up by requests).
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            batches = np.array(self._batches).reshape(-1, 2)
+            stats = {'requests': self._num_requests,
+                     'batches': self._num_batches,
+                     'batch_sizes': dict((size, self._size_counts[size])
+                                         for size in self.batch_sizes)}
+        nan = float('nan')
+        if len(latencies):
+            stats['latency'] = dict(zip(percentiles, np.percentile(
+                latencies, percentiles).tolist()))
+            stats['mean_latency'] = float(latencies.mean())
+            stats['mean_batch'] = float(batches[:, 0].mean())
+            stats['batch_fill'] = float(batches[:, 0].sum() /
+                                        float(batches[:, 1].sum()))
+        else:
+            stats['latency'] = dict((q, nan) for q in percentiles)
+            stats['mean_latency'] = stats['mean_batch'] = nan
+            stats['batch_fill'] = nan
+        return stats
+
+    def reset_stats(self):
+        """
+        Resets the statistics returned by :meth:`stats`.
+        """
+        with self._lock:
+            self._num_requests = 0
+            self._num_batches = 0
+            self._size_counts = collections.Counter()
+            self._latencies.clear()
+            self._batches.clear()
@@ -110,12 +110,12 @@ def transposed_convNd(input, kernel, crop, stride=1, n=None, extend=None):
     return convNd(dilated_input, kernel, pad, stride=1, n=n)
 
 
-def dilated_convNd(input, kernel, pad, dilation=1, n=None):
+def dilated_convNd(input, kernel, pad, dilation=1, n=None, stride=1):
     if n is None:
         n = input.ndim - 2
     dilation = as_tuple(dilation, n, int)
     dilated_kernel = dilate(kernel, (1, 1) + dilation)
-    return convNd(input, dilated_kernel, pad, stride=1, n=n)
+    return convNd(input, dilated_kernel, pad, stride=stride, n=n)
 
 
 def convNd_test_sets(n):
@@ -230,6 +230,20 @@ def dilated_conv2d_test_sets():
             output = dilated_convNd(input, kernel_flip, 'valid', dilation, 2)
             yield _convert(input, kernel, output, {'dilation': dilation})
 
+    # padding, strides and flipped filters
+    for dilation, pad, stride in (((2, 3), 'same', 1), (4, 'full', 1),
+                                  (2, 1, 2), (4, (2, 1), (2, 3)),
+                                  (3, 'same', 2)):
+        input = np.random.random(input_shape)
+        kernel = np.random.random((16, 1, 3, 3))
+        for flip_filters in (False, True):
+            kernel_flip = kernel if flip_filters else kernel[:, :, ::-1, ::-1]
+            output = dilated_convNd(input, kernel_flip, pad, dilation, 2,
+                                    stride)
+            yield _convert(input, kernel, output,
+                           {'dilation': dilation, 'pad': pad,
+                            'stride': stride, 'flip_filters': flip_filters})
+
     # bias-less case
     input = np.random.random(input_shape)
     kernel = np.random.random((16, 1, 3, 3))
@@ -354,6 +368,71 @@ class TestConv1DLayer:
         assert "requires odd filter size" in exc.value.args[0]
 
 
+class TestCausalConv1DLayer:
+
+    @pytest.mark.parametrize('filter_size, dilation', [(1, 1), (2, 1),
+                                                       (3, 2), (2, 5)])
+    @pytest.mark.parametrize('flip_filters', [True, False])
+    def test_output(self, DummyInputLayer, filter_size, dilation,
+                    flip_filters):
+        from lasagne.layers import CausalConv1DLayer
+        input = floatX(np.random.random((2, 3, 12)))
+        kernel = floatX(np.random.random((4, 3, filter_size)))
+        layer = CausalConv1DLayer(DummyInputLayer((None, 3, None)), 4,
+                                  filter_size, dilation=dilation, W=kernel,
+                                  b=None, nonlinearity=None,
+                                  flip_filters=flip_filters)
+        assert layer.history_length == (filter_size - 1) * dilation
+        assert layer.output_shape == (None, 4, None)
+        # pad on the left and compute a valid dilated convolution
+        padded = np.pad(input, [(0, 0), (0, 0), (layer.history_length, 0)],
+                        mode='constant')
+        if not flip_filters:
+            kernel = kernel[:, :, ::-1]
+        expected = dilated_convNd(padded, kernel, 'valid', dilation, 1)
+        actual = layer.get_output_for(theano.shared(input)).eval()
+        assert actual.shape == (2, 4, 12)
+        assert np.allclose(actual, expected, atol=1e-5)
+
+        # causality: changing the future does not change the past
+        input[:, :, 7:] = 0
+        actual_masked = layer.get_output_for(theano.shared(input)).eval()
+        assert np.allclose(actual[:, :, :7], actual_masked[:, :, :7])
+
+    @pytest.mark.parametrize('filter_size, dilation', [(1, 1), (3, 2),
+                                                       (2, 5)])
+    def test_get_step_output_for(self, DummyInputLayer, filter_size,
+                                 dilation):
+        from lasagne.layers import CausalConv1DLayer
+        input = floatX(np.random.random((2, 3, 12)))
+        layer = CausalConv1DLayer(DummyInputLayer((None, 3, None)), 4,
+                                  filter_size, dilation=dilation,
+                                  b=lasagne.init.Normal())
+        expected = layer.get_output_for(theano.shared(input)).eval()
+        input_n = T.matrix()
+        buffer = T.tensor3()
+        position = T.lscalar()
+        step = theano.function([input_n, buffer, position],
+                               layer.get_step_output_for(input_n, buffer,
+                                                         position),
+                               on_unused_input='ignore')
+        state = floatX(np.zeros((2, 3, layer.history_length)))
+        for t in range(12):
+            output, state = step(input[:, :, t], state, t)
+            assert np.allclose(output, expected[:, :, t], atol=1e-5)
+
+    @pytest.mark.parametrize('kwargs', [dict(stride=2), dict(pad='same'),
+                                        dict(untie_biases=True),
+                                        dict(convolution=T.nnet.conv2d),
+                                        dict(num_groups=3)])
+    def test_unsupported_arguments(self, DummyInputLayer, kwargs):
+        from lasagne.layers import CausalConv1DLayer
+        with pytest.raises(TypeError) as exc:
+            CausalConv1DLayer(DummyInputLayer((None, 3, None)), 6, 2,
+                              **kwargs)
+        assert list(kwargs)[0] in exc.value.args[0]
+
+
 class TestConv2DLayerImplementations:
 
     @pytest.fixture(
@@ -612,7 +691,9 @@ class TestTransposedConv2DLayer:
 class TestDilatedConv2DLayer:
     @pytest.mark.parametrize(
         "input, kernel, output, kwargs", list(dilated_conv2d_test_sets()))
-    def test_defaults(self, DummyInputLayer, input, kernel, output, kwargs):
+    @pytest.mark.parametrize("space_to_batch", [False, True])
+    def test_defaults(self, DummyInputLayer, input, kernel, output, kwargs,
+                      space_to_batch):
         from lasagne.layers import DilatedConv2DLayer
         b, c, h, w = input.shape
         input_layer = DummyInputLayer((b, c, h, w))
@@ -621,6 +702,7 @@ class TestDilatedConv2DLayer:
                 num_filters=kernel.shape[0],
                 filter_size=kernel.shape[2:],
                 W=kernel.transpose(1, 0, 2, 3),
+                space_to_batch=space_to_batch,
                 **kwargs)
         actual = layer.get_output_for(theano.shared(input)).eval()
         assert actual.shape == output.shape
@@ -646,16 +728,162 @@ class TestDilatedConv2DLayer:
         assert actual.shape == output.shape
         assert np.allclose(actual, output)
 
+    def test_with_nones_space_to_batch(self, DummyInputLayer):
+        from lasagne.layers import DilatedConv2DLayer
+        input = floatX(np.random.random((3, 2, 13, 10)))
+        kernel = floatX(np.random.random((2, 4, 3, 3)))
+        layers = [DilatedConv2DLayer(DummyInputLayer(shape), 4, 3,
+                                     dilation=3, pad='same', stride=2,
+                                     W=kernel, space_to_batch=True)
+                  for shape in ((None, 2, None, None), (3, 2, 13, 10))]
+        assert layers[0].output_shape == (None, 4, None, None)
+        assert layers[1].output_shape == (3, 4, 7, 5)
+        actual = [layer.get_output_for(input).eval() for layer in layers]
+        assert np.allclose(actual[0], actual[1])
+
+    def test_space_to_batch_auto(self, DummyInputLayer):
+        from lasagne.layers import DilatedConv2DLayer
+        from lasagne.theano_extensions.conv import conv2d_winograd
+        input_layer = DummyInputLayer((2, 3, 16, 16))
+        layer = DilatedConv2DLayer(input_layer, 4, 3, dilation=4)
+        assert not layer.space_to_batch
+        layer_fast = DilatedConv2DLayer(input_layer, 4, 3, dilation=4,
+                                        W=layer.W,
+                                        convolution=conv2d_winograd)
+        assert layer_fast.space_to_batch
+        input = floatX(np.random.random((2, 3, 16, 16)))
+        assert np.allclose(layer.get_output_for(input).eval(),
+                           layer_fast.get_output_for(input).eval(),
+                           atol=1e-5)
+
     def test_unsupported_settings(self, DummyInputLayer):
         from lasagne.layers import DilatedConv2DLayer
         input_layer = DummyInputLayer((10, 20, 30, 40))
-        for pad in 'same', 'full', 1:
-            with pytest.raises(NotImplementedError) as exc:
-                DilatedConv2DLayer(input_layer, 2, 3, pad=pad)
-            assert "requires pad=0" in exc.value.args[0]
         with pytest.raises(NotImplementedError) as exc:
-            DilatedConv2DLayer(input_layer, 2, 3, flip_filters=True)
-        assert "requires flip_filters=False" in exc.value.args[0]
+            DilatedConv2DLayer(input_layer, 2, 4, pad='same')
+        assert "requires odd filter size" in exc.value.args[0]
+
+
+class TestGroupedConvLayers:
+    def grouped_convNd(self, input, kernel, num_groups, **kwargs):
+        # slice + convolve + concatenate
+        c = input.shape[1] // num_groups
+        f = kernel.shape[0] // num_groups
+        return np.concatenate([convNd(input[:, g * c:(g + 1) * c],
+                                      kernel[g * f:(g + 1) * f], **kwargs)
+                               for g in range(num_groups)], axis=1)
+
+    @pytest.mark.parametrize('n', [1, 2])
+    @pytest.mark.parametrize('num_groups, num_filters', [(2, 4), (3, 6),
+                                                         (6, 6), (6, 12)])
+    @pytest.mark.parametrize('pad, stride', [(0, 1), ('same', 2),
+                                             ('full', 1)])
+    def test_output(self, DummyInputLayer, n, num_groups, num_filters, pad,
+                    stride):
+        from lasagne.layers import Conv1DLayer, Conv2DLayer
+        Layer = Conv1DLayer if n == 1 else Conv2DLayer
+        input = floatX(np.random.random((2, 6) + (9, 8)[:n]))
+        kernel = floatX(np.random.random((num_filters, 6 // num_groups) +
+                                         (3, 3)[:n]))
+        layer = Layer(DummyInputLayer((None, 6) + (None,) * n), num_filters,
+                      3, stride=stride, pad=pad, W=kernel, b=None,
+                      nonlinearity=None, num_groups=num_groups)
+        assert layer.get_W_shape() == kernel.shape
+        expected = self.grouped_convNd(input, kernel, num_groups, pad=pad,
+                                       stride=stride)
+        actual = layer.get_output_for(theano.shared(input)).eval()
+        assert np.allclose(actual, expected, atol=1e-5)
+
+    def test_num_params(self, DummyInputLayer):
+        from lasagne.layers import Conv2DLayer, count_params
+        input_layer = DummyInputLayer((None, 32, 8, 8))
+        layer = Conv2DLayer(input_layer, 64, 3, num_groups=4)
+        assert layer.W.get_value().shape == (64, 8, 3, 3)
+        assert count_params(layer) == 64 * 8 * 9 + 64
+
+    def test_custom_convolution(self, DummyInputLayer):
+        from lasagne.layers import Conv2DLayer
+        from lasagne.theano_extensions.conv import conv2d_grouped
+        calls = []
+
+        def convolution(*args, **kwargs):
+            calls.append(kwargs)
+            return conv2d_grouped(*args, **kwargs)
+        input_layer = DummyInputLayer((None, 4, 8, 8))
+        layer = Conv2DLayer(input_layer, 2, 3, convolution=convolution)
+        layer.get_output_for(T.tensor4())
+        assert 'num_groups' not in calls[-1]
+        layer = Conv2DLayer(input_layer, 2, 3, convolution=convolution,
+                            num_groups=2)
+        layer.get_output_for(T.tensor4())
+        assert calls[-1]['num_groups'] == 2
+        # the default convolution is replaced for more than one group
+        layer = Conv2DLayer(input_layer, 2, 3, num_groups=2)
+        assert layer.convolution is conv2d_grouped
+
+    def test_invalid_num_groups(self, DummyInputLayer):
+        from lasagne.layers import Conv2DLayer
+        input_layer = DummyInputLayer((None, 6, 8, 8))
+        with pytest.raises(ValueError) as exc:
+            Conv2DLayer(input_layer, 6, 3, num_groups=0)
+        assert "must be positive" in exc.value.args[0]
+        with pytest.raises(ValueError) as exc:
+            Conv2DLayer(input_layer, 6, 3, num_groups=4)
+        assert "input channels" in exc.value.args[0]
+        with pytest.raises(ValueError) as exc:
+            Conv2DLayer(input_layer, 4, 3, num_groups=3)
+        assert "num_filters" in exc.value.args[0]
+
+
+class TestDepthwiseSeparableConv2DLayer:
+    @pytest.mark.parametrize('depth_multiplier', [1, 2])
+    @pytest.mark.parametrize('pad, stride, flip_filters', [
+        (0, 1, True), ('same', 2, True), ('full', (1, 2), False)])
+    def test_output(self, DummyInputLayer, depth_multiplier, pad, stride,
+                    flip_filters):
+        from lasagne.layers import DepthwiseSeparableConv2DLayer
+        input = floatX(np.random.random((2, 3, 9, 8)))
+        depthwise = floatX(np.random.random((3 * depth_multiplier, 1, 3, 3)))
+        pointwise = floatX(np.random.random((5, 3 * depth_multiplier, 1, 1)))
+        b = floatX(np.random.random(5))
+        layer = DepthwiseSeparableConv2DLayer(
+            DummyInputLayer((None, 3, 9, 8)), 5, 3, stride=stride, pad=pad,
+            depth_multiplier=depth_multiplier, W=depthwise,
+            W_pointwise=pointwise, b=b, nonlinearity=None,
+            flip_filters=flip_filters)
+        if not flip_filters:
+            depthwise = depthwise[:, :, ::-1, ::-1]
+        # convolve each (repeated) input channel with its filter
+        expected = np.concatenate([
+            convNd(np.repeat(input, depth_multiplier, axis=1)[:, i:i + 1],
+                   depthwise[i:i + 1], pad=pad, stride=stride)
+            for i in range(3 * depth_multiplier)], axis=1)
+        expected = (np.einsum('bchw,fc->bfhw', expected, pointwise[:, :, 0, 0])
+                    + b[:, np.newaxis, np.newaxis])
+        actual = layer.get_output_for(theano.shared(input)).eval()
+        assert actual.shape == expected.shape
+        assert layer.output_shape[1:] == expected.shape[1:]
+        assert np.allclose(actual, expected, atol=1e-5)
+
+    def test_params(self, DummyInputLayer):
+        from lasagne.layers import (DepthwiseSeparableConv2DLayer,
+                                    Conv2DLayer, count_params)
+        input_layer = DummyInputLayer((None, 64, 8, 8))
+        layer = DepthwiseSeparableConv2DLayer(input_layer, 128, 3)
+        assert layer.W.get_value().shape == (64, 1, 3, 3)
+        assert layer.W_pointwise.get_value().shape == (128, 64, 1, 1)
+        assert layer.get_params() == [layer.W, layer.b, layer.W_pointwise]
+        assert layer.get_params(regularizable=True) == [layer.W,
+                                                        layer.W_pointwise]
+        dense = Conv2DLayer(input_layer, 128, 3)
+        assert count_params(dense) > 8 * count_params(layer)
+
+    def test_unknown_channels(self, DummyInputLayer):
+        from lasagne.layers import DepthwiseSeparableConv2DLayer
+        with pytest.raises(ValueError) as exc:
+            DepthwiseSeparableConv2DLayer(DummyInputLayer((None, None, 8, 8)),
+                                          4, 3)
+        assert "number of input channels" in exc.value.args[0]
 
 
 class TestConv2DDNNLayer:
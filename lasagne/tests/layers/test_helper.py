@@ -751,6 +751,93 @@ class TestCountParams:
         assert count_params(l3) == num_weights + num_biases
 
 
+class TestModelSummary:
+    def test_dense(self):
+        from lasagne.layers import InputLayer, DenseLayer, model_summary
+        l1 = InputLayer((None, 20))
+        l2 = DenseLayer(l1, 30)
+        l3 = DenseLayer(l2, 40, b=None, nonlinearity=None)
+        summary = model_summary(l3, batch_size=8, dtype='float32')
+        # parameters are floatX, activations float32 as requested
+        p = numpy.dtype(theano.config.floatX).itemsize
+        assert [row['layer'] for row in summary] == [l1, l2, l3]
+        assert [row['name'] for row in summary] == [
+            'InputLayer', 'DenseLayer', 'DenseLayer']
+        assert [row['output_shape'] for row in summary] == [
+            (8, 20), (8, 30), (8, 40)]
+        assert [row['params'] for row in summary] == [0, 20 * 30 + 30,
+                                                      30 * 40]
+        assert summary[1]['param_bytes'] == p * (20 * 30 + 30)
+        assert [row['flops'] for row in summary] == [
+            0, 8 * (2 * 20 * 30 + 2 * 30), 8 * 2 * 30 * 40]
+        assert [row['forward_bytes'] for row in summary] == [
+            4 * 8 * 20, 4 * 8 * 30, 4 * 8 * 40]
+        assert [row['backward_bytes'] for row in summary] == [
+            0, 4 * 8 * 20 + p * (20 * 30 + 30), 4 * 8 * 30 + p * 30 * 40]
+
+    def test_parameter_expressions(self):
+        from lasagne.layers import (InputLayer, DenseLayer, NINLayer,
+                                    model_summary)
+        l1 = InputLayer((None, 4, 3))
+        W1 = theano.shared(numpy.ones((4, 5), dtype=theano.config.floatX))
+        W2 = theano.shared(numpy.ones((15, 6), dtype=theano.config.floatX))
+        l2 = NINLayer(l1, 5, W=W1 * 2, b=None)
+        l3 = DenseLayer(l2, 6, W=W2 * 2, b=None, nonlinearity=None)
+        summary = model_summary(l3, batch_size=2)
+        # the shared variables of the expressions are counted
+        assert [row['params'] for row in summary] == [0, 4 * 5, 15 * 6]
+        assert [row['flops'] for row in summary] == [
+            0, 2 * 5 * 3 * (2 * 4 + 1), 2 * 2 * 15 * 6]
+
+    def test_conv_and_pool(self):
+        from lasagne.layers import (InputLayer, Conv2DLayer, MaxPool2DLayer,
+                                    TransposedConv2DLayer, model_summary)
+        l1 = InputLayer((None, 3, 16, 16))
+        l2 = Conv2DLayer(l1, 8, 3, pad='same', num_groups=1)
+        l3 = MaxPool2DLayer(l2, 2)
+        l4 = Conv2DLayer(l3, 4, 3, num_groups=2, b=None, nonlinearity=None)
+        l5 = TransposedConv2DLayer(l4, 2, 2, stride=2, b=None,
+                                   nonlinearity=None)
+        flops = [row['flops'] for row in model_summary(l5, batch_size=2)]
+        assert flops == [0,
+                         2 * 8 * 16 * 16 * (2 * 3 * 3 * 3 + 2),
+                         2 * 8 * 8 * 8 * 4,
+                         2 * 4 * 6 * 6 * 2 * 4 * 3 * 3,
+                         2 * 2 * 4 * 6 * 6 * 2 * 2 * 2]
+
+    def test_recurrent(self):
+        from lasagne.layers import InputLayer, LSTMLayer, model_summary
+        l1 = InputLayer((None, None, 5))
+        l2 = LSTMLayer(l1, 7)
+        summary = model_summary(l2, batch_size=3)
+        assert summary[1]['flops'] is None
+        assert summary[1]['forward_bytes'] is None
+        summary = model_summary(l2, batch_size=3,
+                                input_shapes={l1: (None, 11, 5)})
+        steps = 3 * 11
+        assert summary[1]['output_shape'] == (3, 11, 7)
+        assert summary[1]['flops'] == (steps * 2 * 5 * 4 * 7 +
+                                       steps * 2 * 7 * 4 * 7 +
+                                       steps * 7 * 10)
+        itemsize = numpy.dtype(theano.config.floatX).itemsize
+        assert summary[1]['forward_bytes'] == itemsize * steps * 7 * 7
+
+    def test_unknown_layer(self):
+        from lasagne.layers import (InputLayer, ExpressionLayer,
+                                    model_summary, format_model_summary)
+        l1 = InputLayer((None, 20))
+        l2 = ExpressionLayer(l1, lambda x: 2 * x, name='double')
+        summary = model_summary(l2)
+        assert summary[1]['name'] == 'double'
+        assert summary[1]['flops'] is None
+        table = format_model_summary(summary).splitlines()
+        assert len(table) == 4
+        assert table[0].split() == ['name', 'output_shape', 'params',
+                                    'flops', 'param_bytes', 'forward_bytes',
+                                    'backward_bytes']
+        assert table[-1].split()[:3] == ['total', '0', '?']
+
+
 class TestGetAllParamValues:
     def test_get_all_param_values(self):
         from lasagne.layers import (InputLayer, DenseLayer,
@@ -97,6 +97,29 @@ class TestDropoutLayer:
         set_rng(rng)  # reset to original RNG for other tests
         assert numpy.allclose(result_eval1, result_eval2)
 
+    def test_lazy_random_streams(self, layer):
+        from theano.sandbox.rng_mrg import MRG_RandomStreams
+        assert '_srng' not in vars(layer)
+        layer.get_output_for(theano.tensor.matrix(), deterministic=True)
+        assert '_srng' not in vars(layer)
+        srng = layer._srng
+        assert isinstance(srng, MRG_RandomStreams)
+        assert layer._srng is srng
+        layer._srng = MRG_RandomStreams(42)
+        assert layer._srng is not srng
+
+
+def test_import_does_not_probe_gpu():
+    # importing Theano's random streams probes the GPU backends, so it
+    # should wait until a noise layer needs them
+    import subprocess
+    import sys
+    code = ("import sys, lasagne; "
+            "lasagne.layers.DropoutLayer((None, 10)); "
+            "print('theano.sandbox.rng_mrg' in sys.modules)")
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().split()[-1] == 'False'
+
 
 def test_dropout_convenience_functions():
     from lasagne.layers.noise import (dropout_channels, spatial_dropout,
@@ -128,6 +128,22 @@ def upscale_2d_dilate(data, scale_factor):
     return upscaled
 
 
+def upscale_2d_bilinear(data, scale_factor):
+    upscaled = data
+    for axis, factor in zip((2, 3), scale_factor):
+        length = upscaled.shape[axis]
+        coords = (np.arange(length * factor) + 0.5) / factor - 0.5
+        coords = np.clip(coords, 0, length - 1)
+        lower = np.floor(coords).astype('int64')
+        upper = np.minimum(lower + 1, length - 1)
+        shape = [1] * data.ndim
+        shape[axis] = -1
+        weight = (coords - lower).reshape(shape)
+        upscaled = (np.take(upscaled, lower, axis) * (1 - weight) +
+                    np.take(upscaled, upper, axis) * weight)
+    return upscaled
+
+
 def upscale_3d_shape(shape, scale_factor):
     return (shape[0], shape[1],
             shape[2] * scale_factor[0], shape[3] * scale_factor[1],
@@ -793,7 +809,7 @@ class TestUpscale2DLayer:
                 yield scale_factor
 
     def mode_test_sets():
-        for mode in ['repeat', 'dilate']:
+        for mode in ['repeat', 'dilate', 'bilinear']:
             yield mode
 
     def input_layer(self, output_shape):
@@ -849,10 +865,54 @@ class TestUpscale2DLayer:
         elif mode == 'dilate':
             numpy_result = upscale_2d_dilate(input, (scale_factor,
                                                      scale_factor))
+        elif mode == 'bilinear':
+            numpy_result = upscale_2d_bilinear(input, (scale_factor,
+                                                       scale_factor))
 
         assert np.all(numpy_result.shape == result_eval.shape)
         assert np.allclose(result_eval, numpy_result)
 
+    @pytest.mark.parametrize(
+        "mode", list(mode_test_sets()))
+    def test_get_output_for_symbolic_shape(self, mode):
+        input = floatX(np.random.randn(2, 3, 5, 4))
+        input_var = theano.tensor.tensor4()
+        layer = self.layer(self.input_layer((None, None, None, None)),
+                           (3, 2), mode)
+        fn = theano.function([input_var], layer.get_output_for(input_var))
+        result = fn(input)
+        if mode == 'repeat':
+            numpy_result = upscale_2d(input, (3, 2))
+        elif mode == 'dilate':
+            numpy_result = upscale_2d_dilate(input, (3, 2))
+        elif mode == 'bilinear':
+            numpy_result = upscale_2d_bilinear(input, (3, 2))
+        assert np.allclose(result, numpy_result)
+
+    def test_bilinear_interpolates_linear_ramp(self):
+        # away from the borders, a linear ramp is interpolated exactly
+        input = floatX(np.arange(6).reshape(1, 1, 1, 6))
+        layer = self.layer(self.input_layer(input.shape), (1, 2), 'bilinear')
+        result = layer.get_output_for(theano.shared(input)).eval()
+        assert np.allclose(result[..., 1:-1],
+                           np.arange(0.25, 4.9, 0.5))
+        assert np.allclose(result[..., [0, -1]], [0, 5])
+
+    def test_bilinear_single_element(self):
+        input = floatX(np.random.randn(2, 3, 1, 2))
+        layer = self.layer(self.input_layer(input.shape), 3, 'bilinear')
+        result = layer.get_output_for(theano.shared(input)).eval()
+        assert np.allclose(result, upscale_2d_bilinear(input, (3, 3)))
+
+    def test_repeat_gradient(self):
+        input = theano.shared(floatX(np.random.randn(2, 3, 4, 5)))
+        layer = self.layer(self.input_layer((2, 3, 4, 5)), (2, 3), 'repeat')
+        output = layer.get_output_for(input)
+        weights = floatX(np.random.randn(2, 3, 8, 15))
+        grad = theano.grad((output * weights).sum(), input).eval()
+        assert np.allclose(grad,
+                           weights.reshape(2, 3, 4, 2, 5, 3).sum(axis=(3, 5)))
+
     @pytest.mark.parametrize(
         "input_shape,output_shape",
         [((32, 64, 24, 24), (32, 64, 48, 48)),
@@ -1078,3 +1138,144 @@ class TestSpatialPyramidPoolingDNNLayer:
         with pytest.raises(ValueError) as exc:
             SpatialPyramidPoolingDNNLayer((10, 20, 30, 40, 50))
         assert "Expected 4 input dimensions" in exc.value.args[0]
+
+
+class TestSpatialPyramidPoolingLayer:
+    def pool_dims_test_sets():
+        for pyramid_level in [2, 3, 4]:
+            pool_dims = list(range(1, pyramid_level))
+            yield pool_dims
+
+    def input_layer(self, output_shape):
+        return Mock(output_shape=output_shape)
+
+    def layer(self, input_layer, pool_dims, mode='max'):
+        from lasagne.layers.pool import SpatialPyramidPoolingLayer
+        return SpatialPyramidPoolingLayer(input_layer, pool_dims=pool_dims,
+                                          mode=mode)
+
+    @pytest.mark.parametrize(
+        "pool_dims", list(pool_dims_test_sets()))
+    @pytest.mark.parametrize(
+        "input_shape", [(8, 16, 17, 13), (None, None, None, None)])
+    def test_get_output_for(self, pool_dims, input_shape):
+        input = floatX(np.random.randn(8, 16, 17, 13))
+        input_layer = self.input_layer(input_shape)
+        input_theano = theano.shared(input)
+        layer = self.layer(input_layer, pool_dims)
+
+        result = layer.get_output_for(input_theano)
+
+        result_eval = result.eval()
+        numpy_result = spatial_pool(input, pool_dims)
+
+        assert result_eval.shape == numpy_result.shape
+        assert np.allclose(result_eval, numpy_result)
+        assert result_eval.shape[2] == layer.output_shape[2]
+
+    def test_get_output_for_average(self):
+        input = floatX(np.random.randn(2, 3, 8, 12))
+        layer = self.layer(self.input_layer(input.shape), [4, 2, 1],
+                           mode='average_inc_pad')
+        result = layer.get_output_for(theano.shared(input)).eval()
+        assert np.allclose(result[:, :, -1], input.mean(axis=(2, 3)))
+        assert np.allclose(result[:, :, 16:20].reshape(2, 3, 2, 2),
+                           input.reshape(2, 3, 2, 4, 2, 6).mean(axis=(3, 5)))
+
+    @pytest.mark.parametrize(
+        "input_shape,output_shape",
+        [((32, 64, 24, 24), (32, 64, 21)),
+         ((None, 64, 23, 25), (None, 64, 21)),
+         ((32, None, 22, 26), (32, None, 21)),
+         ((None, None, None, None), (None, None, 21))],
+    )
+    def test_get_output_shape_for(self, input_shape, output_shape):
+        input_layer = self.input_layer(input_shape)
+        layer = self.layer(input_layer, pool_dims=[1, 2, 4])
+        assert layer.get_output_shape_for(input_shape) == output_shape
+
+    def test_fail_on_mismatching_dimensionality(self):
+        from lasagne.layers.pool import SpatialPyramidPoolingLayer
+        with pytest.raises(ValueError) as exc:
+            SpatialPyramidPoolingLayer((10, 20, 30))
+        assert "Expected 4 input dimensions" in exc.value.args[0]
+        with pytest.raises(ValueError) as exc:
+            SpatialPyramidPoolingLayer((10, 20, 30, 40, 50))
+        assert "Expected 4 input dimensions" in exc.value.args[0]
+
+
+def adaptive_pool_2d(data, output_size, mode):
+    reduce = np.max if mode == 'max' else np.mean
+    result = np.zeros(data.shape[:2] + output_size)
+    rows, cols = data.shape[2:]
+    for i in range(output_size[0]):
+        r0 = i * rows // output_size[0]
+        r1 = -(-(i + 1) * rows // output_size[0])
+        for j in range(output_size[1]):
+            c0 = j * cols // output_size[1]
+            c1 = -(-(j + 1) * cols // output_size[1])
+            result[:, :, i, j] = reduce(data[:, :, r0:r1, c0:c1],
+                                        axis=(2, 3))
+    return result
+
+
+class TestAdaptivePool2DLayer:
+    @pytest.fixture
+    def AdaptivePool2DLayer(self):
+        from lasagne.layers.pool import AdaptivePool2DLayer
+        return AdaptivePool2DLayer
+
+    @pytest.mark.parametrize(
+        "data_shape", [(2, 3, 8, 12), (2, 3, 17, 13), (2, 3, 3, 2)])
+    @pytest.mark.parametrize("output_size", [(4, 2), (3, 5), (1, 1)])
+    @pytest.mark.parametrize(
+        "mode", ['max', 'average_inc_pad', 'average_exc_pad'])
+    @pytest.mark.parametrize("known_shape", [True, False])
+    def test_get_output_for(self, AdaptivePool2DLayer, data_shape,
+                            output_size, mode, known_shape):
+        input = floatX(np.random.randn(*data_shape))
+        input_shape = data_shape if known_shape else (None,) * 4
+        layer = AdaptivePool2DLayer(input_shape, output_size, mode=mode)
+
+        result = layer.get_output_for(theano.shared(input)).eval()
+        numpy_result = adaptive_pool_2d(input, output_size, mode)
+
+        assert result.shape == numpy_result.shape
+        assert np.allclose(result, numpy_result, atol=1e-6)
+
+    def test_get_output_for_symbolic(self, AdaptivePool2DLayer):
+        input_var = theano.tensor.tensor4()
+        layer = AdaptivePool2DLayer((None, 3, None, None), 3)
+        fn = theano.function([input_var], layer.get_output_for(input_var))
+        for shape in [(2, 3, 7, 7), (1, 3, 4, 11)]:
+            input = floatX(np.random.randn(*shape))
+            assert np.allclose(fn(input),
+                               adaptive_pool_2d(input, (3, 3), 'max'))
+
+    def test_gradient(self, AdaptivePool2DLayer):
+        input = theano.shared(floatX(np.random.randn(2, 3, 7, 5)))
+        for mode in ['max', 'average_exc_pad']:
+            layer = AdaptivePool2DLayer((None, 3, None, None), (3, 2),
+                                        mode=mode)
+            grad = theano.grad(layer.get_output_for(input).sum(), input)
+            assert grad.eval().shape == (2, 3, 7, 5)
+
+    @pytest.mark.parametrize(
+        "input_shape,output_size,output_shape",
+        [((32, 64, 24, 24), 3, (32, 64, 3, 3)),
+         ((None, 64, 23, 25), (2, 4), (None, 64, 2, 4)),
+         ((None, None, None, None), (5, 1), (None, None, 5, 1))],
+    )
+    def test_get_output_shape_for(self, AdaptivePool2DLayer, input_shape,
+                                  output_size, output_shape):
+        layer = AdaptivePool2DLayer(input_shape, output_size)
+        assert layer.get_output_shape_for(input_shape) == output_shape
+        assert layer.output_shape == output_shape
+
+    def test_fail_on_invalid_arguments(self, AdaptivePool2DLayer):
+        with pytest.raises(ValueError) as exc:
+            AdaptivePool2DLayer((10, 20, 30), 2)
+        assert "Expected 4 input dimensions" in exc.value.args[0]
+        with pytest.raises(ValueError) as exc:
+            AdaptivePool2DLayer((10, 20, 30, 40), 2, mode='sum')
+        assert "Unsupported pooling mode" in exc.value.args[0]
@@ -0,0 +1,173 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+from lasagne.layers import (InputLayer, NINLayer, Conv2DLayer,
+                            QuantizedDenseLayer, QuantizedNINLayer,
+                            QuantizedConv2DLayer, get_output)
+
+
+floatX = theano.config.floatX
+
+
+def quantized_params(W_shape, num_units, b_shape, seed=0):
+    rng = np.random.RandomState(seed)
+    W = rng.randint(-127, 128, W_shape).astype('int8')
+    W_scale = rng.uniform(0.01, 0.02, num_units).astype(floatX)
+    b = rng.randint(-1000, 1000, b_shape).astype('int32')
+    return W, W_scale, b
+
+
+def quantized_input(shape, input_scale, seed=1):
+    # values whose quantization is unambiguous (no ties when rounding)
+    rng = np.random.RandomState(seed)
+    q = rng.randint(-127, 128, shape)
+    x = (q + rng.uniform(-0.4, 0.4, shape)) * input_scale
+    return x.astype(floatX), q
+
+
+class TestQuantizedDenseLayer:
+    def test_get_output_for(self):
+        # matches int8 products accumulated in int32, plus the int32 biases
+        input_scale = 0.05
+        W, W_scale, b = quantized_params((6, 4), 4, (4,))
+        x, q = quantized_input((3, 2, 3), input_scale)
+        l_in = InputLayer((None, 2, 3))
+        layer = QuantizedDenseLayer(l_in, 4, W, W_scale, input_scale, b,
+                                    nonlinearity=None)
+        acc = q.reshape(3, 6).astype('int32').dot(W.astype('int32')) + b
+        expected = acc * (np.float32(input_scale) * W_scale)
+        result = get_output(layer, x).eval()
+        assert result.dtype == floatX
+        np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+    def test_params(self):
+        W, W_scale, b = quantized_params((6, 4), 4, (4,))
+        layer = QuantizedDenseLayer((None, 6), 4, W, W_scale, 0.1, b,
+                                    name='q')
+        assert [p.name for p in layer.get_params()] == [
+            'q.W', 'q.b', 'q.W_scale', 'q.input_scale']
+        assert layer.get_params(trainable=True) == []
+        assert layer.get_params(regularizable=True) == []
+        assert layer.W.dtype == 'int8'
+        assert layer.b.dtype == 'int32'
+
+    def test_large_fan_in(self):
+        # sums of 2000 * 127 * 127 exceed the 24 bits of float32's mantissa,
+        # but the chunks of the fan-in are accumulated exactly
+        W, _, b = quantized_params((2000, 4), 4, (4,))
+        W[:, 0] = 127
+        b[0] = 1
+        x, q = quantized_input((3, 2000), 1)
+        q[:, :1999] = 127
+        x[:] = q
+        layer = QuantizedDenseLayer((None, 2000), 4, W, np.ones(4, floatX),
+                                    1, b, nonlinearity=None)
+        acc = q.dot(W.astype('int64')) + b
+        assert acc.max() > 2 ** 24
+        np.testing.assert_array_equal(layer.get_output_for(x).eval(),
+                                      acc.astype(floatX))
+
+    def test_follows_weights(self):
+        # the weights are cast in the graph, so setting them takes effect
+        W, W_scale, b = quantized_params((6, 4), 4, (4,))
+        layer = QuantizedDenseLayer((None, 6), 4, W, W_scale, 0.1, b)
+        x = T.matrix()
+        assert layer.W in theano.gof.graph.inputs([layer.get_output_for(x)])
+        other = QuantizedDenseLayer((None, 6), 4, -W, W_scale, 0.1, b)
+        value = np.random.RandomState(2).rand(3, 6).astype(floatX)
+        expected = layer.get_output_for(x).eval({x: value})
+        other.W.set_value(W)
+        np.testing.assert_array_equal(other.get_output_for(x).eval({x: value}),
+                                      expected)
+
+    def test_wrong_dtypes(self):
+        W, W_scale, b = quantized_params((6, 4), 4, (4,))
+        with pytest.raises(TypeError):
+            QuantizedDenseLayer((None, 6), 4, W.astype(floatX), W_scale, 0.1)
+        with pytest.raises(TypeError):
+            QuantizedDenseLayer((None, 6), 4, W, W_scale, 0.1,
+                                b.astype(floatX))
+
+
+def reference(layer_class, l_in, W, W_scale, input_scale, b, q, **kwargs):
+    # the float layer applied to the quantized values, scaled per channel
+    layer = layer_class(l_in, W=W.astype('float64'), b=b.astype('float64'),
+                        nonlinearity=None, **kwargs)
+    acc = get_output(layer, q.astype('float64')).eval()
+    shape = (1, -1) + (1,) * (acc.ndim - 2)
+    return acc * (np.float32(input_scale) * W_scale).reshape(shape)
+
+
+class TestQuantizedNINLayer:
+    @pytest.mark.parametrize('untie_biases', [False, True])
+    def test_get_output_for(self, untie_biases):
+        input_scale = 0.05
+        b_shape = (4, 5, 6) if untie_biases else (4,)
+        W, W_scale, b = quantized_params((3, 4), 4, b_shape)
+        x, q = quantized_input((2, 3, 5, 6), input_scale)
+        l_in = InputLayer((None, 3, 5, 6))
+        layer = QuantizedNINLayer(l_in, 4, W, W_scale, input_scale, b,
+                                  untie_biases=untie_biases,
+                                  nonlinearity=None)
+        expected = reference(NINLayer, l_in, W, W_scale, input_scale, b, q,
+                             num_units=4, untie_biases=untie_biases)
+        np.testing.assert_allclose(get_output(layer, x).eval(), expected,
+                                   rtol=1e-6)
+
+    def test_large_fan_in(self):
+        input_scale = 0.05
+        W, W_scale, b = quantized_params((2500, 4), 4, (4,))
+        x, q = quantized_input((2, 2500, 3), input_scale)
+        l_in = InputLayer((None, 2500, 3))
+        layer = QuantizedNINLayer(l_in, 4, W, W_scale, input_scale, b,
+                                  nonlinearity=None)
+        expected = reference(NINLayer, l_in, W, W_scale, input_scale, b, q,
+                             num_units=4)
+        np.testing.assert_allclose(get_output(layer, x).eval(), expected,
+                                   rtol=1e-6)
+
+
+class TestQuantizedConv2DLayer:
+    @pytest.mark.parametrize('kwargs', [
+        dict(), dict(pad='same', stride=2), dict(flip_filters=False),
+        dict(num_groups=2, pad=1), dict(untie_biases=True)])
+    def test_get_output_for(self, kwargs):
+        input_scale = 0.05
+        l_in = InputLayer((None, 4, 7, 6))
+        num_groups = kwargs.get('num_groups', 1)
+        W_shape = (6, 4 // num_groups, 3, 3)
+        b_shape = ((6, 5, 4) if kwargs.get('untie_biases') else (6,))
+        W, W_scale, b = quantized_params(W_shape, 6, b_shape)
+        x, q = quantized_input((2, 4, 7, 6), input_scale)
+        layer = QuantizedConv2DLayer(l_in, 6, 3, W, W_scale, input_scale, b,
+                                     nonlinearity=None, **kwargs)
+        expected = reference(Conv2DLayer, l_in, W, W_scale, input_scale, b, q,
+                             num_filters=6, filter_size=3, **kwargs)
+        np.testing.assert_allclose(get_output(layer, x).eval(), expected,
+                                   rtol=1e-6)
+
+    @pytest.mark.parametrize('num_groups', [1, 2])
+    def test_large_fan_in(self, num_groups):
+        # 256 channels of 3x3 filters are convolved in chunks of channels
+        input_scale = 0.05
+        l_in = InputLayer((None, 256, 5, 5))
+        W, W_scale, b = quantized_params((4, 256 // num_groups, 3, 3), 4,
+                                         (4,))
+        x, q = quantized_input((2, 256, 5, 5), input_scale)
+        layer = QuantizedConv2DLayer(l_in, 4, 3, W, W_scale, input_scale, b,
+                                     nonlinearity=None, num_groups=num_groups)
+        expected = reference(Conv2DLayer, l_in, W, W_scale, input_scale, b, q,
+                             num_filters=4, filter_size=3,
+                             num_groups=num_groups)
+        np.testing.assert_allclose(get_output(layer, x).eval(), expected,
+                                   rtol=1e-6)
+
+    def test_params(self):
+        W, W_scale, b = quantized_params((6, 4, 3, 3), 6, (6,))
+        layer = QuantizedConv2DLayer((None, 4, 7, 6), 6, 3, W, W_scale, 0.1,
+                                     b)
+        assert layer.get_params(trainable=True) == []
+        assert len(layer.get_params()) == 4
+        assert not isinstance(layer, Conv2DLayer)
@@ -1034,6 +1034,353 @@ def test_gru_return_final():
     assert np.allclose(output_final, output_all[:, -1])
 
 
+def _copy_direction_params(l_bi, l_fwd, l_bck):
+    # copy the parameters of a bidirectional layer to two unidirectional ones
+    for l_uni, direction in ((l_fwd, 'fwd'), (l_bck, 'bwd')):
+        for param in l_uni.get_params():
+            if param.name in ('hid_init', 'cell_init'):
+                continue
+            source = getattr(l_bi, '{}_{}'.format(param.name, direction))
+            param.set_value(source.get_value())
+
+
+@pytest.mark.parametrize('precompute_input', [True, False])
+@pytest.mark.parametrize('unroll_scan', [True, False])
+def test_bidirectional_lstm_matches_concat(precompute_input, unroll_scan):
+    num_batch, seq_len, n_features = 3, 5, 4
+    num_units = 2
+    in_shp = (num_batch, seq_len, n_features)
+    l_inp = InputLayer(in_shp)
+    l_mask_inp = InputLayer(in_shp[:2])
+
+    x_in = np.random.random(in_shp).astype('float32')
+    mask_in = np.ones(in_shp[:2], dtype='float32')
+    mask_in[0, 3:] = 0
+    mask_in[1, 1:] = 0
+
+    kwargs = dict(mask_input=l_mask_inp, precompute_input=precompute_input,
+                  unroll_scan=unroll_scan)
+    l_bi = lasagne.layers.BidirectionalLSTMLayer(l_inp, num_units, **kwargs)
+    l_fwd = LSTMLayer(l_inp, num_units, **kwargs)
+    l_bck = LSTMLayer(l_inp, num_units, backwards=True, **kwargs)
+    _copy_direction_params(l_bi, l_fwd, l_bck)
+    l_concat = lasagne.layers.ConcatLayer([l_fwd, l_bck], axis=2)
+
+    inputs = {l_inp.input_var: x_in, l_mask_inp.input_var: mask_in}
+    output_bi = helper.get_output(l_bi).eval(inputs)
+    output_concat = helper.get_output(l_concat).eval(inputs)
+
+    assert output_bi.shape == (num_batch, seq_len, 2*num_units)
+    assert output_bi.shape == helper.get_output_shape(l_bi)
+    np.testing.assert_almost_equal(output_bi, output_concat, decimal=5)
+
+
+def test_bidirectional_lstm_no_peepholes_return_final():
+    num_batch, seq_len, n_features = 2, 3, 4
+    num_units = 3
+    in_shp = (num_batch, seq_len, n_features)
+    x_in = np.random.random(in_shp).astype('float32')
+
+    l_inp = InputLayer(in_shp)
+    l_bi = lasagne.layers.BidirectionalLSTMLayer(
+        l_inp, num_units, peepholes=False, only_return_final=True)
+    l_fwd = LSTMLayer(l_inp, num_units, peepholes=False)
+    l_bck = LSTMLayer(l_inp, num_units, peepholes=False, backwards=True)
+    _copy_direction_params(l_bi, l_fwd, l_bck)
+
+    # four gates with three parameters each, per direction
+    assert len(l_bi.get_params(trainable=True)) == 24
+
+    output_final = helper.get_output(l_bi).eval({l_inp.input_var: x_in})
+    output_fwd = helper.get_output(l_fwd).eval({l_inp.input_var: x_in})
+    output_bck = helper.get_output(l_bck).eval({l_inp.input_var: x_in})
+
+    assert output_final.shape == helper.get_output_shape(l_bi)
+    np.testing.assert_almost_equal(output_final[:, :num_units],
+                                   output_fwd[:, -1], decimal=5)
+    np.testing.assert_almost_equal(output_final[:, num_units:],
+                                   output_bck[:, 0], decimal=5)
+
+
+def test_bidirectional_lstm_grad():
+    l_inp = InputLayer((2, 3, 4))
+    l_bi = lasagne.layers.BidirectionalLSTMLayer(l_inp, 5, grad_clipping=1,
+                                                 learn_init=True)
+    output = helper.get_output(l_bi)
+    g = T.grad(T.mean(output), lasagne.layers.get_all_params(l_bi))
+    assert isinstance(g, (list, tuple))
+
+
+@pytest.mark.parametrize('precompute_input', [True, False])
+@pytest.mark.parametrize('unroll_scan', [True, False])
+def test_bidirectional_gru_matches_concat(precompute_input, unroll_scan):
+    num_batch, seq_len, n_features = 3, 5, 4
+    num_units = 2
+    in_shp = (num_batch, seq_len, n_features)
+    l_inp = InputLayer(in_shp)
+    l_mask_inp = InputLayer(in_shp[:2])
+
+    x_in = np.random.random(in_shp).astype('float32')
+    mask_in = np.ones(in_shp[:2], dtype='float32')
+    mask_in[0, 3:] = 0
+    mask_in[1, 1:] = 0
+
+    kwargs = dict(mask_input=l_mask_inp, precompute_input=precompute_input,
+                  unroll_scan=unroll_scan)
+    l_bi = lasagne.layers.BidirectionalGRULayer(l_inp, num_units, **kwargs)
+    l_fwd = GRULayer(l_inp, num_units, **kwargs)
+    l_bck = GRULayer(l_inp, num_units, backwards=True, **kwargs)
+    _copy_direction_params(l_bi, l_fwd, l_bck)
+    l_concat = lasagne.layers.ConcatLayer([l_fwd, l_bck], axis=2)
+
+    inputs = {l_inp.input_var: x_in, l_mask_inp.input_var: mask_in}
+    output_bi = helper.get_output(l_bi).eval(inputs)
+    output_concat = helper.get_output(l_concat).eval(inputs)
+
+    assert output_bi.shape == helper.get_output_shape(l_bi)
+    np.testing.assert_almost_equal(output_bi, output_concat, decimal=5)
+
+
+def test_bidirectional_gru_hid_init_layer():
+    l_inp = InputLayer((2, 3, 4))
+    l_inp_h = InputLayer((2, 10))
+    l_bi = lasagne.layers.BidirectionalGRULayer(l_inp, 5, hid_init=l_inp_h)
+    x_in = np.random.random((2, 3, 4)).astype('float32')
+    h_in = np.zeros((2, 10), dtype='float32')
+    output = helper.get_output(l_bi).eval({l_inp.input_var: x_in,
+                                           l_inp_h.input_var: h_in})
+    assert output.shape == (2, 3, 10)
+
+
+def _stack_lstm_layers(l_inp, l_stacked, **kwargs):
+    # build an equivalent stack of LSTMLayers with copied parameters
+    layers = []
+    l_prev = l_inp
+    for layer in range(l_stacked.num_layers):
+        l_prev = LSTMLayer(l_prev, l_stacked.num_units, **kwargs)
+        for param in l_prev.get_params():
+            if param.name in ('hid_init', 'cell_init'):
+                continue
+            source = getattr(l_stacked, param.name)[layer]
+            param.set_value(source.get_value())
+        layers.append(l_prev)
+    return layers
+
+
+@pytest.mark.parametrize('num_layers', [1, 3])
+@pytest.mark.parametrize('unroll_scan', [True, False])
+def test_stacked_lstm_matches_stack(num_layers, unroll_scan):
+    num_batch, seq_len, n_features = 3, 5, 4
+    num_units = 2
+    in_shp = (num_batch, seq_len, n_features)
+    l_inp = InputLayer(in_shp)
+    l_mask_inp = InputLayer(in_shp[:2])
+
+    x_in = np.random.random(in_shp).astype('float32')
+    mask_in = np.ones(in_shp[:2], dtype='float32')
+    mask_in[0, 3:] = 0
+    mask_in[1, 1:] = 0
+
+    l_stacked = lasagne.layers.StackedLSTMLayer(
+        l_inp, num_units, num_layers, mask_input=l_mask_inp,
+        unroll_scan=unroll_scan)
+    l_stacked_all = lasagne.layers.StackedLSTMLayer(
+        l_inp, num_units, num_layers, mask_input=l_mask_inp,
+        return_all_layers=True)
+    lasagne.layers.set_all_param_values(
+        l_stacked_all, lasagne.layers.get_all_param_values(l_stacked))
+    layers = _stack_lstm_layers(l_inp, l_stacked, mask_input=l_mask_inp)
+
+    inputs = {l_inp.input_var: x_in, l_mask_inp.input_var: mask_in}
+    output_stacked = helper.get_output(l_stacked).eval(inputs)
+    output_all = helper.get_output(l_stacked_all).eval(inputs)
+    outputs_ref = [helper.get_output(layer).eval(inputs) for layer in layers]
+
+    assert output_stacked.shape == helper.get_output_shape(l_stacked)
+    assert output_all.shape == helper.get_output_shape(l_stacked_all)
+    np.testing.assert_almost_equal(output_stacked, outputs_ref[-1],
+                                   decimal=5)
+    np.testing.assert_almost_equal(output_all,
+                                   np.concatenate(outputs_ref, axis=2),
+                                   decimal=5)
+
+
+def test_stacked_lstm_return_final():
+    num_batch, seq_len, n_features = 2, 3, 4
+    in_shp = (num_batch, seq_len, n_features)
+    x_in = np.random.random(in_shp).astype('float32')
+
+    l_inp = InputLayer(in_shp)
+    l_final = lasagne.layers.StackedLSTMLayer(l_inp, 3, 2, peepholes=False,
+                                              only_return_final=True)
+    layers = _stack_lstm_layers(l_inp, l_final, peepholes=False)
+
+    # four gates with three parameters each, per layer
+    assert len(l_final.get_params(trainable=True)) == 24
+
+    output_final = helper.get_output(l_final).eval({l_inp.input_var: x_in})
+    output_ref = helper.get_output(layers[-1]).eval({l_inp.input_var: x_in})
+    assert output_final.shape == helper.get_output_shape(l_final)
+    np.testing.assert_almost_equal(output_final, output_ref[:, -1], decimal=5)
+
+
+def test_stacked_lstm_grad():
+    l_inp = InputLayer((2, 3, 4))
+    l_rec = lasagne.layers.StackedLSTMLayer(l_inp, 5, 2, grad_clipping=1,
+                                            learn_init=True)
+    output = helper.get_output(l_rec)
+    g = T.grad(T.mean(output), lasagne.layers.get_all_params(l_rec))
+    assert isinstance(g, (list, tuple))
+
+
+def test_stacked_lstm_num_layers_error():
+    with pytest.raises(ValueError):
+        lasagne.layers.StackedLSTMLayer((2, 3, 4), 5, 0)
+
+
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+def test_fold_embedding(layer_class):
+    num_batch, seq_len, vocab_size, emb_size = 3, 4, 7, 5
+    num_units = 2
+    l_inp = InputLayer((num_batch, seq_len), input_var=T.imatrix())
+    l_mask_inp = InputLayer((num_batch, seq_len))
+    l_emb = lasagne.layers.EmbeddingLayer(l_inp, vocab_size, emb_size)
+
+    ids_in = np.random.randint(vocab_size, size=(num_batch, seq_len))
+    ids_in = ids_in.astype('int32')
+    mask_in = np.ones((num_batch, seq_len), dtype='float32')
+    mask_in[0, 2:] = 0
+
+    lasagne.random.get_rng().seed(1234)
+    l_rec = layer_class(l_emb, num_units, mask_input=l_mask_inp)
+    lasagne.random.get_rng().seed(1234)
+    l_rec_folded = layer_class(l_emb, num_units, mask_input=l_mask_inp,
+                               fold_embedding=True)
+
+    # the folded layer bypasses the embedding layer, but owns its weights
+    assert l_rec_folded.input_layers[0] is l_inp
+    assert l_rec_folded.W_emb is l_emb.W
+    params_folded = lasagne.layers.get_all_params(l_rec_folded)
+    assert l_emb.W in params_folded
+    assert len(params_folded) == len(lasagne.layers.get_all_params(l_rec))
+    assert (helper.get_output_shape(l_rec_folded) ==
+            helper.get_output_shape(l_rec))
+
+    inputs = {l_inp.input_var: ids_in, l_mask_inp.input_var: mask_in}
+    output = helper.get_output(l_rec).eval(inputs)
+    output_folded = helper.get_output(l_rec_folded).eval(inputs)
+    np.testing.assert_almost_equal(output, output_folded, decimal=5)
+
+
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+def test_fold_embedding_cached_table(layer_class):
+    num_batch, seq_len, vocab_size, emb_size = 3, 4, 7, 5
+    l_inp = InputLayer((num_batch, seq_len), input_var=T.imatrix())
+    l_emb = lasagne.layers.EmbeddingLayer(l_inp, vocab_size, emb_size)
+    ids_in = np.random.randint(vocab_size, size=(num_batch, seq_len))
+    inputs = {l_inp.input_var: ids_in.astype('int32')}
+
+    # by default, the deterministic output follows the parameters
+    l_rec = layer_class(l_emb, 2, fold_embedding=True)
+    assert l_rec.folded_table is None
+    output = helper.get_output(l_rec)
+    output_det = helper.get_output(l_rec, deterministic=True)
+    assert l_emb.W in theano.gof.graph.inputs([output_det])
+    l_emb.W.set_value(l_emb.W.get_value() + 0.5)
+    np.testing.assert_almost_equal(output.eval(inputs),
+                                   output_det.eval(inputs), decimal=5)
+    with pytest.raises(ValueError):
+        l_rec.refresh_folded_table()
+
+    # with the cache, it gathers from the cached table, without a product
+    # over the whole vocabulary
+    l_rec = layer_class(l_emb, 2, fold_embedding=True,
+                        cache_folded_table=True)
+    assert l_rec.folded_table is None
+    with pytest.raises(RuntimeError):
+        helper.get_output(l_rec, deterministic=True)
+    l_rec.refresh_folded_table()
+    output = helper.get_output(l_rec)
+    output_det = helper.get_output(l_rec, deterministic=True)
+    assert l_emb.W in theano.gof.graph.inputs([output])
+    assert l_emb.W not in theano.gof.graph.inputs([output_det])
+    assert l_rec.folded_table in theano.gof.graph.inputs([output_det])
+    assert l_rec.folded_table not in l_rec.get_params()
+    np.testing.assert_almost_equal(output.eval(inputs),
+                                   output_det.eval(inputs), decimal=5)
+
+    # the cache is stale after changing the weights, until refreshed
+    l_emb.W.set_value(2 * l_emb.W.get_value())
+    assert not np.allclose(output.eval(inputs), output_det.eval(inputs))
+    l_rec.refresh_folded_table()
+    np.testing.assert_almost_equal(output.eval(inputs),
+                                   output_det.eval(inputs), decimal=5)
+
+    # or kept up to date by an update
+    l_emb.W.set_value(2 * l_emb.W.get_value())
+    theano.function([], updates=[l_rec.folded_table_update()])()
+    np.testing.assert_almost_equal(output.eval(inputs),
+                                   output_det.eval(inputs), decimal=5)
+
+
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+def test_fold_embedding_errors(layer_class):
+    l_inp = InputLayer((2, 3))
+    with pytest.raises(ValueError):
+        layer_class(InputLayer((2, 3, 4)), 5, fold_embedding=True)
+    with pytest.raises(ValueError):
+        layer_class(lasagne.layers.EmbeddingLayer(l_inp, 10, 4), 5,
+                    fold_embedding=True, precompute_input=False)
+    with pytest.raises(ValueError):
+        layer_class(lasagne.layers.EmbeddingLayer(l_inp, 10, 4), 5,
+                    cache_folded_table=True)
+
+
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+@pytest.mark.parametrize('kwargs', [dict(),
+                                    dict(backwards=True),
+                                    dict(only_return_final=True),
+                                    dict(unroll_scan=True),
+                                    dict(precompute_input=False)])
+def test_pack_sequences(layer_class, kwargs):
+    num_batch, seq_len, n_features = 5, 6, 3
+    num_units = 4
+    in_shp = (num_batch, seq_len, n_features)
+    l_inp = InputLayer(in_shp)
+    l_mask_inp = InputLayer(in_shp[:2])
+    l_hid_inp = InputLayer((num_batch, num_units))
+
+    x_in = np.random.random(in_shp).astype('float32')
+    hid_in = np.random.random((num_batch, num_units)).astype('float32')
+    mask_in = np.zeros(in_shp[:2], dtype='float32')
+    for b, length in enumerate([2, 6, 0, 1, 4]):
+        mask_in[b, :length] = 1
+
+    lasagne.random.get_rng().seed(1234)
+    l_rec = layer_class(l_inp, num_units, mask_input=l_mask_inp,
+                        hid_init=l_hid_inp, **kwargs)
+    lasagne.random.get_rng().seed(1234)
+    l_rec_packed = layer_class(l_inp, num_units, mask_input=l_mask_inp,
+                               hid_init=l_hid_inp, pack_sequences=True,
+                               **kwargs)
+
+    inputs = {l_inp.input_var: x_in, l_mask_inp.input_var: mask_in,
+              l_hid_inp.input_var: hid_in}
+    output = helper.get_output(l_rec)
+    output_packed = helper.get_output(l_rec_packed)
+    np.testing.assert_almost_equal(output.eval(inputs),
+                                   output_packed.eval(inputs), decimal=5)
+
+    params = l_rec_packed.get_params(trainable=True)
+    grads = theano.function(list(inputs.keys()),
+                            T.grad(output_packed.sum(), params))
+    grads_ref = theano.function(list(inputs.keys()),
+                                T.grad(output.sum(), l_rec.get_params(
+                                    trainable=True)))
+    for g, g_ref in zip(grads(*inputs.values()), grads_ref(*inputs.values())):
+        np.testing.assert_almost_equal(g, g_ref, decimal=4)
+
+
 def test_gradient_steps_error():
     # Check that error is raised if gradient_steps is not -1 and scan_unroll
     # is true
@@ -1047,6 +1394,14 @@ def test_gradient_steps_error():
     with pytest.raises(ValueError):
         GRULayer(l_in, 5, gradient_steps=3, unroll_scan=True)
 
+    with pytest.raises(ValueError):
+        lasagne.layers.BidirectionalLSTMLayer(l_in, 5, gradient_steps=3,
+                                              unroll_scan=True)
+
+    with pytest.raises(ValueError):
+        lasagne.layers.BidirectionalGRULayer(l_in, 5, gradient_steps=3,
+                                             unroll_scan=True)
+
 
 def test_unroll_none_input_error():
     # Test that a ValueError is raised if unroll scan is True and the input
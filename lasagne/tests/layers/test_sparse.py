@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+import scipy.sparse
+import theano
+
+from lasagne.layers import (InputLayer, DenseLayer, SparseDenseLayer,
+                            get_output)
+
+
+floatX = theano.config.floatX
+
+
+def sparse_weights(shape, density=0.2, seed=0):
+    rng = np.random.RandomState(seed)
+    W = rng.randn(*shape).astype(floatX)
+    W[rng.rand(*shape) > density] = 0
+    return W
+
+
+class TestSparseDenseLayer:
+    @pytest.mark.parametrize('input_shape, num_leading_axes', [
+        ((4, 6), 1), ((4, 2, 3), 1), ((4, 5, 6), 2), ((4, 5, 2, 3), -2)])
+    def test_get_output_for(self, input_shape, num_leading_axes):
+        num_inputs = int(np.prod(input_shape[num_leading_axes:]))
+        W = sparse_weights((num_inputs, 7))
+        b = np.random.randn(7).astype(floatX)
+        l_in = InputLayer((None,) + input_shape[1:])
+        dense = DenseLayer(l_in, 7, W=W, b=b,
+                           num_leading_axes=num_leading_axes)
+        sparse = SparseDenseLayer(l_in, 7, W, b=b,
+                                  num_leading_axes=num_leading_axes)
+        x = np.random.randn(*input_shape).astype(floatX)
+        result = get_output(sparse, x).eval()
+        assert result.shape == sparse.get_output_shape_for(input_shape)
+        np.testing.assert_allclose(result, get_output(dense, x).eval(),
+                                   rtol=1e-5, atol=1e-5)
+
+    @pytest.mark.parametrize('convert', [
+        lambda W: W, scipy.sparse.csc_matrix, scipy.sparse.coo_matrix])
+    def test_weights(self, convert):
+        W = sparse_weights((6, 7))
+        layer = SparseDenseLayer((None, 6), 7, convert(W), b=None)
+        value = layer.W.get_value()
+        assert scipy.sparse.isspmatrix_csr(value)
+        assert value.dtype == floatX
+        assert value.nnz == np.count_nonzero(W)
+        np.testing.assert_array_equal(value.toarray(), W)
+        assert layer.density == np.count_nonzero(W) / 42.
+        assert layer.get_params() == [layer.W]
+        assert layer.get_params(trainable=True) == []
+
+    def test_shared_weights(self):
+        W = theano.sparse.shared(scipy.sparse.csr_matrix(sparse_weights((6,
+                                                                         7))))
+        layer = SparseDenseLayer((None, 6), 7, W)
+        assert layer.W is W
+        assert layer.get_params(trainable=True) == [layer.b]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            SparseDenseLayer((None, 6), 7, sparse_weights((7, 6)))
+        with pytest.raises(ValueError):
+            SparseDenseLayer((None, None), 7, sparse_weights((6, 7)))
+        with pytest.raises(ValueError):
+            SparseDenseLayer((None, 6), 7, sparse_weights((6, 7)),
+                             num_leading_axes=2)
+
+    def test_gradient(self):
+        # the sparse layer can be used within a network trained further
+        W = sparse_weights((6, 7))
+        l_in = InputLayer((None, 6))
+        x = np.random.randn(3, 6).astype(floatX)
+        grads = []
+        for layer in (DenseLayer(l_in, 7, W=W),
+                      SparseDenseLayer(l_in, 7, W)):
+            output = get_output(layer)
+            grads.append(theano.grad(output.sum(), [l_in.input_var,
+                                                    layer.b]))
+        for dense, sparse in zip(*grads):
+            np.testing.assert_allclose(
+                sparse.eval({l_in.input_var: x}),
+                dense.eval({l_in.input_var: x}), rtol=1e-5)
+
+
+def test_import_does_not_import_theano_sparse():
+    # theano.sparse takes a while to import, so it should wait until a
+    # sparse layer is created
+    import subprocess
+    import sys
+    code = ("import sys, lasagne, lasagne.pruning; "
+            "print('theano.sparse' in sys.modules)")
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode().split()[-1] == 'False'
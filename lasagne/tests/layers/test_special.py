@@ -346,6 +346,60 @@ class TestInverseLayer:
         assert np.allclose(
             results.eval(), np.dot(np.dot(input.get_value(), W), W.T))
 
+    @pytest.mark.parametrize("layer_class, kwargs, input_shape", [
+        ('DenseLayer', dict(num_units=7, nonlinearity=None), (4, 3, 5)),
+        ('DenseLayer', dict(num_units=7), (4, 3, 5)),
+        ('DenseLayer', dict(num_units=7, num_leading_axes=2,
+                            nonlinearity='tanh'), (4, 3, 5)),
+        ('DenseLayer', dict(num_units=7, nonlinearity='sigmoid'), (4, 15)),
+        ('DenseLayer', dict(num_units=7, nonlinearity='softplus'), (4, 15)),
+        ('Conv2DLayer', dict(num_filters=4, filter_size=3), (2, 3, 9, 8)),
+        ('Conv2DLayer', dict(num_filters=4, filter_size=3, stride=2,
+                             pad='same', nonlinearity=None), (2, 3, 9, 8)),
+        ('Conv2DLayer', dict(num_filters=4, filter_size=(3, 2),
+                             stride=(1, 3), pad=(2, 1), flip_filters=False,
+                             nonlinearity=None), (2, 3, 9, 8)),
+        ('Conv2DLayer', dict(num_filters=4, filter_size=3, pad='full'),
+         (None, 3, None, 8)),
+        ('Conv2DLayer', dict(num_filters=6, filter_size=3, num_groups=3),
+         (2, 6, 9, 8)),
+        ('Conv2DLayer', dict(num_filters=4, filter_size=3,
+                             convolution='conv2d_fft'), (2, 3, 9, 8)),
+        ('LocallyConnected2DLayer', dict(num_filters=4, filter_size=3),
+         (2, 3, 5, 6)),
+        ('LocallyConnected2DLayer', dict(num_filters=3, filter_size=3,
+                                         channelwise=True), (2, 3, 5, 6)),
+        ('MaxPool2DLayer', dict(pool_size=2), (2, 3, 9, 8)),
+        ('MaxPool2DLayer', dict(pool_size=3, stride=2, pad=1), (2, 3, 9, 8)),
+        ('MaxPool2DLayer', dict(pool_size=2, ignore_border=False),
+         (None, 3, 9, None)),
+    ])
+    def test_direct_inverse(self, layer_class, kwargs, input_shape):
+        # the direct implementations must match the partial derivative
+        import lasagne
+        from lasagne.layers import InputLayer, InverseLayer, get_output
+        if isinstance(kwargs.get('nonlinearity'), str):
+            kwargs['nonlinearity'] = getattr(lasagne.nonlinearities,
+                                             kwargs['nonlinearity'])
+        if 'convolution' in kwargs:
+            import lasagne.theano_extensions.conv
+            kwargs['convolution'] = getattr(lasagne.theano_extensions.conv,
+                                            kwargs['convolution'])
+        input_var = theano.tensor.TensorType(
+            theano.config.floatX, (False,) * len(input_shape))()
+        l_in = InputLayer(input_shape, input_var)
+        layer = getattr(lasagne.layers, layer_class)(l_in, **kwargs)
+        l_inv = InverseLayer(layer, layer)
+        output, layer_out = get_output([l_inv, layer])
+        expected = theano.grad(None, wrt=input_var,
+                               known_grads={layer_out: layer_out})
+        fn = theano.function([input_var], [output, expected])
+        shape = tuple(s or 10 for s in input_shape)
+        result, expected = fn(np.random.randn(*shape).astype(
+            theano.config.floatX))
+        assert result.shape == shape
+        assert np.allclose(result, expected, atol=1e-6)
+
 
 class TestTransformLayer():
 
@@ -416,6 +470,83 @@ class TestTransformLayer():
                                         constant(thetas)]).eval()
         np.testing.assert_allclose(inputs, outputs, rtol=1e-6)
 
+    def test_transform_affine_interpolation_error(self):
+        from lasagne.layers import InputLayer, TransformerLayer
+        with pytest.raises(ValueError):
+            TransformerLayer(InputLayer((None, 3, 28, 28)),
+                             InputLayer((None, 6)), interpolation='cubic')
+
+    def test_transform_affine_nearest(self):
+        from lasagne.layers import InputLayer, TransformerLayer
+        from lasagne.utils import floatX
+        from theano.tensor import constant
+        l_in = InputLayer((2, 3, 11, 9))
+        layer = TransformerLayer(l_in, InputLayer((2, 6)),
+                                 downsample_factor=(0.5, 2),
+                                 interpolation='nearest')
+        inputs = floatX(np.random.random(l_in.shape))
+        thetas = floatX([[0.8, 0.3, 0.1, -0.2, 0.9, 0.05],
+                         [1.2, 0, -0.3, 0, 0.6, 0]])
+        outputs = layer.get_output_for([constant(inputs),
+                                        constant(thetas)]).eval()
+        assert outputs.shape == (2, 3, 22, 4)
+
+        # compare to numpy implementation
+        x_t, y_t = np.meshgrid(np.linspace(-1, 1, 4), np.linspace(-1, 1, 22))
+        grid = np.stack([x_t, y_t, np.ones_like(x_t)])
+        for b in range(2):
+            x_s, y_s = np.tensordot(thetas[b].reshape(2, 3), grid, axes=1)
+            x_s = np.round((np.clip(x_s, -1, 1) + 1) / 2 * 8).astype(int)
+            y_s = np.round((np.clip(y_s, -1, 1) + 1) / 2 * 10).astype(int)
+            np.testing.assert_allclose(outputs[b], inputs[b][:, y_s, x_s])
+
+    @pytest.mark.parametrize('interpolation', ['bilinear', 'nearest'])
+    @pytest.mark.parametrize('fixed_shape', [True, False])
+    def test_transform_scale_translate(self, interpolation, fixed_shape):
+        from lasagne.layers import InputLayer, TransformerLayer, get_output
+        from lasagne.utils import floatX
+        T = theano.tensor
+        x = T.tensor4()
+        theta = T.matrix()
+        shape = (4, 2, 13, 10) if fixed_shape else (None, 2, None, None)
+        l_in = InputLayer(shape, input_var=x)
+        l_affine = TransformerLayer(l_in, InputLayer((None, 6), theta),
+                                    downsample_factor=(2, 0.7),
+                                    interpolation=interpolation)
+        l_loc = InputLayer((None, 4), theta[:, [0, 2, 4, 5]])
+        l_fast = TransformerLayer(l_in, l_loc, downsample_factor=(2, 0.7),
+                                  interpolation=interpolation)
+        assert l_fast.output_shape == l_affine.output_shape
+        out_affine = get_output(l_affine)
+        out_fast = get_output(l_fast)
+
+        # the fast path should match the affine transform without shear, and
+        # so should the gradients with respect to the input and (for bilinear
+        # interpolation) the scale and translation parameters
+        outputs = [out_affine, out_fast,
+                   T.grad(out_affine.sum(), x), T.grad(out_fast.sum(), x)]
+        if interpolation == 'bilinear':
+            outputs += [T.grad((out_affine ** 2).sum(), theta),
+                        T.grad((out_fast ** 2).sum(), theta)]
+        fn = theano.function([x, theta], outputs)
+        inputs = floatX(np.random.random((4, 2, 13, 10)))
+        thetas = np.zeros((4, 6))
+        thetas[:, [0, 2, 4, 5]] = np.random.uniform(-1.3, 1.3, (4, 4))
+        outputs = fn(inputs, floatX(thetas))
+        assert outputs[0].shape == (4, 2, 6, 14)
+        np.testing.assert_allclose(outputs[0], outputs[1], atol=1e-5)
+        np.testing.assert_allclose(outputs[2], outputs[3], atol=1e-5)
+        if interpolation == 'bilinear':
+            np.testing.assert_allclose(outputs[4][:, [0, 2, 4, 5]],
+                                       outputs[5][:, [0, 2, 4, 5]],
+                                       rtol=1e-3, atol=1e-4)
+
+    def test_transform_affine_index_dtype(self):
+        from lasagne.layers.special import _index_dtype
+        assert _index_dtype((10, 3, 28, 28)) == 'int32'
+        assert _index_dtype((None, 3, 28, 28)) == 'int64'
+        assert _index_dtype((2**16, 3, 2**8, 2**8)) == 'int64'
+
 
 class TestTPSTransformLayer():
 
@@ -582,6 +713,52 @@ class TestTPSTransformLayer():
         np.testing.assert_allclose(shifted_input,
                                    outputs, atol=1e-5)
 
+    @pytest.mark.parametrize('num_control_points', [4, 16, 25])
+    def test_transform_thin_plate_spline_precompute(self, num_control_points):
+        from lasagne.layers import InputLayer, TPSTransformerLayer
+        from lasagne.utils import floatX
+        from theano.tensor import constant
+        batchsize = 3
+        np.random.seed(42)
+        dest_offset = floatX(np.random.uniform(
+                -.2, .2, size=(batchsize, 2*num_control_points)))
+        inputs = floatX(np.random.random((batchsize, 2, 20, 24)))
+        l_in = InputLayer(inputs.shape)
+        l_loc = InputLayer((batchsize, 2*num_control_points))
+        outputs = []
+        for precompute_grid in (True, False):
+            layer = TPSTransformerLayer(
+                    l_in, l_loc, control_points=num_control_points,
+                    precompute_grid=precompute_grid)
+            outputs.append(layer.get_output_for(
+                    [constant(inputs), constant(dest_offset)]).eval())
+        np.testing.assert_allclose(outputs[0], outputs[1], atol=1e-4)
+
+    def test_initialize_tps(self):
+        from lasagne.layers.special import _initialize_tps
+        num_control_points = 9
+        right_mat, coefficient_mat, source_points, _, _ = _initialize_tps(
+                num_control_points, (None, 1, 6, 5), (1, 1), True)
+        right_mat = right_mat.eval()
+        coefficient_mat = coefficient_mat.eval()
+        source_points = source_points.eval()
+        assert right_mat.shape == (num_control_points + 3, 30)
+        assert coefficient_mat.shape == (num_control_points,
+                                         num_control_points + 3)
+
+        # compare to constructing and inverting L with explicit loops
+        L = np.zeros((num_control_points + 3,) * 2)
+        L[0, 3:] = L[3:, 0] = 1.
+        L[1:3, 3:] = source_points
+        L[3:, 1:3] = source_points.T
+        for i in range(num_control_points):
+            for j in range(num_control_points):
+                r_2 = np.sum((source_points[:, i] - source_points[:, j])**2)
+                if r_2 > 0:
+                    L[i + 3, j + 3] = r_2 * np.log(r_2)
+        np.testing.assert_allclose(coefficient_mat,
+                                   np.linalg.inv(L)[:, 3:].T, atol=1e-5)
+
 
 class TestParametricRectifierLayer:
     @pytest.fixture
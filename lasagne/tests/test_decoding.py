@@ -0,0 +1,245 @@
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+import lasagne
+from lasagne.layers import (InputLayer, EmbeddingLayer, LSTMLayer, GRULayer,
+                            ReshapeLayer, DenseLayer)
+
+
+VOCAB_SIZE, NUM_UNITS = 6, 5
+
+
+def build_decoder(layer_class, **kwargs):
+    l_in = InputLayer((None, None), input_var=T.imatrix())
+    l_emb = EmbeddingLayer(l_in, VOCAB_SIZE, 4,
+                           W=lasagne.init.Normal(1.))
+    l_rec = layer_class(l_emb, NUM_UNITS, **kwargs)
+    l_shp = ReshapeLayer(l_rec, (-1, NUM_UNITS))
+    l_out = DenseLayer(l_shp, VOCAB_SIZE, W=lasagne.init.Normal(1.),
+                       nonlinearity=lasagne.nonlinearities.softmax)
+    return l_rec, l_out
+
+
+def init_states(layer_class, hid_init):
+    if layer_class is LSTMLayer:
+        return [T.zeros_like(hid_init), hid_init]
+    return [hid_init]
+
+
+def sequence_log_probs(l_rec, l_out, hid_init, sequences, end_token):
+    # score sequences by running the network on (start, sequence[:-1])
+    layer_class = l_rec.__class__
+    start = np.zeros((len(sequences), 1), dtype='int32')
+    inputs = np.concatenate([start, sequences[:, :-1]], axis=1)
+    x = T.imatrix()
+    h = T.matrix()
+    states = init_states(layer_class, h)
+    outputs = []
+    for t in range(inputs.shape[1]):
+        states = l_rec.get_step_output_for(
+            l_rec.input_layers[0].get_output_for(x[:, t]), *states)
+        if layer_class is GRULayer:
+            states = [states]
+        outputs.append(lasagne.layers.get_output(
+            l_out, {l_rec: states[-1]}, deterministic=True))
+    probs = theano.function([x, h], T.stack(outputs, axis=1))(
+        inputs.astype('int32'), hid_init)
+    log_probs = np.log(probs[np.arange(len(sequences))[:, None],
+                             np.arange(inputs.shape[1]), sequences])
+    # tokens after the end token do not count
+    ended = np.cumsum(sequences == end_token, axis=1)
+    ended = np.concatenate([np.zeros((len(sequences), 1)), ended[:, :-1]],
+                           axis=1)
+    return (log_probs * (ended == 0)).sum(axis=1), (ended == 0).sum(axis=1)
+
+
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+def test_beam_search_scores(layer_class):
+    from lasagne.decoding import beam_search
+    lasagne.random.get_rng().seed(1234)
+    l_rec, l_out = build_decoder(layer_class)
+    batch_size, beam_size, max_length = 3, 4, 6
+    hid_init = T.matrix()
+    sequences, scores, lengths = beam_search(
+        l_rec, l_out, init_states(layer_class, hid_init), start_token=0,
+        end_token=1, beam_size=beam_size, max_length=max_length)
+    fn = theano.function([hid_init], [sequences, scores, lengths])
+    hid_val = np.random.randn(batch_size, NUM_UNITS).astype(
+        theano.config.floatX)
+    sequences, scores, lengths = fn(hid_val)
+
+    assert sequences.shape[:2] == (batch_size, beam_size)
+    assert sequences.shape[2] <= max_length
+    assert scores.shape == lengths.shape == (batch_size, beam_size)
+    # hypotheses are sorted by score
+    assert np.all(np.diff(scores, axis=1) <= 1e-5)
+    # scores and lengths match the network's probabilities of the sequences
+    for b in range(batch_size):
+        expected, expected_lengths = sequence_log_probs(
+            l_rec, l_out, np.repeat(hid_val[b:b+1], beam_size, axis=0),
+            sequences[b], end_token=1)
+        np.testing.assert_allclose(scores[b], expected, rtol=1e-4)
+        np.testing.assert_equal(lengths[b], expected_lengths)
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(), dict(fold_embedding=True),
+    dict(fold_embedding=True, cache_folded_table=True)])
+def test_beam_search_greedy(kwargs):
+    from lasagne.decoding import beam_search
+    lasagne.random.get_rng().seed(1234)
+    l_rec, l_out = build_decoder(LSTMLayer, **kwargs)
+    if l_rec.cache_folded_table:
+        l_rec.refresh_folded_table()
+    hid_init = T.matrix()
+    hid_val = np.random.randn(2, NUM_UNITS).astype(theano.config.floatX)
+    sequences, scores, lengths = theano.function(
+        [hid_init], beam_search(l_rec, l_out, init_states(LSTMLayer, hid_init),
+                                start_token=0, end_token=1, beam_size=1,
+                                max_length=5))(hid_val)
+
+    # with a single hypothesis, beam search picks the most probable token
+    x = T.ivector()
+    c, h = T.matrix(), T.matrix()
+    embed = l_rec.input_layers[0].get_output_for
+    if l_rec.fold_embedding:
+        embed = None
+    states = l_rec.get_step_output_for(x if embed is None else embed(x), c, h)
+    probs = lasagne.layers.get_output(l_out, {l_rec: states[1]},
+                                      deterministic=True)
+    step = theano.function([x, c, h], states + [probs])
+    tokens = np.zeros(2, dtype='int32')
+    cell, hid = np.zeros_like(hid_val), hid_val
+    for t in range(sequences.shape[2]):
+        cell, hid, p = step(tokens, cell, hid)
+        tokens = p.argmax(axis=1).astype('int32')
+        done = sequences[:, 0, t - 1] == 1 if t else np.zeros(2, bool)
+        np.testing.assert_equal(sequences[~done, 0, t], tokens[~done])
+
+
+def test_beam_search_early_stopping():
+    from lasagne.decoding import beam_search
+    l_rec, l_out = build_decoder(GRULayer)
+    # make the end token overwhelmingly likely
+    b = np.zeros(VOCAB_SIZE, dtype=theano.config.floatX)
+    b[1] = 100
+    l_out.b.set_value(b)
+    hid_init = T.matrix()
+    sequences, scores, lengths = theano.function(
+        [hid_init], beam_search(l_rec, l_out, [hid_init], start_token=0,
+                                end_token=1, beam_size=2, max_length=20,
+                                length_normalization=1.))(
+        np.zeros((3, NUM_UNITS), dtype=theano.config.floatX))
+    assert sequences.shape == (3, 2, 2)
+    np.testing.assert_equal(sequences[:, 0], 1)
+    np.testing.assert_equal(lengths[:, 0], 1)
+
+
+def test_beam_search_errors():
+    from lasagne.decoding import beam_search
+    l_rec, l_out = build_decoder(LSTMLayer)
+    h = T.matrix()
+    with pytest.raises(ValueError):
+        beam_search(l_rec, l_out, [h], 0, 1)
+    with pytest.raises(TypeError):
+        beam_search(l_out, l_out, [h], 0, 1)
+    l_rec = LSTMLayer(InputLayer((None, None, 3)), NUM_UNITS)
+    with pytest.raises(ValueError):
+        beam_search(l_rec, l_out, [h, h], 0, 1)
+
+
+def build_causal_conv_net():
+    from lasagne.layers import (CausalConv1DLayer, Conv1DLayer,
+                                ElemwiseSumLayer, NonlinearityLayer)
+    l_in = InputLayer((None, 2, None))
+    l_conv = CausalConv1DLayer(l_in, 4, 3)
+    for dilation in (2, 4):
+        l_dil = CausalConv1DLayer(l_conv, 4, 2, dilation=dilation,
+                                  b=lasagne.init.Normal())
+        l_conv = ElemwiseSumLayer([l_conv, Conv1DLayer(l_dil, 4, 1)])
+        l_conv = NonlinearityLayer(l_conv, lasagne.nonlinearities.tanh)
+    return CausalConv1DLayer(l_conv, 3, 1, nonlinearity=None)
+
+
+def test_causal_conv_generator():
+    from lasagne.decoding import CausalConvGenerator
+    l_out = build_causal_conv_net()
+    x = lasagne.utils.floatX(np.random.randn(3, 2, 15))
+    expected = lasagne.layers.get_output(l_out, x).eval()
+    generator = CausalConvGenerator(l_out, batch_size=3)
+    assert len(generator.layers) == 4
+    for _ in range(2):
+        outputs = [generator.step(x[:, :, t]) for t in range(15)]
+        np.testing.assert_allclose(np.stack(outputs, axis=2), expected,
+                                   rtol=1e-5, atol=1e-5)
+        assert generator.position.get_value() == 15
+        generator.reset()
+
+
+def test_causal_conv_step_errors():
+    from lasagne.decoding import causal_conv_step
+    from lasagne.layers import (CausalConv1DLayer, Conv1DLayer, ConcatLayer,
+                                DimshuffleLayer)
+    l_out = build_causal_conv_net()
+    buffers = [T.tensor3() for _ in range(4)]
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), buffers[:3], 0)
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), buffers + [T.tensor3()], 0)
+    l_out = Conv1DLayer(CausalConv1DLayer(InputLayer((None, 2, None)), 4, 2),
+                        3, 3, pad='same')
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), buffers[:1], 0)
+    l_conv = CausalConv1DLayer(InputLayer((None, 2, 6)), 4, 2)
+    l_out = ConcatLayer([l_conv, l_conv], axis=-1)
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), buffers[:1], 0)
+    l_out = DimshuffleLayer(DenseLayer(DimshuffleLayer(l_conv, (0, 2, 1)),
+                                       3), (0, 1, 'x'))
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), buffers[:1], 0)
+
+
+def test_causal_conv_step_per_position_layers():
+    # dense layers on a time-major layout and channel-wise concatenation
+    # compute each position independently
+    from lasagne.decoding import CausalConvGenerator
+    from lasagne.layers import (CausalConv1DLayer, ConcatLayer,
+                                DimshuffleLayer, BiasLayer)
+    l_in = InputLayer((None, 2, None))
+    l_conv = CausalConv1DLayer(l_in, 4, 3)
+    l_cat = ConcatLayer([l_conv, l_in], axis=1)
+    l_shf = DimshuffleLayer(l_cat, (0, 2, 1))
+    l_dense = DenseLayer(l_shf, 5, num_leading_axes=2)
+    l_out = BiasLayer(DimshuffleLayer(l_dense, (0, 2, 1)),
+                      b=lasagne.init.Normal())
+    x = lasagne.utils.floatX(np.random.randn(3, 2, 7))
+    expected = lasagne.layers.get_output(l_out, x).eval()
+    generator = CausalConvGenerator(l_out, batch_size=3)
+    outputs = [generator.step(x[:, :, t]) for t in range(7)]
+    np.testing.assert_allclose(np.stack(outputs, axis=2), expected,
+                               rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize('layer_class, kwargs', [
+    ('Pool1DLayer', dict(pool_size=2)),
+    ('PadLayer', dict(width=1, batch_ndim=2)),
+    ('ReshapeLayer', dict(shape=([0], [1], -1))),
+    ('ExpressionLayer', dict(function=lambda x: x[:, :, ::-1])),
+    ('Conv1DLayer', dict(num_filters=3, filter_size=1, untie_biases=True)),
+    ('Conv1DLayer', dict(num_filters=3, filter_size=1, pad=1)),
+    ('BiasLayer', dict(shared_axes=0)),
+    ('DenseLayer', dict(num_units=3, num_leading_axes=2)),
+    ('DimshuffleLayer', dict(pattern=(0, 2, 1))),
+])
+def test_causal_conv_step_rejects(layer_class, kwargs):
+    # layers that may combine positions, or an output with the time axis
+    # elsewhere, are rejected instead of being computed on a single position
+    from lasagne.decoding import causal_conv_step
+    from lasagne.layers import CausalConv1DLayer
+    l_conv = CausalConv1DLayer(InputLayer((None, 2, 6)), 4, 2)
+    l_out = getattr(lasagne.layers, layer_class)(l_conv, **kwargs)
+    with pytest.raises(ValueError):
+        causal_conv_step(l_out, T.matrix(), [T.tensor3()], 0)
@@ -0,0 +1,39 @@
+import subprocess
+import sys
+
+import pytest
+
+
+def imported_modules(code):
+    # the lasagne and theano modules imported in a fresh interpreter
+    code += "; import sys; print(' '.join(sorted(sys.modules)))"
+    output = subprocess.check_output([sys.executable, '-c', code])
+    return set(output.decode().split())
+
+
+@pytest.fixture(scope='module')
+def network_modules():
+    return imported_modules("import lasagne; "
+                            "lasagne.layers.DenseLayer((None, 10), 5)")
+
+
+@pytest.mark.parametrize('module', [
+    'theano.sparse', 'theano.sandbox.rng_mrg', 'lasagne.decoding',
+    'lasagne.prediction', 'lasagne.profiling', 'lasagne.pruning',
+    'lasagne.quantization', 'lasagne.runtime', 'lasagne.serving'])
+def test_import_lasagne(network_modules, module):
+    # importing these takes a while and building a network does not need
+    # them, so they should wait until they are used
+    assert 'lasagne.layers' in network_modules
+    assert module not in network_modules
+
+
+def test_lazy_submodules():
+    import lasagne
+    modules = imported_modules("import lasagne; lasagne.serving")
+    assert 'lasagne.serving' in modules
+    assert 'serving' in dir(lasagne)
+    from lasagne.prediction import predict
+    assert lasagne.prediction.predict is predict
+    with pytest.raises(AttributeError):
+        lasagne.nonexistent
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+import theano
+
+from lasagne.layers import InputLayer, DenseLayer, ConcatLayer, get_output
+from lasagne.prediction import predict
+
+
+floatX = theano.config.floatX
+
+
+class RecordingFunction(object):
+    def __init__(self):
+        self.shapes = []
+
+    def __call__(self, x):
+        self.shapes.append(x.shape)
+        return x.sum(axis=1)
+
+
+@pytest.fixture
+def network():
+    l_in = InputLayer((None, 6))
+    return l_in, DenseLayer(l_in, 3)
+
+
+@pytest.mark.parametrize('num', [0, 1, 7, 16, 37])
+def test_predict(network, num):
+    l_in, l_out = network
+    x = np.random.rand(num, 6).astype(floatX)
+    result = predict(l_out, x, batch_size=16)
+    assert result.shape == (num, 3)
+    assert result.dtype == floatX
+    if num:
+        expected = get_output(l_out, x, deterministic=True).eval()
+        np.testing.assert_allclose(result, expected, rtol=1e-5)
+
+
+def test_fixed_batch_size():
+    function = RecordingFunction()
+    x = np.arange(50 * 4).reshape(50, 4)
+    result = predict(function, x, batch_size=16)
+    np.testing.assert_array_equal(result, x.sum(axis=1))
+    assert function.shapes == [(16, 4)] * 4
+
+
+def test_input_types(network):
+    # the batches are converted to the type of the input variable
+    l_in, l_out = network
+    x = np.arange(5 * 6).reshape(5, 6)
+    expected = get_output(l_out, x.astype(floatX)).eval()
+    np.testing.assert_allclose(predict(l_out, x, batch_size=4), expected,
+                               rtol=1e-5)
+
+
+def test_out(network):
+    l_in, l_out = network
+    x = np.random.rand(20, 6).astype(floatX)
+    out = np.empty((20, 3), dtype=floatX)
+    assert predict(l_out, x, batch_size=8, out=out) is out
+    np.testing.assert_allclose(out, predict(l_out, x), rtol=1e-5)
+    with pytest.raises(ValueError):
+        predict(l_out, x, out=np.empty((19, 3)))
+    with pytest.raises(ValueError):
+        predict(l_out, x, out=[out, out])
+
+
+def test_memmap(network, tmpdir):
+    l_in, l_out = network
+    x = np.random.rand(30, 6).astype(floatX)
+    np.save(str(tmpdir.join('x.npy')), x)
+    inputs = np.load(str(tmpdir.join('x.npy')), mmap_mode='r')
+    filename = str(tmpdir.join('y.npy'))
+    result = predict(l_out, inputs, batch_size=8, out=filename)
+    assert isinstance(result, np.memmap)
+    np.testing.assert_array_equal(np.load(filename), result)
+    np.testing.assert_allclose(result, predict(l_out, x), rtol=1e-5)
+
+
+def test_multiple_inputs_and_outputs():
+    l_in1 = InputLayer((None, 3))
+    l_in2 = InputLayer((None, 2))
+    l_concat = ConcatLayer([l_in1, l_in2])
+    l_dense = DenseLayer(l_concat, 4)
+    x1 = np.random.rand(9, 3).astype(floatX)
+    x2 = np.random.rand(9, 2).astype(floatX)
+    out = np.empty((9, 5), dtype=floatX)
+    dense, concat = predict([l_dense, l_concat], [x1, x2], batch_size=4,
+                            out=[None, out])
+    assert concat is out
+    np.testing.assert_array_equal(concat, np.hstack([x1, x2]))
+    expected = get_output(l_dense, {l_in1: x1, l_in2: x2}).eval()
+    np.testing.assert_allclose(dense, expected, rtol=1e-5)
+    with pytest.raises(ValueError):
+        predict(l_dense, [x1, x2[:5]])
+
+
+def test_executor(network):
+    from lasagne.runtime import export_network, Executor
+    l_in, l_out = network
+    x = np.random.rand(21, 6).astype(floatX)
+    executor = Executor(*export_network(l_out), batch_size=8)
+    np.testing.assert_allclose(predict(executor, x, batch_size=8),
+                               predict(l_out, x), rtol=1e-5)
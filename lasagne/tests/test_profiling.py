@@ -0,0 +1,218 @@
+import functools
+import json
+
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+import lasagne
+from lasagne.layers import (InputLayer, DenseLayer, DropoutLayer,
+                            ElemwiseSumLayer, get_output, get_all_params)
+from lasagne.profiling import (tagged_grad, profiling_mode, profile_layers,
+                               format_layer_profile, estimate_training_memory,
+                               plan_batch_size)
+
+
+def build_network():
+    l_in = InputLayer((None, 5))
+    l_hid = DenseLayer(l_in, 7, name='hidden')
+    l_drop = DropoutLayer(l_hid, name='dropout')
+    l_sum = ElemwiseSumLayer([l_drop, DenseLayer(l_in, 7, name='skip')],
+                             name='sum')
+    l_out = DenseLayer(l_sum, 3, name='output',
+                       nonlinearity=lasagne.nonlinearities.softmax)
+    return l_in, l_out
+
+
+def build_loss(l_out, tag_layers=True):
+    y = T.ivector('y')
+    prediction = get_output(l_out, deterministic=True, tag_layers=tag_layers)
+    loss = lasagne.objectives.categorical_crossentropy(prediction, y).mean()
+    loss += 1e-3 * lasagne.regularization.regularize_network_params(
+        l_out, lasagne.regularization.l2)
+    return y, loss
+
+
+def data():
+    rng = np.random.RandomState(0)
+    x = rng.randn(4, 5).astype(theano.config.floatX)
+    y = rng.randint(0, 3, 4).astype('int32')
+    return x, y
+
+
+def test_get_output_tags_layers():
+    l_in, l_out = build_network()
+    output = get_output(l_out, tag_layers=True)
+    assert output.tag.lasagne_layer is l_out
+    layers = set(node.tag.lasagne_layer for node in
+                 theano.gof.graph.io_toposort([l_in.input_var], [output]))
+    assert set(layer.name for layer in layers) == {
+        'hidden', 'dropout', 'skip', 'sum', 'output'}
+    untagged = get_output(l_out)
+    assert not any(hasattr(node.tag, 'lasagne_layer') for node in
+                   theano.gof.graph.io_toposort([l_in.input_var],
+                                                [untagged]))
+
+
+@pytest.mark.parametrize('tag_layers', [True, False])
+def test_tagged_grad(tag_layers):
+    l_in, l_out = build_network()
+    y, loss = build_loss(l_out, tag_layers)
+    params = get_all_params(l_out, trainable=True)
+    fn = theano.function([l_in.input_var, y],
+                         tagged_grad(loss, params) +
+                         [tagged_grad(loss, params[0])] +
+                         theano.grad(loss, params))
+    results = fn(*data())
+    for actual, desired in zip(results[:len(params)],
+                               results[-len(params):]):
+        assert np.allclose(actual, desired)
+    assert np.allclose(results[len(params)], results[0])
+
+
+def test_tagged_grad_tags_backward_pass():
+    l_in, l_out = build_network()
+    y, loss = build_loss(l_out)
+    params = get_all_params(l_out, trainable=True)
+    grads = tagged_grad(loss, params)
+    nodes = theano.gof.graph.io_toposort([l_in.input_var, y], grads)
+    tags = set((node.tag.lasagne_layer.name, node.tag.lasagne_pass)
+               for node in nodes if hasattr(node.tag, 'lasagne_layer'))
+    for name in 'hidden', 'skip', 'output':
+        assert (name, 'forward') in tags
+        assert (name, 'backward') in tags
+    # the gradient of a sum passes through unchanged
+    assert ('sum', 'forward') in tags
+
+
+def test_tagged_grad_disconnected():
+    l_in, l_out = build_network()
+    y, loss = build_loss(l_out)
+    with pytest.raises(theano.gradient.DisconnectedInputError):
+        tagged_grad(loss, [theano.shared(np.float32(0))])
+
+
+def test_profile_layers(tmpdir):
+    l_in, l_out = build_network()
+    y, loss = build_loss(l_out)
+    params = get_all_params(l_out, trainable=True)
+    updates = lasagne.updates.sgd(tagged_grad(loss, params), params, 0.1)
+    fn = theano.function([l_in.input_var, y], loss, updates=updates,
+                         mode=profiling_mode(), profile=True)
+    json_file = str(tmpdir.join('profile.json'))
+    report = profile_layers(fn, data(), num_iterations=3,
+                            json_file=json_file)
+
+    assert [row['time'] for row in report] == sorted(
+        (row['time'] for row in report), reverse=True)
+    assert np.isclose(sum(row['fraction'] for row in report), 1)
+    assert sum(row['nodes'] for row in report) == len(
+        fn.maker.fgraph.apply_nodes)
+    keys = set((row['layer'], row['pass']) for row in report)
+    for name in 'hidden', 'skip', 'output':
+        assert (name, 'forward') in keys
+        assert (name, 'backward') in keys
+    types = dict((row['layer'], row['type']) for row in report)
+    assert types['hidden'] == 'DenseLayer'
+    assert types['(unattributed)'] is None
+    assert all(row['memory'] is None for row in report)
+
+    with open(json_file) as f:
+        stored = json.load(f)
+    assert stored['num_iterations'] == 3
+    assert stored['call_time'] > 0
+    assert stored['layers'] == json.loads(json.dumps(report))
+
+    table = format_layer_profile(report, sort_by='layer').splitlines()
+    assert table[0].split() == ['layer', 'type', 'pass', 'time', 'fraction',
+                                'nodes', 'memory']
+    assert len(table) == len(report) + 1
+    assert table[1].startswith('(unattributed)')
+
+
+def test_profile_layers_requires_profile():
+    x = T.vector()
+    fn = theano.function([x], 2 * x)
+    with pytest.raises(ValueError):
+        profile_layers(fn, [np.ones(3, dtype=theano.config.floatX)])
+
+
+def test_estimate_training_memory():
+    l_in = InputLayer((None, 5))
+    l_out = DenseLayer(l_in, 7)
+    itemsize = np.dtype(theano.config.floatX).itemsize
+    estimate = estimate_training_memory(l_out, 10)
+    assert estimate['params'] == estimate['gradients'] == 42 * itemsize
+    assert estimate['optimizer_state'] == 0
+    # input and output
+    assert estimate['activations'] == (50 + 70) * itemsize
+    # gradients of the output, input and parameters of the dense layer
+    assert estimate['workspace'] == (70 + 50) * itemsize
+    assert estimate['total'] == sum(v for k, v in estimate.items()
+                                    if k != 'total')
+
+    adam = estimate_training_memory(l_out, 10, lasagne.updates.adam)
+    # two moments per parameter and the time step
+    assert adam['optimizer_state'] == 2 * estimate['params'] + itemsize
+    assert len(get_all_params(l_out)) == 2
+
+    with pytest.raises(ValueError):
+        estimate_training_memory(DenseLayer(InputLayer((None, None)), 3), 10)
+
+
+def test_plan_batch_size():
+    l_in, l_out = build_network()
+    estimate = functools.partial(estimate_training_memory, l_out)
+    limit = estimate(100)['total']
+
+    plan = plan_batch_size(l_out, limit, probe=False)
+    assert plan['batch_size'] == 100
+    sizes = [c['batch_size'] for c in plan['candidates']]
+    assert sizes == [1, 2, 4, 8, 16, 32, 64, 100]
+    assert all(c['fits'] and c['samples_per_second'] is None
+               for c in plan['candidates'])
+
+    plan = plan_batch_size(l_out, limit, batch_sizes=[4, 200, 50],
+                           probe=False)
+    assert plan['batch_size'] == 50
+    assert [c['fits'] for c in plan['candidates']] == [True, True, False]
+
+    assert plan_batch_size(l_out, 10, probe=False)['batch_size'] is None
+
+
+def test_plan_batch_size_probe():
+    l_in, l_out = build_network()
+    params = get_all_params(l_out)
+    values = [p.get_value() for p in params]
+    plan = plan_batch_size(l_out, 2 ** 40, lasagne.updates.adam,
+                           batch_sizes=[2, 8], num_iterations=1)
+    assert plan['batch_size'] in (2, 8)
+    for candidate in plan['candidates']:
+        assert candidate['fits']
+        assert candidate['samples_per_second'] > 0
+        assert candidate['measured_bytes'] is None or (
+            candidate['measured_bytes'] > 0)
+    for p, value in zip(params, values):
+        assert np.all(p.get_value() == value)
+
+
+def test_plan_batch_size_probe_memory(monkeypatch):
+    import lasagne.profiling
+    l_in, l_out = build_network()
+    known_bytes = sum(p.get_value().nbytes for p in get_all_params(l_out))
+    monkeypatch.setattr(lasagne.profiling, '_current_memory', lambda: 1000)
+    # an earlier, higher peak of the process hides the peak of the probe
+    monkeypatch.setattr(lasagne.profiling, '_peak_memory', lambda: 10 ** 12)
+    plan = plan_batch_size(l_out, 2 ** 40, batch_sizes=[2, 8],
+                           num_iterations=1)
+    assert [c['measured_bytes'] for c in plan['candidates']] == [None, None]
+    assert all(c['fits'] for c in plan['candidates'])
+    # a peak raised by a candidate is measured from the current memory
+    peaks = iter([5000, 6000, 6000, 9000])
+    monkeypatch.setattr(lasagne.profiling, '_peak_memory',
+                        lambda: next(peaks))
+    plan = plan_batch_size(l_out, 2 ** 40, batch_sizes=[2, 8],
+                           num_iterations=1)
+    assert [c['measured_bytes'] for c in plan['candidates']] == [
+        5000 + known_bytes, 8000 + known_bytes]
@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+import theano
+
+from lasagne.layers import (InputLayer, DenseLayer, SparseDenseLayer,
+                            NonlinearityLayer, get_all_layers, get_output)
+from lasagne.pruning import (magnitude_mask, prune_network, gradual_sparsity,
+                             sparsify_network)
+
+
+floatX = theano.config.floatX
+
+
+def test_magnitude_mask():
+    W = np.array([[0.5, -3, 0], [2, -0.1, 0]])
+    np.testing.assert_array_equal(magnitude_mask(W, 0.5),
+                                  [[True, True, False], [True, False, False]])
+    # ties are pruned in C order
+    np.testing.assert_array_equal(magnitude_mask(W, 1 / 6.),
+                                  [[True, True, False], [True, True, True]])
+    assert magnitude_mask(W, 0).all()
+    assert not magnitude_mask(W, 1).any()
+    with pytest.raises(ValueError):
+        magnitude_mask(W, 1.5)
+
+
+def build_network():
+    l_in = InputLayer((None, 40))
+    l_hid = DenseLayer(l_in, 50, name='hid')
+    l_out = NonlinearityLayer(DenseLayer(l_hid, 10, name='out'), name='nl')
+    return l_in, l_hid, l_out
+
+
+def test_prune_network():
+    l_in, l_hid, l_out = build_network()
+    l_dense = l_out.input_layer
+    values = dict((layer, layer.W.get_value()) for layer in (l_hid, l_dense))
+    masks = prune_network(l_out, 0.8)
+    assert set(masks) == set([l_hid, l_dense])
+    for layer, W in values.items():
+        pruned = layer.W.get_value()
+        assert np.count_nonzero(pruned) == W.size // 5
+        np.testing.assert_array_equal(pruned, W * masks[layer])
+        np.testing.assert_array_equal(masks[layer], magnitude_mask(W, 0.8))
+
+    masks = prune_network(l_out, 0.9, layers=[l_hid])
+    assert list(masks) == [l_hid]
+    assert np.count_nonzero(l_hid.W.get_value()) == 200
+    assert np.count_nonzero(l_dense.W.get_value()) == 100
+
+
+def test_gradual_sparsity():
+    schedule = [gradual_sparsity(step, 0.9, 2, 6, initial_sparsity=0.1)
+                for step in range(10)]
+    assert schedule[:3] == [0.1] * 3
+    assert schedule[6:] == [0.9] * 4
+    assert np.all(np.diff(schedule[2:7]) > 0)
+    # it rises quickly at first
+    assert np.all(np.diff(schedule[2:7], 2) < 0)
+    assert np.isclose(schedule[4], 0.9 - 0.8 / 8)
+    assert gradual_sparsity(1, 0.5, 0, 2, exponent=1) == 0.25
+    with pytest.raises(ValueError):
+        gradual_sparsity(0, 0.5, 2, 2)
+
+
+def test_sparsify_network():
+    l_in, l_hid, l_out = build_network()
+    prune_network(l_out, 0.9, layers=[l_hid])
+    x = np.random.randn(5, 40).astype(floatX)
+    expected = get_output(l_out, x).eval()
+
+    sparse, report = sparsify_network(l_out, batch_size=5, min_speedup=0,
+                                      number=1, repeat=1)
+    assert [row['layer'] for row in report] == ['hid', 'out']
+    assert report[0]['sparse'] and report[0]['density'] == 0.1
+    assert report[0]['dense_time'] > 0 and report[0]['sparse_time'] > 0
+    # layers without zeros are never converted
+    assert report[1] == {'layer': 'out', 'density': 1., 'dense_time': None,
+                         'sparse_time': None, 'sparse': False}
+
+    layers = get_all_layers(sparse)
+    assert layers[0] is l_in
+    assert type(layers[1]) is SparseDenseLayer and layers[1].name == 'hid'
+    assert layers[1].b is l_hid.b
+    assert layers[2] is not l_out.input_layer
+    assert layers[2].W is l_out.input_layer.W
+    assert get_all_layers(l_out)[1] is l_hid
+    np.testing.assert_allclose(get_output(sparse, x).eval(), expected,
+                               rtol=1e-5, atol=1e-5)
+
+
+def test_sparsify_network_min_speedup():
+    l_in, l_hid, l_out = build_network()
+    prune_network(l_out, 0.9)
+    sparse, report = sparsify_network(l_out, min_speedup=np.inf, number=1,
+                                      repeat=1)
+    assert sparse is l_out
+    assert not any(row['sparse'] for row in report)
+
+
+def test_sparsify_network_invalid():
+    l_in, l_hid, l_out = build_network()
+    with pytest.raises(ValueError):
+        sparsify_network(l_out, layers=[l_out])
@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+import theano
+
+import lasagne
+from lasagne.layers import (InputLayer, DenseLayer, NINLayer, Conv2DLayer,
+                            MaxPool2DLayer, DropoutLayer, ElemwiseSumLayer,
+                            QuantizedDenseLayer, QuantizedNINLayer,
+                            QuantizedConv2DLayer, get_all_layers,
+                            get_all_params, get_output)
+from lasagne.quantization import (quantize_weights, quantize_network,
+                                  format_quantization_report)
+
+
+floatX = theano.config.floatX
+
+
+def test_quantize_weights():
+    rng = np.random.RandomState(0)
+    W = rng.randn(5, 4, 3).astype(floatX)
+    W[:, 2] = 0
+    W_q, W_scale = quantize_weights(W, axis=1)
+    assert W_q.dtype == np.int8
+    assert W_scale.shape == (4,)
+    assert W_scale.dtype == W.dtype
+    assert W_scale[2] == 1
+    assert np.abs(W_q).max() == 127
+    np.testing.assert_array_equal(np.abs(W_q).max(axis=(0, 2)),
+                                  [127, 127, 0, 127])
+    error = np.abs(W_q * W_scale[:, None] - W)
+    assert np.all(error <= W_scale[:, None] / 2 + 1e-6)
+    W_q, W_scale = quantize_weights(W, axis=-1)
+    assert W_scale.shape == (3,)
+
+
+def build_network():
+    l_in = InputLayer((None, 3, 8, 8))
+    layer = Conv2DLayer(l_in, 8, 3, pad='same', name='conv')
+    layer = MaxPool2DLayer(layer, 2)
+    layer = NINLayer(layer, 6, name='nin')
+    l_skip = DenseLayer(layer, 10, name='skip', nonlinearity=None)
+    layer = DenseLayer(DropoutLayer(layer), 10, name='dense',
+                       nonlinearity=None)
+    layer = ElemwiseSumLayer([layer, l_skip], name='sum')
+    layer = lasagne.layers.NonlinearityLayer(
+        layer, lasagne.nonlinearities.softmax, name='output')
+    return l_in, layer
+
+
+def data():
+    return np.random.RandomState(0).randn(50, 3, 8, 8).astype(floatX)
+
+
+def test_quantize_network():
+    l_in, l_out = build_network()
+    originals = get_all_layers(l_out)
+    x = data()
+    quantized, report = quantize_network(l_out, x, batch_size=16)
+
+    # the original network is unchanged
+    assert get_all_layers(l_out) == originals
+    layers = get_all_layers(quantized)
+    assert layers[0] is l_in
+    types = dict((layer.name, type(layer)) for layer in layers)
+    assert types['conv'] is QuantizedConv2DLayer
+    assert types['nin'] is QuantizedNINLayer
+    assert types['dense'] is types['skip'] is QuantizedDenseLayer
+    assert quantized is not l_out and quantized.name == 'output'
+    assert get_all_params(quantized, trainable=True) == []
+
+    assert [row['layer'] for row in report] == ['conv', 'nin', 'dense',
+                                                'skip', 'output']
+    for row in report[:-1]:
+        assert row['quantized_weight_bytes'] < row['weight_bytes'] / 2
+        assert row['input_scale'] > 0
+        assert row['relative_error'] < 0.05
+        assert 0 < row['mean_error'] <= row['max_error']
+    assert report[-1]['input_scale'] is None
+    assert report[-1]['agreement'] > 0.9
+    assert report[0]['agreement'] is None
+    # the input scale covers the calibration data
+    assert np.isclose(report[0]['input_scale'], np.abs(x).max() / 127)
+
+    predict = theano.function([l_in.input_var],
+                              get_output(quantized, deterministic=True))
+    expected = theano.function([l_in.input_var],
+                               get_output(l_out, deterministic=True))(x)
+    np.testing.assert_allclose(predict(x), expected, atol=0.05)
+
+    table = format_quantization_report(report).splitlines()
+    assert len(table) == 6
+    assert table[0].split()[:2] == ['layer', 'type']
+
+
+def test_restore_quantized_network():
+    # the quantized values of one network can be loaded into another
+    l_in, l_out = build_network()
+    quantized, _ = quantize_network(l_out, data())
+    values = lasagne.layers.get_all_param_values(quantized)
+    for param in get_all_params(l_out, trainable=True):
+        param.set_value(param.get_value() + 0.5)
+    restored, _ = quantize_network(l_out, data())
+    lasagne.layers.set_all_param_values(restored, values)
+    x = data()
+    np.testing.assert_array_equal(
+        get_output(restored, x, deterministic=True).eval(),
+        get_output(quantized, x, deterministic=True).eval())
+
+
+def test_quantize_network_subset():
+    l_in, l_out = build_network()
+    dense = [layer for layer in get_all_layers(l_out)
+             if layer.name == 'dense'][0]
+    quantized, report = quantize_network(l_out, {l_in: data()},
+                                         layers=[dense])
+    assert [row['layer'] for row in report] == ['dense', 'output']
+    layers = get_all_layers(quantized)
+    # layers not depending on the quantized one are shared
+    assert [layer for layer in layers if layer.name == 'skip'][0] in \
+        get_all_layers(l_out)
+    assert sum(isinstance(layer, QuantizedDenseLayer)
+               for layer in layers) == 1
+
+
+def test_quantize_output_layer():
+    l_in = InputLayer((None, 5))
+    l_out = DenseLayer(l_in, 3)
+    quantized, report = quantize_network(
+        l_out, np.ones((4, 5), dtype=floatX))
+    assert isinstance(quantized, QuantizedDenseLayer)
+    assert len(report) == 1
+
+
+def test_quantize_network_errors():
+    l_in, l_out = build_network()
+    with pytest.raises(ValueError):
+        quantize_network(l_out, data(), layers=[l_out])
+    with pytest.raises(ValueError):
+        quantize_network(l_out, {})
+    l_in2 = InputLayer((None, 10))
+    l_sum = ElemwiseSumLayer([l_out, l_in2])
+    with pytest.raises(ValueError):
+        quantize_network(l_sum, data())
@@ -0,0 +1,262 @@
+import imp
+import sys
+
+import numpy as np
+import pytest
+import theano
+import theano.tensor as T
+
+import lasagne
+from lasagne.layers import (InputLayer, DenseLayer, NINLayer, Conv1DLayer,
+                            Conv2DLayer, Pool1DLayer, Pool2DLayer,
+                            MaxPool2DLayer, GlobalPoolLayer, BatchNormLayer,
+                            BiasLayer, ScaleLayer, NonlinearityLayer,
+                            EmbeddingLayer, ConcatLayer, ElemwiseSumLayer,
+                            ElemwiseMergeLayer, ReshapeLayer, FlattenLayer,
+                            DimshuffleLayer, SliceLayer, DropoutLayer,
+                            GaussianNoiseLayer, LSTMLayer, GRULayer,
+                            DilatedConv2DLayer, get_output, get_all_params)
+from lasagne.runtime import (export_network, save_network, load_network,
+                             Executor)
+
+
+floatX = theano.config.floatX
+
+
+def randomize(layer, seed=0):
+    # non-trivial values for all parameters, including biases, batch
+    # normalization statistics and initial states
+    rng = np.random.RandomState(seed)
+    for param in get_all_params(layer):
+        value = param.get_value()
+        param.set_value(rng.uniform(0.5, 1, value.shape).astype(value.dtype)
+                        if param.name == 'inv_std' else
+                        rng.uniform(-0.5, 0.5, value.shape).astype(
+                            value.dtype))
+
+
+def check(layer, inputs, atol=1e-5, **executor_kwargs):
+    randomize(layer)
+    input_layers = [l_in for l_in in lasagne.layers.get_all_layers(layer)
+                    if isinstance(l_in, InputLayer)]
+    expected = theano.function(
+        [l_in.input_var for l_in in input_layers],
+        get_output(layer, deterministic=True),
+        on_unused_input='ignore')(*inputs)
+    plan, params = export_network(layer)
+    executor = Executor(plan, params, batch_size=inputs[0].shape[0],
+                        **executor_kwargs)
+    np.testing.assert_allclose(executor(*inputs), expected, atol=atol,
+                               rtol=1e-4)
+    # the buffers are reused: running again gives the same results
+    np.testing.assert_allclose(executor(*inputs), expected, atol=atol,
+                               rtol=1e-4)
+    return plan, executor
+
+
+def image(*shape):
+    return np.random.RandomState(1).randn(*shape).astype(floatX)
+
+
+@pytest.mark.parametrize('nonlinearity', [
+    lasagne.nonlinearities.rectify, lasagne.nonlinearities.sigmoid,
+    lasagne.nonlinearities.tanh, lasagne.nonlinearities.softmax,
+    lasagne.nonlinearities.elu, lasagne.nonlinearities.softplus,
+    lasagne.nonlinearities.linear, lasagne.nonlinearities.leaky_rectify,
+    lasagne.nonlinearities.ScaledTanH(0.5, 2.4)])
+def test_dense(nonlinearity):
+    l_in = InputLayer((None, 6))
+    check(DenseLayer(l_in, 5, nonlinearity=nonlinearity), [image(4, 6)])
+
+
+def test_dense_leading_axes_and_nin():
+    l_in = InputLayer((None, 3, 4, 5))
+    check(DenseLayer(l_in, 6, num_leading_axes=2), [image(2, 3, 4, 5)])
+    check(DenseLayer(l_in, 6, b=None), [image(2, 3, 4, 5)])
+    check(NINLayer(l_in, 7), [image(2, 3, 4, 5)])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(), dict(pad='same'), dict(pad='full', stride=2),
+    dict(pad=(1, 2), flip_filters=False), dict(untie_biases=True),
+    dict(num_groups=3, pad=1), dict(b=None)])
+def test_conv2d(kwargs):
+    l_in = InputLayer((None, 6, 8, 7))
+    check(Conv2DLayer(l_in, 9, 3, **kwargs), [image(2, 6, 8, 7)])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(), dict(pad='same', stride=2), dict(untie_biases=True)])
+def test_conv1d(kwargs):
+    l_in = InputLayer((None, 4, 10))
+    check(Conv1DLayer(l_in, 5, 3, **kwargs), [image(3, 4, 10)])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(pool_size=2), dict(pool_size=3, stride=2),
+    dict(pool_size=3, ignore_border=False), dict(pool_size=2, pad=1),
+    dict(pool_size=3, pad=1, mode='average_inc_pad'),
+    dict(pool_size=3, pad=1, stride=2, mode='average_exc_pad')])
+def test_pool2d(kwargs):
+    l_in = InputLayer((None, 3, 7, 8))
+    check(Pool2DLayer(l_in, **kwargs), [image(2, 3, 7, 8)])
+
+
+def test_pool1d_and_global_pool():
+    check(Pool1DLayer(InputLayer((None, 3, 9)), 2), [image(2, 3, 9)])
+    l_in = InputLayer((None, 3, 4, 5))
+    for function in T.mean, T.max, T.sum:
+        check(GlobalPoolLayer(l_in, function), [image(2, 3, 4, 5)])
+
+
+def test_affine_layers():
+    l_in = InputLayer((None, 3, 4, 5))
+    check(BatchNormLayer(l_in), [image(2, 3, 4, 5)])
+    check(BatchNormLayer(l_in, axes=(0, 1), beta=None), [image(2, 3, 4, 5)])
+    check(BiasLayer(l_in), [image(2, 3, 4, 5)])
+    check(ScaleLayer(l_in, shared_axes=(0, 2)), [image(2, 3, 4, 5)])
+
+
+def test_convnet():
+    l_in = InputLayer((None, 3, 12, 12))
+    layer = Conv2DLayer(l_in, 8, 3, pad='same', nonlinearity=None)
+    layer = lasagne.layers.batch_norm(layer)
+    layer = MaxPool2DLayer(layer, 2)
+    layer = DropoutLayer(layer)
+    layer = Conv2DLayer(layer, 8, 3)
+    layer = FlattenLayer(layer)
+    layer = GaussianNoiseLayer(layer)
+    layer = DenseLayer(layer, 10, nonlinearity=lasagne.nonlinearities.softmax)
+    plan, _ = check(layer, [image(5, 3, 12, 12)])
+    assert [op['op'] for op in plan['ops']] == [
+        'conv', 'affine', 'nonlinearity', 'pool', 'identity', 'conv',
+        'flatten', 'identity', 'dense']
+
+
+def test_merge_and_shape_layers():
+    l_in = InputLayer((None, 4, 6))
+    l_a = DenseLayer(l_in, 6, num_leading_axes=2)
+    l_b = NonlinearityLayer(l_in, lasagne.nonlinearities.tanh)
+    check(ConcatLayer([l_a, l_b], axis=1), [image(2, 4, 6)])
+    check(ConcatLayer([l_a, l_b], axis=-1), [image(2, 4, 6)])
+    check(ElemwiseSumLayer([l_a, l_b, l_in], coeffs=[1, -0.5, 2]),
+          [image(2, 4, 6)])
+    check(ElemwiseMergeLayer([l_a, l_b], T.maximum), [image(2, 4, 6)])
+    check(ReshapeLayer(l_a, ([0], -1, 3)), [image(2, 4, 6)])
+    check(DimshuffleLayer(l_a, (2, 'x', 0, 1)), [image(2, 4, 6)])
+    check(DimshuffleLayer(ReshapeLayer(l_a, ([0], 1, 24)), (0, 2)),
+          [image(2, 4, 6)])
+    check(SliceLayer(l_a, 1, axis=1), [image(2, 4, 6)])
+    check(SliceLayer(l_a, slice(-4, None, 2), axis=-1), [image(2, 4, 6)])
+
+
+def test_embedding():
+    l_in = InputLayer((None, 5), input_var=T.imatrix())
+    tokens = np.random.RandomState(0).randint(0, 10, (3, 5)).astype('int32')
+    check(DenseLayer(EmbeddingLayer(l_in, 10, 4), 3), [tokens])
+
+
+@pytest.mark.parametrize('kwargs', [
+    dict(), dict(backwards=True), dict(only_return_final=True),
+    dict(backwards=True, only_return_final=True), dict(peepholes=False),
+    dict(nonlinearity=lasagne.nonlinearities.rectify)])
+@pytest.mark.parametrize('mask', [False, True])
+@pytest.mark.parametrize('layer_class', [LSTMLayer, GRULayer])
+def test_recurrent(layer_class, kwargs, mask):
+    kwargs = dict(kwargs)
+    if layer_class is GRULayer:
+        kwargs.pop('peepholes', None)
+        kwargs.pop('nonlinearity', None)
+    l_in = InputLayer((None, None, 3), name='input')
+    inputs = [image(4, 6, 3)]
+    l_mask = None
+    if mask:
+        l_mask = InputLayer((None, None), name='mask')
+        lengths = np.array([6, 2, 4, 1])
+        inputs.append((np.arange(6) < lengths[:, None]).astype(floatX))
+    layer = layer_class(l_in, 5, mask_input=l_mask, **kwargs)
+    input_shapes = dict(zip(('input', 'mask'), [x.shape for x in inputs]))
+    check(layer, inputs, input_shapes=input_shapes)
+
+
+def test_save_and_load(tmpdir):
+    l_in = InputLayer((None, 6), name='input')
+    l_out = DenseLayer(DenseLayer(l_in, 5, name='hidden'), 2, name='output')
+    randomize(l_out)
+    plan, params = export_network([l_out, l_out.input_layer])
+    assert plan['inputs'] == [{'name': 'input', 'shape': [None, 6],
+                               'dtype': floatX}]
+    assert plan['outputs'] == ['output', 'hidden']
+    assert plan['ops'][0]['params'] == {'W': 'hidden.W', 'b': 'hidden.b'}
+    filename = str(tmpdir.join('network.npz'))
+    save_network(filename, plan, params)
+    loaded_plan, loaded_params = load_network(filename)
+    assert loaded_plan == plan
+    assert sorted(loaded_params) == sorted(params)
+    x = image(3, 6)
+    out, hidden = Executor(loaded_plan, loaded_params, batch_size=3)(x)
+    np.testing.assert_allclose(
+        out, theano.function([l_in.input_var], get_output(l_out))(x),
+        rtol=1e-5)
+
+
+def test_no_allocations_at_steady_state():
+    tracemalloc = pytest.importorskip('tracemalloc')
+    l_in = InputLayer((None, 3, 16, 16))
+    layer = Conv2DLayer(l_in, 16, 3, pad='same')
+    layer = MaxPool2DLayer(BatchNormLayer(layer), 2)
+    layer = DenseLayer(layer, 64)
+    layer = DenseLayer(layer, 10, nonlinearity=lasagne.nonlinearities.softmax)
+    plan, params = export_network(layer)
+    executor = Executor(plan, params, batch_size=32)
+    x = image(32, 3, 16, 16)
+    executor(x)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        executor(x)
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    # NumPy's ufuncs may use a fixed-size iteration buffer when broadcasting,
+    # but no memory grows with the size of the activations
+    itemsize = np.dtype(floatX).itemsize
+    assert peak - before < 2 * np.getbufsize() * itemsize
+    # the first convolution alone outputs 32 * 16 * 16 * 16 values
+    assert peak - before < 32 * 16 * 16 * 16 * itemsize / 10
+    assert current - before < 1024
+
+
+def test_errors():
+    l_in = InputLayer((None, 3, 8, 8))
+    with pytest.raises(NotImplementedError):
+        export_network(DilatedConv2DLayer(l_in, 4, 3))
+    with pytest.raises(NotImplementedError):
+        export_network(DenseLayer(l_in, 4, nonlinearity=T.exp))
+    with pytest.raises(ValueError):
+        export_network(DenseLayer((None, 3), 4))
+    plan, params = export_network(DenseLayer(l_in, 4))
+    with pytest.raises(ValueError):
+        Executor(plan, params)
+    executor = Executor(plan, params, batch_size=2)
+    with pytest.raises(ValueError):
+        executor(image(3, 3, 8, 8))
+    with pytest.raises(ValueError):
+        executor()
+
+
+def test_runtime_without_lasagne(tmpdir):
+    # the module can be loaded from its file without importing the package
+    module = imp.load_source('standalone_runtime',
+                             lasagne.runtime.__file__.replace('.pyc', '.py'))
+    try:
+        l_in = InputLayer((None, 4))
+        layer = DenseLayer(l_in, 3)
+        plan, params = export_network(layer)
+        x = image(2, 4)
+        np.testing.assert_allclose(
+            module.Executor(plan, params, batch_size=2)(x),
+            Executor(plan, params, batch_size=2)(x))
+        assert 'theano' not in module.__dict__
+    finally:
+        del sys.modules['standalone_runtime']
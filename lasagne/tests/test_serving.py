@@ -0,0 +1,200 @@
+import threading
+
+import numpy as np
+import pytest
+import theano
+
+from lasagne.layers import (InputLayer, DenseLayer, ConcatLayer, get_output)
+from lasagne.serving import BatchingServer
+
+
+floatX = theano.config.floatX
+
+
+class GatedFunction(object):
+    """
+    Doubles its input, recording the batch shapes, and blocks each call until
+    the gate is opened, so requests queue up in the meantime.
+    """
+    def __init__(self):
+        self.gate = threading.Event()
+        self.shapes = []
+        self.called = threading.Event()
+
+    def __call__(self, x):
+        self.shapes.append(x.shape)
+        self.called.set()
+        self.gate.wait()
+        if np.isnan(x).any():
+            raise FloatingPointError("NaN input")
+        return 2 * x
+
+
+def test_predict():
+    l_in = InputLayer((None, 20))
+    l_out = DenseLayer(l_in, 5)
+    examples = np.random.rand(50, 20).astype(floatX)
+    expected = get_output(l_out, examples, deterministic=True).eval()
+    with BatchingServer(l_out, batch_sizes=(1, 8, 32)) as server:
+        assert server.running
+        results = [None] * len(examples)
+
+        def client(indices):
+            for i in indices:
+                results[i] = server.predict(examples[i])
+        threads = [threading.Thread(target=client,
+                                    args=(range(start, 50, 5),))
+                   for start in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = server.stats()
+    assert not server.running
+    for result, row in zip(results, expected):
+        assert result.shape == (5,)
+        np.testing.assert_allclose(result, row, rtol=1e-5)
+    assert stats['requests'] == 50
+    assert sum(stats['batch_sizes'].values()) == stats['batches']
+    assert set(stats['batch_sizes']) == set([1, 8, 32])
+    assert stats['mean_batch'] == 50. / stats['batches']
+    assert 0 < stats['batch_fill'] <= 1
+    latency = stats['latency']
+    assert sorted(latency) == [50, 90, 99]
+    assert 0 < latency[50] <= latency[90] <= latency[99]
+
+
+def test_batching():
+    function = GatedFunction()
+    server = BatchingServer(function, batch_sizes=(1, 4, 8), max_delay=0)
+    server.start()
+    first = server.submit(np.zeros(3))
+    function.called.wait()
+    # these queue up while the first batch is computed
+    requests = [server.submit(np.full(3, i, dtype=float))
+                for i in range(1, 6)]
+    with pytest.raises(RuntimeError):
+        first.result(timeout=0.01)
+    assert not first.done()
+    function.gate.set()
+    np.testing.assert_array_equal(first.result(), np.zeros(3))
+    for i, request in enumerate(requests):
+        np.testing.assert_array_equal(request.result(), 2 * (i + 1))
+        assert request.latency > 0
+    server.stop()
+
+    assert function.shapes == [(1, 3), (8, 3)]
+    stats = server.stats()
+    assert stats['requests'] == 6
+    assert stats['batches'] == 2
+    assert stats['batch_sizes'] == {1: 1, 4: 0, 8: 1}
+    assert stats['mean_batch'] == 3
+    assert stats['batch_fill'] == 6 / 9.
+    server.reset_stats()
+    stats = server.stats()
+    assert stats['requests'] == 0 and np.isnan(stats['batch_fill'])
+    assert np.isnan(stats['latency'][50])
+
+
+def test_max_delay():
+    function = GatedFunction()
+    function.gate.set()
+    with BatchingServer(function, batch_sizes=(1, 4), max_delay=0.05) as s:
+        request = s.submit(np.ones(2))
+        request.result()
+        assert request.latency >= 0.05
+        # a full batch is computed at once
+        requests = [s.submit(np.ones(2)) for i in range(4)]
+        for request in requests:
+            request.result()
+    assert function.shapes[0] == (1, 2)
+    assert (4, 2) in function.shapes
+
+
+def test_multiple_inputs_and_outputs():
+    l_in1 = InputLayer((None, 3))
+    l_in2 = InputLayer((None, 2), input_var=theano.tensor.imatrix())
+    l_concat = ConcatLayer([l_in1, l_in2])
+    l_dense = DenseLayer(l_concat, 4)
+    with BatchingServer([l_dense, l_concat], batch_sizes=(2,)) as server:
+        x1 = np.arange(3, dtype=floatX)
+        x2 = np.array([4, 5])
+        dense, concat = server.predict(x1, x2)
+        with pytest.raises(ValueError):
+            server.submit(x1)
+        with pytest.raises(ValueError):
+            server.submit(x2, x2)
+    np.testing.assert_allclose(concat, [0, 1, 2, 4, 5])
+    expected = get_output(l_dense, {l_in1: x1[None],
+                                    l_in2: x2[None].astype('int32')}).eval()
+    np.testing.assert_allclose(dense, expected[0], rtol=1e-5)
+
+
+def test_errors():
+    with pytest.raises(ValueError):
+        BatchingServer(DenseLayer(InputLayer((None, None)), 3))
+    with pytest.raises(ValueError):
+        BatchingServer(lambda x: x, batch_sizes=(0, 2))
+    server = BatchingServer(lambda x: x)
+    with pytest.raises(RuntimeError):
+        server.submit(np.ones(3))
+
+
+def test_exception():
+    function = GatedFunction()
+    function.gate.set()
+    with BatchingServer(function, max_delay=0) as server:
+        request = server.submit(np.full(3, np.nan))
+        with pytest.raises(FloatingPointError):
+            request.result()
+        assert isinstance(request.exception(), FloatingPointError)
+        assert server.predict(np.ones(3)).tolist() == [2, 2, 2]
+        assert server.submit(np.ones(3)).exception() is None
+
+
+def test_stop_computes_queued_requests():
+    function = GatedFunction()
+    server = BatchingServer(function, batch_sizes=(1,))
+    server.start()
+    requests = [server.submit(np.ones(2)) for i in range(3)]
+    function.called.wait()
+    threading.Timer(0.05, function.gate.set).start()
+    server.stop()
+    assert all(request.done() for request in requests)
+    assert function.shapes == [(1, 2)] * 3
+
+
+def test_callbacks():
+    function = GatedFunction()
+    done = []
+    with BatchingServer(function) as server:
+        request = server.submit(np.ones(2))
+        request.add_done_callback(done.append)
+        request.add_done_callback(None)
+        with pytest.warns(UserWarning):
+            function.gate.set()
+            request.result()
+            server.stop()
+        request.add_done_callback(done.append)
+    assert done == [request, request]
+
+
+def test_predict_async():
+    asyncio = pytest.importorskip('asyncio')
+    function = GatedFunction()
+    function.gate.set()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with BatchingServer(function, batch_sizes=(1, 8)) as server:
+            futures = [server.predict_async(np.full(2, i, dtype=float))
+                       for i in range(5)]
+            results = loop.run_until_complete(asyncio.gather(*futures))
+            future = server.predict_async(np.full(2, np.nan))
+            with pytest.raises(FloatingPointError):
+                loop.run_until_complete(future)
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    for i, result in enumerate(results):
+        np.testing.assert_array_equal(result, [2 * i, 2 * i])
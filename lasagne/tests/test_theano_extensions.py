@@ -1,5 +1,6 @@
 import pytest
 import numpy as np
+import theano
 import theano.tensor as T
 import lasagne
 
@@ -153,3 +154,257 @@ def test_pad_width_per_border(batch_ndim, val=0):
     X_pad_np = np.pad(X0, pads, mode='constant', constant_values=val)
 
     assert (X_pad_theano == X_pad_np).all()
+
+
+def test_conv2d_legacy():
+    from lasagne.theano_extensions.conv import conv2d_legacy
+
+    X = T.tensor4()
+    W = T.tensor4()
+    input = lasagne.utils.floatX(np.random.uniform(-1, 1, (2, 3, 8, 7)))
+    kernel = lasagne.utils.floatX(np.random.uniform(-1, 1, (4, 3, 3, 2)))
+    for border_mode in ('valid', 'full', 0):
+        for filter_flip in (True, False):
+            for subsample in ((1, 1), (2, 1)):
+                kwargs = dict(border_mode=border_mode, subsample=subsample,
+                              filter_flip=filter_flip)
+                expected = T.nnet.conv2d(X, W, **kwargs)
+                actual = conv2d_legacy(X, W, input.shape, kernel.shape,
+                                       **kwargs)
+                assert np.allclose(actual.eval({X: input, W: kernel}),
+                                   expected.eval({X: input, W: kernel}))
+
+    with pytest.raises(RuntimeError):
+        conv2d_legacy(X, W, border_mode='half')
+
+
+class TestConvAutotuner:
+    @pytest.fixture
+    def fake_timings(self, monkeypatch):
+        from lasagne.theano_extensions.autotune import ConvAutotuner
+        timings = {'conv1d_mc0': 2., 'conv1d_mc1': 1., 'conv1d_sd': .5}
+        calls = []
+
+        def time_candidate(self, candidate, image_shape, filter_shape,
+                           concrete_shape, **kwargs):
+            calls.append((candidate.__name__, concrete_shape))
+            # let the candidate raise for unsupported configurations
+            candidate(T.tensor3(), T.tensor3(), image_shape, filter_shape,
+                      **kwargs)
+            return timings[candidate.__name__]
+        monkeypatch.setattr(ConvAutotuner, 'time_candidate', time_candidate)
+        return calls
+
+    @pytest.fixture
+    def autotuner(self, tmpdir):
+        from lasagne.theano_extensions.autotune import ConvAutotuner
+        from lasagne.theano_extensions import conv
+
+        def make(**kwargs):
+            kwargs.setdefault('cache_file', str(tmpdir.join('tune.json')))
+            return ConvAutotuner([conv.conv1d_mc0, conv.conv1d_mc1,
+                                  conv.conv1d_sd], **kwargs)
+        return make
+
+    def test_choose(self, autotuner, fake_timings):
+        from lasagne.theano_extensions import conv
+        tuner = autotuner()
+        args = ((2, 3, 10), (4, 3, 3))
+        assert tuner.choose(*args, subsample=(1,)) is conv.conv1d_sd
+        assert len(fake_timings) == 3
+        # cached in memory
+        assert tuner.choose(*args, subsample=(1,)) is conv.conv1d_sd
+        assert len(fake_timings) == 3
+        # conv1d_sd does not support padding
+        assert tuner.choose(*args, subsample=(1,),
+                            border_mode=1) is conv.conv1d_mc1
+        assert len(fake_timings) == 6
+
+    def test_cache_file(self, autotuner, fake_timings, tmpdir):
+        from lasagne.theano_extensions import conv
+        args = ((2, 3, 10), (4, 3, 3))
+        autotuner().choose(*args, subsample=(1,))
+        assert tmpdir.join('tune.json').check()
+        assert len(fake_timings) == 3
+        # a new instance with the same cache file does not time again
+        tuner = autotuner()
+        assert tuner.choose(*args, subsample=(1,)) is conv.conv1d_sd
+        assert len(fake_timings) == 3
+        # but it does for other shapes
+        assert tuner.choose((2, 3, 11), (4, 3, 3),
+                            subsample=(1,)) is conv.conv1d_sd
+        assert len(fake_timings) == 6
+        # and without a cache file
+        tuner = autotuner(cache_file=None)
+        tuner.choose(*args, subsample=(1,))
+        assert len(fake_timings) == 9
+
+    def test_unknown_shapes(self, autotuner, fake_timings):
+        from lasagne.theano_extensions import conv
+        tuner = autotuner()
+        assert tuner.choose((None, 3, 10), (4, 3, 3)) is conv.conv1d_mc0
+        assert tuner.choose(None, None) is conv.conv1d_mc0
+        assert fake_timings == []
+        tuner = autotuner(batch_size=16)
+        tuner.choose((None, 3, 10), (4, 3, 3))
+        assert fake_timings[0] == ('conv1d_mc0', (16, 3, 10))
+
+    def test_no_candidate(self, autotuner, fake_timings):
+        tuner = autotuner()
+        with pytest.raises(RuntimeError):
+            tuner.choose((2, 3, 10), (4, 3, 3), border_mode='invalid')
+
+    @pytest.mark.parametrize('gradient', [False, True])
+    def test_conv_layer(self, autotuner, gradient):
+        from lasagne.layers import InputLayer, Conv1DLayer, get_output
+        tuner = autotuner(gradient=gradient, num_runs=1)
+        l_in = InputLayer((2, 3, 12))
+        l_ref = Conv1DLayer(l_in, 4, 3, stride=2)
+        l_tuned = Conv1DLayer(l_in, 4, 3, stride=2, W=l_ref.W,
+                              convolution=tuner)
+        X = lasagne.utils.floatX(np.random.uniform(-1, 1, (2, 3, 12)))
+        np.testing.assert_allclose(get_output(l_tuned, X).eval(),
+                                   get_output(l_ref, X).eval(), rtol=1e-5)
+        # conv1d_sd does not support a stride of 2 for a filter length of 3
+        choice, = tuner.choices.values()
+        assert len(choice['timings']) == 2
+        assert choice['choice'] in choice['timings']
+
+
+@pytest.mark.parametrize('impl, kwargs, filter_size, stride', [
+    ('conv2d_winograd', {'tile_size': 2}, (3, 3), (1, 1)),
+    ('conv2d_winograd', {'tile_size': 4}, (3, 3), (1, 1)),
+    ('conv2d_fft', {}, (3, 3), (1, 1)),
+    ('conv2d_fft', {}, (5, 4), (2, 3)),
+    ('conv1d_winograd', {'tile_size': 2}, (3,), (1,)),
+    ('conv1d_winograd', {'tile_size': 4}, (3,), (1,)),
+    ('conv1d_fft', {}, (4,), (2,)),
+    ])
+@pytest.mark.parametrize('border_mode', ['valid', 'full', 'half', 1])
+@pytest.mark.parametrize('filter_flip', [True, False])
+def test_conv_fast_algorithms(impl, kwargs, filter_size, stride, border_mode,
+                              filter_flip):
+    import lasagne.theano_extensions.conv
+    conv = getattr(lasagne.theano_extensions.conv, impl)
+    if border_mode == 'half' and any(f % 2 == 0 for f in filter_size):
+        pytest.skip("'half' requires odd filter sizes")
+
+    n = len(filter_size)
+    X = T.TensorType(lasagne.utils.floatX(0).dtype, (False,) * (n + 2))()
+    W = X.type()
+    input = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (2, 3) + (11, 10)[:n]))
+    kernel = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (4, 3) + filter_size))
+
+    # compare to Theano's 2D convolution
+    def expand(x):
+        return x.dimshuffle(0, 1, 2, 'x') if n == 1 else x
+    pad = (border_mode, 0) if n == 1 and border_mode == 1 else border_mode
+    expected = T.nnet.conv2d(expand(X), expand(W), border_mode=pad,
+                             subsample=stride + (1,) * (2 - n),
+                             filter_flip=filter_flip)
+    if n == 1:
+        expected = expected[:, :, :, 0]
+    actual = conv(X, W, input.shape, kernel.shape, border_mode=border_mode,
+                  subsample=stride, filter_flip=filter_flip, **kwargs)
+    values = theano.function([X, W], [expected, actual] +
+                             T.grad((expected ** 2).sum(), [X, W]) +
+                             T.grad((actual ** 2).sum(), [X, W]))(input,
+                                                                  kernel)
+    assert values[0].shape == values[1].shape
+    np.testing.assert_allclose(values[0], values[1], rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(values[2], values[4], rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(values[3], values[5], rtol=1e-4, atol=1e-3)
+
+
+def test_conv_fast_algorithms_errors():
+    from lasagne.theano_extensions.conv import conv2d_winograd, conv2d_fft
+    X = T.tensor4()
+    W = T.tensor4()
+    with pytest.raises(RuntimeError):
+        conv2d_winograd(X, W, None, None)
+    with pytest.raises(RuntimeError):
+        conv2d_winograd(X, W, None, (4, 3, 5, 5))
+    with pytest.raises(RuntimeError):
+        conv2d_winograd(X, W, None, (4, 3, 3, 3), subsample=(2, 2))
+    with pytest.raises(ValueError):
+        conv2d_winograd(X, W, None, (4, 3, 3, 3), tile_size=3)
+    with pytest.raises(RuntimeError):
+        conv2d_fft(X, W, None, None)
+    with pytest.raises(RuntimeError):
+        conv2d_fft(X, W, None, (4, 3, 3, 3), border_mode='invalid')
+
+
+@pytest.mark.parametrize('impl', ['conv2d_winograd', 'conv2d_fft'])
+def test_conv_fast_algorithms_layer(impl):
+    import lasagne.theano_extensions.conv
+    from lasagne.layers import InputLayer, Conv2DLayer, get_output
+    l_in = InputLayer((None, 3, 12, 12))
+    l_ref = Conv2DLayer(l_in, 8, 3, pad='same')
+    l_fast = Conv2DLayer(l_in, 8, 3, pad='same', W=l_ref.W, b=l_ref.b,
+                         convolution=getattr(lasagne.theano_extensions.conv,
+                                             impl))
+    X = lasagne.utils.floatX(np.random.uniform(-1, 1, (5, 3, 12, 12)))
+    np.testing.assert_allclose(get_output(l_fast, X).eval(),
+                               get_output(l_ref, X).eval(), atol=1e-4)
+
+
+@pytest.mark.parametrize('num_groups, group_channels', [(3, 2), (6, 1)])
+def test_conv2d_grouped(num_groups, group_channels):
+    from lasagne.theano_extensions.conv import conv2d_grouped
+    X = T.tensor4()
+    W = T.tensor4()
+    input = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (2, num_groups * group_channels, 7, 8)))
+    kernel = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (2 * num_groups, group_channels, 3, 2)))
+    c, f = group_channels, 2
+    expected = T.concatenate([T.nnet.conv2d(X[:, g * c:(g + 1) * c],
+                                            W[g * f:(g + 1) * f],
+                                            border_mode='full')
+                              for g in range(num_groups)], axis=1)
+    actual = conv2d_grouped(X, W, input.shape, kernel.shape,
+                            border_mode='full', num_groups=num_groups)
+    values = theano.function([X, W], [expected, actual] +
+                             T.grad((expected ** 2).sum(), [X, W]) +
+                             T.grad((actual ** 2).sum(), [X, W]))(input,
+                                                                  kernel)
+    np.testing.assert_allclose(values[0], values[1], rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose(values[2], values[4], rtol=1e-4, atol=1e-3)
+    np.testing.assert_allclose(values[3], values[5], rtol=1e-4, atol=1e-3)
+
+    with pytest.raises(RuntimeError):
+        conv2d_grouped(X, W, None, None, num_groups=num_groups)
+
+
+@pytest.mark.parametrize('num_groups, group_channels', [(3, 2), (6, 1)])
+@pytest.mark.parametrize('border_mode, subsample', [('valid', (1, 1)),
+                                                    ('half', (2, 1)),
+                                                    ((1, 2), (2, 3))])
+def test_conv2d_grouped_fallback(monkeypatch, num_groups, group_channels,
+                                 border_mode, subsample):
+    # the batched_dot and the depthwise implementation, whichever Theano
+    # version is installed
+    import lasagne.theano_extensions.conv as conv
+    monkeypatch.setattr(conv, '_native_num_groups', lambda: False)
+    X = T.tensor4()
+    W = T.tensor4()
+    input = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (2, num_groups * group_channels, 7, 8)))
+    kernel = lasagne.utils.floatX(np.random.uniform(
+        -1, 1, (2 * num_groups, group_channels, 3, 3)))
+    c, f = group_channels, 2
+    expected = T.concatenate([T.nnet.conv2d(X[:, g * c:(g + 1) * c],
+                                            W[g * f:(g + 1) * f],
+                                            border_mode=border_mode,
+                                            subsample=subsample)
+                              for g in range(num_groups)], axis=1)
+    actual = conv.conv2d_grouped(X, W, input.shape, kernel.shape,
+                                 border_mode=border_mode, subsample=subsample,
+                                 num_groups=num_groups)
+    assert not any(isinstance(node.op, T.nnet.abstract_conv.BaseAbstractConv)
+                   for node in theano.gof.graph.io_toposort([X, W], [actual]))
+    expected, actual = theano.function([X, W], [expected, actual])(input,
+                                                                   kernel)
+    np.testing.assert_allclose(actual, expected, rtol=1e-4, atol=1e-4)
@@ -225,3 +225,22 @@ def test_total_norm_constraint():
 
     np.testing.assert_array_almost_equal(np.linalg.norm(x_test), norm)
     np.testing.assert_array_almost_equal(np.linalg.norm(x_out), threshold)
+
+
+@pytest.mark.parametrize('sparsity', [0, 0.3, 0.9, 1])
+def test_magnitude_constraint(sparsity):
+    import numpy as np
+    import theano
+    from lasagne.updates import magnitude_constraint
+    from lasagne.pruning import magnitude_mask
+
+    value = np.random.randn(10, 3, 5).astype(theano.config.floatX)
+    param = theano.shared(value)
+    update = magnitude_constraint(param, theano.shared(sparsity))
+
+    apply_update = theano.function([], [], updates=[(param, update)])
+    apply_update()
+
+    assert param.dtype == update.dtype
+    expected = value * magnitude_mask(value, sparsity)
+    np.testing.assert_array_equal(param.get_value(), expected)
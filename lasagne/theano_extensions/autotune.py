@@ -0,0 +1,240 @@
+"""
+Autotuning of convolution implementations
+"""
+
+import errno
+import json
+import os
+import platform
+from timeit import default_timer
+
+import numpy as np
+
+import theano
+import theano.tensor as T
+
+from . import conv
+
+
+__all__ = [
+    "ConvAutotuner",
+    "conv1d",
+    "conv2d",
+]
+
+
+class ConvAutotuner(object):
+    """
+    Convolution implementation choosing the fastest of several candidates.
+
+    An instance can be passed as the `convolution` argument of
+    :class:`lasagne.layers.Conv1DLayer` or :class:`lasagne.layers.Conv2DLayer`.
+    The first time it is asked to build a convolution for a given input
+    shape, filter shape and configuration, it compiles each candidate for
+    these shapes, times it on random data on the current machine and builds
+    the graph with the fastest one. The choice is stored in an on-disk cache
+    keyed by the shapes, the configuration and the machine, so later
+    processes building the same network do not need to time the candidates
+    again.
+
+    Candidates that do not support a configuration (by raising an exception
+    when building, compiling or running the graph) are skipped. If the
+    shapes are not fully known, the first candidate is used.
+
+    Parameters
+    ----------
+    candidates : list of callable
+        The convolution implementations to choose from. They must accept
+        the arguments ``(input, filters, image_shape, filter_shape,
+        **kwargs)`` of the convolution functions in
+        :mod:`lasagne.theano_extensions.conv`, e.g., ``border_mode``,
+        ``subsample`` and ``filter_flip``. Their names (module and function
+        name) identify them in the cache.
+    cache_file : str, None or 'auto' (default: 'auto')
+        The JSON file storing the tuning results. ``'auto'`` stores them in
+        Theano's compilation directory, which is specific to the platform
+        and Python version. ``None`` disables the on-disk cache.
+    batch_size : int or None (default: None)
+        The batch size to tune for if the batch size of `image_shape` is not
+        known, as is typically the case for convolutional layers.
+    gradient : bool (default: False)
+        Whether to time the gradient with respect to the input and filters
+        along with the convolution, to tune for training instead of
+        inference.
+    num_runs : int (default: 5)
+        The number of timed runs of each candidate. The fastest run counts.
+
+    Attributes
+    ----------
+    choices : dict
+        The tuning results of this instance and the cache, mapping cache
+        keys to dictionaries holding the name of the ``'choice'`` and the
+        ``'timings'`` of all working candidates in seconds.
+
+    Examples
+    --------
+    >>> from lasagne.layers import InputLayer, Conv2DLayer
+    >>> from lasagne.theano_extensions.autotune import ConvAutotuner
+    >>> from lasagne.theano_extensions.conv import conv2d_legacy
+    >>> autotuned = ConvAutotuner([theano.tensor.nnet.conv2d, conv2d_legacy],
+    ...                           cache_file=None, batch_size=8)
+    >>> l_in = InputLayer((None, 3, 32, 32))
+    >>> l_conv = Conv2DLayer(l_in, 16, 3, convolution=autotuned)
+
+    The module-level instances :data:`conv1d` and :data:`conv2d` choose
+    among the 1D and 2D implementations available in Lasagne, with the
+    default cache.
+    """
+    def __init__(self, candidates, cache_file='auto', batch_size=None,
+                 gradient=False, num_runs=5):
+        if not candidates:
+            raise ValueError("ConvAutotuner requires at least one candidate")
+        self.candidates = list(candidates)
+        if cache_file == 'auto':
+            cache_file = os.path.join(theano.config.compiledir,
+                                      'lasagne_conv_autotune.json')
+        self.cache_file = cache_file
+        self.batch_size = batch_size
+        self.gradient = gradient
+        self.num_runs = num_runs
+        self.choices = {}
+
+    def __call__(self, input, filters, image_shape=None, filter_shape=None,
+                 **kwargs):
+        candidate = self.choose(image_shape, filter_shape, **kwargs)
+        return candidate(input, filters, image_shape, filter_shape, **kwargs)
+
+    def choose(self, image_shape, filter_shape, **kwargs):
+        """
+        Returns the fastest candidate for the given shapes and keyword
+        arguments, timing all candidates if they have not been tuned for
+        them yet.
+        """
+        concrete_shape = None
+        if image_shape is not None and filter_shape is not None:
+            concrete_shape = tuple(image_shape)
+            if concrete_shape[0] is None:
+                concrete_shape = (self.batch_size,) + concrete_shape[1:]
+            if any(s is None for s in concrete_shape + tuple(filter_shape)):
+                concrete_shape = None
+        if concrete_shape is None:
+            return self.candidates[0]
+
+        names = [_candidate_name(c) for c in self.candidates]
+        key = _cache_key(concrete_shape, filter_shape, self.gradient, kwargs)
+        if key not in self.choices:
+            self.choices.update(self._load_cache())
+        if self.choices.get(key, {}).get('choice') not in names:
+            timings = {}
+            for name, candidate in zip(names, self.candidates):
+                try:
+                    timings[name] = self.time_candidate(
+                        candidate, image_shape, filter_shape, concrete_shape,
+                        **kwargs)
+                except Exception:
+                    continue
+            if not timings:
+                raise RuntimeError("None of the candidates supports a "
+                                   "convolution with image shape %r, filter "
+                                   "shape %r and arguments %r" %
+                                   (image_shape, filter_shape, kwargs))
+            self.choices[key] = {'choice': min(timings, key=timings.get),
+                                 'timings': timings}
+            self._save_cache(key)
+        return self.candidates[names.index(self.choices[key]['choice'])]
+
+    def time_candidate(self, candidate, image_shape, filter_shape,
+                       concrete_shape, **kwargs):
+        """
+        Compiles the given candidate for the given shapes and returns the
+        time of its fastest run on random data of `concrete_shape`, in
+        seconds.
+        """
+        rng = np.random.RandomState(0)
+        dtype = theano.config.floatX
+        input = theano.shared(
+            rng.uniform(-1, 1, concrete_shape).astype(dtype))
+        filters = theano.shared(
+            rng.uniform(-1, 1, filter_shape).astype(dtype))
+        output = candidate(input, filters, image_shape, filter_shape,
+                           **kwargs)
+        outputs = [output]
+        if self.gradient:
+            outputs += T.grad(output.sum(), [input, filters])
+        fn = theano.function([], outputs)
+
+        fn()  # warm up
+        timings = []
+        for _ in range(self.num_runs):
+            start = default_timer()
+            fn()
+            timings.append(default_timer() - start)
+        return min(timings)
+
+    def _load_cache(self):
+        if self.cache_file is None:
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _save_cache(self, key):
+        if self.cache_file is None:
+            return
+        # merge with the choices other processes may have stored meanwhile,
+        # then replace the file atomically
+        cache = self._load_cache()
+        cache[key] = self.choices[key]
+        directory = os.path.dirname(os.path.abspath(self.cache_file))
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        temp_file = '%s.%d.tmp' % (self.cache_file, os.getpid())
+        with open(temp_file, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        if os.name == 'nt' and os.path.exists(self.cache_file):
+            os.remove(self.cache_file)
+        os.rename(temp_file, self.cache_file)
+
+
+def _candidate_name(candidate):
+    return '%s.%s' % (getattr(candidate, '__module__', None),
+                      getattr(candidate, '__name__',
+                              type(candidate).__name__))
+
+
+def _machine():
+    try:
+        blas = theano.config.blas.ldflags
+    except Exception:
+        blas = None
+    return [platform.node(), platform.machine(), platform.processor(),
+            theano.__version__, theano.config.device, theano.config.floatX,
+            blas]
+
+
+def _cache_key(image_shape, filter_shape, gradient, kwargs):
+    def to_list(x):
+        return list(x) if isinstance(x, (tuple, list)) else x
+    return json.dumps([_machine(), list(image_shape), list(filter_shape),
+                       gradient,
+                       sorted((k, to_list(v)) for k, v in kwargs.items())])
+
+
+#: Autotuned 1D convolution choosing among the implementations in
+#: :mod:`lasagne.theano_extensions.conv`
+conv1d = ConvAutotuner([conv.conv1d_mc0, conv.conv1d_mc1, conv.conv1d_sc,
+                        conv.conv1d_unstrided, conv.conv1d_sd,
+                        conv.conv1d_md, conv.conv1d_winograd,
+                        conv.conv1d_fft])
+
+#: Autotuned 2D convolution choosing among Theano's ``conv2d`` (which
+#: uses the GEMM-based or cuDNN implementation, depending on the device),
+#: the legacy ConvOp, and the Winograd and FFT implementations in
+#: :mod:`lasagne.theano_extensions.conv`
+conv2d = ConvAutotuner([T.nnet.conv2d, conv.conv2d_legacy,
+                        conv.conv2d_winograd, conv.conv2d_fft])
@@ -2,9 +2,15 @@
 Alternative convolution implementations for Theano
 """
 
+import itertools
+
 import numpy as np
 
+import theano
 import theano.tensor as T
+import theano.tensor.fft
+
+from .padding import pad
 
 
 # 1D convolutions
@@ -268,6 +274,463 @@ def conv1d_md(input, filters, image_shape, filter_shape, border_mode='valid',
 
 # TODO: conv1d_md_channelslast?
 
+
+def conv1d_winograd(input, filters, image_shape=None, filter_shape=None,
+                    border_mode='valid', subsample=(1,), filter_flip=True,
+                    tile_size=4):
+    """
+    using Winograd's minimal filtering algorithm F(m, 3), see
+    :func:`conv2d_winograd`
+    """
+    return _conv_winograd(input, filters, filter_shape, border_mode,
+                          subsample, filter_flip, tile_size, 1)
+
+
+def conv1d_fft(input, filters, image_shape=None, filter_shape=None,
+               border_mode='valid', subsample=(1,), filter_flip=True):
+    """
+    using the fast Fourier transform, see :func:`conv2d_fft`
+    """
+    return _conv_fft(input, filters, filter_shape, border_mode, subsample,
+                     filter_flip, 1)
+
+
+def conv1d_grouped(input, filters, image_shape=None, filter_shape=None,
+                   border_mode='valid', subsample=(1,), filter_flip=True,
+                   num_groups=1):
+    """
+    grouped convolution, see :func:`conv2d_grouped`
+    """
+    return _conv_grouped(input, filters, filter_shape, border_mode,
+                         subsample, filter_flip, num_groups, 1)
+
+
 # 2D convolutions
 
-# TODO
+def conv2d_legacy(input, filters, image_shape=None, filter_shape=None,
+                  border_mode='valid', subsample=(1, 1), filter_flip=True):
+    """
+    using Theano's legacy ConvOp, which does not rely on BLAS and can be
+    faster for small images and filters
+    """
+    if border_mode in (0, (0, 0)):
+        border_mode = 'valid'
+    if border_mode not in ('valid', 'full'):
+        raise RuntimeError("Unsupported border_mode for conv2d_legacy: "
+                           "%s" % (border_mode,))
+
+    # ConvOp always performs a convolution, so we flip the filters to
+    # compute a correlation
+    if not filter_flip:
+        filters = filters[:, :, ::-1, ::-1]
+
+    return T.nnet.conv.conv2d(input, filters, image_shape, filter_shape,
+                              border_mode=border_mode,
+                              subsample=tuple(subsample))
+
+
+def conv2d_winograd(input, filters, image_shape=None, filter_shape=None,
+                    border_mode='valid', subsample=(1, 1), filter_flip=True,
+                    tile_size=4):
+    """
+    using Winograd's minimal filtering algorithm F(m x m, 3 x 3) [1]_, which
+    computes each m x m output tile with (m + 2)^2 instead of 9 m^2
+    multiplications. Requires 3x3 filters, a known `filter_shape` and a
+    stride of 1. A `tile_size` of 4 reduces the multiplications 4-fold, a
+    `tile_size` of 2 reduces them 2.25-fold but is more accurate.
+
+    The filters are transformed anew in every function call, independently of
+    the batch size, so this cost is only amortized over large batches.
+
+    References
+    ----------
+    .. [1] Andrew Lavin, Scott Gray (2016):
+           Fast Algorithms for Convolutional Neural Networks. CVPR 2016,
+           http://arxiv.org/abs/1509.09308
+    """
+    return _conv_winograd(input, filters, filter_shape, border_mode,
+                          subsample, filter_flip, tile_size, 2)
+
+
+def conv2d_fft(input, filters, image_shape=None, filter_shape=None,
+               border_mode='valid', subsample=(1, 1), filter_flip=True):
+    """
+    using the fast Fourier transform, which multiplies the transformed input
+    and filters in the frequency domain. Its cost hardly depends on the
+    filter size, so it pays off for large filters. Strides are implemented
+    by subsampling the output.
+
+    The filters are transformed anew in every function call, independently of
+    the batch size, so this cost is only amortized over large batches.
+    """
+    return _conv_fft(input, filters, filter_shape, border_mode, subsample,
+                     filter_flip, 2)
+
+
+def _padding(border_mode, filter_size, name):
+    # Returns the zero-padding of each spatial axis for the given border
+    # mode, as accepted by the convolution functions
+    n = len(filter_size)
+    if border_mode == 'valid':
+        return (0,) * n
+    elif border_mode == 'full':
+        return tuple(f - 1 for f in filter_size)
+    elif border_mode == 'half':
+        return tuple(f // 2 for f in filter_size)
+    elif isinstance(border_mode, int):
+        return (border_mode,) * n
+    elif (isinstance(border_mode, tuple) and len(border_mode) == n and
+            all(isinstance(b, int) for b in border_mode)):
+        return border_mode
+    raise RuntimeError("Unsupported border_mode for %s: %s" %
+                       (name, border_mode))
+
+
+# Transformation matrices of the input (B^T), filters (G) and output (A^T)
+# for F(2, 3) and F(4, 3), see Lavin and Gray (2016)
+_WINOGRAD_MATRICES = {
+    2: ([[1, 0, -1, 0],
+         [0, 1, 1, 0],
+         [0, -1, 1, 0],
+         [0, 1, 0, -1]],
+        [[1, 0, 0],
+         [1 / 2., 1 / 2., 1 / 2.],
+         [1 / 2., -1 / 2., 1 / 2.],
+         [0, 0, 1]],
+        [[1, 1, 1, 0],
+         [0, 1, -1, -1]]),
+    4: ([[4, 0, -5, 0, 1, 0],
+         [0, -4, -4, 1, 1, 0],
+         [0, 4, -4, -1, 1, 0],
+         [0, -2, -1, 2, 1, 0],
+         [0, 2, -1, -2, 1, 0],
+         [0, 4, 0, -5, 0, 1]],
+        [[1 / 4., 0, 0],
+         [-1 / 6., -1 / 6., -1 / 6.],
+         [-1 / 6., 1 / 6., -1 / 6.],
+         [1 / 24., 1 / 12., 1 / 6.],
+         [1 / 24., -1 / 12., 1 / 6.],
+         [0, 0, 1]],
+        [[1, 1, 1, 1, 1, 0],
+         [0, 1, -1, 2, -2, 0],
+         [0, 1, 1, 4, 4, 0],
+         [0, 1, -1, 8, -8, 1]]),
+}
+
+
+def _conv_winograd(input, filters, filter_shape, border_mode, subsample,
+                   filter_flip, tile_size, n):
+    name = 'conv%dd_winograd' % n
+    if tile_size not in _WINOGRAD_MATRICES:
+        raise ValueError("%s supports a tile_size of 2 or 4, got %r" %
+                         (name, tile_size))
+    if filter_shape is None or tuple(filter_shape[2:]) != (3,) * n:
+        raise RuntimeError("%s requires a known filter shape with filters "
+                           "of size 3, got %r" % (name, filter_shape))
+    if any(s != 1 for s in subsample):
+        raise RuntimeError("%s does not support strides, got %r" %
+                           (name, subsample))
+    m = tile_size
+    a = m + 2
+    BT, G, AT = _WINOGRAD_MATRICES[m]
+    num_filters, num_input_channels = filters.shape[:2]
+    num_batch = input.shape[0]
+
+    # Pad the input, including the padding needed to cover the output with
+    # full tiles
+    padding = _padding(border_mode, (3,) * n, name)
+    output_length = [input.shape[2 + i] + 2 * padding[i] - 2
+                     for i in range(n)]
+    num_tiles = [(length + m - 1) // m for length in output_length]
+    input = pad(input, [(p, p + t * m - length) for p, t, length in
+                        zip(padding, num_tiles, output_length)],
+                batch_ndim=2)
+
+    # Transform the input tiles: for each spatial axis, the elements of the
+    # input tiles are strided slices of the input, which are combined with
+    # the coefficients of B^T into a new leading axis. This results in
+    # (a, ..., a, batch, channels, tiles_1, ..., tiles_n), with the axes of
+    # the tile elements in reverse order.
+    V = input
+    for i in range(n):
+        axis = 2 * i + 2
+        taps = []
+        for p in range(a):
+            index = [slice(None)] * V.ndim
+            index[axis] = slice(p, p + m * num_tiles[i], m)
+            taps.append(V[tuple(index)])
+        V = T.stack([sum(coeff * tap for coeff, tap in zip(row, taps)
+                         if coeff != 0) for row in BT])
+    V = V.dimshuffle(*((list(range(n)) + [n + 1, n]) +
+                       list(range(n + 2, 2 * n + 2))))
+    V = V.reshape((a ** n, num_input_channels, -1))
+
+    # Transform the filters: U = G g G^T, again with the axes of the tile
+    # elements in reverse order. Winograd's algorithm computes a
+    # correlation, so we flip the filters to compute a convolution.
+    if filter_flip:
+        filters = filters[(slice(None), slice(None)) +
+                          (slice(None, None, -1),) * n]
+    G = np.asarray(G, dtype=theano.config.floatX)
+    U = filters
+    for i in range(n):
+        U = T.tensordot(G, U, axes=[[1], [i + 2]])
+    U = U.reshape((a ** n, num_filters, num_input_channels))
+
+    # Multiply the transformed filters and tiles, summing over the channels,
+    # with a matrix product for each of the a^n tile elements
+    M = T.batched_dot(U, V)
+    M = M.reshape((a,) * n + (num_filters, num_batch) + tuple(num_tiles))
+
+    # Transform the output tiles: Y = A^T M A
+    AT = np.asarray(AT, dtype=theano.config.floatX)
+    Y = M
+    for i in range(n):
+        Y = T.tensordot(AT, Y, axes=[[1], [n - 1]])
+
+    # Y is (m, ..., m, filters, batch, tiles_1, ..., tiles_n), with the axes
+    # of the tile elements in reverse order. Interleave tiles and elements.
+    pattern = [n + 1, n]
+    for i in range(n):
+        pattern += [n + 2 + i, n - 1 - i]
+    Y = Y.dimshuffle(*pattern)
+    Y = Y.reshape((num_batch, num_filters) +
+                  tuple(t * m for t in num_tiles))
+    return Y[(slice(None), slice(None)) +
+             tuple(slice(None, length) for length in output_length)]
+
+
+def _conv_fft(input, filters, filter_shape, border_mode, subsample,
+              filter_flip, n):
+    name = 'conv%dd_fft' % n
+    if filter_shape is None:
+        raise RuntimeError("%s requires a known filter shape" % name)
+    filter_size = tuple(filter_shape[2:])
+    num_filters, num_input_channels = filters.shape[:2]
+    num_batch = input.shape[0]
+
+    input = pad(input, _padding(border_mode, filter_size, name), batch_ndim=2)
+    length = [input.shape[2 + i] for i in range(n)]
+
+    # The circular convolution over the input length is a linear convolution
+    # for all but the first filter_size - 1 outputs, which we do not need.
+    # The last axis is padded to an even length for the inverse transform.
+    input = pad(input, [(0, 0)] * (n - 1) + [(0, length[-1] % 2)],
+                batch_ndim=2)
+    fft_shape = [input.shape[2 + i] for i in range(n)]
+
+    # Place the filters in a zero tensor of the input size. The FFT computes
+    # a convolution, so we flip the filters to compute a correlation.
+    if not filter_flip:
+        filters = filters[(slice(None), slice(None)) +
+                          (slice(None, None, -1),) * n]
+    filters = pad(filters, [(0, s - f) for s, f in zip(fft_shape,
+                                                       filter_size)],
+                  batch_ndim=2)
+
+    # Transform the inputs and filters to arrays of
+    # (frequencies, batch or filters, channels) of real and imaginary parts
+    def transform(x, num):
+        x = T.fft.rfft(x.reshape((-1,) + tuple(fft_shape)))
+        x = x.reshape((num, num_input_channels, -1, 2))
+        return x[..., 0].dimshuffle(2, 0, 1), x[..., 1].dimshuffle(2, 0, 1)
+    input_re, input_im = transform(input, num_batch)
+    filters_re, filters_im = transform(filters, num_filters)
+    filters_re = filters_re.dimshuffle(0, 2, 1)
+    filters_im = filters_im.dimshuffle(0, 2, 1)
+
+    # Multiply in the frequency domain, summing over the channels, with a
+    # complex matrix product for each frequency
+    output_re = (T.batched_dot(input_re, filters_re) -
+                 T.batched_dot(input_im, filters_im))
+    output_im = (T.batched_dot(input_re, filters_im) +
+                 T.batched_dot(input_im, filters_re))
+    output = T.stack([output_re, output_im], axis=3).dimshuffle(1, 2, 0, 3)
+    output = output.reshape((-1,) + tuple(fft_shape[:-1]) +
+                            (fft_shape[-1] // 2 + 1, 2))
+    output = T.fft.irfft(output)
+    output = output.reshape((num_batch, num_filters) + tuple(fft_shape))
+    return output[(slice(None), slice(None)) +
+                  tuple(slice(f - 1, l, s) for f, l, s in zip(filter_size,
+                                                              length,
+                                                              subsample))]
+
+
+def conv2d_grouped(input, filters, image_shape=None, filter_shape=None,
+                   border_mode='valid', subsample=(1, 1), filter_flip=True,
+                   num_groups=1):
+    """
+    grouped convolution, splitting the input channels and the filters into
+    `num_groups` groups and convolving each group of input channels with its
+    group of filters only. The filters are of shape ``(num_filters,
+    num_input_channels // num_groups, rows, columns)``. Requires a known
+    `filter_shape`.
+
+    All groups are computed at once: the filter taps are gathered from the
+    input as strided slices and multiplied with the filters in a single
+    matrix product per group (:func:`theano.tensor.batched_dot`). For a
+    depthwise convolution, i.e., a single input channel per group, the
+    products are summed elementwise instead. Uses Theano's native grouped
+    convolution if it is available (Theano 0.10 or later).
+    """
+    return _conv_grouped(input, filters, filter_shape, border_mode,
+                         subsample, filter_flip, num_groups, 2)
+
+
+def _native_num_groups():
+    # Whether Theano's conv2d supports grouped convolutions
+    try:
+        from inspect import signature
+        return 'num_groups' in signature(T.nnet.conv2d).parameters
+    except ImportError:  # Python 2
+        from inspect import getargspec
+        return 'num_groups' in getargspec(T.nnet.conv2d).args
+
+
+def _conv_grouped(input, filters, filter_shape, border_mode, subsample,
+                  filter_flip, num_groups, n):
+    name = 'conv%dd_grouped' % n
+    if filter_shape is None or any(s is None for s in filter_shape[2:]):
+        raise RuntimeError("%s requires a known filter shape, got %r" %
+                           (name, filter_shape))
+    filter_size = tuple(filter_shape[2:])
+    padding = _padding(border_mode, filter_size, name)
+    if n == 2 and _native_num_groups():
+        return T.nnet.conv2d(input, filters, filter_shape=filter_shape,
+                             border_mode=padding, subsample=subsample,
+                             filter_flip=filter_flip, num_groups=num_groups)
+    num_batch = input.shape[0]
+    num_filters, group_channels = filters.shape[:2]
+    group_filters = num_filters // num_groups
+
+    depthwise = filter_shape[1] == 1
+    if not depthwise:
+        input = input.dimshuffle(*((1, 0) + tuple(range(2, n + 2))))
+    input = pad(input, padding, batch_ndim=2)
+    output_length = [(input.shape[2 + i] - f) // s + 1
+                     for i, (f, s) in enumerate(zip(filter_size, subsample))]
+
+    def taps(x):
+        # Gather the input of each filter tap as a strided slice
+        return [x[(slice(None), slice(None)) +
+                  tuple(slice(o, o + s * (l - 1) + 1, s)
+                        for o, s, l in zip(offset, subsample, output_length))]
+                for offset in itertools.product(*(range(f)
+                                                  for f in filter_size))]
+
+    # The taps correlate the input with the filters, so we flip the filters
+    # to compute a convolution
+    if filter_flip:
+        filters = filters[(slice(None), slice(None)) +
+                          (slice(None, None, -1),) * n]
+    filters = filters.reshape((num_groups, group_filters, group_channels,
+                               -1))
+
+    if depthwise:
+        # Depthwise: multiply each tap with its filter coefficient of each
+        # output channel of the group and sum up, which Theano fuses into a
+        # single elementwise loop
+        pattern = ('x', 0, 1) + ('x',) * n
+        output = sum(filters[:, :, 0, k].dimshuffle(*pattern) *
+                     tap.reshape((num_batch, num_groups, 1) +
+                                 tuple(output_length))
+                     for k, tap in enumerate(taps(input)))
+        return output.reshape((num_batch, num_filters) +
+                              tuple(output_length))
+
+    # Otherwise, multiply the filters with the taps of all positions,
+    # (groups, filters, channels * taps) x (groups, channels * taps,
+    # batch * positions), in one matrix product per group
+    patches = T.stack(taps(input), axis=1)
+    patches = patches.reshape((num_groups, -1,
+                               num_batch * T.prod(output_length)))
+    output = T.batched_dot(filters.reshape((num_groups, group_filters, -1)),
+                           patches)
+    output = output.reshape((num_filters, num_batch) + tuple(output_length))
+    return output.dimshuffle(*((1, 0) + tuple(range(2, n + 2))))
+
+
+def conv2d_space_to_batch(input, filters, image_shape=None, filter_shape=None,
+                          border_mode='valid', subsample=(1, 1),
+                          filter_flip=True, filter_dilation=(1, 1),
+                          convolution=T.nnet.conv2d):
+    """
+    dilated convolution computed by a dense convolution on rearranged input:
+    for a dilation of d, the input is split into d x d interleaved
+    subsampled images, which are moved into the batch dimension ("space to
+    batch"), convolved with the undilated filters using `convolution`, and
+    interleaved again ("batch to space"). This allows to use any convolution
+    implementation for dilated convolutions. Requires a known
+    `filter_shape`.
+
+    Strides that divide the dilation are applied by subsampling the input
+    beforehand, other strides by subsampling the output.
+    """
+    name = 'conv2d_space_to_batch'
+    if filter_shape is None or any(s is None for s in filter_shape[2:]):
+        raise RuntimeError("%s requires a known filter shape, got %r" %
+                           (name, filter_shape))
+    filter_size = tuple(filter_shape[2:])
+    dilation = tuple(filter_dilation)
+    dilated_size = [(f - 1) * d + 1 for f, d in zip(filter_size, dilation)]
+    padding = _padding(border_mode, dilated_size, name)
+    length = [input.shape[2 + i] + 2 * padding[i] for i in range(2)]
+    output_length = [(ln - f) // s + 1
+                     for ln, f, s in zip(length, dilated_size, subsample)]
+    if image_shape is not None:
+        image_shape = tuple(image_shape)
+        known_length = [None if s is None else s + 2 * p
+                        for s, p in zip(image_shape[2:], padding)]
+    else:
+        image_shape = (None,) * 4
+        known_length = (None, None)
+
+    # Apply the strides dividing the dilation to the input: the dilated
+    # filters of the strided output positions only cover every s-th input
+    pre_stride = [s if d % s == 0 else 1 for s, d in zip(subsample, dilation)]
+    post_stride = [s // p for s, p in zip(subsample, pre_stride)]
+    dilation = [d // p for d, p in zip(dilation, pre_stride)]
+
+    def ceil_div(a, b):
+        return None if a is None else (a + b - 1) // b
+    length = [ceil_div(ln, p) for ln, p in zip(length, pre_stride)]
+    known_length = [ceil_div(ln, p) for ln, p in zip(known_length, pre_stride)]
+    blocks = [ceil_div(ln, d) for ln, d in zip(length, dilation)]
+    known_blocks = [ceil_div(ln, d) for ln, d in zip(known_length, dilation)]
+
+    # Pad the input to a multiple of the dilation
+    if any(p > 1 for p in pre_stride):
+        input = pad(input, padding, batch_ndim=2)
+        input = input[:, :, ::pre_stride[0], ::pre_stride[1]]
+        padding = (0, 0)
+    input = pad(input, [(p, b * d - ln + p) for p, b, d, ln in
+                        zip(padding, blocks, dilation, length)],
+                batch_ndim=2)
+
+    # Space to batch: (batch, channels, blocks_0 * d_0, blocks_1 * d_1) to
+    # (d_0 * d_1 * batch, channels, blocks_0, blocks_1)
+    num_batch, num_channels = input.shape[:2]
+    input = input.reshape((num_batch, num_channels, blocks[0], dilation[0],
+                           blocks[1], dilation[1]))
+    input = input.dimshuffle(3, 5, 0, 1, 2, 4)
+    input = input.reshape((-1, num_channels, blocks[0], blocks[1]))
+    batch_shape = image_shape[0]
+    if batch_shape is not None:
+        batch_shape *= dilation[0] * dilation[1]
+    conved = convolution(input, filters,
+                         (batch_shape, image_shape[1]) + tuple(known_blocks),
+                         filter_shape, border_mode='valid',
+                         filter_flip=filter_flip)
+
+    # Batch to space
+    num_filters = conved.shape[1]
+    conved_length = [conved.shape[2], conved.shape[3]]
+    conved = conved.reshape((dilation[0], dilation[1], num_batch, num_filters,
+                             conved_length[0], conved_length[1]))
+    conved = conved.dimshuffle(2, 3, 4, 0, 5, 1)
+    conved = conved.reshape((num_batch, num_filters,
+                             conved_length[0] * dilation[0],
+                             conved_length[1] * dilation[1]))
+    return conved[(slice(None), slice(None)) +
+                  tuple(slice(None, s * (ln - 1) + 1, s)
+                        for s, ln in zip(post_stride, output_length))]
@@ -47,7 +47,7 @@ def pad(x, width, val=0, batch_ndim=1):
         indices[k + batch_ndim] = slice(l, l + input_shape[k + batch_ndim])
 
     if val:
-        out = T.ones(output_shape) * val
+        out = T.ones(output_shape, dtype=x.dtype) * val
     else:
-        out = T.zeros(output_shape)
+        out = T.zeros(output_shape, dtype=x.dtype)
     return T.set_subtensor(out[tuple(indices)], x)
@@ -27,18 +27,23 @@ Two functions can be used to further modify the updates to include momentum:
     apply_momentum
     apply_nesterov_momentum
 
-Finally, we provide two helper functions to constrain the norm of tensors:
+Finally, we provide helper functions to constrain the norm or the sparsity
+of tensors:
 
 .. autosummary::
     :nosignatures:
 
     norm_constraint
     total_norm_constraint
+    magnitude_constraint
 
 :func:`norm_constraint()` can be used to constrain the norm of parameters
 (as an alternative to weight decay), or for a form of gradient clipping.
 :func:`total_norm_constraint()` constrain the total norm of a list of tensors.
 This is often used when training recurrent neural networks.
+:func:`magnitude_constraint()` prunes the smallest weights of a parameter,
+which allows to gradually sparsify a network during training (see
+:mod:`lasagne.pruning`).
 
 Examples
 --------
@@ -80,7 +85,8 @@ __all__ = [
     "adam",
     "adamax",
     "norm_constraint",
-    "total_norm_constraint"
+    "total_norm_constraint",
+    "magnitude_constraint",
 ]
 
 
@@ -817,3 +823,64 @@ def total_norm_constraint(tensor_vars, max_norm, epsilon=1e-7,
         return tensor_vars_scaled, norm
     else:
         return tensor_vars_scaled
+
+
+def magnitude_constraint(tensor_var, sparsity):
+    """Magnitude pruning constraint
+
+    This takes a TensorVariable and sets its entries of the smallest
+    absolute value to zero, so that the given fraction of its entries is
+    zero. Applied to the updates of a weight matrix, it prunes the weights
+    after every update; increasing `sparsity` over the course of training
+    prunes the network gradually [1]_.
+
+    Parameters
+    ----------
+    tensor_var : TensorVariable
+        Theano expression for update, or other quantity.
+    sparsity : scalar or Theano shared variable
+        The fraction of entries of `tensor_var` to set to zero, between 0
+        and 1. Pass a shared variable to change it during training, e.g.,
+        following :func:`lasagne.pruning.gradual_sparsity()`.
+
+    Returns
+    -------
+    TensorVariable
+        Input `tensor_var` with its smallest entries set to zero.
+
+    Examples
+    --------
+    >>> param = theano.shared(
+    ...     np.random.randn(100, 200).astype(theano.config.floatX))
+    >>> sparsity = theano.shared(0.5)
+    >>> update = param + 0.01
+    >>> update = magnitude_constraint(update, sparsity)
+    >>> func = theano.function([], [], updates=[(param, update)])
+    >>> # Apply constrained update
+    >>> _ = func()
+    >>> np.count_nonzero(param.get_value() == 0)
+    10000
+    >>> sparsity.set_value(0.9)
+    >>> _ = func()
+    >>> np.count_nonzero(param.get_value() == 0)
+    18000
+
+    Notes
+    -----
+    The threshold is found by sorting the absolute values of all entries,
+    which is cheap compared to computing the gradients of a dense layer.
+    Entries tied with the largest pruned magnitude are pruned as well, so
+    the sparsity can exceed the requested one if there are ties, e.g.,
+    among entries that are already zero.
+
+    References
+    ----------
+    .. [1] Zhu, M., & Gupta, S. (2017): To prune, or not to prune: exploring
+       the efficacy of pruning for model compression. arXiv:1710.01878.
+    """
+    magnitudes = abs(tensor_var)
+    flat = T.sort(magnitudes.flatten())
+    num_pruned = T.cast(T.floor(sparsity * flat.shape[0] + 0.5), 'int64')
+    threshold = T.switch(T.gt(num_pruned, 0),
+                         flat[T.maximum(num_pruned - 1, 0)], -1)
+    return T.switch(T.gt(magnitudes, threshold), tensor_var, 0)
@@ -57,7 +57,7 @@ setup(
     author_email="lasagne-users@googlegroups.com",
     url="https://github.com/Lasagne/Lasagne",
     license="MIT",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     include_package_data=False,
     zip_safe=False,
     install_requires=install_requires,